@@ -0,0 +1,222 @@
+# app/alloc.py
+"""
+按流水线阶段统计内存分配 (调试 / 基准用，默认关闭)
+
+/signal 的处理过程用 mark("阶段") 切成连续的几段; 只有在 measure() 里
+(当前线程挂了计量器) mark 才生效，平时只是一次全局变量判断。
+
+每段记录 (tracemalloc，含 NumPy 数组数据):
+    net_bytes    段结束时相对段开始的净增字节 (留下来的对象)
+    peak_bytes   段内相对段开始的最高水位 (临时副本 / 中间数组都体现在这里)
+    blocks       净增的内存块数 (sys.getallocatedblocks)
+    gc_objects   净增的 GC 跟踪对象数 (第 0 代计数，决定 GC 触发频率; 中途发生回收时累加回收前的计数)
+计量自身每段约有 ±200 字节 / 几个内存块的噪声 (上一段快照对象的释放)。
+tracemalloc 是进程级的: 并发的其他请求也会被计入 (且计量期间所有线程都变慢)，线上只在低流量时使用。
+
+每个请求另记进程 RSS:
+    rss_peak_bytes   请求期间的 RSS 最高水位: 请求前写 /proc/self/clear_refs 重置，请求后读 VmHWM
+                     (内核不支持重置时为 None; 同样是进程级的)
+    rss_after_bytes  请求结束后的 RSS
+"""
+import gc
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from .schemas import MarketData
+
+STAGES = ("parse", "state", "indicators", "L0", "positions", "L3", "L1", "L2", "L5", "L4", "response", "serialize")
+FIELDS = ("net_bytes", "peak_bytes", "blocks", "gc_objects")
+
+_local = threading.local()
+_active = 0
+# 计量期间已回收掉的第 0 代计数 (GC 回调累加): 加上当前计数即为单调的分配计数，不需要关掉 GC
+_gc_collected = 0
+
+
+def _on_gc(phase, info):
+    global _gc_collected
+    if phase == "start":
+        _gc_collected += gc.get_count()[0]
+
+
+def _gc_objects():
+    return _gc_collected + gc.get_count()[0]
+
+
+def mark(stage):
+    """进入下一个阶段 (没有计量器时为空操作)"""
+    if _active:
+        meter = getattr(_local, "meter", None)
+        if meter is not None:
+            meter.mark(stage)
+
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        return 0
+
+
+def _reset_rss_peak():
+    """把 VmHWM 重置为当前 RSS (Linux 4.0+); 不支持时返回 False"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _rss_peak_bytes():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class StageMeter:
+    def __init__(self):
+        self.stages = {}
+        self._stage = None
+        self._start = None
+        self.request_peak = 0
+        self._request_base = 0
+
+    def _snapshot(self):
+        current, peak = tracemalloc.get_traced_memory()
+        return current, peak, sys.getallocatedblocks(), _gc_objects()
+
+    def begin(self, stage):
+        self._request_base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        self._stage, self._start = stage, self._snapshot()
+
+    def mark(self, stage):
+        current, peak, blocks, objects = self._snapshot()
+        s_current, _, s_blocks, s_objects = self._start
+        row = self.stages.setdefault(self._stage, dict.fromkeys(FIELDS, 0))
+        row["net_bytes"] += current - s_current
+        row["peak_bytes"] = max(row["peak_bytes"], peak - s_current)
+        row["blocks"] += blocks - s_blocks
+        row["gc_objects"] += objects - s_objects
+        self.request_peak = max(self.request_peak, peak - self._request_base)
+        tracemalloc.reset_peak()
+        # 重新取一次，不把本次统计自身的分配算进下一段
+        self._stage, self._start = stage, self._snapshot()
+
+    def end(self):
+        self.mark(None)
+
+
+def request_class(response, data):
+    """按响应归类: risk_block / manage / entry / hold (空仓) / hold_with_positions (有持仓)"""
+    if response.reason.startswith("RISK:") or response.reason.startswith("NO_DATA"):
+        return "risk_block"
+    if response.action in ("CLOSE_PARTIAL", "MODIFY_SL"):
+        return "manage"
+    if response.action != "HOLD":
+        return "entry"
+    return "hold_with_positions" if data.current_positions else "hold"
+
+
+class AllocationStats:
+    """按请求类别累计: 请求数、各阶段的均值 / 最大值、请求内 Python 堆峰值、RSS 最大值"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.classes = {}
+
+    def add(self, cls, meter, rss_peak, rss_after):
+        """rss_peak: 请求期间的 RSS 最高水位 (None = 无法测量); rss_after: 请求结束后的 RSS"""
+        with self._lock:
+            c = self.classes.setdefault(cls, {"requests": 0, "stages": {}, "request_peak_bytes": 0,
+                                              "rss_peak_bytes": None, "rss_after_bytes": 0})
+            c["requests"] += 1
+            c["request_peak_bytes"] = max(c["request_peak_bytes"], meter.request_peak)
+            if rss_peak is not None:
+                c["rss_peak_bytes"] = max(c["rss_peak_bytes"] or 0, rss_peak)
+            c["rss_after_bytes"] = max(c["rss_after_bytes"], rss_after)
+            for stage, row in meter.stages.items():
+                agg = c["stages"].setdefault(stage, {"calls": 0, **{f"sum_{k}": 0 for k in FIELDS},
+                                                     **{f"max_{k}": 0 for k in FIELDS}})
+                agg["calls"] += 1
+                for k in FIELDS:
+                    agg[f"sum_{k}"] += row[k]
+                    agg[f"max_{k}"] = max(agg[f"max_{k}"], row[k])
+
+    def report(self):
+        out = {}
+        with self._lock:
+            for cls, c in sorted(self.classes.items()):
+                stages = {}
+                for stage in STAGES:
+                    agg = c["stages"].get(stage)
+                    if agg is None:
+                        continue
+                    n = agg["calls"]
+                    stages[stage] = {**{f"mean_{k}": round(agg[f"sum_{k}"] / n, 1) for k in FIELDS},
+                                     **{f"max_{k}": agg[f"max_{k}"] for k in FIELDS}, "calls": n}
+                out[cls] = {"requests": c["requests"], "request_peak_bytes": c["request_peak_bytes"],
+                            "rss_peak_bytes": c["rss_peak_bytes"], "rss_after_bytes": c["rss_after_bytes"],
+                            "stages": stages}
+        return out
+
+
+_measure_lock = threading.Lock()
+
+
+def measure(body, handler, stats, repeat=1):
+    """
+    body: /signal 的原始 JSON (bytes); handler: data -> SignalResponse
+    (线上用 main._sandbox_signal(): 独立的状态 / 挂单意图 / 预算日志，不影响实盘)
+    逐次计量 parse -> handler 内部各阶段 -> serialize，结果累计进 stats
+    返回最后一次的 (类别, 各阶段明细, 响应)
+    """
+    global _active
+    with _measure_lock:
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        gc.callbacks.append(_on_gc)
+        _active += 1
+        try:
+            for _ in range(max(1, repeat)):
+                meter = StageMeter()
+                _local.meter = meter
+                hwm = _reset_rss_peak()
+                t0 = time.perf_counter()
+                meter.begin("parse")
+                data = MarketData.model_validate(json.loads(body))
+                response = handler(data)
+                meter.mark("serialize")
+                response.model_dump_json()
+                meter.end()
+                _local.meter = None
+                rss_peak = _rss_peak_bytes() if hwm else None
+                cls = request_class(response, data)
+                stats.add(cls, meter, rss_peak, _rss_bytes())
+                elapsed = (time.perf_counter() - t0) * 1000.0
+        finally:
+            _local.meter = None
+            _active -= 1
+            gc.callbacks.remove(_on_gc)
+            if not was_tracing:
+                tracemalloc.stop()
+    return cls, {"stages": meter.stages, "request_peak_bytes": meter.request_peak,
+                 "elapsed_ms_traced": round(elapsed, 2)}, response
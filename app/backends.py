@@ -0,0 +1,173 @@
+# app/backends.py
+"""
+可替换的计算后端 (Compute Backends)
+
+L3 identify_stage / L2 update_counter / L2 _detect_wedge_fuzzy / L5 generate_order 每一层都可以有多个实现，
+按名字登记在这里，由配置选择 (COMPUTE_BACKEND，以及按层的 COMPUTE_BACKEND_STAGE / SETUP / WEDGE / ORDER):
+- "reference": 原有的服务层实现 (app/services)，是所有其他实现的比对基准
+- "array":     把逐根 Python 循环换成数组运算的实现，结论与 reference 逐位一致
+  wedge = Pivot 判定对整个扫描范围一次算成布尔矩阵 (不再逐根调用 is_pivot);
+  order = Stage 3 Major Pivot 对 11 根邻域一次比较 (不再逐根 all())
+某个后端没有登记某一层时，该层使用 reference。stage / setup 的 reference 本身已是 NumPy 运算、
+没有逐根循环: 把 app.batch 的多窗口向量化规则用在单个窗口上反而更慢 (每次 NumPy 调用的固定开销占主导)，
+所以 array 后端不登记这两层。
+
+配置在每个请求开始时取快照，可热更新: 出现问题把 COMPUTE_BACKEND 改回 "reference" 即回滚，不需要重启。
+后端名列在 runtime_config.COMPUTE_BACKENDS，构造配置快照时校验，写错的覆盖文件不会生效。
+新实现上线前用 tools/backend_equiv.py 在录制的历史与合成行情上逐层比对。
+"""
+import numpy as np
+
+from . import runtime_config
+from .services.l2_structure import StructureService
+from .services.l3_context import ContextService
+from .services.l5_execution import ExecutionService
+
+LAYERS = ("stage", "setup", "wedge", "order")
+REFERENCE = "reference"
+
+# 层 -> {后端名 -> 实现}
+# stage: 带 identify_stage 的对象; setup: 带 update_counter 的对象;
+# wedge: 函数 (df, atr) -> (score, type, pivots); order: 带 generate_order 的对象
+_REGISTRY = {layer: {} for layer in LAYERS}
+
+
+def register(layer, name, impl):
+    if layer not in _REGISTRY:
+        raise ValueError(f"Unknown backend layer: {layer!r}")
+    if name not in runtime_config.COMPUTE_BACKENDS:
+        raise ValueError(f"Backend {name!r} is not listed in runtime_config.COMPUTE_BACKENDS")
+    _REGISTRY[layer][name] = impl
+
+
+def selected(layer, cfg):
+    """配置为某一层选择的后端名 (按层的设置优先)"""
+    return getattr(cfg, f"COMPUTE_BACKEND_{layer.upper()}") or cfg.COMPUTE_BACKEND
+
+
+def implementation(layer, name):
+    """某个后端在某一层的实现; 该后端没有登记这一层时返回 reference"""
+    impls = _REGISTRY[layer]
+    if name in impls:
+        return impls[name]
+    if name not in runtime_config.COMPUTE_BACKENDS:
+        raise ValueError(f"Unknown COMPUTE_BACKEND: {name!r}")
+    return impls[REFERENCE]
+
+
+def resolve(layer, cfg):
+    return implementation(layer, selected(layer, cfg))
+
+
+def describe(cfg=None):
+    """各层实际使用的后端 (/health 展示): 后端没有这一层的实现时标为 reference"""
+    cfg = cfg or runtime_config.current()
+    out = {}
+    for layer in LAYERS:
+        name = selected(layer, cfg)
+        out[layer] = name if name in _REGISTRY[layer] else REFERENCE
+    return out
+
+
+# ------------------------------------------------------------------
+# 流水线入口 (签名与服务层相同，多一个按配置选择实现的步骤)
+# ------------------------------------------------------------------
+def identify_stage(df_m5, df_h1, current_atr, cfg):
+    return resolve("stage", cfg).identify_stage(df_m5, df_h1, current_atr, cfg)
+
+
+def update_counter(df, trend_dir, atr, cfg, budget=None):
+    return resolve("setup", cfg).update_counter(df, trend_dir, atr, cfg, budget=budget,
+                                                detect_wedge=resolve("wedge", cfg))
+
+
+def generate_order(stage, trend_dir, setup_type, df, candles, atr, cfg, budget=None):
+    return resolve("order", cfg).generate_order(stage, trend_dir, setup_type, df, candles, atr, cfg, budget=budget)
+
+
+# ------------------------------------------------------------------
+# array 后端
+# ------------------------------------------------------------------
+def _stack_high_low(highs, lows, pad=0):
+    """
+    (2, n + pad): 第 0 行高点，第 1 行取负的低点 (取负是精确运算); 低点上的"不低于"变成与高点相同的"不高于"
+    末尾 pad 列为 +inf (还没出来的 K 线，任何"不高于"比较都不成立)
+    """
+    n = len(highs)
+    values = np.empty((2, n + pad))
+    values[0, :n] = highs
+    np.negative(lows, out=values[1, :n])
+    values[:, n:] = np.inf
+    return values
+
+
+def _shifted_max(values, start, stop, width):
+    """out[:, j] = values[:, start + j : start + j + width] 的最大值 (width 次切片比较，比滑动窗口视图快)"""
+    out = values[:, start:stop]
+    for k in range(1, width):
+        out = np.maximum(out, values[:, start + k:stop + k])
+    return out
+
+
+class ArrayStructureService(StructureService):
+    """
+    L2 楔形: Pivot 判定 (左 5 根严格、右侧 1 或 2 根) 对扫描范围一次算成布尔矩阵，
+    高点与低点叠成 2 行共用同一组比较
+    """
+
+    def _find_wedge_pivots(self, df):
+        n_bars = len(df)
+        # 与逐根扫描相同的范围: 下标 21 .. n-2
+        lo, hi = 21, n_bars - 1
+        if hi <= lo:
+            return [], []
+        highs, lows = df['high'], df['low']
+        # 补 1 列: 右侧第 2 根还没出来 (下标 n-2) 时不能确认
+        values = _stack_high_low(highs, lows, pad=1)
+        cur = values[:, lo:hi]
+
+        # 强反转棒只需右侧 1 根确认: 顶部 = 阴线或长上影，底部 = 阳线或长下影
+        o, c = df['open'][lo:hi], df['close'][lo:hi]
+        move = c - o
+        body = np.abs(move)
+        strong = np.empty(cur.shape, dtype=bool)
+        strong[0] = (move < 0) | ((highs[lo:hi] - np.maximum(o, c)) > body)
+        strong[1] = (move > 0) | ((np.minimum(o, c) - lows[lo:hi]) > body)
+
+        pivot = (_shifted_max(values, lo - 5, hi - 5, 5) <= cur) & (values[:, lo + 1:hi + 1] <= cur) & \
+                (strong | (values[:, lo + 2:hi + 2] <= cur))
+
+        found = []
+        for row, source in ((pivot[0], highs), (pivot[1], lows)):
+            idx = (np.flatnonzero(row)[-3:] + lo)[::-1].tolist()
+            found.append([(i, source[i].item()) for i in idx])
+        return found[0], found[1]
+
+
+class ArrayExecutionService(ExecutionService):
+    """L5: Stage 3 Major Pivot 搜索对 (2 * neighbor_strength + 1) 根的邻域一次比较，高点与低点同时算"""
+
+    def _find_major_pivots(self, df, candles, lookback_limit=100, neighbor_strength=5):
+        if len(df) < lookback_limit: return None, None
+        highs, lows = df['high'][-lookback_limit:], df['low'][-lookback_limit:]
+        values = _stack_high_low(highs, lows)
+        # 与逐根扫描相同的候选: 下标 neighbor_strength + 1 .. lookback_limit - neighbor_strength - 1
+        first, last = neighbor_strength + 1, lookback_limit - neighbor_strength
+        ok = values[:, first:last] >= _shifted_max(values, 1, last - neighbor_strength, 2 * neighbor_strength + 1)
+        result = []
+        for row, source in ((ok[0], highs), (ok[1], lows)):
+            hits = np.flatnonzero(row)
+            result.append(source[hits[-1] + first].item() if len(hits) else -1.0)
+        return result[0], result[1]
+
+
+_l2 = StructureService()
+_l2_array = ArrayStructureService()
+
+register("stage", REFERENCE, ContextService())
+register("setup", REFERENCE, _l2)
+register("wedge", REFERENCE, _l2._detect_wedge_fuzzy)
+register("order", REFERENCE, ExecutionService())
+
+register("wedge", "array", _l2_array._detect_wedge_fuzzy)
+register("order", "array", ArrayExecutionService())
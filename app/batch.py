@@ -0,0 +1,632 @@
+# app/batch.py
+"""
+整段序列批量模式 (Series API)
+
+对一段 M5 历史，按 EA 的发包方式 (每根 K 线取最近 110 根 M5 + 50 根 H1) 计算每根 K 线的
+ATR / 阶段 / 方向 / Setup / 楔形分数 / 假想订单，结果与逐窗口调用 L1-L5 逐位一致。
+
+做法: 不再逐窗口调用服务，而是把所有窗口排成 (窗口数, 110) 的二维视图，
+每个规则在"窗口"这一维上向量化计算:
+- 窗口内 EMA 的递推只有 110 步，每一步同时推进所有窗口 (与 indicators.ema 同样的运算顺序)
+- 楔形 Pivot、Major Pivot 先在整段序列上算一次布尔数组，再按窗口边界取"最近 3 个"
+- 分块 (chunk_size 个窗口) 产出，内存占用与序列长度无关
+
+不包含 L0 (时间 / 点差 / 账户风控) 与 reason 文本; 需要这些请用 tools.replay。
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from . import runtime_config
+from .history import T, O, H, L, C
+from .indicators import ema, true_range
+from .resample import TIMEFRAME_SECONDS, resample
+
+M5_WINDOW = 110        # 与 EA / tools.replay 一致
+ATR_PERIOD = 14
+DEFAULT_CHUNK = 5000
+
+SERIES_FIELDS = ("time", "atr", "stage", "trend", "setup", "wedge_score",
+                 "action", "entry", "sl", "tp", "lot")
+# 研究用逐 K 线特征 (iter_features): L1 / L3 / L2 / L5 各层在单次请求内部算出的中间量
+FEATURE_FIELDS = ("time", "atr",
+                  "control", "is_trend_bar", "rejection_type", "overlap",
+                  "norm_slope", "crossings", "overlap_count", "range_10_bar", "is_compressed",
+                  "is_deep_compressed", "is_choppy", "strong_momentum", "always_in", "stage", "trend",
+                  "setup", "wedge_score",
+                  "tick_buffer", "trend_bar_size", "ext_threshold", "climax_bar_threshold", "is_huge_bar")
+
+# 阶段编码 (classify_stages 的输出) 与可以整体扫描的 L3 阈值
+STAGE_NAMES = ("0-BARBWIRE", "1-STRONG_TREND", "2-CHANNEL", "3-TRADING_RANGE", "4-BREAKOUT_MODE")
+STAGE_PARAMS = ("SLOPE_SPIKE_ATR", "SLOPE_FLAT_ATR", "STAGE3_THRESHOLD_ATR", "STAGE4_THRESHOLD_ATR",
+                "CHOPS_SLOPE_MULTIPLIER")
+
+_ALPHA = 1.0 / (1.0 + (20 - 1) / 2.0)
+
+
+def window_ema(values):
+    """(窗口数, 窗口长度) -> 每个窗口各自从第一根开始的 EMA20 (与 indicators.ema 逐位一致)"""
+    out = np.empty_like(values, dtype=np.float64)
+    old_wt = 1.0 - _ALPHA
+    weighted = values[:, 0].astype(np.float64)
+    out[:, 0] = weighted
+    for k in range(1, values.shape[1]):
+        cur = values[:, k]
+        updated = ((old_wt * weighted) + (_ALPHA * cur)) / (old_wt + _ALPHA)
+        weighted = np.where(weighted != cur, updated, weighted)
+        out[:, k] = weighted
+    return out
+
+
+def _last_index(mask):
+    """每个位置之前 (含) 最近一个 True 的下标，没有则为 -1"""
+    return np.maximum.accumulate(np.where(mask, np.arange(len(mask)), -1))
+
+
+def _prev_of(last, idx):
+    """last[idx - 1]，idx <= 0 时为 -1"""
+    return np.where(idx > 0, last[np.maximum(idx - 1, 0)], -1)
+
+
+class _SeriesContext:
+    """整段序列上只算一次的中间结果 (与窗口无关的部分)"""
+
+    def __init__(self, bars, h1_window):
+        self.bars = bars
+        n = len(bars)
+        high, low, opn, close = bars[:, H], bars[:, L], bars[:, O], bars[:, C]
+
+        # --- L2 楔形 Pivot: 左 5 根严格，右侧 1 根 (强反转棒) 或 2 根 ---
+        body = np.abs(close - opn)
+        upper_wick = high - np.maximum(opn, close)
+        lower_wick = np.minimum(opn, close) - low
+        self.pivot_h, self.rw1_h = self._pivots(high, (close < opn) | (upper_wick > body), n, is_high=True)
+        self.pivot_l, self.rw1_l = self._pivots(low, (close > opn) | (lower_wick > body), n, is_high=False)
+        self.last_pivot_h = _last_index(self.pivot_h)
+        self.last_pivot_l = _last_index(self.pivot_l)
+
+        # --- L5 Stage 3 Major Pivot: 左右各 5 根 (含相等) ---
+        self.last_major_h = _last_index(self._major(high, n, is_high=True))
+        self.last_major_l = _last_index(self._major(low, n, is_high=False))
+
+        # --- H1 (EA 方式: 已收盘 H1 + 当前正在形成的 H1) ---
+        seconds = TIMEFRAME_SECONDS["H1"]
+        bucket = (bars[:, T] // seconds).astype(np.int64)
+        change = np.concatenate(([True], bucket[1:] != bucket[:-1]))
+        self.h1_of = np.cumsum(change) - 1
+        self.h1_close = resample(bars, seconds, drop_partial_head=False)[:, C]
+        self.h1_window = h1_window
+
+    @staticmethod
+    def _pivots(values, strong_reversal, n, is_high):
+        better = (lambda a, b: a > b) if is_high else (lambda a, b: a < b)
+        left = np.zeros(n, dtype=bool)
+        left[5:] = True
+        for k in range(1, 6):
+            left[5:] &= ~better(values[5 - k:n - k], values[5:])
+        right1 = np.zeros(n, dtype=bool)
+        right1[:-1] = ~better(values[1:], values[:-1])
+        right2 = np.zeros(n, dtype=bool)
+        right2[:-2] = right1[:-2] & ~better(values[2:], values[:-2])
+        # rw1: 只需 1 根右侧确认; 否则需 2 根
+        pivot = left & np.where(strong_reversal, right1, right2)
+        return pivot, strong_reversal
+
+    @staticmethod
+    def _major(values, n, is_high):
+        ok = np.zeros(n, dtype=bool)
+        ok[5:n - 5] = True
+        for k in range(1, 6):
+            if is_high:
+                ok[5:n - 5] &= (values[5:n - 5] >= values[5 - k:n - 5 - k]) & (values[5:n - 5] >= values[5 + k:n - 5 + k])
+            else:
+                ok[5:n - 5] &= (values[5:n - 5] <= values[5 - k:n - 5 - k]) & (values[5:n - 5] <= values[5 + k:n - 5 + k])
+        return ok
+
+
+def _h1_always_in(ctx, idx, atr):
+    """H1 "Always In" 方向 (与 L3 相同的规则)，返回字符串数组"""
+    b = ctx.h1_of[idx]
+    size = ctx.h1_window
+    out = np.full(len(idx), "NEUTRAL", dtype="<U7")
+    close_now = ctx.bars[idx, C]
+
+    full = b >= size - 1
+    if full.any():
+        cols = b[full, None] + np.arange(-(size - 1), 0)
+        mat = np.concatenate((ctx.h1_close[cols], close_now[full, None]), axis=1)
+        eh = window_ema(mat)
+        slope = (eh[:, -1] - eh[:, -3]) / 2
+        thr = atr[full] * 0.2
+        res = np.where((slope > thr) & (mat[:, -1] > eh[:, -1]), "BULL",
+                       np.where((slope < -thr) & (mat[:, -1] < eh[:, -1]), "BEAR", "NEUTRAL"))
+        out[full] = res
+
+    # 序列开头 H1 不足 50 根的窗口 (长度各不相同) 逐个计算
+    for k in np.flatnonzero(~full):
+        closes = np.concatenate((ctx.h1_close[:b[k]], [close_now[k]]))
+        if len(closes) <= 20:
+            continue
+        eh = ema(closes, 20)
+        slope = (eh[-1] - eh[-3]) / 2
+        thr = atr[k] * 0.2
+        if slope > thr and closes[-1] > eh[-1]:
+            out[k] = "BULL"
+        elif slope < -thr and closes[-1] < eh[-1]:
+            out[k] = "BEAR"
+    return out
+
+
+def stage_features(cfg, Hw, Lw, Ow, Cw, E, atr):
+    """
+    L3 identify_stage 中与 STAGE_PARAMS 无关的部分 (每根 K 线算一次)
+    其余 L3 参数 (INSTANT_SPIKE_ATR / COMPRESSION_ATR_BARBWIRE / AB_RANGE_CROSSINGS 等) 取自 cfg
+    """
+    norm_slope = (E[:, -1] - E[:, -4]) / atr
+
+    lo, lh, ll, lc = Ow[:, -1], Hw[:, -1], Lw[:, -1], Cw[:, -1]
+    body = np.abs(lc - lo)
+    bar_height = lh - ll
+    is_huge_bar = body > (atr * cfg.INSTANT_SPIKE_ATR)
+    safe_height = np.where(bar_height > 0, bar_height, 1.0)
+    strength = np.where(lc > lo, (lc - ll) / safe_height, (lh - lc) / safe_height)
+    strength = np.where(bar_height > 0, strength, 0.0)
+    is_strong_close = strength > cfg.STRONG_CLOSE_RATIO
+    recent_highs = Hw[:, -20:-1].max(axis=1)
+    recent_lows = Lw[:, -20:-1].min(axis=1)
+    instant = is_huge_bar & is_strong_close
+    instant_bull = instant & (lc > recent_highs) & (lc > lo)
+    instant_bear = instant & ~instant_bull & (lc < recent_lows) & (lc < lo)
+
+    ema_20 = E[:, -20:]
+    crossings = ((Hw[:, -20:] > ema_20) & (ema_20 > Lw[:, -20:])).sum(axis=1)
+    recent_high = Hw[:, -10:].max(axis=1)
+    recent_low = Lw[:, -10:].min(axis=1)
+    is_compressed = (recent_high - recent_low) < (atr * cfg.COMPRESSION_ATR)
+    is_deep_compressed = (recent_high - recent_low) < (atr * cfg.COMPRESSION_ATR_BARBWIRE)
+
+    tail_h, tail_l = Hw[:, -10:], Lw[:, -10:]
+    overlap_h = np.minimum(tail_h[:, 1:], tail_h[:, :-1])
+    overlap_l = np.maximum(tail_l[:, 1:], tail_l[:, :-1])
+    bar_range = tail_h[:, 1:] - tail_l[:, 1:]
+    safe_range = np.where(bar_range > 0, bar_range, 1.0)
+    is_overlap = (overlap_h > overlap_l) & (bar_range > 0) & (((overlap_h - overlap_l) / safe_range) > 0.3)
+    overlap_count = is_overlap.sum(axis=1)
+    is_choppy = (overlap_count >= 6) | (crossings >= 4)
+    is_barbwire = is_choppy & is_deep_compressed
+
+    bodies = np.abs(Cw[:, -3:] - Ow[:, -3:])
+    strong_momentum = ((bodies > (atr * 0.8)[:, None]).sum(axis=1) >= 2) | (bodies[:, -1] > atr * 2.0)
+
+    range_10_bar = recent_high - recent_low
+    avg_body = np.abs(Cw[:, -10:] - Ow[:, -10:]).mean(axis=1)
+    return {
+        "atr": atr, "norm_slope": norm_slope, "range_10_bar": range_10_bar,
+        "instant_bull": instant_bull, "instant_bear": instant_bear,
+        "is_choppy": is_choppy, "is_barbwire": is_barbwire, "strong_momentum": strong_momentum,
+        "is_tight_relative": range_10_bar < (avg_body * cfg.STAGE4_RELATIVE_BODY_RATIO),
+        "range_crossings": crossings >= cfg.AB_RANGE_CROSSINGS,
+        "crossings": crossings, "overlap_count": overlap_count,
+        "is_compressed": is_compressed, "is_deep_compressed": is_deep_compressed,
+    }
+
+
+def classify_stages(f, slope_spike, slope_flat, stage3, stage4, chop_mult, spike_penalty):
+    """
+    stage_features 的结果 + 阈值 -> 阶段编码 (下标对应 STAGE_NAMES)
+    阈值可以是标量或长度为 P 的数组 (P 组参数)，结果为 (K 线数, P) int8:
+    K 线一维、参数一维广播，一次算完所有参数组合
+    派生阈值的算法与 ConfigSnapshot 相同 (SPIKE_SLOPE_FROM_RANGE / FLAT_SLOPE_CHOPPY)
+    """
+    params = [np.atleast_1d(np.asarray(v, dtype=np.float64))[None, :]
+              for v in (slope_spike, slope_flat, stage3, stage4, chop_mult)]
+    slope_spike, slope_flat, stage3, stage4, chop_mult = params
+    col = {k: v[:, None] for k, v in f.items()}
+    atr, rng = col["atr"], col["range_10_bar"]
+    abs_slope = np.abs(col["norm_slope"])
+    choppy = col["is_choppy"]
+
+    is_stage_4 = (rng < (atr * stage4)) & col["is_tight_relative"]
+    is_in_range = ((atr * stage4) <= rng) & (rng < (atr * stage3))
+    req_slope = np.where(is_in_range | choppy, slope_spike + spike_penalty, slope_spike)
+    is_spike = (abs_slope > req_slope) & col["strong_momentum"]
+    is_flat = abs_slope < np.where(choppy, slope_flat * chop_mult, slope_flat)
+    is_trading_range = is_flat & (is_in_range | choppy | col["range_crossings"])
+
+    # 与 identify_stage 的判定顺序相同: 先命中的优先
+    codes = np.where(is_trading_range, 3, 2).astype(np.int8)
+    codes[is_stage_4] = 4
+    codes[np.broadcast_to(col["is_barbwire"], codes.shape)] = 0
+    codes[is_spike | (col["instant_bull"] | col["instant_bear"])] = 1
+    return codes
+
+
+def _stage(cfg, f, always_in):
+    """L3 identify_stage 的向量化版本 (f: stage_features 的结果)"""
+    code = classify_stages(f, cfg.SLOPE_SPIKE_ATR, cfg.SLOPE_FLAT_ATR, cfg.STAGE3_THRESHOLD_ATR,
+                           cfg.STAGE4_THRESHOLD_ATR, cfg.CHOPS_SLOPE_MULTIPLIER, cfg.SPIKE_FROM_RANGE_PENALTY)[:, 0]
+    stage = np.asarray(STAGE_NAMES)[code]
+    slope_dir = np.where(f["norm_slope"] > 0, "BULL", "BEAR")
+    trend = np.select(
+        [f["instant_bull"], f["instant_bear"], code == 1, code == 0, code == 4, code == 3],
+        ["BULL", "BEAR", slope_dir, "NEUTRAL", np.where(always_in != "NEUTRAL", always_in, "BULL"), "NEUTRAL"],
+        slope_dir,
+    )
+    return stage, trend
+
+
+def _wedge(ctx, idx, Hw, Lw, Ow, Cw, atr):
+    """L2 楔形模糊评分，返回 (score, type 数组: "BEAR_WEDGE"/"BULL_WEDGE")"""
+    lo, lh, ll, lc = Ow[:, -1], Hw[:, -1], Lw[:, -1], Cw[:, -1]
+    # 扫描范围: 窗口内相对下标 21 .. 108 -> 绝对下标 i-88 .. i-1
+    oldest = idx - (M5_WINDOW - 1) + 21
+    scores = []
+    for values, pivot, rw1, last, bear in ((ctx.bars[:, H], ctx.pivot_h, ctx.rw1_h, ctx.last_pivot_h, True),
+                                           (ctx.bars[:, L], ctx.pivot_l, ctx.rw1_l, ctx.last_pivot_l, False)):
+        # i-1 只有在只需 1 根右侧确认时才成立; 更早的 Pivot 已经有足够的右侧 K 线
+        newest_ok = pivot[idx - 1] & rw1[idx - 1]
+        q1 = last[idx - 2]
+        q2 = _prev_of(last, q1)
+        q3 = _prev_of(last, q2)
+        p0 = np.where(newest_ok, idx - 1, q1)
+        p1 = np.where(newest_ok, q1, q2)
+        p2 = np.where(newest_ok, q2, q3)
+        has3 = (p2 >= oldest) & (p2 >= 0)
+        v3, v2, v1 = values[np.maximum(p0, 0)], values[np.maximum(p1, 0)], values[np.maximum(p2, 0)]
+
+        if bear:
+            shape_ok = has3 & (v3 > v2) & (v2 > v1)
+            push1, push2 = v2 - v1, v3 - v2
+            signal = (lc < lo).astype(np.int64) * 20 + ((lh - np.maximum(lo, lc)) > (atr * 0.3)).astype(np.int64) * 10
+        else:
+            shape_ok = has3 & (v3 < v2) & (v2 < v1)
+            push1, push2 = v1 - v2, v2 - v3
+            signal = (lc > lo).astype(np.int64) * 20 + ((np.minimum(lo, lc) - ll) > (atr * 0.3)).astype(np.int64) * 10
+        decay = np.where(push2 < push1, 30, np.where(push2 < push1 * 1.2, 10, -20))
+        near = (idx + 1 - p0) <= 5
+        scores.append(np.where(shape_ok, 40 + decay + np.where(near, signal, 0), 0))
+
+    score_bear, score_bull = scores
+    is_bear = score_bear > score_bull
+    return np.where(is_bear, score_bear, score_bull), np.where(is_bear, "BEAR_WEDGE", "BULL_WEDGE")
+
+
+def _setup(cfg, ctx, idx, Hw, Lw, Ow, Cw, E, atr, trend):
+    """L2 update_counter 的向量化版本，返回 (setup, wedge_score)"""
+    trend = np.where(trend == "NEUTRAL", np.where(E[:, -1] > E[:, -2], "BULL", "BEAR"), trend)
+    bull, bear = trend == "BULL", trend == "BEAR"
+    lo, lh, ll, lc, le = Ow[:, -1], Hw[:, -1], Lw[:, -1], Cw[:, -1], E[:, -1]
+    po, ph, pl = Ow[:, -2], Hw[:, -2], Lw[:, -2]
+
+    wedge_score, wedge_type = _wedge(ctx, idx, Hw, Lw, Ow, Cw, atr)
+    wedge_setup = np.where(wedge_score >= 80,
+                           np.where(wedge_type == "BEAR_WEDGE", "WEDGE_TOP", "WEDGE_BOTTOM"), "NONE")
+
+    # --- H1/H2 / L1/L2 / Micro DB/DT ---
+    threshold = atr * 0.1
+    high_vol = atr > 3.0
+    dist_to_ema = lc - le
+    weak_slope = np.abs(E[:, -1] - E[:, -4]) < (atr * 0.4)
+
+    bull_sig = (lc > lo) | (lc > ph)
+    bull_a = np.select(
+        [~bull_sig, ll < (le - atr * 0.2), dist_to_ema > (atr * cfg.AB_MAGNET_DISTANCE_ATR), weak_slope],
+        ["WEAK_H1_IGNORE", "H2", "WEAK_H1_TOO_FAR", "WEAK_H1_WAIT_FOR_H2"], "H1")
+    micro_db = ((np.abs(ll - pl) < threshold) | ((lh < ph) & (ll > pl))) & \
+               (lc > lo) & ((lc - ll) > (lh - ll) * 0.6)
+    bull_b = np.where(micro_db, np.where(high_vol, "MICRO_DB_FILTERED_BY_ATR", "H1_MICRO_DB"), "NONE")
+    bull_setup = np.where(lh > ph, bull_a, bull_b)
+
+    bear_sig = (lc < lo) | (lc < pl)
+    bear_a = np.select(
+        [~bear_sig, lh > (le + atr * 0.2), dist_to_ema < -(atr * cfg.AB_MAGNET_DISTANCE_ATR), weak_slope],
+        ["WEAK_L1_IGNORE", "L2", "WEAK_L1_TOO_FAR", "WEAK_L1_WAIT_FOR_L2"], "L1")
+    micro_dt = ((np.abs(lh - ph) < threshold) | ((ll > pl) & (lh < ph))) & \
+               (lc < lo) & ((lh - lc) > (lh - ll) * 0.6)
+    bear_b = np.where(micro_dt, np.where(high_vol, "MICRO_DT_FILTERED_BY_ATR", "L1_MICRO_DT"), "NONE")
+    bear_setup = np.where(ll < pl, bear_a, bear_b)
+
+    setup = np.where(wedge_setup != "NONE", wedge_setup,
+                     np.where(bull, bull_setup, np.where(bear, bear_setup, "NONE")))
+    setup = setup.astype("<U24")
+
+    # --- 破坏性重置 ---
+    setup[bull & (lc < lo) & ((lo - lc) > (atr * 1.5))] = "RESET_BY_BEAR_SPIKE"
+    setup[bear & (lc > lo) & ((lc - lo) > (atr * 1.5))] = "RESET_BY_BULL_SPIKE"
+
+    # --- MTR 升级: 窗口内 [-30:-5] 曾有强力反向突破 EMA ---
+    h_open, h_close, h_ema = Ow[:, -30:-5], Cw[:, -30:-5], E[:, -30:-5]
+    bear_break = (((h_open - h_close) > (atr * 0.6)[:, None]) & (h_close < h_ema)).any(axis=1)
+    bull_break = (((h_close - h_open) > (atr * 0.6)[:, None]) & (h_close > h_ema)).any(axis=1)
+    setup[(setup == "H2") & bear_break] = "MTR_BOTTOM"
+    setup[(setup == "L2") & bull_break] = "MTR_TOP"
+    return setup, wedge_score
+
+
+def _contains(arr, text):
+    return np.char.find(arr, text) >= 0
+
+
+def _dynamic_thresholds(Ow, Cw, le):
+    """L5 _calculate_dynamic_thresholds: 最近 50 根的 (乖离阈值, 巨型 K 线阈值)"""
+    c50, o50 = Cw[:, -50:], Ow[:, -50:]
+    dists = np.abs(c50 - le[:, None])
+    ext_threshold = dists.mean(axis=1) + (3.0 * dists.std(axis=1, ddof=1))
+    max_body_recent = np.abs(c50 - o50)[:, :-1].max(axis=1)
+    return ext_threshold, np.where(max_body_recent > 0, max_body_recent * 1.1, 999.0)
+
+
+def _orders(cfg, ctx, idx, Hw, Lw, Ow, Cw, E, atr, stage, trend, setup):
+    """L5 generate_order 的向量化版本，返回 (action, entry, sl, tp, lot)"""
+    n = len(idx)
+    lo, lh, ll, lc, le = Ow[:, -1], Hw[:, -1], Lw[:, -1], Cw[:, -1], E[:, -1]
+    ph, pl = Hw[:, -2], Lw[:, -2]
+    bull, bear = trend == "BULL", trend == "BEAR"
+    s1 = stage == "1-STRONG_TREND"
+    s2 = stage == "2-CHANNEL"
+    s3 = stage == "3-TRADING_RANGE"
+    s4 = stage == "4-BREAKOUT_MODE"
+    is_reversal = _contains(setup, "WEDGE") | _contains(setup, "MTR")
+
+    # --- 入场过滤 (提前返回 HOLD) ---
+    high_20, low_20 = Hw[:, -20:].max(axis=1), Lw[:, -20:].min(axis=1)
+    channel_range = high_20 - low_20
+    rel_pos = (lc - low_20) / np.where(channel_range > 0, channel_range, 1.0)
+    weak_channel = s2 & (channel_range > 0) & (
+        (bear & (rel_pos < 0.25) & _contains(setup, "L")) | (bull & (rel_pos > 0.75) & _contains(setup, "H")))
+    stage3_blocked = s3 & ~(is_reversal | _contains(setup, "MICRO"))
+    round_dist = np.abs(np.remainder(lc, 100))
+    near_round = np.minimum(round_dist, 100 - round_dist) < 0.2
+
+    tick_buffer = np.maximum(cfg.MIN_TICK_SIZE, atr * 0.05)
+    bar_height = lh - ll
+    is_huge_bar = bar_height > (atr * 3.0)
+    climax = is_huge_bar & ~s1
+    hold = weak_channel | stage3_blocked | near_round | (stage == "0-BARBWIRE") | climax
+
+    action = np.full(n, "HOLD", dtype="<U16")
+    entry, sl, tp = np.zeros(n), np.zeros(n), np.zeros(n)
+    fade = np.zeros(n, dtype=bool)
+
+    def put(mask, act, e, s, t):
+        action[mask] = act
+        entry[mask], sl[mask], tp[mask] = e[mask], s[mask], t[mask]
+
+    zero = np.zeros(n)
+
+    # --- Stage 1: 顺势 Stop + 动态阈值 Fade ---
+    b1 = ~hold & s1
+    put(b1 & bull, "PLACE_BUY_STOP", lh + tick_buffer,
+        np.where(is_huge_bar, ll + (bar_height * 0.5), ll - tick_buffer), zero)
+    put(b1 & bear, "PLACE_SELL_STOP", ll - tick_buffer,
+        np.where(is_huge_bar, lh - (bar_height * 0.5), lh + tick_buffer), zero)
+    if b1.any():
+        ext_threshold, bar_threshold = _dynamic_thresholds(Ow, Cw, le)
+        is_extreme = np.abs(lc - le) > ext_threshold
+        current_body = np.abs(lc - lo)
+        is_climax_bar = current_body > bar_threshold
+        c3, o3 = Cw[:, -3:], Ow[:, -3:]
+        fade_buy = b1 & bear & is_extreme & is_climax_bar & (c3 < o3).all(axis=1)
+        fade_sell = b1 & bull & is_extreme & is_climax_bar & (c3 > o3).all(axis=1)
+        buy_entry = ll - current_body * 0.1
+        put(fade_buy, "PLACE_BUY_LIMIT", buy_entry, buy_entry - (atr * 1.5), le)
+        sell_entry = lh + current_body * 0.1
+        put(fade_sell, "PLACE_SELL_LIMIT", sell_entry, sell_entry + (atr * 1.5), le)
+        fade = fade_buy | fade_sell
+
+    # --- Wedge / MTR 反转 ---
+    brev = ~hold & ~s1 & is_reversal
+    top = brev & ((setup == "WEDGE_TOP") | (setup == "MTR_TOP"))
+    e_top, s_top = ll - tick_buffer, lh + tick_buffer
+    put(top, "PLACE_SELL_STOP", e_top, s_top, e_top - (np.abs(s_top - e_top) * 3.0))
+    bottom = brev & ((setup == "WEDGE_BOTTOM") | (setup == "MTR_BOTTOM"))
+    e_bot, s_bot = lh + tick_buffer, ll - tick_buffer
+    put(bottom, "PLACE_BUY_STOP", e_bot, s_bot, e_bot + (np.abs(e_bot - s_bot) * 3.0))
+
+    # --- Stage 2: 通道 H1/H2 / L1/L2 (Measured Move) ---
+    b2 = ~hold & ~s1 & ~is_reversal & s2
+    leg1_height = channel_range
+    buy = b2 & bull & np.isin(setup, ("H1", "H2", "H1_MICRO_DB"))
+    micro = setup == "H1_MICRO_DB"
+    e_buy = np.where(micro, np.maximum(lh, ph), lh) + tick_buffer
+    s_buy = np.where(micro, np.minimum(ll, pl), ll) - tick_buffer
+    put(buy, "PLACE_BUY_STOP", e_buy, s_buy, np.maximum(e_buy + leg1_height, e_buy + (e_buy - s_buy) * 2.0))
+    sell = b2 & bear & np.isin(setup, ("L1", "L2", "L1_MICRO_DT"))
+    micro = setup == "L1_MICRO_DT"
+    e_sell = np.where(micro, np.minimum(ll, pl), ll) - tick_buffer
+    s_sell = np.where(micro, np.maximum(lh, ph), lh) + tick_buffer
+    put(sell, "PLACE_SELL_STOP", e_sell, s_sell, np.minimum(e_sell - leg1_height, e_sell - (s_sell - e_sell) * 2.0))
+
+    # --- Stage 3: 区间上下沿反转 ---
+    b3 = ~hold & ~s1 & ~is_reversal & s3
+    if b3.any():
+        # Major Pivot 搜索范围: 最近 100 根内相对下标 6 .. 94 -> 绝对下标 i-93 .. i-5
+        first = idx - 93
+        mh, ml = ctx.last_major_h[idx - 5], ctx.last_major_l[idx - 5]
+        rg_high = np.where(mh >= first, ctx.bars[np.maximum(mh, 0), H], Hw[:, -50:].max(axis=1))
+        rg_low = np.where(ml >= first, ctx.bars[np.maximum(ml, 0), L], Lw[:, -50:].min(axis=1))
+        rg_height = rg_high - rg_low
+        rg_height = np.where(rg_height == 0, 0.001, rg_height)
+        current_pos = (lc - rg_low) / rg_height
+        bull_rev = ((lc > ph) & (lo < pl)) | ((lc - lo) > (atr * 0.3))
+        bear_rev = ((lc < pl) & (lo > ph)) | ((lo - lc) > (atr * 0.3))
+        e3b, s3b = lh + tick_buffer, ll - tick_buffer
+        put(b3 & (current_pos <= 0.25) & bull_rev, "PLACE_BUY_STOP", e3b, s3b, e3b + (e3b - s3b) * 1.5)
+        e3s, s3s = ll - tick_buffer, lh + tick_buffer
+        put(b3 & (current_pos >= 0.75) & bear_rev, "PLACE_SELL_STOP", e3s, s3s, e3s - (s3s - e3s) * 1.5)
+
+    # --- Stage 4: 突破模式 ---
+    b4 = ~hold & ~s1 & ~is_reversal & s4
+    range_high, range_low = Hw[:, -10:].max(axis=1), Lw[:, -10:].min(axis=1)
+    target_dist = np.maximum(range_high - range_low, atr) * 2.0
+    b4 &= ~(atr > 3.0)
+    e4b = range_high + tick_buffer
+    put(b4 & bull, "PLACE_BUY_STOP", e4b, range_low - tick_buffer, e4b + target_dist)
+    e4s = range_low - tick_buffer
+    put(b4 & bear, "PLACE_SELL_STOP", e4s, range_high + tick_buffer, e4s - target_dist)
+
+    # --- 手数 ---
+    sl_dist = np.abs(entry - sl)
+    sl_dist = np.where(sl_dist == 0, atr, sl_dist)
+    lot = np.maximum(cfg.MIN_LOT, np.minimum(cfg.MAX_LOT, cfg.RISK_PER_TRADE_USD / (100 * sl_dist)))
+    lot = np.where(fade, 0.01, lot)
+    placed = action != "HOLD"
+    # 与 L5 一样用 Python round (np.round 在 .xx5 附近的舍入与之不同)
+    lot[placed] = [round(v, 2) if not f else v for v, f in zip(lot[placed].tolist(), fade[placed].tolist())]
+    lot[~placed] = 0.0
+
+    # --- 价格合规性检查 ---
+    is_buy = _contains(action, "BUY")
+    is_sell = _contains(action, "SELL")
+    invalid = (is_buy & ((sl >= entry) | ((tp > 0) & (tp <= entry)))) | \
+              (is_sell & ((sl <= entry) | ((tp > 0) & (tp >= entry))))
+    action[invalid] = "HOLD"
+    for arr in (entry, sl, tp, lot):
+        arr[action == "HOLD"] = 0.0
+    return action, entry, sl, tp, lot
+
+
+def iter_series(bars, cfg=None, start=None, end=None, chunk_size=DEFAULT_CHUNK, prob_gate=False):
+    """
+    逐块产出 dict (字段见 SERIES_FIELDS，每个都是长度为块大小的数组)
+    bars: (N, 7) M5 数组 (app.history 格式，按时间升序)
+    第一个结果对应第 109 根 (前面不足一个 EA 窗口)
+    prob_gate=True 时对产生订单的 K 线逐个查 L4 概率表 (信号稀疏，开销很小)
+    """
+    cfg = cfg or runtime_config.current()
+    start = max(M5_WINDOW - 1, start or 0)
+    end = len(bars) if end is None else min(end, len(bars))
+    if start >= end:
+        return
+    ctx = _SeriesContext(bars, cfg.H1_WINDOW_BARS)
+
+    for idx, Ow, Hw, Lw, Cw, atr, E in _iter_windows(bars, start, end, chunk_size):
+        always_in = _h1_always_in(ctx, idx, atr)
+        stage, trend = _stage(cfg, stage_features(cfg, Hw, Lw, Ow, Cw, E, atr), always_in)
+        setup, wedge_score = _setup(cfg, ctx, idx, Hw, Lw, Ow, Cw, E, atr, trend)
+        action, entry, sl, tp, lot = _orders(cfg, ctx, idx, Hw, Lw, Ow, Cw, E, atr, stage, trend, setup)
+
+        # evaluate_entry 的弱 Setup 过滤在 L5 之前
+        weak = _contains(setup, "IGNORE") | _contains(setup, "TOO_FAR") | _contains(setup, "RESET")
+        action[weak] = "HOLD"
+        for arr in (entry, sl, tp, lot):
+            arr[weak] = 0.0
+
+        if prob_gate:
+            _apply_prob_gate(cfg, bars, idx, atr, stage, setup, action, entry, sl, tp, lot)
+
+        yield {
+            "time": bars[idx, T].astype(np.int64), "atr": atr, "stage": stage, "trend": trend,
+            "setup": setup, "wedge_score": wedge_score,
+            "action": action, "entry": entry, "sl": sl, "tp": tp, "lot": lot,
+        }
+
+
+def _bar_features(cfg, Ow, Hw, Lw, Cw, atr):
+    """L1 analyze_bar 的向量化版本 (最后一根对前一根)，返回 (control, is_trend_bar, rejection_type, overlap)"""
+    lo, lh, ll, lc = Ow[:, -1], Hw[:, -1], Lw[:, -1], Cw[:, -1]
+    ph, pl = Hw[:, -2], Lw[:, -2]
+    body = np.abs(lc - lo)
+    rng = lh - ll
+    rng = np.where(rng == 0, 0.001, rng)
+    is_trend_bar = body > (atr * cfg.AB_TREND_BAR_ATR_RATIO)
+
+    close_pos = (lc - ll) / rng
+    control = np.where(close_pos > 0.8, "BULL", np.where(close_pos < 0.2, "BEAR", "NEUTRAL"))
+
+    upper_wick = lh - np.maximum(lo, lc)
+    lower_wick = np.minimum(lo, lc) - ll
+    top = (upper_wick > body) & (upper_wick > (rng * 0.4))
+    bottom = ~top & (lower_wick > body) & (lower_wick > (rng * 0.4))
+    rejection_type = np.select([top, bottom], ["TOP_TAIL", "BOTTOM_TAIL"], "NONE")
+
+    overlap_max, overlap_min = np.minimum(lh, ph), np.maximum(ll, pl)
+    prev_rng = ph - pl
+    has_overlap = (overlap_max > overlap_min) & (prev_rng > 0)
+    overlap = np.where(has_overlap, (overlap_max - overlap_min) / np.where(prev_rng > 0, prev_rng, 1.0), 0.0)
+    return control, is_trend_bar, rejection_type, overlap
+
+
+def iter_features(bars, cfg=None, start=None, end=None, chunk_size=DEFAULT_CHUNK):
+    """
+    逐块产出 dict (字段见 FEATURE_FIELDS)，窗口 / 起点约定与 iter_series 相同
+    L5 的 trend_bar_size 按当根的阶段取因子; ext / climax 阈值是 Stage 1 Fade 用的动态阈值 (每根都算)
+    """
+    cfg = cfg or runtime_config.current()
+    start = max(M5_WINDOW - 1, start or 0)
+    end = len(bars) if end is None else min(end, len(bars))
+    if start >= end:
+        return
+    ctx = _SeriesContext(bars, cfg.H1_WINDOW_BARS)
+
+    for idx, Ow, Hw, Lw, Cw, atr, E in _iter_windows(bars, start, end, chunk_size):
+        control, is_trend_bar, rejection_type, overlap = _bar_features(cfg, Ow, Hw, Lw, Cw, atr)
+        f = stage_features(cfg, Hw, Lw, Ow, Cw, E, atr)
+        always_in = _h1_always_in(ctx, idx, atr)
+        stage, trend = _stage(cfg, f, always_in)
+        setup, wedge_score = _setup(cfg, ctx, idx, Hw, Lw, Ow, Cw, E, atr, trend)
+
+        factor = np.select([stage == "3-TRADING_RANGE", stage == "1-STRONG_TREND"],
+                           [cfg.TREND_BAR_FACTOR_RANGE, cfg.TREND_BAR_FACTOR_S1], cfg.AB_TREND_BAR_ATR_RATIO)
+        ext_threshold, climax_bar_threshold = _dynamic_thresholds(Ow, Cw, E[:, -1])
+
+        yield {
+            "time": bars[idx, T].astype(np.int64), "atr": atr,
+            "control": control, "is_trend_bar": is_trend_bar, "rejection_type": rejection_type, "overlap": overlap,
+            "norm_slope": f["norm_slope"], "crossings": f["crossings"], "overlap_count": f["overlap_count"],
+            "range_10_bar": f["range_10_bar"], "is_compressed": f["is_compressed"],
+            "is_deep_compressed": f["is_deep_compressed"], "is_choppy": f["is_choppy"],
+            "strong_momentum": f["strong_momentum"], "always_in": always_in, "stage": stage, "trend": trend,
+            "setup": setup, "wedge_score": wedge_score,
+            "tick_buffer": np.maximum(cfg.MIN_TICK_SIZE, atr * 0.05), "trend_bar_size": atr * factor,
+            "ext_threshold": ext_threshold, "climax_bar_threshold": climax_bar_threshold,
+            "is_huge_bar": (Hw[:, -1] - Lw[:, -1]) > (atr * 3.0),
+        }
+
+
+def _iter_windows(bars, start, end, chunk_size):
+    """逐块产出 (下标, 开 / 高 / 低 / 收 (块大小, 110), ATR, 窗口内 EMA20)"""
+    windows = sliding_window_view(bars, M5_WINDOW, axis=0)   # (N-109, 7, 110) 视图
+    tr = true_range(bars[:, H].copy(), bars[:, L], bars[:, C])
+    tr_windows = sliding_window_view(tr, ATR_PERIOD)
+
+    for lo_i in range(start, end, chunk_size):
+        idx = np.arange(lo_i, min(end, lo_i + chunk_size))
+        w = windows[idx - (M5_WINDOW - 1)]
+        Ow, Hw, Lw, Cw = w[:, O, :], w[:, H, :], w[:, L, :], w[:, C, :]
+
+        atr = tr_windows[idx - (ATR_PERIOD - 1)].mean(axis=1)
+        atr = np.where(np.isnan(atr), 5.0, atr)
+        yield idx, Ow, Hw, Lw, Cw, atr, window_ema(Cw)
+
+
+def iter_stage_features(bars, cfg=None, start=None, end=None, chunk_size=DEFAULT_CHUNK):
+    """逐块产出 (下标, stage_features 结果)，供阈值扫描使用 (不需要 H1 / L2 / L5)"""
+    cfg = cfg or runtime_config.current()
+    start = max(M5_WINDOW - 1, start or 0)
+    end = len(bars) if end is None else min(end, len(bars))
+    for idx, Ow, Hw, Lw, Cw, atr, E in _iter_windows(bars, start, end, chunk_size):
+        yield idx, stage_features(cfg, Hw, Lw, Ow, Cw, E, atr)
+
+
+def _apply_prob_gate(cfg, bars, idx, atr, stage, setup, action, entry, sl, tp, lot):
+    from .history import to_candles
+    from .pipeline import l1_svc, l4_svc
+
+    for k in np.flatnonzero(action != "HOLD"):
+        i = idx[k]
+        last, prev = to_candles(bars[i - 1:i + 1])[::-1]
+        features = l1_svc.analyze_bar(last, prev, atr[k], cfg)
+        ok, _ = l4_svc.check(str(stage[k]), str(setup[k]), features, atr[k], cfg)
+        if not ok:
+            action[k] = "HOLD"
+            entry[k] = sl[k] = tp[k] = lot[k] = 0.0
+
+
+def iter_ndjson(chunks):
+    """把 iter_series 的结果转为 NDJSON (每根 K 线一行)"""
+    import json
+
+    for chunk in chunks:
+        columns = [chunk[name].tolist() for name in SERIES_FIELDS]
+        lines = [json.dumps(dict(zip(SERIES_FIELDS, row)), separators=(",", ":")) for row in zip(*columns)]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
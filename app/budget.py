@@ -0,0 +1,171 @@
+# app/budget.py
+"""
+/signal 的延迟预算
+
+EA 的 WebRequest 最多等 5 秒，且等待期间阻塞 OnTick; 迟到的答复不如一个保守的 HOLD。
+- 每个请求从到达服务端 (ArrivalMiddleware 打点，含排队时间) 起有一个截止时间:
+  min(LATENCY_BUDGET_MS, EA 发送的 deadline_ms) - LATENCY_RESERVE_MS
+- 可选的重计算 (楔形模糊评分 / MTR 回溯 / Stage 3 主要拐点搜索) 通过 Budget.run 执行:
+  剩余预算不足以覆盖该步骤的历史耗时 (EWMA) 时跳过，优先用同一输入上次的结果，否则返回 SHED:
+  这几步都会改变开仓结论 (逆势楔形 / MTR 升级 / 区间边界)，没有结果时调用方放弃本次开仓 (HOLD)
+  EA 发来的最后一根是正在形成的 K 线，同一根 K 线的不同 tick 结论可能不同: 缓存只在最后一根 K 线的
+  OHLC、窗口长度、配置版本与步骤的标量参数 (ATR 等) 都相同时命中
+- 截止时间已过则直接 HOLD
+- 同一终端来了更新的请求时 (app.singleflight) 预算被取消: 可选步骤直接用默认值，下一个检查点返回 HOLD
+- 跳过 / 超时次数记在 journal 中 (GET /budget)
+"""
+import collections
+import contextvars
+import threading
+import time
+
+SIGNAL_PATH = "/signal"
+# 预估耗时的安全系数与 EWMA 平滑系数
+COST_SAFETY = 2.0
+COST_ALPHA = 0.1
+
+_arrival = contextvars.ContextVar("signal_arrival", default=None)
+
+# 可选步骤被跳过且没有缓存时的返回值
+SHED = object()
+
+
+class ArrivalMiddleware:
+    """纯 ASGI 中间件: 记录 /signal 到达时间 (请求体解析 / 线程池排队都算在预算内)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == SIGNAL_PATH:
+            _arrival.set(time.perf_counter())
+        return await self.app(scope, receive, send)
+
+
+class LatencyJournal:
+    """各可选步骤的耗时估计与降级统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.cost_ms = {}
+        self.shed = collections.Counter()
+        self.cache_hits = collections.Counter()
+        self.requests = 0
+        self.degraded = 0
+        self.deadline_holds = 0
+
+    def observe(self, name, ms):
+        with self._lock:
+            prev = self.cost_ms.get(name)
+            self.cost_ms[name] = ms if prev is None else prev + COST_ALPHA * (ms - prev)
+
+    def decay(self, name):
+        """被跳过的步骤拿不到新的耗时样本: 每跳过一次估计值衰减一点，避免一次异常值导致永久跳过"""
+        with self._lock:
+            if name in self.cost_ms:
+                self.cost_ms[name] *= 1.0 - COST_ALPHA
+
+    def record(self, budget):
+        with self._lock:
+            self.requests += 1
+            if budget.degraded:
+                self.degraded += 1
+            if budget.deadline_hold:
+                self.deadline_holds += 1
+            for name, cached in budget.shed:
+                self.shed[name] += 1
+                if cached:
+                    self.cache_hits[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": self.requests, "degraded": self.degraded, "deadline_holds": self.deadline_holds,
+                "shed": dict(self.shed), "served_from_cache": dict(self.cache_hits),
+                "cost_ms": {k: round(v, 3) for k, v in self.cost_ms.items()},
+            }
+
+
+journal = LatencyJournal()
+
+
+class Budget:
+    __slots__ = ("deadline", "cache", "key", "shed", "deadline_hold", "cancelled", "journal")
+
+    def __init__(self, budget_ms, start=None, cache=None, key=None, journal=None):
+        self.deadline = (start if start is not None else time.perf_counter()) + budget_ms / 1000.0
+        self.cache = cache          # SymbolState.cache (同一根 K 线内复用结果)
+        self.key = key              # 窗口标识: 最后一根 M5 的时间 + OHLC、窗口长度、配置版本
+        self.shed = []              # [(步骤, 是否用了缓存)]
+        self.deadline_hold = False
+        self.cancelled = False      # 被同一终端更新的请求取代
+        self.journal = journal      # 耗时估计来源; None = 全局 journal (调试计量用独立的一份)
+
+    @classmethod
+    def for_request(cls, data, cfg, state=None, journal=None):
+        budget_ms = cfg.LATENCY_BUDGET_MS
+        if data.deadline_ms > 0:
+            budget_ms = min(budget_ms, data.deadline_ms)
+        key = None
+        if data.m5_candles:
+            last = data.m5_candles[-1]
+            key = (last.time, last.open, last.high, last.low, last.close, len(data.m5_candles), cfg.version)
+        return cls(budget_ms - cfg.LATENCY_RESERVE_MS, start=_arrival.get(),
+                   cache=state.cache if state is not None else None, key=key, journal=journal)
+
+    def remaining_ms(self):
+        return (self.deadline - time.perf_counter()) * 1000.0
+
+    def cancel(self):
+        # 由其它线程调用; 只置标志，流水线在下一个检查点退出
+        self.cancelled = True
+
+    def expired(self):
+        if self.cancelled:
+            return True
+        if time.perf_counter() < self.deadline:
+            return False
+        self.deadline_hold = True
+        return True
+
+    def run(self, name, fn, *args, default=SHED, variant=None):
+        """预算足够时执行 fn(*args) 并缓存结果; 否则返回同一输入的缓存结果或 default (默认 SHED)"""
+        if self.cancelled:
+            # 结果不会被使用，也不计入降级统计
+            return default
+        cache_key = (name, variant)
+        # 窗口标识 + 标量参数 (ATR / setup / 回溯长度): 任何一项不同都不复用
+        signature = (self.key,) + tuple(a for a in args if isinstance(a, (int, float, str)))
+        costs = self.journal if self.journal is not None else journal
+        if self.remaining_ms() < costs.cost_ms.get(name, 0.0) * COST_SAFETY:
+            costs.decay(name)
+            hit = self.cache.get(cache_key) if self.cache is not None else None
+            if hit is not None and self.key is not None and hit[0] == signature:
+                self.shed.append((name, True))
+                return hit[1]
+            self.shed.append((name, False))
+            return default
+        t0 = time.perf_counter()
+        result = fn(*args)
+        costs.observe(name, (time.perf_counter() - t0) * 1000.0)
+        if self.cache is not None:
+            self.cache[cache_key] = (signature, result)
+        return result
+
+    @property
+    def degraded(self):
+        return self.deadline_hold or bool(self.shed)
+
+    @property
+    def reason(self):
+        parts = [f"{name}{'(cached)' if cached else ''}" for name, cached in self.shed]
+        if self.deadline_hold:
+            parts.append("DEADLINE")
+        return ",".join(parts)
+
+
+def run_optional(budget, name, fn, *args, default=SHED, variant=None):
+    """服务层调用可选步骤的统一入口 (离线工具不带预算时直接执行)"""
+    if budget is None:
+        return fn(*args)
+    return budget.run(name, fn, *args, default=default, variant=variant)
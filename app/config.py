@@ -18,8 +18,22 @@ NO_TRADE_END_H_BJ = 9.5
 # [数据保护]
 MIN_HISTORY_FOR_ATR = 20
 NEWS_PADDING_MINUTES = 30
+# [新增] 风控日历 (时段 / 结算 / 新闻 / 假期 / 夏令时，相对 app/ 目录，格式见 app/risk_calendar.py)
+# 文件不存在时按上面的时段常量与 IS_WINTER_TIME 构造
+RISK_CALENDAR_FILE = "risk_calendar.json"
+# 日历中 impact >= 该值的新闻前后 NEWS_PADDING_MINUTES 分钟禁止开仓
+NEWS_MIN_IMPACT = 3
 COOLDOWN_AFTER_LOSS_MINUTES = 15
 
+# [新增] 计算后端 (app/backends.py): "reference" = 原有服务层实现; "array" = 数组化实现 (结论逐位一致，
+# 上线前用 tools/backend_equiv.py 比对)。可热更新，改回 "reference" 即回滚
+COMPUTE_BACKEND = "reference"
+# 按层单独指定 (L3 阶段 / L2 Setup / L2 楔形评分 / L5 订单); 空字符串 = 跟随 COMPUTE_BACKEND
+COMPUTE_BACKEND_STAGE = ""
+COMPUTE_BACKEND_SETUP = ""
+COMPUTE_BACKEND_WEDGE = ""
+COMPUTE_BACKEND_ORDER = ""
+
 # ==============================================================================
 # SECTION B: MONEY MANAGEMENT (资金管理 - 建议动态化)
 # ==============================================================================
@@ -106,4 +120,75 @@ MIN_TICK_SIZE = 0.20
 # ==============================================================================
 # 用于计算手数时的保底 ATR，防止 ATR=0 导致除零
 MIN_SAFE_ATR = 0.5
+# [新增] 挂单意图 (app/intents.py): 同一 Setup + 信号 K 线的挂单已在 EA 上时，
+# entry / sl / tp 的变化都不超过 max(MIN_TICK_SIZE, ATR * 该值) 回 KEEP，否则回 MODIFY_PENDING (不再删单重下)
+INTENT_TOLERANCE_ATR = 0.1
+# [新增] 持仓管理 (main._analyze 的出场规则; 轮询间隔 app/polling.py、价格触发 app/triggers.py、
+# tools/exit_sweep.py 都从这里读，ATR 倍数)
+# 减仓: 价格偏离开仓价超过该值 (手数 >= 0.02、未减过仓) 时平掉 PARTIAL_CLOSE_LOT
+PARTIAL_CLOSE_ATR = 1.0
+# 移动止损: 浮盈超过启动阈值后止损跟在现价后面的距离 (Stage 1 宽松 / Stage 2 标准 / 其余阶段紧迫)
+TRAIL_S1_START_ATR = 2.0
+TRAIL_S1_DISTANCE_ATR = 1.5
+TRAIL_S2_START_ATR = 1.5
+TRAIL_S2_DISTANCE_ATR = 1.0
+TRAIL_OTHER_START_ATR = 1.0
+TRAIL_OTHER_DISTANCE_ATR = 0.5
+# 新止损至少要比旧止损好这么多 (价格单位) 才修改
+TRAIL_MIN_STEP = 0.05
+
 
+# ==============================================================================
+# SECTION E: PROBABILITY GATE (L4 查表模型)
+# ==============================================================================
+# 由 tools/build_prob_table.py 离线回放生成; 相对路径以 app/ 目录为基准
+# 文件不存在时 L4 门控自动关闭
+PROB_TABLE_FILE = "prob_table.npz"
+# 开仓最低胜率 (胜 = 先到 +1R 再到 SL)
+MIN_PROB = 0.65
+# 桶内样本少于该值时不做判断 (放行)
+PROB_MIN_SAMPLES = 30
+
+# ==============================================================================
+# SECTION F: STATE PERSISTENCE (按 account+symbol 的分析状态)
+# ==============================================================================
+# 每个品种最多保留的 M5 根数 (4032 = 14 天)
+STATE_MAX_BARS = 4032
+# 快照文件 (相对 app/ 目录) 与写入间隔; 间隔 <= 0 时只在关机时写
+STATE_SNAPSHOT_FILE = "data/state_snapshot.bin"
+STATE_SNAPSHOT_SECONDS = 60
+# 从 M5 状态重采样的高周期 (可选 "M15", "H1", "H4", "D1")
+RESAMPLE_TIMEFRAMES = ("H1",)
+# L3 使用的 H1 根数 (与 EA 原先发送的 50 根一致); 状态里不足这么多时退回请求中的 h1_candles
+H1_WINDOW_BARS = 50
+# 状态存储: "local" = 进程内 (单 worker); "shm" = 共享内存，多个 uvicorn worker 共用一份 (见 app/shm_state.py)
+# 以下三项只在启动时读取
+STATE_BACKEND = "local"
+# 共享内存段名前缀 (同一台机器上的多套服务需要不同的前缀) 与最多品种数
+STATE_SHM_NAME = "fxagent"
+STATE_SHM_SLOTS = 64
+
+# ==============================================================================
+# SECTION G: LATENCY BUDGET (EA WebRequest 超时 5000ms，迟到的答复不如 HOLD)
+# ==============================================================================
+# 每个 /signal 从到达服务端起的处理预算; EA 发送 deadline_ms 时取两者较小值
+LATENCY_BUDGET_MS = 1000
+# 预留给响应序列化与网络回程的时间
+LATENCY_RESERVE_MS = 100
+
+# ==============================================================================
+# SECTION H: POLLING HINTS / PRICE TRIGGERS (见 app/polling.py, app/triggers.py)
+# ==============================================================================
+# EA 原先固定每 5 秒一次; 有持仓 / 挂单 / 强趋势与突破模式时保持这个节奏
+POLL_BASE_MS = 5000
+# 刚执行过动作、持仓接近减仓 / 移动止损阈值时
+POLL_MIN_MS = 1000
+# 空仓的安静时段 / 禁止时段最长间隔
+POLL_MAX_MS = 60000
+# 空仓时在 M5 收盘前多久恢复正常轮询
+POLL_BAR_CLOSE_LEAD_MS = 20000
+# 浮盈达到阈值的该比例即视为"接近"
+POLL_NEAR_THRESHOLD_RATIO = 0.8
+# 价格触发表: 每笔持仓的移动止损给出几档 (价格每推进 TRIGGER_TRAIL_STEP_ATR 一档)，0 = 不下发移动止损触发
+TRIGGER_TRAIL_LEVELS = 3
+TRIGGER_TRAIL_STEP_ATR = 0.25
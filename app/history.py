@@ -0,0 +1,80 @@
+# app/history.py
+"""
+历史 K 线文件格式 (CSV, 字段与 MT5 CopyRates / schemas.Candle 一致):
+
+    time,open,high,low,close,tick_vol,spread
+
+内存中统一用 (N, 7) float64 数组表示，列顺序同上。
+"""
+import itertools
+import os
+
+import numpy as np
+
+from .schemas import Candle
+
+COLUMNS = ("time", "open", "high", "low", "close", "tick_vol", "spread")
+T, O, H, L, C, V, S = range(len(COLUMNS))
+HEADER = ",".join(COLUMNS)
+
+
+def load_bars(path):
+    """读取历史文件 -> (N, 7) 数组 (按时间升序)"""
+    bars = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+    if bars.size == 0:
+        return np.empty((0, len(COLUMNS)))
+    if bars.shape[1] != len(COLUMNS):
+        raise ValueError(f"{path}: expected {len(COLUMNS)} columns ({HEADER}), got {bars.shape[1]}")
+    return bars[np.argsort(bars[:, T], kind="stable")]
+
+
+def iter_bar_blocks(path, block_size, skip_rows=0):
+    """
+    流式读取历史文件: 每次产出最多 block_size 行的 (n, 7) 数组，内存与文件长度无关
+    skip_rows: 跳过表头之后的前若干行 (只读不解析，用于断点续跑)
+    不排序，文件必须已按时间升序 (save_bars / 各导出工具的输出都满足)，否则报错
+    """
+    last_time = None
+    with open(path, encoding="utf-8") as f:
+        lines = (line for line in itertools.islice(f, 1, None) if line.strip())
+        for _ in itertools.islice(lines, skip_rows):
+            pass
+        while True:
+            block = list(itertools.islice(lines, block_size))
+            if not block:
+                return
+            bars = np.loadtxt(block, delimiter=",", ndmin=2)
+            if bars.shape[1] != len(COLUMNS):
+                raise ValueError(f"{path}: expected {len(COLUMNS)} columns ({HEADER}), got {bars.shape[1]}")
+            times = bars[:, T]
+            if (last_time is not None and times[0] < last_time) or (np.diff(times) < 0).any():
+                raise ValueError(f"{path}: bars must be sorted by time for streaming reads")
+            last_time = times[-1]
+            yield bars
+
+
+def save_bars(path, bars, append=False):
+    """写历史文件; append=True 时追加 (文件不存在则自动写表头)"""
+    bars = np.asarray(bars, dtype=np.float64).reshape(-1, len(COLUMNS))
+    write_header = not (append and os.path.exists(path) and os.path.getsize(path) > 0)
+    with open(path, "a" if append else "w", encoding="utf-8") as f:
+        np.savetxt(
+            f, bars, delimiter=",",
+            fmt=["%d", "%.5f", "%.5f", "%.5f", "%.5f", "%d", "%d"],
+            header=HEADER if write_header else "", comments="",
+        )
+
+
+def to_candles(bars):
+    """数组 -> Candle 列表 (供 L1/L5 等按对象访问的服务使用)"""
+    return [
+        Candle(time=int(r[T]), open=r[O], high=r[H], low=r[L], close=r[C], tick_vol=int(r[V]), spread=int(r[S]))
+        for r in np.asarray(bars).tolist()
+    ]
+
+
+def from_candles(candles):
+    return np.array(
+        [(c.time, c.open, c.high, c.low, c.close, c.tick_vol, c.spread) for c in candles],
+        dtype=np.float64,
+    ).reshape(-1, len(COLUMNS))
@@ -0,0 +1,95 @@
+# app/indicators.py
+"""
+NumPy 版 K 线表与指标 (实盘热路径不再依赖 pandas)
+
+BarFrame 只保留服务层用到的那一小部分 DataFrame 用法:
+    df['close']        -> np.ndarray
+    df['ema20'][-1]    -> 最后一个值
+    df.row(-1)         -> {'open': .., 'high': .., ..., 'ema20': ..}
+    df.tail(10)        -> 后 10 行 (视图，不复制)
+pandas 只在研究工具里通过 to_pandas() 按需导入。
+"""
+import numpy as np
+
+BAR_COLUMNS = ("time", "open", "high", "low", "close", "tick_vol", "spread")
+
+
+class BarFrame:
+    __slots__ = ("_cols", "_n")
+
+    def __init__(self, columns):
+        self._cols = dict(columns)
+        self._n = len(next(iter(self._cols.values()))) if self._cols else 0
+
+    @classmethod
+    def from_candles(cls, candles):
+        raw = np.array(
+            [(c.time, c.open, c.high, c.low, c.close, c.tick_vol, c.spread) for c in candles],
+            dtype=np.float64,
+        ).reshape(-1, len(BAR_COLUMNS))
+        return cls.from_array(raw)
+
+    @classmethod
+    def from_array(cls, bars):
+        """(N, 7) 数组 (app.history 格式) -> BarFrame (列为视图)"""
+        return cls({name: bars[:, i] for i, name in enumerate(BAR_COLUMNS)})
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, key):
+        return self._cols[key]
+
+    def __setitem__(self, key, values):
+        if len(values) != self._n:
+            raise ValueError(f"column '{key}' has {len(values)} rows, frame has {self._n}")
+        self._cols[key] = values
+
+    def __contains__(self, key):
+        return key in self._cols
+
+    @property
+    def columns(self):
+        return list(self._cols)
+
+    def row(self, i):
+        return {k: v[i].item() for k, v in self._cols.items()}
+
+    def slice(self, start=None, stop=None):
+        return BarFrame({k: v[start:stop] for k, v in self._cols.items()})
+
+    def tail(self, n):
+        return self.slice(max(0, self._n - n), None)
+
+    def to_pandas(self):
+        import pandas as pd
+        return pd.DataFrame(self._cols)
+
+
+def true_range(high, low, close):
+    """TR = max(H-L, |H-PC|, |L-PC|); 第一根没有前收盘，只取 H-L"""
+    tr = high - low
+    if len(tr) > 1:
+        prev_close = close[:-1]
+        tr[1:] = np.maximum(tr[1:], np.maximum(np.abs(high[1:] - prev_close), np.abs(low[1:] - prev_close)))
+    return tr
+
+
+def ema(values, span):
+    """
+    指数均线，与 pandas Series.ewm(span=span, adjust=False).mean() 逐位一致
+    (同样的递推与归一化顺序，避免阈值比较因末位误差翻转)
+    """
+    n = len(values)
+    out = np.empty(n)
+    if n == 0:
+        return out
+    alpha = 1.0 / (1.0 + (span - 1) / 2.0)
+    old_wt = 1.0 - alpha
+    weighted = float(values[0])
+    out[0] = weighted
+    for i, cur in enumerate(values[1:].tolist(), start=1):
+        if weighted != cur:
+            weighted = ((old_wt * weighted) + (alpha * cur)) / (old_wt + alpha)
+        out[i] = weighted
+    return out
@@ -0,0 +1,95 @@
+# app/intents.py
+"""
+挂单意图: 同一张挂单不再每次轮询都删单重下
+
+L5 在同一根信号 K 线上每次轮询 (5 秒) 都会给出同一张挂单; EA 以前每收到 PLACE_* 就删掉全部挂单再下新单，
+一根 K 线最多 60 次券商往返。现在:
+- 每张挂单有稳定的意图 id = 方向 + 信号 K 线时间 + Setup，EA 下单时写进订单 comment
+- 服务端按 (account, symbol) 记录最近一次的意图及其挂单 ticket; EA 在请求里带上自己的挂单 (pending_orders)，
+  据此确认挂单还在 (成交 / 过期 / 被拒后自然消失，下一次就重新 PLACE)
+- 新决策与在场挂单意图相同且手数相同:
+    entry / sl / tp 的变化都在容差内 -> KEEP (EA 不做任何操作)
+    超出容差 -> MODIFY_PENDING (EA 按 ticket 原地改价，一次往返)
+  意图不同或手数变了 (挂单不能改手数) -> 仍是 PLACE_* (EA 删旧单下新单)
+- 旧版 EA 不发送 pending_orders: 原样返回 PLACE_*，行为不变
+多 worker 时各进程的记录互不相通，没有记录的进程按 comment 找回挂单，结论相同。
+"""
+import collections
+import threading
+import time
+
+# PLACE_* -> (意图 id 前缀, EA 上报的挂单类型)
+PLACE_ACTIONS = {
+    "PLACE_BUY_STOP": ("BS", "BUY_STOP"),
+    "PLACE_SELL_STOP": ("SS", "SELL_STOP"),
+    "PLACE_BUY_LIMIT": ("BL", "BUY_LIMIT"),
+    "PLACE_SELL_LIMIT": ("SL", "SELL_LIMIT"),
+}
+# MT5 订单 comment 的长度上限
+COMMENT_MAX = 31
+
+
+def intent_id(action, setup, bar_time):
+    """稳定的意图 id: 同一方向、同一信号 K 线、同一 Setup 的挂单每次轮询得到同一个 id"""
+    return f"{PLACE_ACTIONS[action][0]}{int(bar_time)}-{setup}"[:COMMENT_MAX]
+
+
+class IntentTracker:
+    """按 (account, symbol) 记录在场的挂单意图，并统计各种结论的次数 (GET /intents)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._live = {}
+        self.decisions = collections.Counter()
+
+    def resolve(self, data, response, setup, atr, cfg):
+        """PLACE_* 决策 -> PLACE_* / KEEP / MODIFY_PENDING (其它动作原样返回)"""
+        if response.action not in PLACE_ACTIONS or data.pending_orders is None or not data.m5_candles:
+            return response
+        key = (data.account_login, data.symbol)
+        iid = intent_id(response.action, setup, data.m5_candles[-1].time)
+        response.intent_id = iid
+        tolerance = max(cfg.MIN_TICK_SIZE, atr * cfg.INTENT_TOLERANCE_ATR)
+
+        with self._lock:
+            order = self._find_order(self._live.get(key), iid, data.pending_orders)
+            decision = response.action
+            if (order is not None and order.type == PLACE_ACTIONS[response.action][1]
+                    and abs(order.volume - response.lot) < 1e-9):
+                moved = max(abs(order.price - response.entry_price), abs(order.sl - response.sl),
+                            abs(order.tp - response.tp))
+                response.ticket = order.ticket
+                if moved <= tolerance:
+                    # 回报实际在场的挂单价格，日志与 EA 上的挂单一致
+                    decision = "KEEP"
+                    response.entry_price, response.sl, response.tp = order.price, order.sl, order.tp
+                else:
+                    decision = "MODIFY_PENDING"
+                response.action = decision
+            self._live[key] = {
+                # PLACE 之后的新挂单 ticket 未知，下一次按 comment 找回
+                "intent_id": iid, "ticket": response.ticket if decision in ("KEEP", "MODIFY_PENDING") else None,
+                "entry": response.entry_price, "sl": response.sl, "tp": response.tp, "lot": response.lot,
+                "decision": decision, "updated_at": time.time(),
+            }
+            self.decisions["PLACE" if decision in PLACE_ACTIONS else decision] += 1
+        return response
+
+    @staticmethod
+    def _find_order(live, iid, pending_orders):
+        # 优先按记录的 ticket 找 (券商可能改写 comment)，其次按 comment 中的意图 id
+        ticket = live["ticket"] if live is not None and live["intent_id"] == iid else None
+        for order in pending_orders:
+            if (ticket is not None and order.ticket == ticket) or order.comment == iid:
+                return order
+        return None
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "decisions": dict(self.decisions),
+                "live": [{"account": a, "symbol": s, **v} for (a, s), v in self._live.items()],
+            }
+
+
+intent_tracker = IntentTracker()
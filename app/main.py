@@ -1,72 +1,249 @@
-from fastapi import FastAPI
-from .schemas import MarketData, SignalResponse
-from .services.global_risk import GlobalRiskService
-from .services.l1_perception import PerceptionService
-from .services.l2_structure import StructureService
-from .services.l3_context import ContextService
-from .services.l5_execution import ExecutionService
-from . import config
+import time
+_IMPORT_T0 = time.perf_counter()
+
+import functools
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from .schemas import MarketData, SignalResponse, SeriesRequest
+from .runtime_config import config_store, resolve_app_path
+from .pipeline import risk_svc, state_store, prepare_market_data, evaluate_entry, resolve_h1
+from .history import from_candles
+from .batch import iter_series, iter_ndjson
+from .state import StateStore, SnapshotWriter
+from . import alloc, backends
+from .profiler import profiler, ProfilerMiddleware
+from .budget import Budget, ArrivalMiddleware, LatencyJournal, journal as latency_journal
+from .intents import IntentTracker, intent_tracker
+from .polling import next_poll_after_ms
+from .triggers import build_triggers
+from .singleflight import single_flight
+from .warmup import run_warmup, WARMUP_SYMBOL
 import logging
-import pandas as pd
-import numpy as np
+
+# 模块导入耗时 (FastAPI + Pydantic + NumPy + 各服务层; pandas 不在热路径上)
+IMPORT_MS = (time.perf_counter() - _IMPORT_T0) * 1000.0
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
-risk_svc = GlobalRiskService()
-l1_svc = PerceptionService()
-l2_svc = StructureService()
-l3_svc = ContextService()
-l5_svc = ExecutionService()
-
-def prepare_market_data(candles, period=14):
-    """
-    统一的数据准备函数:
-    1. 转 DataFrame
-    2. 计算 ATR
-    3. 计算 EMA20 (所有服务公用)
-    """
-    if not candles or len(candles) < config.MIN_HISTORY_FOR_ATR:
-        return None, None
-    
-    df = pd.DataFrame([c.dict() for c in candles])
-    
-    # 1. 计算 ATR
-    df['h-l'] = df['high'] - df['low']
-    df['h-pc'] = abs(df['high'] - df['close'].shift(1))
-    df['l-pc'] = abs(df['low'] - df['close'].shift(1))
-    df['tr'] = df[['h-l', 'h-pc', 'l-pc']].max(axis=1)
-    current_atr = df['tr'].rolling(period).mean().iloc[-1]
+startup_stats = {"import_ms": round(IMPORT_MS, 1), "warmup_ms": [], "first_request_ms": None}
+
+@asynccontextmanager
+async def lifespan(app):
+    # uvicorn 在 lifespan 启动完成后才开始监听端口:
+    # 预热期间不会有 MT5 请求进来，第一笔真实请求直接走热路径
+    cfg = config_store.current()
     
-    # 2. 计算 EMA20
-    df['ema20'] = df['close'].ewm(span=20, adjust=False).mean()
+    # 读回上次的分析状态快照 (首个请求到来时再与请求中的 K 线对账)
+    snapshot_path = resolve_app_path(cfg.STATE_SNAPSHOT_FILE)
+    state_store.load_snapshot(snapshot_path, cfg.version)
+    writer = SnapshotWriter(state_store, snapshot_path, cfg.STATE_SNAPSHOT_SECONDS,
+                            lambda: config_store.current().version)
+    writer.start()
     
-    if pd.isna(current_atr): current_atr = 5.0
+    timings = run_warmup(_analyze, cfg)
+    startup_stats["warmup_ms"] = [round(t, 2) for t in timings]
+    logger.info(f"[STARTUP] Import: {IMPORT_MS:.0f}ms | Warm-up: cold {timings[0]:.1f}ms, warm {timings[-1]:.1f}ms "
+                f"| Config: {cfg.version} | Backends: {backends.describe(cfg)}")
+    yield
     
-    return df, current_atr
+    # 关机: 停止后台线程并写最后一次快照
+    writer.stop()
+    logger.info(f"[SHUTDOWN] State snapshot written: {len(state_store.keys())} symbols")
+    state_store.close()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(ProfilerMiddleware, profiler=profiler)
+app.add_middleware(ArrivalMiddleware)
+
+@app.get("/health")
+def health():
+    cfg = config_store.current()
+    return {"status": "ok", "config_version": cfg.version, "compute_backends": backends.describe(cfg),
+            "startup": startup_stats}
+
+@app.get("/state")
+def get_state():
+    states = []
+    for account, symbol in state_store.keys():
+        st = state_store.get(account, symbol)
+        states.append({"account": account, "symbol": symbol, "bars": len(st),
+                       "timeframes": {name: len(series) for name, series in st.timeframes.items()},
+                       "last_ema20": st.last_ema, "updated_at": st.updated_at})
+    return {"stats": state_store.stats, "states": states}
+
+@app.get("/calendar")
+def get_calendar(ts: int = 0):
+    # 风控日历概况; 带 ts (服务器时间戳) 时返回该时刻的查询结果
+    calendar = risk_svc.calendar.get(config_store.current())
+    result = calendar.describe()
+    if ts:
+        block, session_ratio, bj_ts = calendar.lookup(ts)
+        result["lookup"] = {"ts": ts, "block": block, "spread_ratio": session_ratio, "bj_ts": bj_ts}
+    return result
+
+@app.post("/profile/start")
+def start_profile(every_n: int = 1, seconds: float = 0.0, interval_ms: float = 5.0):
+    # 每 every_n 个 /signal 采样 1 个; seconds > 0 时到期自动停止
+    # 采样期间整个进程的 GIL 切换间隔降到 interval_ms / 10 (所有请求都受影响)，停止后恢复
+    try:
+        return profiler.start(every_n=every_n, seconds=seconds, interval_ms=interval_ms)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/profile/stop")
+def stop_profile():
+    return profiler.stop()
+
+@app.get("/profile")
+def get_profile():
+    return profiler.status()
+
+@app.get("/profile/collapsed", response_class=PlainTextResponse)
+def get_profile_collapsed(stage: str = None):
+    # 折叠栈文本: flamegraph.pl profile.txt > profile.svg
+    return profiler.collapsed(stage)
+
+# 内存分配统计 (调试用): 同一份 /signal 请求体按阶段计量，按请求类别累计
+alloc_stats = alloc.AllocationStats()
+
+@app.post("/debug/alloc")
+async def debug_alloc(request: Request, repeat: int = 5):
+    # 请求体与 /signal 相同; 读原始字节，JSON 解析 + Pydantic 校验也计入 (parse 阶段)
+    # 在独立的状态 / 挂单意图 / 预算日志上运行 (不影响实盘); tracemalloc 是进程级的，计量期间所有请求都变慢
+    body = await request.body()
+    try:
+        cls, detail, response = await run_in_threadpool(alloc.measure, body, _sandbox_signal(), alloc_stats, repeat)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"class": cls, "last": detail, "response": response.model_dump()}
+
+@app.get("/debug/alloc")
+def get_alloc():
+    return alloc_stats.report()
+
+@app.post("/debug/alloc/reset")
+def reset_alloc():
+    alloc_stats.reset()
+    return {"reset": True}
+
+@app.get("/budget")
+def get_budget():
+    # 延迟预算: 各可选步骤的耗时估计、被跳过 / 用缓存的次数、超时 HOLD 次数
+    return latency_journal.snapshot()
+
+@app.get("/intents")
+def get_intents():
+    # 挂单意图: PLACE / KEEP / MODIFY_PENDING 次数与各品种在场的意图
+    return intent_tracker.snapshot()
+
+@app.get("/inflight")
+def get_inflight():
+    # 同一终端的请求串行化: 排队深度、合并 (attached) / 取代 (superseded / dropped) 次数
+    return single_flight.snapshot()
+
+@app.get("/config")
+def get_config():
+    cfg = config_store.current()
+    return {"version": cfg.version, "source": cfg.source, "values": cfg.as_dict()}
+
+@app.post("/config/reload")
+def reload_config():
+    # 手动触发热更新 (正常情况下 /signal 入口也会按 mtime 自动检测)
+    changed, version = config_store.reload()
+    return {"changed": changed, "version": version}
+
+@app.post("/series")
+def analyze_series(req: SeriesRequest):
+    """整段历史的逐根分析结果，以 NDJSON 分块流式返回 (每根 K 线一行)"""
+    cfg = config_store.current()
+    bars = from_candles(req.m5_candles)
+    chunks = iter_series(bars, cfg, chunk_size=max(1, req.chunk_size), prob_gate=req.prob_gate)
+    return StreamingResponse(iter_ndjson(chunks), media_type="application/x-ndjson")
 
 @app.post("/signal", response_model=SignalResponse)
 def analyze_market(data: MarketData):
+    # 被采样时登记当前线程 (profiler 未开启时是空操作)
+    with profiler.track():
+        # [新增] 同一 (account, symbol) 串行: 相同输入合并，新输入取代在跑的旧请求
+        return single_flight.run(data, _signal, _superseded_hold)
+
+def _superseded_hold():
+    return SignalResponse(action="HOLD", reason="SUPERSEDED")
+
+def _sandbox_signal():
+    """调试计量用的 _signal: 独立的 StateStore / IntentTracker / LatencyJournal，不写实盘状态、不计入 GET /budget"""
+    cfg = config_store.current()
+    return functools.partial(_signal, store=StateStore(max_bars=cfg.STATE_MAX_BARS, timeframes=cfg.RESAMPLE_TIMEFRAMES),
+                             intents=IntentTracker(), journal=LatencyJournal())
+
+def _signal(data, call=None, store=state_store, intents=intent_tracker, journal=latency_journal):
+    # 请求开始时固定配置快照: 中途热更新不会让同一请求读到两套参数
+    t0 = time.perf_counter()
+    cfg = config_store.maybe_reload()
+    state = None
+    alloc.mark("state")
+    if data.symbol != WARMUP_SYMBOL:
+        state = store.ingest(data.account_login, data.symbol, from_candles(data.m5_candles))
+    budget = Budget.for_request(data, cfg, state, journal=journal)
+    if call is not None:
+        single_flight.attach_budget(call, budget)
+    context = {}
+    response = _analyze(data, cfg, state, budget, context, intents=intents)
+    response.config_version = cfg.version
+    # [新增] 下一次轮询的建议间隔 (空仓的安静时段 / 禁止时段放慢，收盘前后与持仓管理时保持快速)
+    response.next_poll_after_ms = next_poll_after_ms(data, response, cfg, risk_svc.calendar.get(cfg), **context)
+    # [新增] 两次轮询之间由 EA 本地执行的价格触发 (突破 / 减仓 / 移动止损)
+    response.triggers, response.triggers_valid_until = build_triggers(data, response, cfg, **context)
+    journal.record(budget)
+    if budget.degraded:
+        response.degraded = True
+        response.degraded_reason = budget.reason
+        logger.info(f"[DEGRADED] {data.symbol}: {budget.reason} | Remaining: {budget.remaining_ms():.0f}ms")
+    
+    if startup_stats["first_request_ms"] is None and store is state_store:
+        startup_stats["first_request_ms"] = round((time.perf_counter() - t0) * 1000.0, 2)
+        logger.info(f"[STARTUP] First /signal latency: {startup_stats['first_request_ms']}ms")
+    return response
+
+def _deadline_hold(budget):
+    # 已超过延迟预算: 不再继续分析，直接给保守的 HOLD
+    if budget.cancelled:
+        return _superseded_hold()
+    return SignalResponse(action="HOLD", reason=f"DEADLINE_HOLD({budget.remaining_ms():.0f}ms)")
+
+def _analyze(data, cfg, state=None, budget=None, context=None, intents=intent_tracker):
+    # context: 可选的 dict，回填 atr / stage 供轮询间隔计算 (提前返回时只有已算出的部分)
+    context = context if context is not None else {}
     # 1. 统一数据准备
-    df_m5, current_atr = prepare_market_data(data.m5_candles)
+    alloc.mark("indicators")
+    df_m5, current_atr = prepare_market_data(data.m5_candles, cfg=cfg)
     
     if df_m5 is None or current_atr is None:
         return SignalResponse(action="HOLD", reason="NO_DATA_OR_ATR_FAIL")
+    context["atr"] = current_atr
+
+    # [新增] 排队 / 解析已经耗尽预算
+    if budget is not None and budget.expired():
+        return _deadline_hold(budget)
 
     # 0. 全局风控 (传入 ATR)
     # [修正] 确保 current_atr 有效后再调用
-    is_safe, safety_reason = risk_svc.check_safety(data, current_atr)
+    alloc.mark("L0")
+    is_safe, safety_reason = risk_svc.check_safety(data, current_atr, cfg)
     if not is_safe:
         return SignalResponse(action="HOLD", reason=f"RISK:{safety_reason}")
 
     # 2. 仓位管理 & 动态减仓 (修正版：遍历所有持仓)
+    alloc.mark("positions")
     current_pos_count = len(data.current_positions)
     
     if data.current_positions:
-        # [修正] 设定 ATR 阈值
-        atr_threshold = current_atr * 1.0
+        # [修正] 设定 ATR 阈值 (PARTIAL_CLOSE_ATR，轮询间隔 / 价格触发用同一个值)
+        atr_threshold = current_atr * cfg.PARTIAL_CLOSE_ATR
         
         # [修正] 遍历所有持仓，而不仅仅是第 0 个
         for pos in data.current_positions:
@@ -82,7 +259,7 @@ def analyze_market(data: MarketData):
                  return SignalResponse(
                      action="CLOSE_PARTIAL", 
                      ticket=pos.ticket, 
-                     lot=config.PARTIAL_CLOSE_LOT, 
+                     lot=cfg.PARTIAL_CLOSE_LOT, 
                      reason=f"TP_Partial_1ATR({dist_moved:.1f})"
                  )
 
@@ -90,10 +267,14 @@ def analyze_market(data: MarketData):
     m5_bars = data.m5_candles
     
     # [提前] L3 Context 计算
-    stage, trend_dir = l3_svc.identify_stage(df_m5, data.h1_candles, current_atr)
+    alloc.mark("L3")
+    df_h1, _ = resolve_h1(state, m5_bars, data.h1_candles, cfg)
+    stage, trend_dir = backends.identify_stage(df_m5, df_h1, current_atr, cfg)
+    context["stage"] = stage
 
     # [新增] 移动止损逻辑 (Stage-Based Trailing Stop)
     # Module 4: Exit Strategy
+    alloc.mark("positions")
     if data.current_positions:
         atr_val = current_atr
         for pos in data.current_positions:
@@ -112,10 +293,10 @@ def analyze_market(data: MarketData):
             
             # 策略 A: Stage 1 (强趋势) -> 宽松止损，哪怕回撤也不怕
             if "1-STRONG_TREND" in stage:
-                # 只有盈利 > 2.0 ATR 才开始保本/移动
-                if dist_profit > (atr_val * 2.0):
-                    # 留给它 1.5 ATR 的呼吸空间
-                    target_sl_dist = atr_val * 1.5
+                # 只有盈利 > TRAIL_S1_START_ATR (2.0 ATR) 才开始保本/移动
+                if dist_profit > (atr_val * cfg.TRAIL_S1_START_ATR):
+                    # 留给它 TRAIL_S1_DISTANCE_ATR (1.5 ATR) 的呼吸空间
+                    target_sl_dist = atr_val * cfg.TRAIL_S1_DISTANCE_ATR
                     if pos.type == "BUY": new_sl = pos.current_price - target_sl_dist
                     else: new_sl = pos.current_price + target_sl_dist
                     should_modify = True
@@ -123,9 +304,9 @@ def analyze_market(data: MarketData):
 
             # 策略 B: Stage 2 (通道) -> 标准止损
             elif "2-CHANNEL" in stage:
-                # 盈利 > 1.5 ATR 保本
-                if dist_profit > (atr_val * 1.5):
-                    target_sl_dist = atr_val * 1.0 # 保持 1.0 ATR 距离
+                # 盈利 > TRAIL_S2_START_ATR (1.5 ATR) 保本
+                if dist_profit > (atr_val * cfg.TRAIL_S2_START_ATR):
+                    target_sl_dist = atr_val * cfg.TRAIL_S2_DISTANCE_ATR # 保持 1.0 ATR 距离
                     if pos.type == "BUY": new_sl = pos.current_price - target_sl_dist
                     else: new_sl = pos.current_price + target_sl_dist
                     should_modify = True
@@ -133,9 +314,9 @@ def analyze_market(data: MarketData):
                     
             # 策略 C: Stage 3/4 (震荡/突破) -> 紧迫止损 (见好就收)
             else: 
-                # 盈利 > 1.0 ATR 就赶紧保本
-                if dist_profit > (atr_val * 1.0):
-                    target_sl_dist = atr_val * 0.5 # 贴得很近 (0.5 ATR)
+                # 盈利 > TRAIL_OTHER_START_ATR (1.0 ATR) 就赶紧保本
+                if dist_profit > (atr_val * cfg.TRAIL_OTHER_START_ATR):
+                    target_sl_dist = atr_val * cfg.TRAIL_OTHER_DISTANCE_ATR # 贴得很近 (0.5 ATR)
                     if pos.type == "BUY": new_sl = pos.current_price - target_sl_dist
                     else: new_sl = pos.current_price + target_sl_dist
                     should_modify = True
@@ -146,17 +327,17 @@ def analyze_market(data: MarketData):
                 current_sl = pos.sl
                 if pos.type == "BUY":
                     # 买单: 新止损必须 > 旧止损 + 阈值
-                    if new_sl > current_sl + 0.05:
+                    if new_sl > current_sl + cfg.TRAIL_MIN_STEP:
                         return SignalResponse(action="MODIFY_SL", ticket=pos.ticket, sl=new_sl, reason=reason_mod)
                 elif pos.type == "SELL":
                     # 卖单: 新止损必须 < 旧止损 - 阈值 (注意 new_sl 越小越好，但这里是 SL 下移)
                     # 修正: 卖单 SL 是向下移动才是盈利保护？不对，卖单 SL 是价格下跌后 SL 也下跌。
                     # 所以新 SL 应该小于旧 SL。
-                    if current_sl == 0 or new_sl < current_sl - 0.05:
+                    if current_sl == 0 or new_sl < current_sl - cfg.TRAIL_MIN_STEP:
                          return SignalResponse(action="MODIFY_SL", ticket=pos.ticket, sl=new_sl, reason=reason_mod)
 
     # 最大持仓限制 & 反向加仓保护 (Anti-Pyramid)
-    if current_pos_count >= config.MAX_POSITIONS_COUNT:
+    if current_pos_count >= cfg.MAX_POSITIONS_COUNT:
          return SignalResponse(action="HOLD", reason="Max_Pos_Reached")
          
     # [新增] 只有当所有持仓都盈利 > 1 ATR 或者 已经推了保本损，才允许加仓
@@ -167,35 +348,36 @@ def analyze_market(data: MarketData):
             # 简单粗暴点：只要有浮亏，就别加仓了
             return SignalResponse(action="HOLD", reason=f"Block_Pyramid:Pos_{pos.ticket}_Loss")
     
-    # 3. 分析流程 (已在上方提前计算)
-    # m5_bars = data.m5_candles
-    
-    # L1: K 线特征分析 (用于增强日志)
-    last_bar = m5_bars[-1]
-    prev_bar = m5_bars[-2] if len(m5_bars) > 1 else None
-    bar_analysis = l1_svc.analyze_bar(last_bar, prev_bar, current_atr)
+    # 3. 分析流程: L1 -> L2 -> L5 -> L4 门控 (与离线回放共用 pipeline.evaluate_entry)
+    if budget is not None and budget.expired():
+        return _deadline_hold(budget)
+    entry_result = evaluate_entry(df_m5, m5_bars, stage, trend_dir, current_atr, cfg, budget=budget)
+    alloc.mark("response")
+    setup = entry_result['setup']
+    bar_analysis = entry_result['bar']
+    action = entry_result['action']
     
-    # [L3 已计算] stage, trend_dir = l3_svc.identify_stage...
+    lot, entry, sl, tp, reason = (entry_result['lot'], entry_result['entry'], entry_result['sl'],
+                                  entry_result['tp'], entry_result['reason'])
     
-    # [修改] L2 传入 df_m5
-    # StructureService.update_counter(self, df, trend_dir, atr)
-    structure = l2_svc.update_counter(df_m5, trend_dir, current_atr)
+    if reason.startswith("Weak_Setup_"):
+        logger.info(f"[FILTER] Setup={setup}, Stage={stage}, Trend={trend_dir}")
+    elif reason.startswith("L4_"):
+        logger.info(f"[L4_BLOCK] {reason}, Stage={stage}, Setup={setup}")
     
-    # Setup 过滤
-    if "IGNORE" in structure.get('setup', '') or "TOO_FAR" in structure.get('setup', '') or "RESET" in structure.get('setup', ''):
-        logger.info(f"[FILTER] Setup={structure['setup']}, Stage={stage}, Trend={trend_dir}")
-        return SignalResponse(action="HOLD", reason=f"Weak_Setup_{structure['setup']}")
+    # 已被同一终端更新的请求取代: 不再记录挂单意图
+    if budget is not None and budget.cancelled:
+        return _superseded_hold()
     
-    # [修改] L5 传入 df_m5
-    # ExecutionService.generate_order(self, stage, trend_dir, setup_type, df, candles, atr)
-    action, lot, entry, sl, tp, reason = l5_svc.generate_order(
-        stage, trend_dir, structure.get('setup', 'NONE'), df_m5, m5_bars, current_atr
-    )
+    # [新增] 与 EA 上在场的挂单意图对比: 未变 -> KEEP，价格移动 -> MODIFY_PENDING
+    response = intents.resolve(
+        data, SignalResponse(action=action, lot=lot, entry_price=entry, sl=sl, tp=tp, reason=reason),
+        setup, current_atr, cfg)
     
-    # 日志记录决策
-    if action != "HOLD":
-        logger.info(f"[SIGNAL] Action={action}, Stage={stage}, Setup={structure['setup']}, "
-                    f"Entry={entry:.2f}, SL={sl:.2f}, TP={tp:.2f}, Lot={lot}, "
+    # 日志记录决策 (KEEP 每次轮询都会出现，不记)
+    if response.action not in ("HOLD", "KEEP"):
+        logger.info(f"[SIGNAL] Action={response.action}, Stage={stage}, Setup={setup}, "
+                    f"Entry={response.entry_price:.2f}, SL={response.sl:.2f}, TP={response.tp:.2f}, Lot={lot}, "
                     f"Bar=[Ctrl:{bar_analysis['control']}, Trend:{bar_analysis['is_trend_bar']}, Rej:{bar_analysis['rejection_type']}]")
     
-    return SignalResponse(action=action, lot=lot, entry_price=entry, sl=sl, tp=tp, reason=reason)
+    return response
@@ -0,0 +1,133 @@
+# app/pipeline.py
+"""
+决策流水线中与"开仓"相关的公共部分。
+/signal 实盘接口与 tools/ 下的离线回放共用这里的逻辑，保证两边结论一致。
+"""
+import logging
+import math
+
+from . import alloc, backends
+from .indicators import BarFrame, ema, true_range
+from .runtime_config import config_store
+from .state import StateStore
+from .services.global_risk import GlobalRiskService
+from .services.l1_perception import PerceptionService
+from .services.l4_probability import ProbabilityService
+
+logger = logging.getLogger(__name__)
+
+risk_svc = GlobalRiskService()
+l1_svc = PerceptionService()
+l4_svc = ProbabilityService()
+# L2 / L3 / L5 按配置选择计算后端 (app/backends.py)
+
+
+def _create_state_store(cfg):
+    if cfg.STATE_BACKEND == "shm":
+        from .shm_state import SharedStateStore
+        return SharedStateStore(max_bars=cfg.STATE_MAX_BARS, timeframes=cfg.RESAMPLE_TIMEFRAMES,
+                                name=cfg.STATE_SHM_NAME, slots=cfg.STATE_SHM_SLOTS)
+    if cfg.STATE_BACKEND != "local":
+        raise ValueError(f"Unknown STATE_BACKEND: {cfg.STATE_BACKEND!r}")
+    return StateStore(max_bars=cfg.STATE_MAX_BARS, timeframes=cfg.RESAMPLE_TIMEFRAMES)
+
+
+# 按 (account, symbol) 的 K 线历史 / 指标状态 (快照读写见 main 的 lifespan)
+state_store = _create_state_store(config_store.current())
+
+
+def prepare_market_data(candles, period=14, cfg=None):
+    """
+    统一的数据准备函数 (纯 NumPy):
+    1. 转 BarFrame
+    2. 计算 ATR
+    3. 计算 EMA20 (所有服务公用)
+    """
+    cfg = cfg or config_store.current()
+    if not candles or len(candles) < cfg.MIN_HISTORY_FOR_ATR:
+        return None, None
+
+    df = BarFrame.from_candles(candles)
+
+    # 1. 计算 ATR (最后 period 根 TR 的简单均值)
+    df['tr'] = true_range(df['high'], df['low'], df['close'])
+    current_atr = float(df['tr'][-period:].mean()) if len(df) >= period else math.nan
+
+    # 2. 计算 EMA20
+    df['ema20'] = ema(df['close'], 20)
+
+    if math.isnan(current_atr): current_atr = 5.0
+
+    return df, current_atr
+
+
+def resolve_h1(state, m5_bars, h1_candles, cfg):
+    """
+    L3 使用的 H1:
+    1. 状态与本次请求同步 (最后一根 M5 相同) 且重采样的 H1 足够 -> 服务端重采样
+    2. 否则用 EA 发送的 h1_candles
+    返回 (BarFrame 或 None, 来源)
+    """
+    resampled = None
+    if state is not None and "H1" in state.timeframes and m5_bars and state.last_time == m5_bars[-1].time:
+        resampled = state.timeframe("H1", cfg.H1_WINDOW_BARS)
+        if len(resampled) >= cfg.H1_WINDOW_BARS:
+            return resampled, "RESAMPLED"
+    if h1_candles:
+        return BarFrame.from_candles(h1_candles), "PAYLOAD"
+    return resampled, "RESAMPLED_SHORT"
+
+
+def is_weak_setup(setup):
+    return "IGNORE" in setup or "TOO_FAR" in setup or "RESET" in setup
+
+
+def evaluate_entry(df_m5, m5_bars, stage, trend_dir, current_atr, cfg, prob_gate=True, budget=None):
+    """
+    L1 + L2 + L4 + L5: 开仓决策
+    返回 dict: setup / bar (L1 特征) / action / lot / entry / sl / tp / reason
+    prob_gate=False 时跳过 L4 (生成概率表时需要未经门控的原始信号)
+    budget: 延迟预算 (app.budget); 离线工具不传
+    """
+    # L1: K 线特征分析
+    alloc.mark("L1")
+    last_bar = m5_bars[-1]
+    prev_bar = m5_bars[-2] if len(m5_bars) > 1 else None
+    bar_analysis = l1_svc.analyze_bar(last_bar, prev_bar, current_atr, cfg)
+
+    # L2: 结构计数
+    alloc.mark("L2")
+    structure = backends.update_counter(df_m5, trend_dir, current_atr, cfg, budget=budget)
+    setup = structure.get('setup', 'NONE')
+
+    result = {
+        "setup": setup, "bar": bar_analysis,
+        "action": "HOLD", "lot": 0.0, "entry": 0.0, "sl": 0.0, "tp": 0.0, "reason": "",
+    }
+
+    # [新增] 改变结论的可选步骤被延迟预算跳过且没有缓存: 保守 HOLD
+    if setup == "SHED":
+        result["reason"] = f"DEGRADED_HOLD({structure['reason']})"
+        return result
+
+    # Setup 过滤
+    if is_weak_setup(setup):
+        result["reason"] = f"Weak_Setup_{setup}"
+        return result
+
+    # L5: 生成订单
+    alloc.mark("L5")
+    action, lot, entry, sl, tp, reason = backends.generate_order(
+        stage, trend_dir, setup, df_m5, m5_bars, current_atr, cfg, budget=budget
+    )
+
+    # L4: 概率门控 (查表 O(1))
+    if prob_gate and action != "HOLD":
+        alloc.mark("L4")
+        prob_ok, prob_reason = l4_svc.check(stage, setup, bar_analysis, current_atr, cfg)
+        if not prob_ok:
+            result["reason"] = prob_reason
+            return result
+
+    result.update(action=action, lot=lot, entry=entry, sl=sl, tp=tp, reason=reason)
+    return result
@@ -0,0 +1,92 @@
+# app/polling.py
+"""
+EA 轮询间隔建议 (SignalResponse.next_poll_after_ms)
+
+EA 原先全天每 5 秒请求一次，包括禁止交易时段、结算时段和 K 线中段什么都不会变的时候。
+服务端根据本次请求的状态给出下一次请求的间隔 (EA 再按自己的上下限截断):
+1. 刚下发了持仓动作 (减仓 / 平仓 / 移损) -> POLL_MIN_MS，尽快处理下一笔持仓
+   (挂单 / 改挂单之后按正常节奏: 下一次请求得到 KEEP，或 EA 因价格已越过而未下单时不会反复刷新)
+2. 处于风控日历的禁止时段 -> 睡到禁止结束 (期间 L0 之后的逻辑都不会执行)
+3. 有持仓: 浮盈接近减仓 / 移动止损阈值 -> POLL_MIN_MS; 已越过阈值或相差不到 1 ATR -> POLL_BASE_MS;
+   都还差 1 ATR 以上 (亏损单靠券商端止损) -> 与空仓相同
+4. 有挂单 (PLACE_* / KEEP / MODIFY_PENDING) -> POLL_BASE_MS
+5. 空仓: Stage 1 / Stage 4 (盘中随时可能出现突破) -> POLL_BASE_MS;
+   其余阶段睡到本根 M5 收盘前 POLL_BAR_CLOSE_LEAD_MS，收盘前后恢复 POLL_BASE_MS
+拿不到服务器时间等无法判断的情况一律 POLL_BASE_MS (与原先的固定节奏相同)。
+"""
+from .services.global_risk import request_server_time
+
+M5_SECONDS = 300
+# 需要立即跟进的动作 (一次只下发一笔，其余持仓等下一次请求)
+FOLLOW_UP_ACTIONS = ("MODIFY_SL", "CLOSE_PARTIAL", "CLOSE_POS")
+# 空仓时盘中也需要正常轮询的阶段
+ACTIVE_STAGES = ("1-STRONG_TREND", "4-BREAKOUT_MODE")
+
+
+def trail_params(stage, cfg):
+    """按阶段的移动止损 (启动浮盈, 止损距离)，ATR 倍数; main._analyze / triggers / exit_sweep 共用"""
+    if stage and "1-STRONG_TREND" in stage:
+        return cfg.TRAIL_S1_START_ATR, cfg.TRAIL_S1_DISTANCE_ATR
+    if stage and "2-CHANNEL" in stage:
+        return cfg.TRAIL_S2_START_ATR, cfg.TRAIL_S2_DISTANCE_ATR
+    return cfg.TRAIL_OTHER_START_ATR, cfg.TRAIL_OTHER_DISTANCE_ATR
+
+
+def _clip(ms, cfg):
+    return int(min(max(ms, cfg.POLL_MIN_MS), cfg.POLL_MAX_MS))
+
+
+def position_state(positions, atr, stage, cfg):
+    """
+    持仓离减仓 / 移动止损阈值的远近 (取最紧的一笔):
+    "near"   浮盈在阈值的 POLL_NEAR_THRESHOLD_RATIO 以上、尚未越过 (马上要触发)
+    "active" 已越过阈值 (移动止损随价格推进) 或无法判断
+    "far"    离阈值还差 1 ATR 以上 (一根 M5 的平均波幅内到不了)
+    """
+    if not atr or atr <= 0:
+        return "active"
+    trail = trail_params(stage, cfg)[0]
+    state = "far"
+    for pos in positions:
+        profit = (pos.current_price - pos.open_price if pos.type == "BUY" else pos.open_price - pos.current_price) / atr
+        thresholds = [trail]
+        if pos.volume >= 0.02 and "PARTIAL" not in pos.comment:
+            thresholds.append(cfg.PARTIAL_CLOSE_ATR)
+        for threshold in thresholds:
+            if threshold * cfg.POLL_NEAR_THRESHOLD_RATIO <= profit < threshold:
+                return "near"
+            if profit >= threshold or threshold - profit <= 1.0:
+                state = "active"
+    return state
+
+
+def next_poll_after_ms(data, response, cfg, calendar=None, atr=None, stage=None):
+    """
+    data: MarketData; response: 本次的 SignalResponse
+    calendar: 风控日历 (RiskCalendar); atr / stage: 本次分析得到的值 (提前返回时可能没有)
+    """
+    if response.action in FOLLOW_UP_ACTIONS:
+        return _clip(cfg.POLL_MIN_MS, cfg)
+    now = request_server_time(data)
+    if not now or not data.m5_candles:
+        return _clip(cfg.POLL_BASE_MS, cfg)
+
+    if response.reason.startswith("RISK:") and calendar is not None:
+        end = calendar.block_end(now)
+        if end is not None:
+            return _clip((end - now) * 1000, cfg)
+
+    if data.current_positions:
+        state = position_state(data.current_positions, atr, stage, cfg)
+        if state == "near":
+            return _clip(cfg.POLL_MIN_MS, cfg)
+        if state == "active":
+            return _clip(cfg.POLL_BASE_MS, cfg)
+
+    if response.action != "HOLD" or stage is None or stage in ACTIVE_STAGES:
+        return _clip(cfg.POLL_BASE_MS, cfg)
+
+    # 安静阶段 (空仓或持仓离阈值都很远): 睡到收盘前 POLL_BAR_CLOSE_LEAD_MS
+    bar_close = data.m5_candles[-1].time + M5_SECONDS
+    wait_ms = (bar_close - now) * 1000 - cfg.POLL_BAR_CLOSE_LEAD_MS
+    return _clip(max(wait_ms, cfg.POLL_BASE_MS), cfg)
@@ -0,0 +1,291 @@
+# app/profiler.py
+"""
+/signal 的采样分析器 (按需开启，默认关闭，运行时通过接口切换)
+
+- 模式: 每 N 个 /signal 采样 1 个，或在一段时间窗口内 (可两者同时)
+- 被采样的请求在处理期间登记它所在的线程 (事件循环线程: 路由 / 请求体校验 / 响应序列化;
+  线程池线程: 流水线本身)，后台线程每 interval_ms 读一次这些线程的调用栈
+- 调用栈按流水线阶段 (parse / state / indicators / L0-L5 / ...) 归类，折叠成
+  "阶段;帧;帧;... 次数" 的文本，可直接交给 flamegraph.pl / speedscope
+- 一次 /signal 只有几毫秒，短于默认的 GIL 切换间隔 (5ms)，采样线程抢不到 GIL 就只能
+  看到请求之间的空档; 所以采样期间把 sys.setswitchinterval 降到采样间隔的 1/10，停止后恢复。
+  这是进程级设置: 采样期间所有线程 (包括未被采样的请求) 都更频繁地切换 GIL。
+  原值在构造时取一次，start / stop 在锁内切换，重叠的 start / stop 不会把降低后的值当成原值
+- 开销上限: 没有被采样的请求在途时后台线程休眠; 最小采样间隔 1ms;
+  折叠栈条目数与栈深度有上限
+"""
+import collections
+import contextvars
+import sys
+import threading
+import time
+
+DEFAULT_INTERVAL_MS = 5.0
+MIN_INTERVAL_MS = 1.0
+MAX_STACKS = 10000
+MAX_DEPTH = 96
+SIGNAL_PATH = "/signal"
+
+# 最内层命中的帧决定阶段 (先按 "模块:函数" 查，再按模块查)
+STAGE_BY_FUNCTION = {
+    "app.pipeline:prepare_market_data": "indicators",
+    "app.pipeline:resolve_h1": "state",
+    "fastapi.routing:serialize_response": "serialize",
+    "starlette.responses:JSONResponse.render": "serialize",
+}
+STAGE_BY_MODULE = {
+    "app.state": "state",
+    "app.resample": "state",
+    "app.history": "state",
+    "app.risk_calendar": "L0",
+    "app.services.global_risk": "L0",
+    "app.services.l1_perception": "L1",
+    "app.services.l2_structure": "L2",
+    "app.services.l3_context": "L3",
+    "app.services.l4_probability": "L4",
+    "app.services.l5_execution": "L5",
+    "fastapi._compat": "parse",
+    "fastapi.dependencies.utils": "parse",
+    "json.decoder": "parse",
+    "fastapi.encoders": "serialize",
+    "json.encoder": "serialize",
+}
+# 折叠栈从第一个属于这些包的帧开始 (去掉线程池 / 事件循环的外壳)
+_ROOT_PREFIXES = ("app.", "fastapi", "starlette")
+
+_sampled = contextvars.ContextVar("profile_sampled", default=False)
+
+
+def _frame_key(frame):
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}"
+
+
+def _classify(frame, default):
+    """叶子 -> 根 的帧列表: (阶段, 折叠栈) ; 不属于请求处理的栈 (事件循环空闲) 返回 None"""
+    keys = []
+    while frame is not None and len(keys) < MAX_DEPTH:
+        keys.append(_frame_key(frame))
+        frame = frame.f_back
+    keys.reverse()
+    for i, key in enumerate(keys):
+        if key.startswith(_ROOT_PREFIXES):
+            keys = keys[i:]
+            break
+    else:
+        return None
+
+    stage = default
+    for key in reversed(keys):
+        hit = STAGE_BY_FUNCTION.get(key) or STAGE_BY_MODULE.get(key.partition(":")[0])
+        if hit:
+            stage = hit
+            break
+    return stage, ";".join(keys)
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._active = {}          # 线程 id -> (在途的被采样请求数, 默认阶段)
+        self.enabled = False
+        self.every_n = 1
+        self.deadline = None       # time.monotonic() 截止; None = 直到手动停止
+        self.interval = DEFAULT_INTERVAL_MS / 1000.0
+        self._switch_interval = sys.getswitchinterval()    # 进程原来的 GIL 切换间隔 (只取一次，停止时恢复)
+        self._reset()
+
+    def _reset(self):
+        self.stacks = collections.Counter()     # (阶段, 折叠栈) -> 样本数
+        self.stage_samples = collections.Counter()
+        self.requests_seen = 0
+        self.requests_sampled = 0
+        self.dropped = 0
+        self.sampler_cpu = 0.0
+        self.started_at = None
+
+    # ------------------------------------------------------------------
+    # 开关
+    # ------------------------------------------------------------------
+    def start(self, every_n=1, seconds=0.0, interval_ms=DEFAULT_INTERVAL_MS):
+        """开始新一轮采样 (清空上一轮结果)"""
+        if every_n < 1:
+            raise ValueError("every_n must be >= 1")
+        with self._lock:
+            self._reset()
+            self.every_n = int(every_n)
+            self.deadline = time.monotonic() + seconds if seconds > 0 else None
+            self.interval = max(MIN_INTERVAL_MS, float(interval_ms)) / 1000.0
+            self.started_at = time.time()
+            self.enabled = True
+            sys.setswitchinterval(min(self._switch_interval, self.interval / 10.0))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._thread.start()
+        return self.status()
+
+    def stop(self):
+        """停止采样 (结果保留到下一次 start)"""
+        with self._lock:
+            if self.enabled:
+                self.enabled = False
+                sys.setswitchinterval(self._switch_interval)
+        self._wake.set()
+        return self.status()
+
+    def _expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    # ------------------------------------------------------------------
+    # 请求侧
+    # ------------------------------------------------------------------
+    def should_sample(self):
+        if not self.enabled:
+            return False
+        if self._expired():
+            self.stop()
+            return False
+        with self._lock:
+            self.requests_seen += 1
+            hit = (self.requests_seen - 1) % self.every_n == 0
+            if hit:
+                self.requests_sampled += 1
+        return hit
+
+    def _enter(self, default_stage):
+        tid = threading.get_ident()
+        with self._lock:
+            count, _ = self._active.get(tid, (0, default_stage))
+            self._active[tid] = (count + 1, default_stage)
+        self._wake.set()
+        return tid
+
+    def _exit(self, tid):
+        with self._lock:
+            count, stage = self._active.get(tid, (1, ""))
+            if count <= 1:
+                self._active.pop(tid, None)
+            else:
+                self._active[tid] = (count - 1, stage)
+
+    def track(self):
+        """线程池里执行的 /signal 处理函数: 属于被采样请求时登记当前线程"""
+        return _Track(self) if _sampled.get() else _NULL_TRACK
+
+    # ------------------------------------------------------------------
+    # 后台采样线程
+    # ------------------------------------------------------------------
+    def _run(self):
+        while True:
+            if not self.enabled and not self._active:
+                # 已停止且没有在途请求: 线程退出，下次 start 时重建
+                with self._lock:
+                    if not self.enabled and not self._active:
+                        self._thread = None
+                        return
+            # 先 clear 再检查，避免错过检查之后才登记的请求
+            self._wake.clear()
+            if not self._active:
+                self._wake.wait(0.5)
+                if self.enabled and self._expired():
+                    self.stop()
+                continue
+            time.sleep(self.interval)
+            if not self.enabled:
+                continue
+            t0 = time.thread_time()
+            with self._lock:
+                active = list(self._active.items())
+            frames = sys._current_frames()
+            for tid, (_, default_stage) in active:
+                frame = frames.get(tid)
+                if frame is None:
+                    continue
+                hit = _classify(frame, default_stage)
+                if hit is None:
+                    continue
+                self.stage_samples[hit[0]] += 1
+                if hit in self.stacks or len(self.stacks) < MAX_STACKS:
+                    self.stacks[hit] += 1
+                else:
+                    self.dropped += 1
+            del frames
+            self.sampler_cpu += time.thread_time() - t0
+
+    # ------------------------------------------------------------------
+    # 输出
+    # ------------------------------------------------------------------
+    def status(self):
+        remaining = None
+        if self.enabled and self.deadline is not None:
+            remaining = round(max(0.0, self.deadline - time.monotonic()), 1)
+        total = sum(self.stage_samples.values())
+        return {
+            "enabled": self.enabled, "every_n": self.every_n, "remaining_seconds": remaining,
+            "interval_ms": self.interval * 1000.0, "started_at": self.started_at,
+            "requests_seen": self.requests_seen, "requests_sampled": self.requests_sampled,
+            "samples": total, "distinct_stacks": len(self.stacks), "dropped_samples": self.dropped,
+            "sampler_cpu_ms": round(self.sampler_cpu * 1000.0, 1),
+            "stages": {k: {"samples": v, "share": round(v / total, 4)}
+                       for k, v in self.stage_samples.most_common()},
+        }
+
+    def collapsed(self, stage=None):
+        """flamegraph.pl 格式: 每行 "阶段;帧;...;帧 次数" """
+        lines = [f"{s};{stack} {n}" for (s, stack), n in sorted(self.stacks.items())
+                 if stage is None or s == stage]
+        return "\n".join(lines) + ("\n" if lines else "")
+
+
+class _Track:
+    __slots__ = ("profiler", "tid")
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def __enter__(self):
+        self.tid = self.profiler._enter("other")
+
+    def __exit__(self, *exc):
+        self.profiler._exit(self.tid)
+
+
+class _NullTrack:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_TRACK = _NullTrack()
+
+
+class ProfilerMiddleware:
+    """
+    纯 ASGI 中间件 (不经过 BaseHTTPMiddleware，关闭时只多一次属性判断):
+    决定本次 /signal 是否采样，采样时登记事件循环线程 (请求体解析 / 校验 / 序列化)
+    """
+
+    def __init__(self, app, profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if not self.profiler.enabled or scope["type"] != "http" or scope["path"] != SIGNAL_PATH \
+                or not self.profiler.should_sample():
+            return await self.app(scope, receive, send)
+        token = _sampled.set(True)
+        tid = self.profiler._enter("http")
+        try:
+            return await self.app(scope, receive, send)
+        finally:
+            self.profiler._exit(tid)
+            _sampled.reset(token)
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,74 @@
+# app/resample.py
+"""
+从 M5 重采样高周期 K 线 (M15 / H1 / H4 / D1)
+
+MT5 的 K 线时间戳就是经纪商服务器时间，所以按 "时间戳 // 周期秒数" 分桶
+即与终端里的 H1/H4/D1 边界一致 (D1 从服务器午夜开始)。周末 / 休市没有 M5，
+对应的桶自然不存在。
+
+数组格式与 app.history 相同: (N, 7) time, open, high, low, close, tick_vol, spread
+"""
+import numpy as np
+
+from .history import COLUMNS, T, O, H, L, C, V, S
+
+TIMEFRAME_SECONDS = {"M15": 900, "H1": 3600, "H4": 14400, "D1": 86400}
+
+
+def resample(bars, seconds, drop_partial_head=True):
+    """
+    M5 (N, 7) -> 高周期 (M, 7)
+    drop_partial_head: 第一根 M5 不在周期边界上时，第一个桶缺了开头几根 M5，丢弃它
+    """
+    if len(bars) == 0:
+        return np.empty((0, len(COLUMNS)))
+    bucket = bars[:, T] // seconds
+    starts = np.flatnonzero(np.concatenate(([True], bucket[1:] != bucket[:-1])))
+    ends = np.concatenate((starts[1:], [len(bars)]))
+
+    out = np.empty((len(starts), len(COLUMNS)))
+    out[:, T] = bucket[starts] * seconds
+    out[:, O] = bars[starts, O]
+    out[:, H] = np.maximum.reduceat(bars[:, H], starts)
+    out[:, L] = np.minimum.reduceat(bars[:, L], starts)
+    out[:, C] = bars[ends - 1, C]
+    out[:, V] = np.add.reduceat(bars[:, V], starts)
+    out[:, S] = bars[ends - 1, S]
+
+    if drop_partial_head and bars[0, T] % seconds != 0:
+        out = out[1:]
+    return out
+
+
+class TimeframeSeries:
+    """
+    单个高周期的增量序列
+    M5 从第 k 行开始变化时，只重算第 k 行所在的桶及之后 (通常就是当前未收盘的那一根)
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.bars = np.empty((0, len(COLUMNS)))
+
+    def __len__(self):
+        return len(self.bars)
+
+    def rebuild(self, m5):
+        self.bars = resample(m5, self.seconds)
+
+    def update(self, m5, first_changed):
+        """m5: 完整的 M5 数组; first_changed: 第一根发生变化的 M5 下标"""
+        if first_changed >= len(m5):
+            return
+        if len(self.bars) == 0:
+            self.rebuild(m5)
+            return
+        bucket_start = m5[first_changed, T] // self.seconds * self.seconds
+        m5_from = int(np.searchsorted(m5[:, T], bucket_start, side="left"))
+        if m5_from == 0:
+            # 变化落在第一个桶里 (可能是不完整的桶)，整体重算
+            self.rebuild(m5)
+            return
+        keep = int(np.searchsorted(self.bars[:, T], bucket_start, side="left"))
+        tail = resample(m5[m5_from:], self.seconds, drop_partial_head=False)
+        self.bars = np.concatenate((self.bars[:keep], tail))
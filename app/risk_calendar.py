@@ -0,0 +1,304 @@
+# app/risk_calendar.py
+"""
+L0 风控日历: 交易时段 / 结算 / 新闻 / 假期 + 服务器时区 (含夏令时)
+
+所有规则在加载时展开成一张按服务器时间排序、互不重叠的区间表，
+每个区间记录: 禁止原因 (或无)、点差时段系数、服务器 -> 北京的小时差。
+请求时只用 K 线 / 服务器时间戳做一次二分查找，O(log n)。
+
+日历文件 (JSON, 相对路径以 app/ 为基准，见 config.RISK_CALENDAR_FILE):
+    server_utc_offset   服务器冬令时 UTC 偏移 (小时)
+    dst_rule            "US" / "EU" / "NONE"，夏令时期间偏移 +1
+    years               展开范围 [起始年, 结束年]，范围外一律禁止开仓
+    sessions            每日重复的时段 (北京时间 "HH:MM"):
+                        {"name", "start", "end", "block": true} 或 {"name", "start", "end", "spread_ratio": x}
+    news                [{"time": "YYYY-MM-DD HH:MM" (UTC), "impact": 1-3, "name", "padding_minutes"(可选)}]
+    blackouts           [{"start", "end" (UTC), "name"}] 假期 / 临时停止交易
+文件不存在时按 config.py 的时段常量与 IS_WINTER_TIME 构造 (与原先的硬编码逻辑一致)。
+"""
+import bisect
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from . import runtime_config
+
+logger = logging.getLogger(__name__)
+
+BJ_UTC_OFFSET = 8
+DEFAULT_YEARS = (2000, 2040)
+DST_RULES = ("US", "EU", "NONE")
+CALENDAR_CHECK_SECONDS = 2.0
+
+# 展开范围之外: 没有可信的时段 / 时区信息，保守处理
+OUT_OF_RANGE = "CALENDAR_OUT_OF_RANGE"
+
+_DAY = 86400
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _hhmm(text):
+    h, m = str(text).split(":")
+    return int(h) * 3600 + int(m) * 60
+
+
+def _utc_ts(text):
+    """'YYYY-MM-DD HH:MM[:SS]' (UTC) 或 epoch 秒 -> epoch 秒"""
+    if isinstance(text, (int, float)):
+        return int(text)
+    dt = datetime.datetime.fromisoformat(str(text).replace("Z", ""))
+    return int((dt.replace(tzinfo=datetime.timezone.utc) - _EPOCH).total_seconds())
+
+
+def _nth_sunday(year, month, n):
+    """当月第 n 个星期日 (n=-1 表示最后一个) 的 UTC 零点时间戳"""
+    if n > 0:
+        first = datetime.date(year, month, 1)
+        day = first + datetime.timedelta(days=(6 - first.weekday()) % 7 + 7 * (n - 1))
+    else:
+        nxt = datetime.date(year + month // 12, month % 12 + 1, 1)
+        last = nxt - datetime.timedelta(days=1)
+        day = last - datetime.timedelta(days=(last.weekday() - 6) % 7)
+    return (day - datetime.date(1970, 1, 1)).days * _DAY
+
+
+def dst_periods(rule, years):
+    """夏令时区间 (UTC 时间戳) 列表"""
+    out = []
+    for y in range(years[0], years[1] + 1):
+        if rule == "US":
+            # 3 月第二个周日 02:00 EST -> 11 月第一个周日 02:00 EDT
+            out.append((_nth_sunday(y, 3, 2) + 7 * 3600, _nth_sunday(y, 11, 1) + 6 * 3600))
+        elif rule == "EU":
+            # 3 月最后一个周日 01:00 UTC -> 10 月最后一个周日 01:00 UTC
+            out.append((_nth_sunday(y, 3, -1) + 3600, _nth_sunday(y, 10, -1) + 3600))
+    return out
+
+
+def default_definition(cfg):
+    """没有日历文件时: 由 config.py 的常量构造，行为与原先 check_safety 的硬编码一致"""
+    def h(x):
+        return f"{int(x):02d}:{int(round((x - int(x)) * 60)):02d}"
+    return {
+        "server_utc_offset": BJ_UTC_OFFSET - cfg.SERVER_TO_BJ_HOURS,
+        "dst_rule": "NONE",
+        "sessions": [
+            {"name": "NO_TRADE_HOURS", "start": h(cfg.NO_TRADE_START_H_BJ), "end": h(cfg.NO_TRADE_END_H_BJ), "block": True},
+            {"name": "ROLLOVER_TIME", "start": h(cfg.ROLLOVER_START_H_BJ), "end": h(cfg.ROLLOVER_END_H_BJ), "block": True},
+            {"name": "ASIAN", "start": "00:00", "end": "09:00", "spread_ratio": cfg.SESSION_ASIAN_SPREAD_FIX},
+            {"name": "CORE", "start": "14:00", "end": "22:00", "spread_ratio": cfg.SESSION_CORE_SPREAD_FIX},
+        ],
+    }
+
+
+class RiskCalendar:
+    """
+    展开后的区间索引 (只读):
+    starts[k] <= ts < starts[k+1] 落在第 k 段，段内属性恒定
+    """
+
+    def __init__(self, definition, cfg, source="config.py"):
+        self.source = source
+        std = int(definition.get("server_utc_offset", BJ_UTC_OFFSET - cfg.SERVER_TO_BJ_HOURS))
+        rule = str(definition.get("dst_rule", "NONE")).upper()
+        if rule not in DST_RULES:
+            raise ValueError(f"Unknown dst_rule: {rule}")
+        years = tuple(int(y) for y in definition.get("years", DEFAULT_YEARS))
+        if len(years) != 2 or years[0] > years[1]:
+            raise ValueError(f"Invalid years: {years}")
+
+        # --- 1. 时区: 服务器时间上的夏令时区间 ---
+        utc_lo = (datetime.date(years[0], 1, 1) - datetime.date(1970, 1, 1)).days * _DAY
+        utc_hi = (datetime.date(years[1] + 1, 1, 1) - datetime.date(1970, 1, 1)).days * _DAY
+        dst = np.asarray(dst_periods(rule, years), dtype=np.int64).reshape(-1, 2)
+
+        def to_server(utc):
+            utc = np.asarray(utc, dtype=np.int64)
+            k = np.searchsorted(dst[:, 0], utc, side="right") - 1
+            in_dst = (k >= 0) & (utc < dst[np.maximum(k, 0), 1]) if len(dst) else np.zeros(utc.shape, bool)
+            return utc + (std + in_dst.astype(np.int64)) * 3600
+
+        # 夏令时段在服务器时间上的边界 (切换瞬间服务器时钟跳变一小时，取切换后的读数)
+        dst_server = dst + (std + 1) * 3600
+        lo, hi = int(to_server(utc_lo)), int(to_server(utc_hi))
+
+        # --- 2. 收集区间: (服务器开始, 服务器结束, 名称) ---
+        blocks = []          # 按优先级排列 (先出现的原因优先)
+        spread = []
+        days = np.arange(utc_lo // _DAY - 1, utc_hi // _DAY + 1, dtype=np.int64)
+        for s in definition.get("sessions", []):
+            start, end = _hhmm(s["start"]), _hhmm(s["end"])
+            if end <= start:
+                end += _DAY
+            # 北京日 d 的时段 -> UTC -> 服务器时间 (偏移按时段开始时刻计算)
+            bj_start = days * _DAY + start - BJ_UTC_OFFSET * 3600
+            shift = to_server(bj_start) - bj_start
+            iv = (bj_start + shift, bj_start + (end - start) + shift, s["name"])
+            if s.get("block"):
+                blocks.append(iv)
+            elif "spread_ratio" in s:
+                spread.append(iv + (float(s["spread_ratio"]),))
+
+        for b in definition.get("blackouts", []):
+            t0, t1 = _utc_ts(b["start"]), _utc_ts(b["end"])
+            blocks.append((to_server([t0]), to_server([t1]), b.get("name", "BLACKOUT")))
+
+        min_impact = cfg.NEWS_MIN_IMPACT
+        self.news_count = 0
+        for n in sorted(definition.get("news", []), key=lambda e: -int(e.get("impact", 0))):
+            if int(n.get("impact", 0)) < min_impact:
+                continue
+            pad = int(n.get("padding_minutes", cfg.NEWS_PADDING_MINUTES)) * 60
+            t = int(to_server([_utc_ts(n["time"])])[0])
+            # |分钟差| <= padding (两端都包含)
+            blocks.append(([t - pad], [t + pad + 1], f"NEWS:{n.get('name', 'UNKNOWN')}"))
+            self.news_count += 1
+
+        # --- 3. 扫描线: 全部边界切成互不重叠的段 ---
+        edges = [np.asarray([lo, hi], dtype=np.int64), dst_server.ravel()]
+        for iv in blocks + spread:
+            edges.append(np.asarray(iv[0], dtype=np.int64))
+            edges.append(np.asarray(iv[1], dtype=np.int64))
+        starts = np.unique(np.concatenate(edges))
+        starts = starts[(starts >= lo) & (starts <= hi)]
+
+        self.reasons = [OUT_OF_RANGE]
+        block_id = np.full(len(starts), -1, dtype=np.int32)
+        ratio = np.full(len(starts), np.nan)
+        # 低优先级先写，高优先级覆盖
+        for iv in reversed(blocks):
+            code = len(self.reasons)
+            self.reasons.append(iv[2])
+            _paint(block_id, starts, iv[0], iv[1], code)
+        for iv in reversed(spread):
+            _paint(ratio, starts, iv[0], iv[1], iv[3])
+        block_id[-1], ratio[-1] = 0, np.nan    # hi 之后
+
+        # 服务器 -> 北京 的小时差
+        k = np.searchsorted(dst_server[:, 0], starts, side="right") - 1 if len(dst) else np.full(len(starts), -1)
+        in_dst = (k >= 0) & (starts < dst_server[np.maximum(k, 0), 1]) if len(dst) else np.zeros(len(starts), bool)
+        bj_shift = (BJ_UTC_OFFSET - std - in_dst.astype(np.int64)) * 3600
+
+        # 相邻且属性相同的段合并
+        keep = np.ones(len(starts), dtype=bool)
+        same_ratio = (ratio[1:] == ratio[:-1]) | (np.isnan(ratio[1:]) & np.isnan(ratio[:-1]))
+        keep[1:] = ~((block_id[1:] == block_id[:-1]) & same_ratio & (bj_shift[1:] == bj_shift[:-1]))
+        self.range = (lo, hi)
+        # 查询走 bisect (比对 numpy 标量快)
+        self._starts = starts[keep].tolist()
+        self._block = block_id[keep].tolist()
+        self._ratio = [None if np.isnan(r) else float(r) for r in ratio[keep]]
+        self._bj_shift = bj_shift[keep].tolist()
+
+    def __len__(self):
+        return len(self._starts)
+
+    def lookup(self, ts):
+        """
+        服务器时间戳 -> (禁止原因 或 None, 点差时段系数 或 None, 北京时间戳)
+        """
+        k = bisect.bisect_right(self._starts, ts) - 1
+        if k < 0:
+            return OUT_OF_RANGE, None, ts
+        code = self._block[k]
+        return (self.reasons[code] if code >= 0 else None), self._ratio[k], ts + self._bj_shift[k]
+
+    def block_end(self, ts):
+        """ts 处于禁止时段时返回禁止结束的服务器时间戳 (之后不再禁止)，否则 None; 一直禁止到范围末尾也返回 None"""
+        k = bisect.bisect_right(self._starts, ts) - 1
+        if k >= 0 and self._block[k] < 0:
+            return None
+        for j in range(k + 1, len(self._starts)):
+            if self._block[j] < 0:
+                return self._starts[j]
+        return None
+
+    def describe(self):
+        return {"source": self.source, "segments": len(self), "news_events": self.news_count,
+                "range": [datetime.datetime.fromtimestamp(t, datetime.timezone.utc).strftime("%Y-%m-%d")
+                          for t in self.range]}
+
+
+def _paint(values, starts, iv_start, iv_end, value):
+    """把 [iv_start, iv_end) 覆盖的段写成 value (iv_* 为等长数组)"""
+    a = np.searchsorted(starts, np.asarray(iv_start, dtype=np.int64), side="left")
+    b = np.searchsorted(starts, np.asarray(iv_end, dtype=np.int64), side="left")
+    if len(a) == 1:
+        values[a[0]:b[0]] = value
+        return
+    # 每日时段: 区间互不重叠，用差分标记覆盖范围
+    mark = np.zeros(len(starts) + 1, dtype=np.int32)
+    np.add.at(mark, a, 1)
+    np.add.at(mark, b, -1)
+    values[np.cumsum(mark)[:-1] > 0] = value
+
+
+class CalendarStore:
+    """
+    按需构造日历; 文件或配置版本变化后自动重建 (最多每 2 秒 stat 一次)
+    - 第一次 (启动预热) 同步构造
+    - 之后的重建 (约 100-200ms) 在后台线程进行，同一时间只有一个; 新日历构造完成前请求继续使用旧日历
+    新日历构造失败时保留旧日历
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calendar = None
+        self._key = None
+        self._pending = None        # 正在后台构造的 key
+        self._last_check = 0.0
+
+    def get(self, cfg=None):
+        cfg = cfg or runtime_config.current()
+        path = runtime_config.resolve_app_path(cfg.RISK_CALENDAR_FILE)
+        now = time.monotonic()
+        if self._calendar is not None and self._key[:2] == (path, cfg.version) \
+                and now - self._last_check < CALENDAR_CHECK_SECONDS:
+            return self._calendar
+        self._last_check = now
+
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        key = (path, cfg.version, mtime)
+        if key == self._key or key == self._pending:
+            return self._calendar
+
+        with self._lock:
+            if self._calendar is None:
+                # 第一次: 没有旧日历可用，同步构造
+                self._calendar = self._build(path, cfg, mtime) or RiskCalendar(default_definition(cfg), cfg)
+                self._key = key
+            elif self._pending is None and key != self._key:
+                self._pending = key
+                threading.Thread(target=self._rebuild, args=(path, cfg, key), name="calendar-rebuild",
+                                 daemon=True).start()
+        return self._calendar
+
+    def _rebuild(self, path, cfg, key):
+        calendar = self._build(path, cfg, key[2])
+        with self._lock:
+            if calendar is not None:
+                self._calendar = calendar
+            # 失败时也记下 key: 文件再次修改 (mtime 变化) 前不反复重试
+            self._key = key
+            self._pending = None
+
+    def _build(self, path, cfg, mtime):
+        try:
+            if mtime is None:
+                calendar = RiskCalendar(default_definition(cfg), cfg)
+            else:
+                with open(path, "r", encoding="utf-8") as f:
+                    calendar = RiskCalendar(json.load(f), cfg, source=path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"[CALENDAR] Failed to load {path}, keep previous: {e}")
+            return None
+        logger.info(f"[CALENDAR] Loaded {calendar.source}: {len(calendar)} segments, {calendar.news_count} news")
+        return calendar
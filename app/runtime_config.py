@@ -0,0 +1,204 @@
+# app/runtime_config.py
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from . import config
+from .resample import TIMEFRAME_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# 覆盖文件: 只需写要修改的键 (JSON)，其余沿用 config.py 默认值
+# docker-compose 把 ./app 挂载进容器，所以默认放在 app/ 目录下即可热更新
+DEFAULT_OVERRIDE_FILE = os.path.join(os.path.dirname(__file__), "config_override.json")
+RELOAD_CHECK_SECONDS = 2.0
+# 计算后端名 (实现登记在 app/backends.py; 该模块依赖服务层，不能在这里导入，所以名字列在这里)
+COMPUTE_BACKENDS = ("reference", "array")
+COMPUTE_BACKEND_KEYS = ("COMPUTE_BACKEND", "COMPUTE_BACKEND_STAGE", "COMPUTE_BACKEND_SETUP",
+                        "COMPUTE_BACKEND_WEDGE", "COMPUTE_BACKEND_ORDER")
+
+
+def resolve_app_path(path):
+    """配置中的相对路径以 app/ 目录为基准 (容器内挂载的也是这个目录)"""
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(__file__), path)
+
+
+def _base_values():
+    """从 config.py 收集全部大写常量作为默认值"""
+    return {k: getattr(config, k) for k in dir(config) if k.isupper()}
+
+
+class ConfigSnapshot:
+    """
+    不可变配置快照:
+    1. 字段名与 config.py 完全一致 (cfg.SLOPE_SPIKE_ATR)
+    2. 热路径里的派生阈值在构造时一次算好
+    3. version 是全部取值的哈希，可直接作为决策缓存 / 日志的 key
+    """
+
+    def __init__(self, values, source="config.py"):
+        for k, v in values.items():
+            object.__setattr__(self, k, v)
+
+        # --- 派生阈值 (原先在 L0/L3/L5 每次请求重复计算) ---
+        derived = {
+            # L3: 从震荡中突破需要的斜率 (0.5 + 0.2 = 0.7)
+            "SPIKE_SLOPE_FROM_RANGE": values["SLOPE_SPIKE_ATR"] + values["SPIKE_FROM_RANGE_PENALTY"],
+            # L3: Choppy 时的 Flat 阈值 (0.20 * 1.75 = 0.35)
+            "FLAT_SLOPE_CHOPPY": values["SLOPE_FLAT_ATR"] * values["CHOPS_SLOPE_MULTIPLIER"],
+            # L5: 动态 Trend Bar 因子
+            "TREND_BAR_FACTOR_RANGE": values["AB_TREND_BAR_ATR_RATIO"] + values["RANGE_TREND_BAR_ADDON"],
+            "TREND_BAR_FACTOR_S1": values["AB_TREND_BAR_ATR_RATIO"] - values["TREND_S1_BAR_REDUCTION"],
+            # L0: 服务器时间 -> 北京时间
+            "SERVER_TO_BJ_HOURS": 6 if values["IS_WINTER_TIME"] else 5,
+            "COOLDOWN_AFTER_LOSS_SECONDS": values["COOLDOWN_AFTER_LOSS_MINUTES"] * 60,
+            "MAX_SPREAD_NO_ATR_POINTS": values["SPREAD_FLOOR_POINTS"] * 1.5,
+        }
+        for k, v in derived.items():
+            object.__setattr__(self, k, v)
+
+        payload = json.dumps(values, sort_keys=True, default=str)
+        object.__setattr__(self, "version", hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12])
+        object.__setattr__(self, "source", source)
+        object.__setattr__(self, "_values", dict(values))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"ConfigSnapshot is immutable (tried to set {name})")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"ConfigSnapshot is immutable (tried to delete {name})")
+
+    def as_dict(self):
+        return dict(self._values)
+
+
+def _check_compute_backends(values):
+    """后端名写错的覆盖文件整体不生效 (保留旧快照)，而不是让之后的每个请求报错"""
+    for k in COMPUTE_BACKEND_KEYS:
+        # 按层的设置可以为空 (跟随 COMPUTE_BACKEND)
+        allowed = COMPUTE_BACKENDS if k == "COMPUTE_BACKEND" else ("",) + COMPUTE_BACKENDS
+        if values[k] not in allowed:
+            raise ValueError(f"{k} must be one of {allowed}, got {values[k]!r}")
+
+
+def _check_timeframes(values):
+    """重采样周期必须是 resample.TIMEFRAME_SECONDS 中的名字，且不重复"""
+    timeframes = values["RESAMPLE_TIMEFRAMES"]
+    for tf in timeframes:
+        if tf not in TIMEFRAME_SECONDS:
+            raise ValueError(f"RESAMPLE_TIMEFRAMES: unknown timeframe {tf!r} (allowed: {tuple(TIMEFRAME_SECONDS)})")
+    if len(set(timeframes)) != len(timeframes):
+        raise ValueError(f"RESAMPLE_TIMEFRAMES has duplicates: {timeframes!r}")
+
+
+def build_snapshot(overrides=None, source="config.py"):
+    """
+    默认值 + 覆盖值 -> 新快照
+    校验: 不允许未知键; 数值类型必须与默认值一致 (int 可写成 float 的位置除外; tuple 的位置接受 JSON 列表);
+    计算后端名必须是 COMPUTE_BACKENDS 之一; 重采样周期必须是 TIMEFRAME_SECONDS 中的名字
+    """
+    values = _base_values()
+    for k, v in (overrides or {}).items():
+        if k not in values:
+            raise ValueError(f"Unknown config key: {k}")
+        base = values[k]
+        if isinstance(base, bool):
+            if not isinstance(v, bool):
+                raise ValueError(f"{k} must be bool, got {v!r}")
+        elif isinstance(base, (int, float)):
+            if isinstance(v, bool) or not isinstance(v, (int, float)):
+                raise ValueError(f"{k} must be numeric, got {v!r}")
+            if isinstance(base, float):
+                v = float(v)
+        elif isinstance(base, tuple):
+            # JSON 没有元组: 列表转成元组 (快照保持不可变)
+            if not isinstance(v, (list, tuple)):
+                raise ValueError(f"{k} must be a list, got {v!r}")
+            v = tuple(v)
+        elif not isinstance(v, type(base)):
+            raise ValueError(f"{k} must be {type(base).__name__}, got {v!r}")
+        values[k] = v
+    _check_compute_backends(values)
+    _check_timeframes(values)
+    return ConfigSnapshot(values, source=source)
+
+
+class ConfigStore:
+    """
+    持有当前快照，支持从覆盖文件原子热更新:
+    - 新快照完整构造并校验成功后，才做一次引用替换
+    - 正在处理的请求继续使用它开始时拿到的快照，不受影响
+    - 文件有误时保留旧快照并记录日志
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get("AGENT_CONFIG_FILE", DEFAULT_OVERRIDE_FILE)
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._last_check = 0.0
+        self._snapshot = build_snapshot()
+        self.reload()
+
+    def current(self):
+        return self._snapshot
+
+    def reload(self):
+        """强制从文件重新加载，返回 (是否切换, 当前版本)"""
+        with self._lock:
+            self._last_check = time.monotonic()
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                mtime = None
+
+            if mtime is None:
+                # 覆盖文件被删除 -> 回到 config.py 默认值
+                if self._mtime is None:
+                    return False, self._snapshot.version
+                new_snapshot = build_snapshot()
+            else:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        overrides = json.load(f)
+                    if not isinstance(overrides, dict):
+                        raise ValueError("override file must contain a JSON object")
+                    new_snapshot = build_snapshot(overrides, source=self.path)
+                except (OSError, ValueError) as e:
+                    logger.error(f"[CONFIG] Reload failed, keep version {self._snapshot.version}: {e}")
+                    self._mtime = mtime  # 同一个坏文件不反复报错
+                    return False, self._snapshot.version
+
+            self._mtime = mtime
+            if new_snapshot.version == self._snapshot.version:
+                return False, self._snapshot.version
+
+            old_version = self._snapshot.version
+            self._snapshot = new_snapshot
+            logger.info(f"[CONFIG] Reloaded {old_version} -> {new_snapshot.version} ({new_snapshot.source})")
+            return True, new_snapshot.version
+
+    def maybe_reload(self):
+        """请求入口调用: 最多每 RELOAD_CHECK_SECONDS 秒 stat 一次文件"""
+        now = time.monotonic()
+        if now - self._last_check < RELOAD_CHECK_SECONDS:
+            return self._snapshot
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        self._last_check = now
+        if mtime != self._mtime:
+            self.reload()
+        return self._snapshot
+
+
+config_store = ConfigStore()
+
+
+def current():
+    return config_store.current()
@@ -31,12 +31,27 @@ class Position(BaseModel):
     profit: float           # 浮动盈亏
     comment: str
 
+class PendingOrder(BaseModel):
+    ticket: int
+    type: str               # "BUY_STOP" / "SELL_STOP" / "BUY_LIMIT" / "SELL_LIMIT"
+    volume: float
+    price: float
+    sl: float
+    tp: float
+    comment: str            # EA 下单时写入的意图 id
+
 # --- 核心请求包 (MT5 -> Python) ---
 
 class MarketData(BaseModel):
     symbol: str
+    # 账户号 (用于按 account+symbol 区分状态; 旧版 EA 不发送时为 0)
+    account_login: int = 0
     server_time_hour: int
     server_time_minute: int
+    # [新增] 服务器时间戳 (TimeCurrent); 旧版 EA 不发送时为 0，由时/分与最后一根 M5 推算
+    server_time: int = 0
+    # [新增] EA 愿意等待的毫秒数 (WebRequest 超时); 0 = 只用服务端的 LATENCY_BUDGET_MS
+    deadline_ms: int = 0
     bid: float
     ask: float
     spread: int
@@ -50,11 +65,14 @@ class MarketData(BaseModel):
     m5_candles: List[Candle] 
     
     # H1 发送 50 根 (用于判断大环境 Context)
-    h1_candles: List[Candle] 
+    # [新增] 可选: 服务端已有足够 M5 历史时改用重采样的 H1，EA 可不再发送
+    h1_candles: List[Candle] = []
     
     # 动态信息
     news_info: NewsInfo
     current_positions: List[Position]
+    # [新增] EA 当前的挂单 (本品种 + MagicNumber); 旧版 EA 不发送时为 None，PLACE_* 原样返回
+    pending_orders: Optional[List[PendingOrder]] = None
     
     # [新增] 历史数据 (用于冷却逻辑)
     # 如果没历史，传 0
@@ -65,10 +83,11 @@ class MarketData(BaseModel):
 
 class SignalResponse(BaseModel):
     # 动作: PLACE_BUY_STOP, PLACE_SELL_STOP, CLOSE_PARTIAL, CLOSE_POS, HOLD
+    # [新增] KEEP (挂单不动), MODIFY_PENDING (按 ticket 改挂单价格)
     action: str         
     
     # 订单参数
-    ticket: int = 0      # 用于平仓/减仓
+    ticket: int = 0      # 用于平仓/减仓/改挂单
     lot: float = 0.0     # 开仓/平仓手数
     entry_price: float = 0.0  # 挂单价格 (新增: 用于Stop Order)
     sl: float = 0.0
@@ -77,3 +96,29 @@ class SignalResponse(BaseModel):
     # 决策理由  
     # 例: "Stage:1-Spike | Setup:H1"
     reason: str
+
+    # [新增] 挂单意图 id (方向 + 信号 K 线时间 + Setup)，EA 写进订单 comment
+    intent_id: str = ""
+
+    # 生成本决策所用的配置快照版本 (用于决策缓存 / 日志对账)
+    config_version: str = ""
+
+    # [新增] 延迟预算不足时跳过了可选步骤 (或已超时直接 HOLD)，reason 列出被跳过的步骤
+    degraded: bool = False
+    degraded_reason: str = ""
+
+    # [新增] 建议 EA 多少毫秒后再请求 (0 = 没有建议，EA 用自己的默认间隔)
+    next_poll_after_ms: int = 0
+
+    # [新增] 价格触发表 (格式见 app/triggers.py)，EA 每个 tick 本地检查; 有效到 triggers_valid_until (服务器时间)
+    triggers: str = ""
+    triggers_valid_until: int = 0
+
+# --- 整段序列批量分析 (研究用) ---
+
+class SeriesRequest(BaseModel):
+    symbol: str = ""
+    # 按时间升序的 M5 历史 (至少 110 根才有结果)
+    m5_candles: List[Candle]
+    prob_gate: bool = False
+    chunk_size: int = 5000
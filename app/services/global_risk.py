@@ -1,76 +1,90 @@
 # app/services/global_risk.py
-from .. import config
+from .. import runtime_config
+from ..risk_calendar import CalendarStore
 import logging
 
 logger = logging.getLogger(__name__)
 
+_HALF_DAY = 12 * 3600
+
+
+def request_server_time(data):
+    """
+    本次请求的服务器时间戳:
+    EA 发送了 server_time 时直接使用; 旧版 EA 只有时/分，日期取自最后一根 M5
+    """
+    ts = getattr(data, 'server_time', 0)
+    if ts:
+        return ts
+    if not data.m5_candles:
+        return 0
+    bar_ts = data.m5_candles[-1].time
+    ts = bar_ts - bar_ts % 86400 + data.server_time_hour * 3600 + getattr(data, 'server_time_minute', 0) * 60
+    # 跨午夜: 时/分与最后一根 K 线不在同一天
+    if ts < bar_ts - _HALF_DAY:
+        ts += 86400
+    elif ts > bar_ts + _HALF_DAY:
+        ts -= 86400
+    return ts
+
+
 class GlobalRiskService:
+    def __init__(self):
+        # [新增] 时段 / 新闻 / 夏令时统一由风控日历的区间索引给出
+        self.calendar = CalendarStore()
+
     # [修改] 增加 current_atr 参数
-    def check_safety(self, data, current_atr):
+    def check_safety(self, data, current_atr, cfg=None):
         """
         L0: 物理/账户硬风控 (引入 ATR 动态点差)
         """
+        cfg = cfg or runtime_config.current()
+
         # 1. 账户熔断
-        if config.INITIAL_BALANCE > 0:
-            drawdown = (config.INITIAL_BALANCE - data.account_equity) / config.INITIAL_BALANCE
-            if drawdown >= config.MAX_DRAWDOWN_PERCENT:
+        if cfg.INITIAL_BALANCE > 0:
+            drawdown = (cfg.INITIAL_BALANCE - data.account_equity) / cfg.INITIAL_BALANCE
+            if drawdown >= cfg.MAX_DRAWDOWN_PERCENT:
                 return self._log_and_return(False, f"CIRCUIT_BREAKER:DD_{drawdown*100:.1f}%", data)
         else:
             # 异常配置保护
             return self._log_and_return(False, "CONFIG_ERROR:INITIAL_BALANCE_ZERO", data)
             
         # 2. 保证金保护
-        if 0 < data.margin_level < config.MIN_MARGIN_LEVEL:
+        if 0 < data.margin_level < cfg.MIN_MARGIN_LEVEL:
              return self._log_and_return(False, f"LOW_MARGIN:{data.margin_level:.0f}%", data)
 
-        # --- [1] 北京时间换算逻辑 ---
-        hour_diff = 6 if config.IS_WINTER_TIME else 5
-        current_server_h = data.server_time_hour
-        current_server_m = getattr(data, 'server_time_minute', 0)  # 获取分钟数，默认0
-        
-        # 转换为北京时间（小时 + 分钟的小数部分）
-        current_bj_h = (current_server_h + hour_diff) % 24
-        current_bj_decimal = current_bj_h + (current_server_m / 60.0)
-        
-        # --- [新增] 交易时间过滤 (优先级最高，在 Rollover 之前) ---
-        # 禁止在北京时间 03:00 - 09:30 开单
-        if config.NO_TRADE_START_H_BJ <= current_bj_decimal < config.NO_TRADE_END_H_BJ:
-            return self._log_and_return(False, f"NO_TRADE_HOURS(BJ:{current_bj_h:02d}:{current_server_m:02d})", data)
-        
-        # Rollover 保护 (原有逻辑，使用整数小时判断)
-        if config.ROLLOVER_START_H_BJ <= current_bj_h < config.ROLLOVER_END_H_BJ:
-             return self._log_and_return(False, f"ROLLOVER_TIME(BJ:{current_bj_h}h)", data)
+        # --- [修改] 时段 / 结算 / 新闻 / 假期: 风控日历一次二分查找 ---
+        # 夏令时由日历的 dst_rule 自动处理 (不再依赖手动的 IS_WINTER_TIME)
+        block, session_ratio, bj_ts = self.calendar.get(cfg).lookup(request_server_time(data))
+        if block is not None:
+            if block.startswith("NEWS:"):
+                return self._log_and_return(False, block, data)
+            bj_sec = bj_ts % 86400
+            return self._log_and_return(False, f"{block}(BJ:{bj_sec // 3600:02d}:{bj_sec % 3600 // 60:02d})", data)
 
         # 3. [修改] 动态点差保护 (ATR Based + Session Dynamic)
         # 必须有有效的 ATR，否则用保底逻辑
         if current_atr and current_atr > 0:
-            # [Dynamic] 根据时段调整 Ratio
-            # 默认 0.3
-            active_ratio = config.MAX_SPREAD_ATR_RATIO
-            
-            # Asian Session (0-9h): 放宽 (0.5)
-            if 0 <= current_bj_h < 9:
-                active_ratio = config.SESSION_ASIAN_SPREAD_FIX
-            # Core Session (14-22h): 收紧 (0.25)
-            elif 14 <= current_bj_h < 22:
-                active_ratio = config.SESSION_CORE_SPREAD_FIX
+            # [Dynamic] 根据时段调整 Ratio (日历中的 spread_ratio 时段)
+            # 默认 0.3; Asian (BJ 0-9h) 放宽 0.5; Core (BJ 14-22h) 收紧 0.25
+            active_ratio = session_ratio if session_ratio is not None else cfg.MAX_SPREAD_ATR_RATIO
                 
             # 计算允许最大点差
             max_spread_points = (current_atr * active_ratio) * 1000
             
             # 使用配置的物理下限 (例如 800 微点)
-            max_spread_points = max(config.SPREAD_FLOOR_POINTS, max_spread_points)
+            max_spread_points = max(cfg.SPREAD_FLOOR_POINTS, max_spread_points)
             
             if data.spread > max_spread_points:
                 return self._log_and_return(False, f"HIGH_SPREAD({data.spread}>{max_spread_points:.0f}|R:{active_ratio})", data)
         else:
             # ATR 无效时的保底
-            if data.spread > (config.SPREAD_FLOOR_POINTS * 1.5): 
+            if data.spread > cfg.MAX_SPREAD_NO_ATR_POINTS: 
                 return self._log_and_return(False, "HIGH_SPREAD_NO_ATR", data)
 
-        # 4. 新闻过滤
+        # 4. 新闻过滤 (日历中的新闻已在上面处理; 这里保留 EA 自带新闻信息的兼容判断)
         if data.news_info.impact_level == 3:
-            if abs(data.news_info.minutes_to_news) <= config.NEWS_PADDING_MINUTES:
+            if abs(data.news_info.minutes_to_news) <= cfg.NEWS_PADDING_MINUTES:
                 return self._log_and_return(False, f"NEWS:{data.news_info.event_name}", data)
 
         # 5. [新增] 亏损冷却 (Cooldown)
@@ -81,7 +95,7 @@ class GlobalRiskService:
             if data.m5_candles and data.last_closed_time > 0:
                 current_ts = data.m5_candles[-1].time
                 # 15分钟 = 900秒
-                if (current_ts - data.last_closed_time) < (config.COOLDOWN_AFTER_LOSS_MINUTES * 60):
+                if (current_ts - data.last_closed_time) < cfg.COOLDOWN_AFTER_LOSS_SECONDS:
                      return self._log_and_return(False, f"COOLDOWN_LOSS({data.last_closed_profit:.2f})", data)
 
         return True, "SAFE"
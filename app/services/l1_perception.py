@@ -1,12 +1,13 @@
 # app/services/l1_perception.py
-from .. import config
+from .. import runtime_config
 
 class PerceptionService:
     # [修改] 增加 atr 参数
-    def analyze_bar(self, candle, prev_candle, atr):
+    def analyze_bar(self, candle, prev_candle, atr, cfg=None):
         """
         基于 ATR 判断 K 线强弱，不再用固定美金
         """
+        cfg = cfg or runtime_config.current()
         body = abs(candle.close - candle.open)
         rng = candle.high - candle.low
         if rng == 0: rng = 0.001
@@ -14,7 +15,7 @@ class PerceptionService:
         # 1. 动能 (Momentum) - 自适应
         # 如果当前 ATR 是 6.0，那么实体 > 3.6 (0.6倍) 才算趋势K线
         # 如果用以前的 2.0 标准，现在全是趋势K线，那就乱套了
-        is_trend_bar = body > (atr * config.AB_TREND_BAR_ATR_RATIO)
+        is_trend_bar = body > (atr * cfg.AB_TREND_BAR_ATR_RATIO)
         
         # 2. 控制权 (Control)
         close_pos = (candle.close - candle.low) / rng
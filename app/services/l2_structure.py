@@ -1,27 +1,34 @@
 # app/services/l2_structure.py
-import pandas as pd
 import numpy as np
-from .. import config
+from .. import runtime_config
+from ..budget import run_optional, SHED
 
 class StructureService:
-    def update_counter(self, df, trend_dir, atr):
+    def update_counter(self, df, trend_dir, atr, cfg=None, budget=None, detect_wedge=None):
+        """detect_wedge: 楔形评分的实现 (app.backends 按配置选择)，默认为本类的 _detect_wedge_fuzzy"""
+        cfg = cfg or runtime_config.current()
         if len(df) < 50:
             return {"setup": "NONE", "reason": "NO_DATA"}
             
         # df 已经在 main 中生成并包含了 ema20
         
         if trend_dir == "NEUTRAL":
-             trend_dir = "BULL" if df['ema20'].iloc[-1] > df['ema20'].iloc[-2] else "BEAR"
+             trend_dir = "BULL" if df['ema20'][-1] > df['ema20'][-2] else "BEAR"
         
-        last = df.iloc[-1]
-        prev = df.iloc[-2]
+        last = df.row(-1)
+        prev = df.row(-2)
         setup = "NONE"
         
         # =========================================================
         # [新增] 楔形反转检测 (Wedge Reversal Detection) - 模糊逻辑
         # =========================================================
         # 这是一个强反转信号，优先级高于 H1/H2
-        wedge_score, wedge_type, wedge_pivots = self._detect_wedge_fuzzy(df, atr)
+        # [新增] 可选步骤: 延迟预算不足时跳过 (或复用同一输入的结果)
+        wedge = run_optional(budget, "wedge", detect_wedge or self._detect_wedge_fuzzy, df, atr)
+        if wedge is SHED:
+            # [修正] 不知道是否有逆势楔形，不能退回顺势 H1/H2 (可能给出反方向的订单): 放弃本次开仓
+            return {"setup": "SHED", "reason": "wedge"}
+        wedge_score, wedge_type, wedge_pivots = wedge
         
         # 阈值 80: 只有形态非常标准时才逆势入场
         if wedge_score >= 80:
@@ -59,11 +66,11 @@ class StructureService:
                     if is_bullish_signal:
                         setup = "H1"
                         # [修正] 弱趋势过滤: 如果斜率不够陡，不要做 H1，只做 H2
-                        current_slope = abs(df['ema20'].iloc[-1] - df['ema20'].iloc[-4])
+                        current_slope = abs(df['ema20'][-1] - df['ema20'][-4])
                         if current_slope < (atr * 0.4): 
                             setup = "WEAK_H1_WAIT_FOR_H2"
                         
-                        if dist_to_ema > (atr * config.AB_MAGNET_DISTANCE_ATR):
+                        if dist_to_ema > (atr * cfg.AB_MAGNET_DISTANCE_ATR):
                             setup = "WEAK_H1_TOO_FAR"
                         # H2 逻辑
                         if last['low'] < (last['ema20'] - atr * 0.2):
@@ -94,11 +101,11 @@ class StructureService:
                 if last['low'] < prev['low']:
                     if is_bearish_signal:
                         setup = "L1"
-                        current_slope = abs(df['ema20'].iloc[-1] - df['ema20'].iloc[-4])
+                        current_slope = abs(df['ema20'][-1] - df['ema20'][-4])
                         if current_slope < (atr * 0.4):
                              setup = "WEAK_L1_WAIT_FOR_L2"
 
-                        if dist_to_ema < -(atr * config.AB_MAGNET_DISTANCE_ATR):
+                        if dist_to_ema < -(atr * cfg.AB_MAGNET_DISTANCE_ATR):
                             setup = "WEAK_L1_TOO_FAR"
                         if last['high'] > (last['ema20'] + atr * 0.2):
                             setup = "L2"
@@ -142,7 +149,10 @@ class StructureService:
         # H2 setup = M5 在 BULL 趋势中回调, 如果历史上有 Bear Break EMA, 这可能是 MTR Bottom
         # L2 setup = M5 在 BEAR 趋势中回调, 如果历史上有 Bull Break EMA, 这可能是 MTR Top
         if setup in ["H2", "L2"]:
-            is_mtr = self._check_mtr_signal(df, atr, setup)
+            is_mtr = run_optional(budget, "mtr", self._check_mtr_signal, df, atr, setup, variant=setup)
+            if is_mtr is SHED:
+                # [修正] 预算不足且没有缓存: H2/L2 与 MTR 的入场不同，放弃本次开仓
+                return {"setup": "SHED", "reason": "mtr"}
             if is_mtr:
                 if setup == "H2": setup = "MTR_BOTTOM" # 底部反转
                 elif setup == "L2": setup = "MTR_TOP"  # 顶部反转
@@ -172,28 +182,24 @@ class StructureService:
         if len(df) < lookback: return False
         
         # 不看最近 5 根(因为那是 Test 过程)，看之前的
-        history = df.iloc[-lookback:-5]
+        h_open = df['open'][-lookback:-5]
+        h_close = df['close'][-lookback:-5]
+        h_ema = df['ema20'][-lookback:-5]
         has_break = False
         
         if current_setup == "H2":
             # H2 = 多头回调中的第二腿, 寻找之前是否有 Bear Break (曾经空头占优)
             # 这样 H2 就变成了从空头 -> 多头的 MTR Bottom
-            for i in range(len(history)):
-                bar = history.iloc[i]
-                is_strong_bear = (bar['open'] - bar['close']) > (atr * 0.6)
-                break_ema_down = bar['close'] < bar['ema20']
-                if is_strong_bear and break_ema_down:
-                    has_break = True; break
+            is_strong_bear = (h_open - h_close) > (atr * 0.6)
+            break_ema_down = h_close < h_ema
+            has_break = bool((is_strong_bear & break_ema_down).any())
                     
         elif current_setup == "L2":
             # L2 = 空头回调中的第二腿, 寻找之前是否有 Bull Break (曾经多头占优)
             # 这样 L2 就变成了从多头 -> 空头的 MTR Top
-            for i in range(len(history)):
-                bar = history.iloc[i]
-                is_strong_bull = (bar['close'] - bar['open']) > (atr * 0.6)
-                break_ema_up = bar['close'] > bar['ema20']
-                if is_strong_bull and break_ema_up:
-                    has_break = True; break
+            is_strong_bull = (h_close - h_open) > (atr * 0.6)
+            break_ema_up = h_close > h_ema
+            has_break = bool((is_strong_bull & break_ema_up).any())
                     
         return has_break
 
@@ -201,68 +207,9 @@ class StructureService:
     # 核心算法: 基于 Pivot 的模糊楔形评分
     # ------------------------------------------------------------------
     def _detect_wedge_fuzzy(self, df, atr):
-        # 定义辅助函数：判断是否为 Pivot
-        # 核心逻辑：左侧必须严格(5根)，右侧根据 K 线形态动态决定(1或2根)
-        def is_pivot(idx, type='HIGH'):
-            if idx < 5 or idx >= len(df) - 1: return False
-            
-            # 1. 左侧检查 (严格，确保是主要高/低点)
-            window_left = 5
-            current_val = df['high'].iloc[idx] if type == 'HIGH' else df['low'].iloc[idx]
-            
-            for k in range(1, window_left + 1):
-                if idx - k < 0: break
-                compare_val = df['high'].iloc[idx-k] if type == 'HIGH' else df['low'].iloc[idx-k]
-                if type == 'HIGH' and compare_val > current_val: return False
-                if type == 'LOW' and compare_val < current_val: return False
-            
-            # 2. 右侧检查 (动态宽松)
-            # 默认只需 1 根确认 (最快反应)
-            # 但如果这根 Pivot K线本身很弱，我们可能需要第 2 根确认
-            window_right = 1 
-            
-            # 获取这根潜在 Pivot 的形态
-            bar = df.iloc[idx]
-            body = abs(bar['close'] - bar['open'])
-            upper_wick = bar['high'] - max(bar['open'], bar['close'])
-            lower_wick = min(bar['open'], bar['close']) - bar['low']
-            
-            # 判断逻辑:
-            if type == 'HIGH':
-                # 如果是顶部 Pivot，看是否是强空头K线 (阴线且收盘在低位，或长上影)
-                is_strong_reversal = (bar['close'] < bar['open']) or (upper_wick > body)
-                # 如果不强，强制要求右边 2 根都比它低，防止误报
-                if not is_strong_reversal: window_right = 2
-                
-                # 执行右侧检查
-                for k in range(1, window_right + 1):
-                    if idx + k >= len(df): return False # 数据还没出来，不能确认
-                    if df['high'].iloc[idx+k] > current_val: return False
-
-            elif type == 'LOW':
-                # 如果是底部 Pivot，看是否是强多头K线
-                is_strong_reversal = (bar['close'] > bar['open']) or (lower_wick > body)
-                if not is_strong_reversal: window_right = 2
-                
-                for k in range(1, window_right + 1):
-                    if idx + k >= len(df): return False
-                    if df['low'].iloc[idx+k] < current_val: return False
-                    
-            return True
+        n_bars = len(df)
+        pivots_high, pivots_low = self._find_wedge_pivots(df)
 
-        # --- 使用新逻辑寻找 Pivots ---
-        pivots_high = []
-        pivots_low = []
-        
-        # 倒序遍历 (找最近的)
-        # 范围修正: len(df)-2 是因为至少要留 1 根做右侧确认
-        for i in range(len(df)-2, 20, -1):
-            if is_pivot(i, 'HIGH'): pivots_high.append((i, df['high'].iloc[i]))
-            if is_pivot(i, 'LOW'): pivots_low.append((i, df['low'].iloc[i]))
-            
-            # 找到 3 个就停
-            if len(pivots_high) >= 3 and len(pivots_low) >= 3: break
-            
         # ----------------------------------------------------
         # 评分逻辑 A: 楔形顶 (Wedge Top) -> 看空
         # ----------------------------------------------------
@@ -292,9 +239,9 @@ class StructureService:
                     
                 # [规则 3] 信号棒确认 (Signal Bar)
                 # 当前 K 线 (P3附近) 必须表现出反转意图
-                last_bar = df.iloc[-1]
+                last_bar = df.row(-1)
                 # P3 离当前不能太远 (比如就在最近 5 根内)
-                if (len(df) - idx3) <= 5:
+                if (n_bars - idx3) <= 5:
                     # 收阴 或者 长上影线
                     is_bear_bar = last_bar['close'] < last_bar['open']
                     has_tail = (last_bar['high'] - max(last_bar['open'], last_bar['close'])) > (atr * 0.3)
@@ -328,8 +275,8 @@ class StructureService:
                     score_bull -= 20
                     
                 # [规则 3] Signal Bar
-                if (len(df) - idx3) <= 5:
-                    last_bar = df.iloc[-1]
+                if (n_bars - idx3) <= 5:
+                    last_bar = df.row(-1)
                     is_bull_bar = last_bar['close'] > last_bar['open']
                     has_tail = (min(last_bar['open'], last_bar['close']) - last_bar['low']) > (atr * 0.3)
                     
@@ -341,3 +288,79 @@ class StructureService:
             return score_bear, "BEAR_WEDGE", p_bear
         else:
             return score_bull, "BULL_WEDGE", p_bull
+
+    def _find_wedge_pivots(self, df):
+        """
+        倒序寻找最近的 Pivot 高点 / 低点，返回两个 [(下标, 价格), ...] 列表 (最近的在前)
+        评分只用每边最近 3 个
+        """
+        # 逐根扫描用 Python list 访问 (比逐个取 numpy 标量快)
+        n_bars = len(df)
+        opens = df['open'].tolist()
+        highs = df['high'].tolist()
+        lows = df['low'].tolist()
+        closes = df['close'].tolist()
+
+        # 定义辅助函数：判断是否为 Pivot
+        # 核心逻辑：左侧必须严格(5根)，右侧根据 K 线形态动态决定(1或2根)
+        def is_pivot(idx, type='HIGH'):
+            if idx < 5 or idx >= n_bars - 1: return False
+            
+            # 1. 左侧检查 (严格，确保是主要高/低点)
+            window_left = 5
+            current_val = highs[idx] if type == 'HIGH' else lows[idx]
+            
+            for k in range(1, window_left + 1):
+                if idx - k < 0: break
+                compare_val = highs[idx-k] if type == 'HIGH' else lows[idx-k]
+                if type == 'HIGH' and compare_val > current_val: return False
+                if type == 'LOW' and compare_val < current_val: return False
+            
+            # 2. 右侧检查 (动态宽松)
+            # 默认只需 1 根确认 (最快反应)
+            # 但如果这根 Pivot K线本身很弱，我们可能需要第 2 根确认
+            window_right = 1 
+            
+            # 获取这根潜在 Pivot 的形态
+            bar_open, bar_close = opens[idx], closes[idx]
+            body = abs(bar_close - bar_open)
+            upper_wick = highs[idx] - max(bar_open, bar_close)
+            lower_wick = min(bar_open, bar_close) - lows[idx]
+            
+            # 判断逻辑:
+            if type == 'HIGH':
+                # 如果是顶部 Pivot，看是否是强空头K线 (阴线且收盘在低位，或长上影)
+                is_strong_reversal = (bar_close < bar_open) or (upper_wick > body)
+                # 如果不强，强制要求右边 2 根都比它低，防止误报
+                if not is_strong_reversal: window_right = 2
+                
+                # 执行右侧检查
+                for k in range(1, window_right + 1):
+                    if idx + k >= n_bars: return False # 数据还没出来，不能确认
+                    if highs[idx+k] > current_val: return False
+
+            elif type == 'LOW':
+                # 如果是底部 Pivot，看是否是强多头K线
+                is_strong_reversal = (bar_close > bar_open) or (lower_wick > body)
+                if not is_strong_reversal: window_right = 2
+                
+                for k in range(1, window_right + 1):
+                    if idx + k >= n_bars: return False
+                    if lows[idx+k] < current_val: return False
+                    
+            return True
+
+        # --- 使用新逻辑寻找 Pivots ---
+        pivots_high = []
+        pivots_low = []
+        
+        # 倒序遍历 (找最近的)
+        # 范围修正: len(df)-2 是因为至少要留 1 根做右侧确认
+        for i in range(n_bars-2, 20, -1):
+            if is_pivot(i, 'HIGH'): pivots_high.append((i, highs[i]))
+            if is_pivot(i, 'LOW'): pivots_low.append((i, lows[i]))
+            
+            # 找到 3 个就停
+            if len(pivots_high) >= 3 and len(pivots_low) >= 3: break
+
+        return pivots_high, pivots_low
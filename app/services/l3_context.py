@@ -1,33 +1,35 @@
 # app/services/l3_context.py
-import pandas as pd
 import numpy as np
-from .. import config
+from .. import runtime_config
+from ..indicators import ema
 
 class ContextService:
-    def identify_stage(self, df_m5, h1_candles, current_atr):
+    def identify_stage(self, df_m5, df_h1, current_atr, cfg=None):
         """
         引入 H1 数据来模拟 Al Brooks 的 "Always In" 大局观
+        df_h1: H1 的 BarFrame (服务端重采样或 EA 发送)，可为 None
         """
+        cfg = cfg or runtime_config.current()
         if len(df_m5) < 21: return "UNKNOWN", "WAIT"
             
         # df_m5 已经包含 ema20
         df = df_m5
         
         # --- 1. M5 基础因子计算 ---
-        current_ema = df['ema20'].iloc[-1]
-        prev_ema_3 = df['ema20'].iloc[-4]
+        current_ema = df['ema20'][-1]
+        prev_ema_3 = df['ema20'][-4]
         raw_slope = current_ema - prev_ema_3
         norm_slope = raw_slope / current_atr 
         
         # ---------------------------------------------------------
         # [新增] 快速通道：单根超级K线定性 (Instant Stage 1)
         # ---------------------------------------------------------
-        last_bar = df_m5.iloc[-1]
+        last_bar = df_m5.row(-1)
         body = abs(last_bar['close'] - last_bar['open'])
         bar_height = last_bar['high'] - last_bar['low']
         
         # 1. 尺寸判定：是否是巨型趋势棒 (Super Trend Bar)
-        is_huge_bar = body > (current_atr * config.INSTANT_SPIKE_ATR)
+        is_huge_bar = body > (current_atr * cfg.INSTANT_SPIKE_ATR)
         
         # 2. 质量判定：收盘是否极强 (收在最高点附近的 20% 区域)
         # 对于阳线：(Close - Low) / Range > 0.8
@@ -38,12 +40,12 @@ class ContextService:
             else: # 阴线
                 token_close_strength = (last_bar['high'] - last_bar['close']) / bar_height
                 
-        is_strong_close = token_close_strength > config.STRONG_CLOSE_RATIO
+        is_strong_close = token_close_strength > cfg.STRONG_CLOSE_RATIO
         
         # 3. 突破判定：是否突破了过去 20 根的高点 (Bull) 或 低点 (Bear)
         # 这一步是为了过滤掉震荡区间内部的假突破，确保它是真正的 Breakout
-        recent_highs = df_m5['high'].iloc[-20:-1].max() # 不包含当前K线的过去高点
-        recent_lows = df_m5['low'].iloc[-20:-1].min()
+        recent_highs = df_m5['high'][-20:-1].max() # 不包含当前K线的过去高点
+        recent_lows = df_m5['low'][-20:-1].min()
         
         is_breakout_bull = (last_bar['close'] > recent_highs) and (last_bar['close'] > last_bar['open'])
         is_breakout_bear = (last_bar['close'] < recent_lows) and (last_bar['close'] < last_bar['open'])
@@ -58,39 +60,31 @@ class ContextService:
                 return "1-STRONG_TREND", "BEAR"
 
         # 穿越次数 & 压缩度
-        crossings = 0
-        for i in range(len(df)-20, len(df)):
-            if i < 0: continue
-            row = df.iloc[i]
-            if pd.notna(row['ema20']) and (row['high'] > row['ema20'] > row['low']):
-                crossings += 1
+        # 最近 20 根中 EMA 落在 K 线内部 (High > EMA > Low) 的次数
+        ema_20 = df['ema20'][-20:]
+        crossings = int(((df['high'][-20:] > ema_20) & (ema_20 > df['low'][-20:])).sum())
                 
-        recent_high = df['high'].tail(10).max()
-        recent_low = df['low'].tail(10).min()
-        is_compressed = (recent_high - recent_low) < (current_atr * config.COMPRESSION_ATR)
-        is_deep_compressed = (recent_high - recent_low) < (current_atr * config.COMPRESSION_ATR_BARBWIRE)
+        recent_high = df['high'][-10:].max()
+        recent_low = df['low'][-10:].min()
+        is_compressed = (recent_high - recent_low) < (current_atr * cfg.COMPRESSION_ATR)
+        is_deep_compressed = (recent_high - recent_low) < (current_atr * cfg.COMPRESSION_ATR_BARBWIRE)
         
         # ---------------------------------------------------------
         # [新增 1] 重叠度计算 (Choppiness Index) - 震荡的DNA
         # ---------------------------------------------------------
-        overlap_count = 0
         chop_lookback = 10
-        bars_tail = df.tail(chop_lookback)
-        for i in range(1, len(bars_tail)):
-            curr = bars_tail.iloc[i]
-            prev = bars_tail.iloc[i-1]
-            # 计算垂直重叠部分: min(Highs) > max(Lows)
-            overlap_h = min(curr['high'], prev['high'])
-            overlap_l = max(curr['low'], prev['low'])
-            
-            # [修正] 必须是显著重叠 (>30% 当根K线幅度) 才算 Choppy
-            # 仅仅一点点触碰不算，那是正常的趋势回调
-            bar_range = curr['high'] - curr['low']
-            if overlap_h > overlap_l:
-                overlap_amp = overlap_h - overlap_l
-                # 如果重叠幅度超过当根 K 线幅度的 30%，才算有效重叠
-                if bar_range > 0 and (overlap_amp / bar_range) > 0.3:
-                    overlap_count += 1
+        tail_h = df['high'][-chop_lookback:]
+        tail_l = df['low'][-chop_lookback:]
+        # 计算相邻两根的垂直重叠部分: min(Highs) > max(Lows)
+        overlap_h = np.minimum(tail_h[1:], tail_h[:-1])
+        overlap_l = np.maximum(tail_l[1:], tail_l[:-1])
+        
+        # [修正] 必须是显著重叠 (>30% 当根K线幅度) 才算 Choppy
+        # 仅仅一点点触碰不算，那是正常的趋势回调
+        bar_range = tail_h[1:] - tail_l[1:]
+        safe_range = np.where(bar_range > 0, bar_range, 1.0)
+        is_overlap = (overlap_h > overlap_l) & (bar_range > 0) & (((overlap_h - overlap_l) / safe_range) > 0.3)
+        overlap_count = int(is_overlap.sum())
                 
         # 判定标准: 10根里有6根以上重叠，或者穿越均线次数过多
         is_choppy = overlap_count >= 6 or crossings >= 4
@@ -102,29 +96,28 @@ class ContextService:
              is_barbwire = True
         
         # 强趋势因子
-        last_3 = df.tail(3)
-        bodies = abs(last_3['close'] - last_3['open'])
-        strong_momentum = ((bodies > (current_atr * 0.8)).sum() >= 2) or (bodies.iloc[-1] > current_atr * 2.0)
+        bodies = np.abs(df['close'][-3:] - df['open'][-3:])
+        strong_momentum = ((bodies > (current_atr * 0.8)).sum() >= 2) or (bodies[-1] > current_atr * 2.0)
 
         # --- 2. H1 "Always In" 方向判断 (新增) ---
         # 如果 M5 看不清，就看 H1。H1 EMA 向上 = Always In Long
         always_in_dir = "NEUTRAL"
-        if h1_candles and len(h1_candles) > 20:
-            df_h1 = pd.DataFrame([c.dict() for c in h1_candles])
-            df_h1['ema20'] = df_h1['close'].ewm(span=20, adjust=False).mean()
+        if df_h1 is not None and len(df_h1) > 20:
+            h1_close = df_h1['close']
+            h1_ema = ema(h1_close, 20)
             
             # [优化] 使用 3 根 K 线的平滑斜率，避免单根 K 线噪音
             # Slope = (EMA[-1] - EMA[-3]) / 2
-            ema_now = df_h1['ema20'].iloc[-1]
-            ema_prev_2 = df_h1['ema20'].iloc[-3]
+            ema_now = h1_ema[-1]
+            ema_prev_2 = h1_ema[-3]
             h1_slope = (ema_now - ema_prev_2) / 2
             
             # [关键修正] 引入阈值 (0.2 ATR)，解决"永远不为0"的问题
             h1_threshold = current_atr * 0.2
             
             # [新增] 必须配合 K 线位置确认 (过滤掉 EMA 虽然向上但价格都在下方的假突破)
-            price_above = df_h1['close'].iloc[-1] > df_h1['ema20'].iloc[-1]
-            price_below = df_h1['close'].iloc[-1] < df_h1['ema20'].iloc[-1]
+            price_above = h1_close[-1] > h1_ema[-1]
+            price_below = h1_close[-1] < h1_ema[-1]
 
             if h1_slope > h1_threshold and price_above: always_in_dir = "BULL"
             elif h1_slope < -h1_threshold and price_below: always_in_dir = "BEAR"
@@ -140,23 +133,23 @@ class ContextService:
         range_10_bar = recent_high - recent_low
         
         # [Context] 计算相对实体大小 (Relative Body Size)
-        recent_bodies = (df['close'] - df['open']).abs().tail(10)
+        recent_bodies = np.abs(df['close'][-10:] - df['open'][-10:])
         avg_body = recent_bodies.mean() if len(recent_bodies) > 0 else current_atr
         
         # 定义状态
         # [Context] Stage 4 (Breakout Mode): 不仅 ATR 小，还要相对实体紧凑 (Real Compression)
-        is_tight_relative = range_10_bar < (avg_body * config.STAGE4_RELATIVE_BODY_RATIO)
-        is_stage_4 = (range_10_bar < (current_atr * config.STAGE4_THRESHOLD_ATR)) and is_tight_relative
+        is_tight_relative = range_10_bar < (avg_body * cfg.STAGE4_RELATIVE_BODY_RATIO)
+        is_stage_4 = (range_10_bar < (current_atr * cfg.STAGE4_THRESHOLD_ATR)) and is_tight_relative
         
         # Stage 3 Range Condition (ATR Based)
-        is_in_range_context = (current_atr * config.STAGE4_THRESHOLD_ATR) <= range_10_bar < (current_atr * config.STAGE3_THRESHOLD_ATR)
+        is_in_range_context = (current_atr * cfg.STAGE4_THRESHOLD_ATR) <= range_10_bar < (current_atr * cfg.STAGE3_THRESHOLD_ATR)
         is_stage_3 = is_in_range_context # Preliminary check
         
         # Stage 1: Spike (强趋势)
         # [Context] 动态阈值: 如果处于震荡区间(Range Context)，突破需要更强的斜率
-        req_slope = config.SLOPE_SPIKE_ATR
+        req_slope = cfg.SLOPE_SPIKE_ATR
         if is_in_range_context or is_choppy:
-            req_slope += config.SPIKE_FROM_RANGE_PENALTY # 0.5 + 0.2 = 0.7
+            req_slope = cfg.SPIKE_SLOPE_FROM_RANGE # 0.5 + 0.2 = 0.7 (快照中预计算)
             
         # 必须有斜率 + 动能 + 不混乱 (或者斜率极强 override 混乱)
         # 如果 is_choppy 为真，通常不给 Trend，除非斜率超级大 (这里暂不 override not is_choppy 限制，保持保守)
@@ -179,9 +172,9 @@ class ContextService:
         
         # 1. 动态斜率阈值 (Dynamic Slope Threshold)
         # 如果市场混乱 (Choppy)，我们需要更高的斜率才能确认为趋势，否则视为震荡
-        slope_threshold = config.SLOPE_FLAT_ATR # 默认为 0.20
+        slope_threshold = cfg.SLOPE_FLAT_ATR # 默认为 0.20
         if is_choppy:
-            slope_threshold *= config.CHOPS_SLOPE_MULTIPLIER # 例如 0.20 * 1.5 = 0.30
+            slope_threshold = cfg.FLAT_SLOPE_CHOPPY # 例如 0.20 * 1.75 = 0.35 (快照中预计算)
             
         is_flat = abs(norm_slope) < slope_threshold
 
@@ -194,7 +187,7 @@ class ContextService:
         # 如果有明显斜率，那就是 Channel (Stage 2)
         
         if is_flat:
-            if is_stage_3 or is_choppy or (crossings >= config.AB_RANGE_CROSSINGS):
+            if is_stage_3 or is_choppy or (crossings >= cfg.AB_RANGE_CROSSINGS):
                  is_trading_range = True
             
         if is_trading_range:
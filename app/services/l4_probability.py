@@ -1,51 +1,175 @@
 # app/services/l4_probability.py
+import bisect
+import logging
+import os
+import time
+
+import numpy as np
+
+from .. import runtime_config
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+# 分桶维度 (顺序即编码, 修改后必须重新生成概率表)
+# ------------------------------------------------------------------
+STAGES = ("UNKNOWN", "0-BARBWIRE", "1-STRONG_TREND", "2-CHANNEL", "3-TRADING_RANGE", "4-BREAKOUT_MODE")
+SETUPS = (
+    "OTHER", "NONE",
+    "H1", "H2", "H1_MICRO_DB", "L1", "L2", "L1_MICRO_DT",
+    "WEDGE_TOP", "WEDGE_BOTTOM", "MTR_TOP", "MTR_BOTTOM",
+    "WEAK_H1_WAIT_FOR_H2", "WEAK_L1_WAIT_FOR_L2",
+    "MICRO_DB_FILTERED_BY_ATR", "MICRO_DT_FILTERED_BY_ATR",
+)
+CONTROLS = ("NEUTRAL", "BULL", "BEAR")
+REJECTIONS = ("NONE", "TOP_TAIL", "BOTTOM_TAIL")
+
+# ATR 区间 (美金): <1.5 / 1.5-3 / 3-5 / >=5
+DEFAULT_ATR_EDGES = (1.5, 3.0, 5.0)
+
+_STAGE_IDX = {v: i for i, v in enumerate(STAGES)}
+_SETUP_IDX = {v: i for i, v in enumerate(SETUPS)}
+_CONTROL_IDX = {v: i for i, v in enumerate(CONTROLS)}
+_REJECTION_IDX = {v: i for i, v in enumerate(REJECTIONS)}
+
+TABLE_CHECK_SECONDS = 2.0
+
+
+def table_shape(atr_edges):
+    return (len(STAGES), len(SETUPS), 2, len(CONTROLS), len(REJECTIONS), len(atr_edges) + 1)
+
+
+def bucket_index(stage, setup, is_trend_bar, control, rejection_type, atr, atr_edges):
+    """
+    (stage, setup, trend-bar, control, rejection, ATR 区间) -> 扁平数组下标
+    未知的 stage/setup 归入 0 号桶 (UNKNOWN / OTHER)
+    """
+    shape = table_shape(atr_edges)
+    idx = _STAGE_IDX.get(stage, 0)
+    idx = idx * shape[1] + _SETUP_IDX.get(setup, 0)
+    idx = idx * shape[2] + (1 if is_trend_bar else 0)
+    idx = idx * shape[3] + _CONTROL_IDX.get(control, 0)
+    idx = idx * shape[4] + _REJECTION_IDX.get(rejection_type, 0)
+    idx = idx * shape[5] + bisect.bisect_right(atr_edges, atr)
+    return idx
+
+
+def wilson_bounds(wins, trials, z=1.96):
+    """Wilson 区间 (支持 numpy 数组)，样本为 0 时返回 (0, 1)"""
+    wins = np.asarray(wins, dtype=np.float64)
+    trials = np.asarray(trials, dtype=np.float64)
+    n = np.maximum(trials, 1.0)
+    p = wins / n
+    denom = 1.0 + z * z / n
+    centre = (p + z * z / (2 * n)) / denom
+    half = z * np.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    lower = np.where(trials > 0, centre - half, 0.0)
+    upper = np.where(trials > 0, centre + half, 1.0)
+    return lower, upper
+
+
+class ProbabilityTable:
+    """
+    离线统计出的胜率表 (一个扁平数组, 请求时只做一次下标访问)
+    win 定义见 tools/build_prob_table.py: 入场后先到 +1R 再到 SL
+    """
+
+    def __init__(self, wins, trials, atr_edges=DEFAULT_ATR_EDGES, meta=None):
+        self.atr_edges = tuple(float(x) for x in atr_edges)
+        size = int(np.prod(table_shape(self.atr_edges)))
+        self.wins = np.asarray(wins, dtype=np.int32).reshape(size)
+        self.trials = np.asarray(trials, dtype=np.int32).reshape(size)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.win_rate = np.where(self.trials > 0, self.wins / np.maximum(self.trials, 1), 0.0).astype(np.float32)
+        lower, upper = wilson_bounds(self.wins, self.trials)
+        self.lower = lower.astype(np.float32)
+        self.upper = upper.astype(np.float32)
+        self.meta = dict(meta or {})
+
+    def lookup(self, stage, setup, is_trend_bar, control, rejection_type, atr):
+        i = bucket_index(stage, setup, is_trend_bar, control, rejection_type, atr, self.atr_edges)
+        return float(self.win_rate[i]), float(self.lower[i]), float(self.upper[i]), int(self.trials[i])
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            wins=self.wins, trials=self.trials,
+            atr_edges=np.asarray(self.atr_edges, dtype=np.float64),
+            stages=np.asarray(STAGES), setups=np.asarray(SETUPS),
+            controls=np.asarray(CONTROLS), rejections=np.asarray(REJECTIONS),
+            meta_keys=np.asarray(list(self.meta.keys()), dtype=str),
+            meta_values=np.asarray([str(v) for v in self.meta.values()], dtype=str),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as z:
+            for key, vocab in (("stages", STAGES), ("setups", SETUPS), ("controls", CONTROLS), ("rejections", REJECTIONS)):
+                if tuple(z[key].tolist()) != vocab:
+                    raise ValueError(f"Probability table vocabulary mismatch on '{key}', rebuild the table")
+            meta = dict(zip(z["meta_keys"].tolist(), z["meta_values"].tolist()))
+            return cls(z["wins"], z["trials"], z["atr_edges"].tolist(), meta)
+
 
 class ProbabilityService:
-    def calculate_win_rate(self, context, structure, l1_features):
+    def __init__(self):
+        self._table = None
+        self._path = None
+        self._mtime = None
+        self._last_check = 0.0
+
+    def get_table(self, cfg=None):
+        """按需加载概率表; 文件更新后自动切换 (最多每 2 秒 stat 一次)"""
+        cfg = cfg or runtime_config.current()
+        path = runtime_config.resolve_app_path(cfg.PROB_TABLE_FILE)
+        now = time.monotonic()
+        if path == self._path and now - self._last_check < TABLE_CHECK_SECONDS:
+            return self._table
+        self._last_check = now
+
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        if path == self._path and mtime == self._mtime:
+            return self._table
+
+        self._path, self._mtime, self._table = path, mtime, None
+        if mtime is not None:
+            try:
+                self._table = ProbabilityTable.load(path)
+                logger.info(f"[L4] Probability table loaded: {path} ({int(self._table.trials.sum())} samples)")
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"[L4] Failed to load probability table {path}: {e}")
+        return self._table
+
+    def calculate_win_rate(self, stage, setup, l1_features, atr, cfg=None):
         """
-        计算胜率 (0.0 - 1.0)
+        查表得到胜率 (win_rate, lower, upper, samples)
+        没有概率表时返回 None
         """
-        # 基础胜率
-        prob_bull = 0.5
-        prob_bear = 0.5
-        
-        # 1. 环境修正 (Context)
-        if context['cycle'] == "BREAKOUT_MODE":
-            # 突破模式下，顺势信号胜率大增
-            pass 
-        elif context['cycle'] == "TRADING_RANGE":
-            # 震荡模式下，高抛低吸胜率高，突破胜率低
-            pass
-            
-        # 2. 结构修正 (Structure)
-        # H1 通常胜率一般，H2 (第二次机会) 胜率更高
-        if structure['major_trend'] == "BULL":
-            prob_bull += 0.1 # 顺势基础分
-            if structure['setup'] == "H2":
-                prob_bull += 0.15 # 黄金 Setup
-            elif structure['setup'] == "H1":
-                prob_bull += 0.05
-                
-        elif structure['major_trend'] == "BEAR":
-            prob_bear += 0.1
-            if structure['setup'] == "L2":
-                prob_bear += 0.15
-            elif structure['setup'] == "L1":
-                prob_bear += 0.05
-                
-        # 3. 信号 K 线修正 (Signal Bar)
-        # 如果 Signal Bar 是个完美的 Trend Bar，胜率加成
-        if l1_features['is_trend_bar']:
-            if l1_features['control'] == "BULL_CONTROL":
-                prob_bull += 0.1
-            elif l1_features['control'] == "BEAR_CONTROL":
-                prob_bear += 0.1
-                
-        # 如果 Signal Bar 有巨大的反向影线 (拒绝)，胜率加成
-        if l1_features['has_rejection']:
-            if l1_features['rejection_type'] == "BOTTOM_TAIL": # 下方买盘
-                prob_bull += 0.1
-            elif l1_features['rejection_type'] == "TOP_TAIL": # 上方抛压
-                prob_bear += 0.1
-                
-        return prob_bull, prob_bear
+        table = self.get_table(cfg)
+        if table is None:
+            return None
+        return table.lookup(
+            stage, setup,
+            l1_features['is_trend_bar'], l1_features['control'], l1_features['rejection_type'],
+            atr,
+        )
+
+    def check(self, stage, setup, l1_features, atr, cfg=None):
+        """
+        L4 门控: 样本足够且胜率 < MIN_PROB 时拒绝
+        没有概率表 / 样本不足时放行 (没有证据不做判断)
+        """
+        cfg = cfg or runtime_config.current()
+        result = self.calculate_win_rate(stage, setup, l1_features, atr, cfg)
+        if result is None:
+            return True, "NO_TABLE"
+
+        win_rate, lower, upper, samples = result
+        if samples < cfg.PROB_MIN_SAMPLES:
+            return True, f"LOW_SAMPLES({samples})"
+        if win_rate < cfg.MIN_PROB:
+            return False, f"L4_LOW_PROB({win_rate:.2f}[{lower:.2f}-{upper:.2f}],n={samples})"
+        return True, f"PROB({win_rate:.2f},n={samples})"
@@ -1,6 +1,7 @@
 # app/services/l5_execution.py
-from .. import config
-import math
+from .. import runtime_config
+from ..budget import run_optional, SHED
+import numpy as np
 
 class ExecutionService:
     def _calculate_dynamic_thresholds(self, df_recent, ema20_val):
@@ -9,27 +10,54 @@ class ExecutionService:
         """
         # 1. 计算过去 50 根 K 线的"价格-EMA距离"的标准差 (SD)
         # 这反映了当前的"乖离率波动范围"
-        dists = (df_recent['close'] - ema20_val).abs()
+        dists = np.abs(df_recent['close'] - ema20_val)
         
         if len(dists) == 0: return 999.0, 999.0
         
         avg_dist = dists.mean()
-        std_dev_dist = dists.std()
+        std_dev_dist = dists.std(ddof=1) if len(dists) > 1 else float('nan')
         
         # 动态乖离阈值: 平均乖离 + 3倍标准差 (99.7% 置信度)
         threshold_extension = avg_dist + (3.0 * std_dev_dist)
         
         # 2. 计算过去 50 根 K 线的"最大实体"
-        bodies = (df_recent['close'] - df_recent['open']).abs()
+        bodies = np.abs(df_recent['close'] - df_recent['open'])
         # 排除当前这根 (因为主要看历史背景)
-        max_body_recent = bodies.iloc[:-1].max() if len(bodies) > 1 else bodies.max()
+        max_body_recent = bodies[:-1].max() if len(bodies) > 1 else bodies.max()
         
         # 动态巨型K线阈值: 必须比过去50根里最大的还要大 10%
         threshold_climax_bar = max_body_recent * 1.1 if max_body_recent > 0 else 999.0
         
         return threshold_extension, threshold_climax_bar
 
-    def generate_order(self, stage, trend_dir, setup_type, df, candles, atr):
+    # --- [内部辅助函数] 寻找最近的主要拐点 ---
+    def _find_major_pivots(self, df, candles, lookback_limit=100, neighbor_strength=5):
+        """df 与 candles 是同一段 K 线 (这里按对象逐根比较; app.backends 的数组实现用 df 的列)"""
+        if len(candles) < lookback_limit: return None, None
+        major_high = -1.0
+        major_low = -1.0
+        search_pool = candles[-lookback_limit:]
+        pool_len = len(search_pool)
+        # 寻找 Major High
+        for i in range(pool_len - neighbor_strength - 1, neighbor_strength, -1):
+            candidate = search_pool[i]
+            left_wins = all(candidate.high >= search_pool[i-j].high for j in range(1, neighbor_strength+1))
+            right_wins = all(candidate.high >= search_pool[i+j].high for j in range(1, neighbor_strength+1))
+            if left_wins and right_wins:
+                major_high = candidate.high
+                break
+        # 寻找 Major Low
+        for i in range(pool_len - neighbor_strength - 1, neighbor_strength, -1):
+            candidate = search_pool[i]
+            left_wins = all(candidate.low <= search_pool[i-j].low for j in range(1, neighbor_strength+1))
+            right_wins = all(candidate.low <= search_pool[i+j].low for j in range(1, neighbor_strength+1))
+            if left_wins and right_wins:
+                major_low = candidate.low
+                break
+        return major_high, major_low
+
+    def generate_order(self, stage, trend_dir, setup_type, df, candles, atr, cfg=None, budget=None):
+        cfg = cfg or runtime_config.current()
         signal_bar = candles[-1]
         
         # =========================================================
@@ -39,12 +67,12 @@ class ExecutionService:
         # 1. 弱通道保护 (Weak Channel Protection)
         # 防止在通道底部追空，或通道顶部追多
         if stage == "2-CHANNEL":
-            recent_high = df['high'].tail(20).max()
-            recent_low = df['low'].tail(20).min()
+            recent_high = df['high'][-20:].max()
+            recent_low = df['low'][-20:].min()
             channel_range = recent_high - recent_low
             
             if channel_range > 0:
-                current_price = df['close'].iloc[-1]
+                current_price = df['close'][-1]
                 # 计算相对位置 (0.0 = Low, 1.0 = High)
                 relative_pos = (current_price - recent_low) / channel_range
                 
@@ -74,7 +102,7 @@ class ExecutionService:
 
         # 3. 整数关口保护 (Round Number)
         # 避免在 4300, 4350 等整数关口附近做突破
-        current_close = df['close'].iloc[-1]
+        current_close = df['close'][-1]
         dist_to_round_100 = abs(current_close % 100)
         dist_to_round_100 = min(dist_to_round_100, 100 - dist_to_round_100)
         
@@ -92,7 +120,7 @@ class ExecutionService:
         lot = 0.0 
         reason = f"Stage:{stage}"
         
-        tick_buffer = max(config.MIN_TICK_SIZE, atr * 0.05)
+        tick_buffer = max(cfg.MIN_TICK_SIZE, atr * 0.05)
         bar_height = signal_bar.high - signal_bar.low
         is_huge_bar = bar_height > (atr * 3.0)
 
@@ -103,14 +131,14 @@ class ExecutionService:
         # [L1] 计算动态 Trend Bar 阈值
         # ---------------------------------------------------------
         # 基础因子
-        trend_bar_factor = config.AB_TREND_BAR_ATR_RATIO
+        trend_bar_factor = cfg.AB_TREND_BAR_ATR_RATIO
         
         # [Dynamic] 震荡市需要更强的信号
         if "3-TRADING_RANGE" in stage:
-            trend_bar_factor += config.RANGE_TREND_BAR_ADDON # 0.6 + 0.15 = 0.75
+            trend_bar_factor = cfg.TREND_BAR_FACTOR_RANGE # 0.6 + 0.15 = 0.75
         # [Dynamic] 强趋势中，连续的小阳线也是趋势
         elif "1-STRONG_TREND" in stage:
-            trend_bar_factor -= config.TREND_S1_BAR_REDUCTION # 0.6 - 0.10 = 0.50
+            trend_bar_factor = cfg.TREND_BAR_FACTOR_S1 # 0.6 - 0.10 = 0.50
             
         trend_bar_size = atr * trend_bar_factor
         
@@ -147,10 +175,10 @@ class ExecutionService:
             # ==========================================================
             
             # 准备数据
-            ema20_val = df['ema20'].iloc[-1]
+            ema20_val = df['ema20'][-1]
             
             # [关键] 获取动态阈值
-            df_recent = df.iloc[-50:]
+            df_recent = df.tail(50)
             dyn_ext_threshold, dyn_bar_threshold = self._calculate_dynamic_thresholds(df_recent, ema20_val)
             
             # 1. 乖离率判断 (使用动态阈值)
@@ -279,32 +307,11 @@ class ExecutionService:
 
         # --- Stage 3: Trading Range ---
         elif "3-TRADING_RANGE" in stage:
-            # --- [内部辅助函数] 寻找最近的主要拐点 ---
-            def _find_major_pivots(bars, lookback_limit=100, neighbor_strength=5):
-                if len(bars) < lookback_limit: return None, None
-                major_high = -1.0
-                major_low = -1.0
-                search_pool = bars[-lookback_limit:]
-                pool_len = len(search_pool)
-                # 寻找 Major High
-                for i in range(pool_len - neighbor_strength - 1, neighbor_strength, -1):
-                    candidate = search_pool[i]
-                    left_wins = all(candidate.high >= search_pool[i-j].high for j in range(1, neighbor_strength+1))
-                    right_wins = all(candidate.high >= search_pool[i+j].high for j in range(1, neighbor_strength+1))
-                    if left_wins and right_wins:
-                        major_high = candidate.high
-                        break
-                # 寻找 Major Low
-                for i in range(pool_len - neighbor_strength - 1, neighbor_strength, -1):
-                    candidate = search_pool[i]
-                    left_wins = all(candidate.low <= search_pool[i-j].low for j in range(1, neighbor_strength+1))
-                    right_wins = all(candidate.low <= search_pool[i+j].low for j in range(1, neighbor_strength+1))
-                    if left_wins and right_wins:
-                        major_low = candidate.low
-                        break
-                return major_high, major_low
-
-            p_high, p_low = _find_major_pivots(candles, lookback_limit=100, neighbor_strength=5)
+            pivots = run_optional(budget, "major_pivots", self._find_major_pivots, df, candles, 100, 5)
+            if pivots is SHED:
+                # [修正] 预算不足且没有缓存: 区间边界决定买卖方向，不用 50 根高低点代替
+                return "HOLD", 0.0, 0.0, 0.0, 0.0, "DEGRADED_HOLD(major_pivots)"
+            p_high, p_low = pivots
             fallback_lookback = 50
             recent_bars_fallback = candles[-fallback_lookback:]
             
@@ -382,8 +389,8 @@ class ExecutionService:
             else:
                 sl_dist = abs(entry_price - sl)
                 if sl_dist == 0: sl_dist = atr 
-                calc_lot = config.RISK_PER_TRADE_USD / (100 * sl_dist)
-                lot = max(config.MIN_LOT, min(config.MAX_LOT, calc_lot))
+                calc_lot = cfg.RISK_PER_TRADE_USD / (100 * sl_dist)
+                lot = max(cfg.MIN_LOT, min(cfg.MAX_LOT, calc_lot))
                 lot = round(lot, 2)
 
         # --- [新增] 价格逻辑与合规性检查 ---
@@ -0,0 +1,534 @@
+# app/shm_state.py
+"""
+多 worker 部署 (uvicorn --workers N) 共享的 K 线 / 指标状态
+
+每个 worker 各存一份 StateStore 时，同一终端的请求落到不同 worker 上，状态既重复占内存、
+又互相看不到对方合并过的 K 线。这里把状态放进 multiprocessing.shared_memory:
+
+    {name}_dir      目录: 头部 + 槽位表 (account, symbol)
+    {name}_{槽位}   每个 (account, symbol) 一段: 头部 + M5 状态行 + 各高周期 K 线
+
+- 写: 每个槽位同一时刻只有一个写者 (进程内 threading.Lock + 锁文件上该槽位字节的 fcntl 记录锁)。
+  合并逻辑与本地存储相同 (state.merge_bars / TimeframeSeries.update)，只写回变化的行
+- 读: seqlock。写者开始前把序号加 1 (奇数)，写完再加 1 (偶数); 读者直接在共享内存的视图上
+  计算，结束后序号没变才算数，否则重试 (不复制整段历史)
+- 写者在写到一半时崩溃 (序号停在奇数): 下一个拿到写锁的进程把该槽位清空重来
+- 快照: 只有抢到 "快照" 锁的 worker 写文件; 创建共享内存的 worker 负责从快照恢复
+- 每个 worker 在锁文件上持有一个 "worker" 字节的记录锁 (进程退出 / 被杀时由内核释放);
+  close() 时没有其他进程持有 worker 字节 = 最后一个 worker，删除共享内存。
+  所有 worker 都异常退出时残留的段下次启动直接复用 (比快照新)
+
+依赖 POSIX (fcntl + /dev/shm)，Docker 里默认的 64MB /dev/shm 足够几十个品种。
+按 x86-64 的存储顺序实现 seqlock (NumPy 写入不带内存屏障)。
+"""
+import _posixshmem
+import fcntl
+import logging
+import os
+import struct
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from .indicators import BAR_COLUMNS, BarFrame
+from .resample import TIMEFRAME_SECONDS, TimeframeSeries
+from .state import STATE_COLUMNS, T, EMA, _fill_derived, merge_bars, read_snapshot, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+SHM_MAGIC = b"FXSM"
+SHM_FORMAT = 1
+# 目录头部: magic, 格式版本, 保留, 槽位数, 每段 M5 容量, 高周期秒数 x4, 保留 (旧版的连接计数，不再使用)
+_DIR_HEADER = struct.Struct("<4sHHII4II")
+_SLOT_ENTRY = struct.Struct("<q32s")
+MAX_TIMEFRAMES = 4
+# 槽位头部 (uint64 x 8): 序号, M5 行数, 待对账, 更新时间 (float64), 各高周期根数 x4
+_SEQ, _ROWS, _RECONCILE, _UPDATED, _TF0 = 0, 1, 2, 3, 4
+_SLOT_HEADER_WORDS = 8
+# 锁文件的字节: 0 = 目录 (分配槽位 / 连接与断开), 1 = 快照写入者, 2 + i = 槽位 i 的写者,
+# _WORKER_LOCK0 + j = 第 j 个存活的 worker (连接期间一直持有)
+_DIR_LOCK, _SNAPSHOT_LOCK, _SLOT_LOCK0 = 0, 1, 2
+_WORKER_LOCK0 = 1 << 20
+MAX_WORKERS = 256
+# 读者遇到写到一半的槽位时最多重试的次数 (之后检查写者是否已崩溃)
+READ_SPINS = 1000
+
+
+def _lock_dir():
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def remove_lock_file(name):
+    """所有 worker 都已退出后清理锁文件 (运行期间不能删: 新进程会锁到另一个文件上)"""
+    try:
+        os.remove(os.path.join(_lock_dir(), f"{name}.lock"))
+    except FileNotFoundError:
+        pass
+
+
+# 本进程持有的 worker 字节 (锁文件路径 -> {j}): fcntl 记录锁按进程计，同一进程内的探测看不到自己的锁
+_held_workers = {}
+_held_lock = threading.Lock()
+
+
+def _probe_free(fd, offset):
+    """没有任何进程持有该字节时返回 True (探测用的锁随即释放); 调用方保证本进程没有持有它"""
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, offset)
+    except OSError:
+        return False
+    fcntl.lockf(fd, fcntl.LOCK_UN, 1, offset)
+    return True
+
+
+def _open_segment(name, size=0):
+    """size > 0 时创建; 不登记到 resource_tracker (否则第一个退出的 worker 会把段删掉)"""
+    shm = shared_memory.SharedMemory(name=name, create=size > 0, size=size)
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+def _unlink(name):
+    # 不走 SharedMemory.unlink (它会再向 resource_tracker 注销一次)
+    try:
+        _posixshmem.shm_unlink(f"/{name}")
+    except FileNotFoundError:
+        pass
+
+
+class _FileLock:
+    """锁文件上的单字节 fcntl 记录锁 (进程级，进程退出时由内核释放)"""
+
+    def __init__(self, fd, offset):
+        self.fd = fd
+        self.offset = offset
+
+    def __enter__(self):
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, self.offset)
+
+    def __exit__(self, *exc):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, self.offset)
+
+
+class _SeriesLength:
+    """/state 展示用: 共享段里某个高周期当前的根数"""
+    __slots__ = ("state", "index")
+
+    def __init__(self, state, index):
+        self.state = state
+        self.index = index
+
+    def __len__(self):
+        return int(self.state._header[_TF0 + self.index])
+
+
+class SharedSymbolState:
+    """单个 (account, symbol) 的共享状态; 接口与 state.SymbolState 一致"""
+
+    def __init__(self, store, slot, account, symbol):
+        self.store = store
+        self.slot = slot
+        self.account = account
+        self.symbol = symbol
+        self.max_bars = store.max_bars
+        self._shm = _open_segment(store.segment_name(slot))
+        self._header, self._rows, self._tf = store.slot_views(self._shm.buf)
+        self.timeframes = {name: _SeriesLength(self, i) for i, name in enumerate(store.timeframes)}
+        self._thread_lock = threading.Lock()
+        self._file_lock = _FileLock(store.lock_fd, _SLOT_LOCK0 + slot)
+        # 可选计算步骤的结果 (见 app.budget; 每个 worker 各自一份)
+        self.cache = {}
+
+    # --------------------------------------------------------------
+    # 读 (seqlock，不加锁)
+    # --------------------------------------------------------------
+    def read(self, fn):
+        """
+        fn(M5 状态行视图, {高周期: K 线视图}) 在一致的数据上执行
+        视图直接指向共享内存: 只能在 fn 内使用，需要保留的结果请在 fn 里复制
+        """
+        header = self._header
+        spins = 0
+        while True:
+            seq = int(header[_SEQ])
+            if seq & 1:
+                spins += 1
+                if spins >= READ_SPINS:
+                    self._recover()
+                    spins = 0
+                time.sleep(0)
+                continue
+            rows = self._rows[:int(header[_ROWS])]
+            frames = {name: self._tf[i][:int(header[_TF0 + i])] for i, name in enumerate(self.store.timeframes)}
+            try:
+                result = fn(rows, frames)
+            except (IndexError, ValueError):
+                # 读到了被并发修改的数据 (例如行数与内容不一致)，按序号判断是否重试
+                if int(header[_SEQ]) == seq:
+                    raise
+                continue
+            if int(header[_SEQ]) == seq:
+                return result
+
+    def __len__(self):
+        return int(self._header[_ROWS])
+
+    @property
+    def rows(self):
+        return self.read(lambda rows, frames: rows.copy())
+
+    @property
+    def last_ema(self):
+        return self.read(lambda rows, frames: float(rows[-1, EMA]) if len(rows) else None)
+
+    @property
+    def last_time(self):
+        return self.read(lambda rows, frames: int(rows[-1, T]) if len(rows) else None)
+
+    @property
+    def updated_at(self):
+        return float(self._header[_UPDATED:_UPDATED + 1].view(np.float64)[0])
+
+    @property
+    def needs_reconcile(self):
+        return bool(self._header[_RECONCILE])
+
+    def timeframe(self, name, count=None):
+        """重采样的高周期 -> BarFrame (复制最后 count 根，离开 seqlock 后仍然有效)"""
+        return BarFrame.from_array(self.read(lambda rows, frames: frames[name][-count:].copy()
+                                             if count else frames[name].copy()))
+
+    # --------------------------------------------------------------
+    # 写 (每个槽位一个写者)
+    # --------------------------------------------------------------
+    def ingest(self, bars):
+        """合并请求中的 M5 (N, 7) 数组; 返回值同 SymbolState.ingest"""
+        if len(bars) == 0:
+            return "APPEND"
+        with self._thread_lock, self._file_lock:
+            header = self._header
+            if int(header[_SEQ]) & 1:
+                # 上一个写者写到一半崩溃: 内容不可信，清空
+                logger.warning(f"[STATE] {self.symbol}@{self.account}: torn shared slot {self.slot}, reset")
+                self._clear()
+                header[_SEQ] += 1
+            stored = self._rows[:int(header[_ROWS])]
+            result, rows, keep = merge_bars(stored, bars, self.max_bars)
+            if result == "STALE":
+                return result
+            header[_SEQ] += 1
+            try:
+                if rows is not None:
+                    self._write_rows(rows, keep)
+                header[_RECONCILE] = 0
+                header[_UPDATED:_UPDATED + 1].view(np.float64)[0] = time.time()
+            finally:
+                header[_SEQ] += 1
+        return result
+
+    def restore(self, rows):
+        """从快照恢复: 整段写入，标记为待对账"""
+        with self._thread_lock, self._file_lock:
+            rows = rows[-self.store.capacity:]
+            self._header[_SEQ] += 1 - (int(self._header[_SEQ]) & 1)
+            try:
+                self._write_rows(rows, 0)
+                self._header[_RECONCILE] = 1
+                self._header[_UPDATED:_UPDATED + 1].view(np.float64)[0] = time.time()
+            finally:
+                self._header[_SEQ] += 1
+
+    def _write_rows(self, rows, keep):
+        """调用方持有写锁且序号为奇数; rows[:keep] 与共享段中已有的内容相同"""
+        n = len(rows)
+        self._rows[keep:n] = rows[keep:]
+        self._header[_ROWS] = n
+        m5 = self._rows[:n, :len(BAR_COLUMNS)]
+        for i, name in enumerate(self.store.timeframes):
+            series = TimeframeSeries(TIMEFRAME_SECONDS[name])
+            series.bars = self._tf[i][:int(self._header[_TF0 + i])]
+            if keep == 0:
+                series.rebuild(m5)
+            else:
+                series.update(m5, keep)
+            self._tf[i][:len(series.bars)] = series.bars
+            self._header[_TF0 + i] = len(series.bars)
+
+    def _clear(self):
+        self._header[_ROWS] = 0
+        self._header[_TF0:_TF0 + MAX_TIMEFRAMES] = 0
+
+    def _recover(self):
+        """读者久等不到偶数序号: 拿写锁后若仍为奇数，说明写者已崩溃"""
+        with self._thread_lock, self._file_lock:
+            if int(self._header[_SEQ]) & 1:
+                logger.warning(f"[STATE] {self.symbol}@{self.account}: writer died mid-update "
+                               f"(slot {self.slot}), reset")
+                self._clear()
+                self._header[_SEQ] += 1
+
+    def close(self):
+        self._header = self._rows = self._tf = None
+        self._shm.close()
+
+
+class SharedStateStore:
+    """所有 (account, symbol) 的共享状态 + 快照读写; 接口与 state.StateStore 一致"""
+
+    def __init__(self, max_bars=4032, timeframes=("H1",), name="fxagent", slots=64):
+        if len(timeframes) > MAX_TIMEFRAMES:
+            raise ValueError(f"at most {MAX_TIMEFRAMES} resampled timeframes in shared memory")
+        self.max_bars = max_bars
+        self.timeframes = tuple(timeframes)
+        self.name = name
+        self.slots = slots
+        # merge_bars 保证行数不超过 max_bars * 1.25
+        self.capacity = int(max_bars * 1.25) + 1
+        self._states = {}
+        self._lock = threading.Lock()
+        self._saved_seq = {}
+        self._snapshot_leader = False
+        self.stats = {"backend": "shm", "pid": os.getpid(), "restored": 0, "reconciled": 0, "reset": 0,
+                      "snapshots": 0, "last_snapshot_ms": None, "slots": slots, "full": 0}
+
+        self.lock_path = os.path.join(_lock_dir(), f"{name}.lock")
+        self.lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        with _FileLock(self.lock_fd, _DIR_LOCK):
+            self.created = self._attach()
+            self._worker = self._register_worker()
+
+    # --------------------------------------------------------------
+    # 布局
+    # --------------------------------------------------------------
+    def segment_name(self, slot):
+        return f"{self.name}_{slot}"
+
+    def _layout(self):
+        seconds = [TIMEFRAME_SECONDS[tf] for tf in self.timeframes] + [0] * (MAX_TIMEFRAMES - len(self.timeframes))
+        return self.slots, self.capacity, *seconds
+
+    def _slot_size(self):
+        words = _SLOT_HEADER_WORDS + self.capacity * len(STATE_COLUMNS) \
+            + len(self.timeframes) * self.capacity * len(BAR_COLUMNS)
+        return words * 8
+
+    def slot_views(self, buf):
+        """槽位段 -> (头部 uint64[8], M5 状态行 (容量, 9), [各高周期 (容量, 7)])"""
+        header = np.ndarray((_SLOT_HEADER_WORDS,), dtype=np.uint64, buffer=buf)
+        offset = _SLOT_HEADER_WORDS * 8
+        rows = np.ndarray((self.capacity, len(STATE_COLUMNS)), dtype=np.float64, buffer=buf, offset=offset)
+        offset += rows.nbytes
+        frames = []
+        for _ in self.timeframes:
+            frame = np.ndarray((self.capacity, len(BAR_COLUMNS)), dtype=np.float64, buffer=buf, offset=offset)
+            offset += frame.nbytes
+            frames.append(frame)
+        return header, rows, frames
+
+    def _attach(self):
+        """连接 (或创建) 目录段; 调用方持有目录锁。返回是否新建"""
+        dir_name = f"{self.name}_dir"
+        size = _DIR_HEADER.size + self.slots * _SLOT_ENTRY.size
+        try:
+            self._dir = _open_segment(dir_name)
+            magic, fmt, _, *layout, _ = _DIR_HEADER.unpack_from(self._dir.buf, 0)
+            if magic == SHM_MAGIC and fmt == SHM_FORMAT and tuple(layout) == self._layout():
+                return False
+            # 残留的旧布局 (配置改过): 删除后重建
+            logger.warning(f"[STATE] Shared memory {dir_name} has a different layout, recreating")
+            old_slots = layout[0] if magic == SHM_MAGIC else 0
+            self._dir.close()
+            for slot in range(old_slots):
+                _unlink(self.segment_name(slot))
+            _unlink(dir_name)
+        except FileNotFoundError:
+            pass
+        self._dir = _open_segment(dir_name, size)
+        self._dir.buf[:size] = bytes(size)
+        _DIR_HEADER.pack_into(self._dir.buf, 0, SHM_MAGIC, SHM_FORMAT, 0, *self._layout(), 0)
+        return True
+
+    def _register_worker(self):
+        """占用一个空闲的 worker 字节并一直持有 (调用方持有目录锁); 返回其编号"""
+        with _held_lock:
+            held = _held_workers.setdefault(self.lock_path, set())
+            for j in range(MAX_WORKERS):
+                if j in held:
+                    continue
+                try:
+                    fcntl.lockf(self.lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, _WORKER_LOCK0 + j)
+                except OSError:
+                    continue
+                held.add(j)
+                return j
+        raise RuntimeError(f"more than {MAX_WORKERS} workers attached to shared state {self.name}")
+
+    def _other_workers_alive(self):
+        """除自己以外是否还有存活的 worker (调用方持有目录锁; 被杀的进程的锁已由内核释放)"""
+        with _held_lock:
+            held = _held_workers.get(self.lock_path, set())
+            if held - {self._worker}:
+                return True
+            return any(not _probe_free(self.lock_fd, _WORKER_LOCK0 + j) for j in range(MAX_WORKERS) if j not in held)
+
+    def _entry(self, slot):
+        account, raw = _SLOT_ENTRY.unpack_from(self._dir.buf, _DIR_HEADER.size + slot * _SLOT_ENTRY.size)
+        symbol = raw.rstrip(b"\0").decode("utf-8")
+        return (account, symbol) if symbol else None
+
+    def _scan(self):
+        return {key: slot for slot in range(self.slots) if (key := self._entry(slot)) is not None}
+
+    def _scan_locked(self):
+        """持目录锁读取槽位表 (不会读到 _allocate 写到一半的目录项); 调用方不能已持有目录锁"""
+        with self._lock, _FileLock(self.lock_fd, _DIR_LOCK):
+            return self._scan()
+
+    # --------------------------------------------------------------
+    # 槽位
+    # --------------------------------------------------------------
+    def _state(self, key, create):
+        state = self._states.get(key)
+        if state is not None:
+            return state
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None:
+                return state
+            slot = self._scan().get(key)
+            if slot is None:
+                if not create:
+                    return None
+                slot = self._allocate(key)
+                if slot is None:
+                    return None
+            state = self._states[key] = SharedSymbolState(self, slot, *key)
+            return state
+
+    def _allocate(self, key):
+        """在目录锁内分配槽位; 先建好并清零数据段，最后才写目录项 (其他 worker 看到时已可用)"""
+        name = key[1].encode("utf-8")
+        if not name or len(name) > 32:
+            raise ValueError(f"symbol must be 1-32 bytes in shared memory, got {key[1]!r}")
+        with _FileLock(self.lock_fd, _DIR_LOCK):
+            used = self._scan()
+            if key in used:
+                return used[key]
+            free = sorted(set(range(self.slots)) - set(used.values()))
+            if not free:
+                self.stats["full"] += 1
+                logger.error(f"[STATE] Shared memory full ({self.slots} slots), {key[1]}@{key[0]} runs without state")
+                return None
+            slot = free[0]
+            _unlink(self.segment_name(slot))
+            shm = _open_segment(self.segment_name(slot), self._slot_size())
+            shm.buf[:_SLOT_HEADER_WORDS * 8] = bytes(_SLOT_HEADER_WORDS * 8)
+            shm.close()
+            _SLOT_ENTRY.pack_into(self._dir.buf, _DIR_HEADER.size + slot * _SLOT_ENTRY.size, int(key[0]), name)
+            return slot
+
+    def get(self, account, symbol):
+        return self._state((account, symbol), create=False)
+
+    def keys(self):
+        return list(self._scan_locked())
+
+    def ingest(self, account, symbol, bars):
+        """合并请求中的 M5; 槽位用完时返回 None (本次请求退回只用请求里的 K 线)"""
+        state = self._state((account, symbol), create=True)
+        if state is None:
+            return None
+        reconciling = state.needs_reconcile
+        result = state.ingest(bars)
+        if reconciling:
+            with self._lock:
+                self.stats["reset" if result == "RESET" else "reconciled"] += 1
+            logger.info(f"[STATE] {symbol}@{account}: restored state {'reset (no overlap)' if result == 'RESET' else 'reconciled'}")
+        return state
+
+    # --------------------------------------------------------------
+    # 快照
+    # --------------------------------------------------------------
+    def _is_snapshot_leader(self):
+        """第一个抢到快照锁的 worker 一直持有它 (进程退出时内核释放，其他 worker 接替)"""
+        if not self._snapshot_leader:
+            try:
+                fcntl.lockf(self.lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, _SNAPSHOT_LOCK)
+                self._snapshot_leader = True
+            except OSError:
+                pass
+        return self._snapshot_leader
+
+    def save_snapshot(self, path, config_version, force=False):
+        """只有快照写入者执行; 各槽位按 seqlock 复制一份一致的状态行，没有变化时跳过"""
+        if not self._is_snapshot_leader():
+            return False
+        keys = self._scan_locked()
+        seqs = {}
+        for key in keys:
+            state = self._state(key, create=False)
+            if state is not None:
+                seqs[key] = int(state._header[_SEQ])
+        if not force and seqs == self._saved_seq:
+            return False
+        t0 = time.perf_counter()
+        items = [(account, symbol, self._states[(account, symbol)].rows) for account, symbol in seqs]
+        write_snapshot(path, config_version, items)
+        self._saved_seq = seqs
+
+        with self._lock:
+            self.stats["snapshots"] += 1
+            self.stats["last_snapshot_ms"] = round((time.perf_counter() - t0) * 1000.0, 2)
+        return True
+
+    def load_snapshot(self, path, config_version):
+        """只有新建共享内存的 worker 从快照恢复 (其余 worker 连接时状态已在共享内存里)"""
+        if not self.created:
+            logger.info(f"[STATE] Attached to shared state {self.name} ({len(self.keys())} symbols)")
+            return 0
+        t0 = time.perf_counter()
+        loaded = read_snapshot(path)
+        if loaded is None:
+            return 0
+        entries, snap_version = loaded
+        same_config = snap_version == config_version
+        restored = 0
+        for account, symbol, rows in entries:
+            state = self._state((account, symbol), create=True)
+            if state is None:
+                continue
+            if not same_config:
+                _fill_derived(rows, 0)
+            state.restore(rows)
+            restored += 1
+        self._saved_seq = {key: int(self._states[key]._header[_SEQ]) for key in self._states}
+        with self._lock:
+            self.stats["restored"] = restored
+        logger.info(f"[STATE] Restored {restored} symbol states into shared memory from {path} in "
+                    f"{(time.perf_counter() - t0) * 1000.0:.1f}ms (config {snap_version}"
+                    f"{'' if same_config else ' != current, derived columns recomputed'})")
+        return restored
+
+    def close(self):
+        """断开共享内存; 最后一个断开的 worker 删除所有段"""
+        with self._lock:
+            for state in self._states.values():
+                state.close()
+            self._states.clear()
+        with _FileLock(self.lock_fd, _DIR_LOCK):
+            last = not self._other_workers_alive()
+            self._dir.close()
+            if last:
+                for slot in range(self.slots):
+                    _unlink(self.segment_name(slot))
+                _unlink(f"{self.name}_dir")
+            fcntl.lockf(self.lock_fd, fcntl.LOCK_UN, 1, _WORKER_LOCK0 + self._worker)
+            with _held_lock:
+                _held_workers[self.lock_path].discard(self._worker)
+        os.close(self.lock_fd)
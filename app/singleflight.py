@@ -0,0 +1,142 @@
+# app/singleflight.py
+"""
+同一终端的 /signal 串行化 (single-flight)
+
+一次慢响应接近 EA 的 5 秒 WebRequest 超时时，下一个 OnTick 会在第一次请求还在跑的时候再发一次:
+两个请求各自跑完整条流水线，可能给出互相矛盾的 PLACE_* / MODIFY_SL，而且到达 EA 的先后不确定。
+现在按 (account, symbol) 串行:
+- 同一时刻每个终端只有一个请求在分析 (状态合并、意图记录、持仓动作都按到达顺序发生)
+- 新请求与在跑的请求输入指纹相同 (EA 重发的同一份数据): 不再计算，直接等在跑的结果 (attached)
+- 指纹不同: 在跑的请求被取消 (Budget.cancel，在下一个检查点返回 HOLD(SUPERSEDED)，不再下发交易指令)，
+  新请求排队等它退出后执行; 排队中又来了更新的请求，旧的排队请求直接放弃 (dropped)
+- 排队深度、attached / superseded / dropped 次数见 GET /inflight
+指纹 = 请求内容的哈希 (server_time 按分钟取整，同一分钟内只差几秒的重发视为同一份)。
+只在进程内串行: 多 worker 时同一终端的请求落到不同 worker 仍可能并发 (与延迟预算缓存相同)。
+"""
+import collections
+import hashlib
+import threading
+
+# 指纹中 server_time 的粒度 (秒)
+FINGERPRINT_TIME_GRANULARITY = 60
+
+
+def fingerprint(data):
+    """请求输入的指纹: 除 server_time (按分钟取整) 外逐字段相同才相同"""
+    payload = data.model_dump_json(exclude={"server_time"})
+    minute = data.server_time // FINGERPRINT_TIME_GRANULARITY
+    return hashlib.blake2b(f"{minute}|{payload}".encode("utf-8"), digest_size=16).digest()
+
+
+class _Call:
+    __slots__ = ("fingerprint", "budget", "done", "response", "error", "superseded")
+
+    def __init__(self, fp):
+        self.fingerprint = fp
+        self.budget = None          # 执行方建好 Budget 后登记，取消时通过它通知流水线
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+        self.superseded = False
+
+
+class _Lane:
+    __slots__ = ("running", "seq", "waiting")
+
+    def __init__(self):
+        self.running = None         # 正在执行的 _Call
+        self.seq = 0                # 最新到达的排队请求序号 (只有最新的会执行)
+        self.waiting = 0
+
+
+class SingleFlight:
+    """按 (account, symbol) 串行执行 fn(data, call)，并统计合并 / 取代的次数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._lanes = {}
+        self.counts = collections.Counter()
+        self.max_depth = 0
+
+    def run(self, data, fn, superseded):
+        """
+        fn(data, call): 实际的分析; 建好 Budget 后调用 attach_budget(call, budget) 以便被取消
+        superseded(): 被更新的请求取代时返回的响应 (排队中放弃、或执行中被取消)
+        """
+        key = (data.account_login, data.symbol)
+        fp = fingerprint(data)
+        with self._lock:
+            self.counts["requests"] += 1
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = self._lanes[key] = _Lane()
+            running = lane.running
+            if running is not None and running.fingerprint == fp and not running.superseded:
+                self.counts["attached"] += 1
+                attached = running
+            else:
+                attached = None
+                if running is not None and not running.superseded:
+                    running.superseded = True
+                    if running.budget is not None:
+                        running.budget.cancel()
+                    self.counts["superseded"] += 1
+                lane.seq += 1
+                seq = lane.seq
+                # 唤醒更早的排队请求，让它们立即放弃
+                self._idle.notify_all()
+                lane.waiting += 1
+                self.max_depth = max(self.max_depth, lane.waiting)
+                while lane.running is not None and lane.seq == seq:
+                    self._idle.wait()
+                lane.waiting -= 1
+                if lane.seq != seq:
+                    # 排队期间来了更新的请求: 本请求的结果已经过时，不再执行
+                    self.counts["dropped"] += 1
+                    self._release(key, lane)
+                    return superseded()
+                call = lane.running = _Call(fp)
+
+        if attached is not None:
+            attached.done.wait()
+            if attached.error is not None:
+                raise attached.error
+            return superseded() if attached.superseded else attached.response.model_copy()
+
+        try:
+            call.response = fn(data, call)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                lane.running = None
+                self._release(key, lane)
+                self._idle.notify_all()
+            call.done.set()
+        return superseded() if call.superseded else call.response
+
+    @staticmethod
+    def attach_budget(call, budget):
+        """执行方登记本请求的 Budget; 登记前已被取代的立即取消"""
+        call.budget = budget
+        if call.superseded:
+            budget.cancel()
+
+    def _release(self, key, lane):
+        # 空闲且无人排队的终端不保留记录
+        if lane.running is None and lane.waiting == 0 and self._lanes.get(key) is lane:
+            del self._lanes[key]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counts": dict(self.counts), "max_queue_depth": self.max_depth,
+                "queue_depth": sum(lane.waiting for lane in self._lanes.values()),
+                "in_flight": [{"account": a, "symbol": s, "waiting": lane.waiting}
+                              for (a, s), lane in self._lanes.items() if lane.running is not None],
+            }
+
+
+single_flight = SingleFlight()
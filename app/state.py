@@ -0,0 +1,342 @@
+# app/state.py
+"""
+按 (account, symbol) 保存的分析状态 (更长的 M5 历史 + 已收敛的 EMA / TR + 从 M5 重采样的高周期)
+
+每次 /signal 把请求里的 110 根 M5 合并进来，只重算发生变化的那几根
+(高周期只重算当前未收盘的那一根，见 app.resample)。
+定期 / 关机时写入紧凑的二进制快照，启动时读回，首个请求到来时用请求里的
+K 线对账: 重叠部分以请求为准，没有重叠 (停机太久) 则丢弃旧状态。
+
+快照格式 (little-endian):
+    header  <4sHH12sdI   magic, 格式版本, 保留, config 版本, 写入时间, 条目数
+    entry   <qH          account, symbol 字节长度
+            symbol       utf-8
+            <II          行数, 列数
+            float64[]    行 × 列 (列顺序见 STATE_COLUMNS)
+    footer  <I           以上全部内容的 CRC32
+"""
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from .indicators import BAR_COLUMNS, BarFrame
+from .resample import TIMEFRAME_SECONDS, TimeframeSeries
+
+logger = logging.getLogger(__name__)
+
+STATE_COLUMNS = BAR_COLUMNS + ("tr", "ema20")
+T, O, H, L, C, V, S, TR, EMA = range(len(STATE_COLUMNS))
+
+EMA_SPAN = 20
+BAR_SECONDS = 300
+_ALPHA = 1.0 / (1.0 + (EMA_SPAN - 1) / 2.0)
+
+SNAPSHOT_MAGIC = b"FXST"
+SNAPSHOT_FORMAT = 1
+_HEADER = struct.Struct("<4sHH12sdI")
+_ENTRY = struct.Struct("<qH")
+_SHAPE = struct.Struct("<II")
+_FOOTER = struct.Struct("<I")
+
+
+def _fill_derived(rows, start):
+    """从 start 行开始递推 TR 与 EMA20 (与 indicators.ema 同样的递推顺序)"""
+    old_wt = 1.0 - _ALPHA
+    for i in range(start, len(rows)):
+        high, low, close = rows[i, H], rows[i, L], rows[i, C]
+        if i == 0:
+            rows[i, TR] = high - low
+            rows[i, EMA] = close
+            continue
+        prev_close = rows[i - 1, C]
+        rows[i, TR] = max(high - low, abs(high - prev_close), abs(low - prev_close))
+        weighted = rows[i - 1, EMA]
+        if weighted != close:
+            weighted = ((old_wt * weighted) + (_ALPHA * close)) / (old_wt + _ALPHA)
+        rows[i, EMA] = weighted
+
+
+def merge_bars(stored, bars, max_bars):
+    """
+    把请求中的 M5 (N, 7) 数组 (按时间升序) 合并进已有的状态行 stored
+    返回 (结果, 新的状态行或 None (没有变化), 第一根重算的行)
+    结果: "APPEND" / "RESET" (与已有历史没有重叠，只能从请求重新开始)
+          / "STALE" (请求比已有历史还旧，例如乱序到达，忽略)
+    """
+    result = "APPEND"
+    if len(stored) > 0 and bars[-1, T] < stored[-1, T]:
+        return "STALE", None, len(stored)
+
+    if len(stored) == 0 or bars[0, T] > stored[-1, T] + BAR_SECONDS:
+        # 没有重叠: 停机时间超过一个请求窗口，旧状态无法对账
+        if len(stored) > 0:
+            result = "RESET"
+        keep = 0
+        new_rows = np.empty((len(bars), len(STATE_COLUMNS)))
+        new_rows[:, :len(BAR_COLUMNS)] = bars
+    else:
+        # 重叠部分以请求为准; 只从第一根发生变化的 K 线开始重算
+        keep = int(np.searchsorted(stored[:, T], bars[0, T], side="left"))
+        overlap = min(len(stored) - keep, len(bars))
+        same = np.all(stored[keep:keep + overlap, :len(BAR_COLUMNS)] == bars[:overlap], axis=1)
+        changed = np.flatnonzero(~same)
+        first_changed = int(changed[0]) if len(changed) else overlap
+        if first_changed == overlap == len(bars) and keep + overlap == len(stored):
+            return result, None, len(stored)
+        new_rows = np.empty((len(bars) - first_changed, len(STATE_COLUMNS)))
+        new_rows[:, :len(BAR_COLUMNS)] = bars[first_changed:]
+        keep += first_changed
+
+    rows = np.concatenate((stored[:keep], new_rows)) if keep else new_rows
+    _fill_derived(rows, keep)
+
+    # 超出容量时一次性裁掉多余部分 (留 25% 余量，避免每根 K 线都复制)
+    if len(rows) > max_bars * 1.25:
+        rows = rows[-max_bars:].copy()
+        keep = 0
+    return result, rows, keep
+
+
+class SymbolState:
+    """单个 (account, symbol) 的 K 线历史、增量指标与重采样的高周期"""
+
+    def __init__(self, account, symbol, rows=None, max_bars=4032, timeframes=("H1",)):
+        self.account = account
+        self.symbol = symbol
+        self.max_bars = max_bars
+        self.rows = rows if rows is not None else np.empty((0, len(STATE_COLUMNS)))
+        self.timeframes = {name: TimeframeSeries(TIMEFRAME_SECONDS[name]) for name in timeframes}
+        for series in self.timeframes.values():
+            series.rebuild(self.rows[:, :len(BAR_COLUMNS)])
+        # 可选计算步骤的结果 (延迟预算不足时复用同一输入的结果，见 app.budget; 不写入快照)
+        self.cache = {}
+        # 从快照恢复后，首个请求需要对账
+        self.needs_reconcile = rows is not None and len(rows) > 0
+        self.updated_at = time.time()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def ingest(self, bars):
+        """
+        合并请求中的 M5 (N, 7) 数组 (按时间升序)
+        返回 "APPEND" / "RESET" (与已有历史没有重叠，只能从请求重新开始)
+             / "STALE" (请求比已有历史还旧，例如乱序到达，忽略)
+        """
+        if len(bars) == 0:
+            return "APPEND"
+        result, rows, keep = merge_bars(self.rows, bars, self.max_bars)
+        if result == "STALE":
+            return result
+        if rows is not None:
+            self.rows = rows
+            for series in self.timeframes.values():
+                series.update(rows[:, :len(BAR_COLUMNS)], keep)
+        self.needs_reconcile = False
+        self.updated_at = time.time()
+        return result
+
+    @property
+    def last_ema(self):
+        return float(self.rows[-1, EMA]) if len(self.rows) else None
+
+    @property
+    def last_time(self):
+        return int(self.rows[-1, T]) if len(self.rows) else None
+
+    def timeframe(self, name, count=None):
+        """重采样的高周期 -> BarFrame (最后一根是正在形成的 K 线); count 取最后若干根"""
+        bars = self.timeframes[name].bars
+        return BarFrame.from_array(bars[-count:] if count else bars)
+
+
+class StateStore:
+    """所有 (account, symbol) 状态 + 快照读写"""
+
+    def __init__(self, max_bars=4032, timeframes=("H1",)):
+        self.max_bars = max_bars
+        self.timeframes = tuple(timeframes)
+        self._states = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.stats = {"restored": 0, "reconciled": 0, "reset": 0, "snapshots": 0, "last_snapshot_ms": None}
+
+    def get(self, account, symbol):
+        return self._states.get((account, symbol))
+
+    def keys(self):
+        return list(self._states)
+
+    def ingest(self, account, symbol, bars):
+        key = (account, symbol)
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                state = self._states[key] = SymbolState(account, symbol, max_bars=self.max_bars,
+                                                                timeframes=self.timeframes)
+            reconciling = state.needs_reconcile
+            result = state.ingest(bars)
+            self._dirty = True
+            if reconciling:
+                self.stats["reset" if result == "RESET" else "reconciled"] += 1
+        if reconciling:
+            logger.info(f"[STATE] {symbol}@{account}: restored state {'reset (no overlap)' if result == 'RESET' else 'reconciled'}")
+        return state
+
+    # --------------------------------------------------------------
+    # 快照
+    # --------------------------------------------------------------
+    def save_snapshot(self, path, config_version, force=False):
+        """原子写入 (先写临时文件再 rename)，没有变化时跳过"""
+        if not (self._dirty or force):
+            return False
+        t0 = time.perf_counter()
+        with self._lock:
+            items = [(s.account, s.symbol, s.rows.copy()) for s in self._states.values()]
+            self._dirty = False
+        try:
+            write_snapshot(path, config_version, items)
+        except OSError:
+            # 写入失败: 保留"有变化"标记，下一次再写
+            self._dirty = True
+            raise
+
+        with self._lock:
+            self.stats["snapshots"] += 1
+            self.stats["last_snapshot_ms"] = round((time.perf_counter() - t0) * 1000.0, 2)
+        return True
+
+    def load_snapshot(self, path, config_version):
+        """
+        读回快照; 校验失败时忽略整个文件 (宁可冷启动也不用坏数据)
+        config 版本不同: K 线保留，派生指标 (TR/EMA) 按当前代码重新计算
+        返回恢复的条目数
+        """
+        t0 = time.perf_counter()
+        loaded = read_snapshot(path)
+        if loaded is None:
+            return 0
+        entries, snap_version = loaded
+
+        same_config = snap_version == config_version
+        with self._lock:
+            for account, symbol, rows in entries:
+                if not same_config:
+                    _fill_derived(rows, 0)
+                self._states[(account, symbol)] = SymbolState(account, symbol, rows, self.max_bars, self.timeframes)
+            self._dirty = False
+            self.stats["restored"] = len(entries)
+        logger.info(f"[STATE] Restored {len(entries)} symbol states from {path} in "
+                    f"{(time.perf_counter() - t0) * 1000.0:.1f}ms (config {snap_version}"
+                    f"{'' if same_config else ' != current, derived columns recomputed'})")
+        return len(entries)
+
+    def close(self):
+        """关机时调用 (本地存储没有需要释放的资源)"""
+
+
+def write_snapshot(path, config_version, items):
+    """items: [(account, symbol, 状态行)]; 原子写入 (先写临时文件再 rename)"""
+    parts = [_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, 0, config_version.encode("ascii")[:12].ljust(12, b"\0"),
+                          time.time(), len(items))]
+    for account, symbol, rows in items:
+        name = symbol.encode("utf-8")
+        parts.append(_ENTRY.pack(int(account), len(name)))
+        parts.append(name)
+        parts.append(_SHAPE.pack(rows.shape[0], rows.shape[1]))
+        parts.append(np.ascontiguousarray(rows, dtype="<f8").tobytes())
+    body = b"".join(parts)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(body)
+        f.write(_FOOTER.pack(zlib.crc32(body)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_snapshot(path):
+    """返回 ([(account, symbol, 状态行)], config 版本); 文件不存在或校验失败时返回 None"""
+    try:
+        with open(path, "rb") as f:
+            blob = f.read()
+    except OSError:
+        return None
+    try:
+        return _parse_snapshot(blob)
+    except ValueError as e:
+        logger.error(f"[STATE] Snapshot {path} rejected: {e}")
+        return None
+
+
+def _parse_snapshot(blob):
+    if len(blob) < _HEADER.size + _FOOTER.size:
+        raise ValueError("file too short")
+    body, footer = blob[:-_FOOTER.size], blob[-_FOOTER.size:]
+    if zlib.crc32(body) != _FOOTER.unpack(footer)[0]:
+        raise ValueError("CRC mismatch")
+    magic, fmt, _, version, _, count = _HEADER.unpack_from(body, 0)
+    if magic != SNAPSHOT_MAGIC or fmt != SNAPSHOT_FORMAT:
+        raise ValueError(f"unsupported snapshot format {magic!r}/{fmt}")
+
+    offset = _HEADER.size
+    entries = []
+    for _ in range(count):
+        account, name_len = _ENTRY.unpack_from(body, offset)
+        offset += _ENTRY.size
+        symbol = body[offset:offset + name_len].decode("utf-8")
+        offset += name_len
+        n_rows, n_cols = _SHAPE.unpack_from(body, offset)
+        offset += _SHAPE.size
+        if n_cols != len(STATE_COLUMNS):
+            raise ValueError(f"{symbol}: expected {len(STATE_COLUMNS)} columns, got {n_cols}")
+        size = n_rows * n_cols * 8
+        rows = np.frombuffer(body, dtype="<f8", count=n_rows * n_cols, offset=offset).reshape(n_rows, n_cols).copy()
+        offset += size
+        entries.append((account, symbol, rows))
+    if offset != len(body):
+        raise ValueError("trailing bytes after last entry")
+    return entries, version.rstrip(b"\0").decode("ascii")
+
+
+class SnapshotWriter:
+    """后台线程: 每 interval 秒写一次快照 (有变化时)"""
+
+    def __init__(self, store, path, interval, version_fn):
+        self.store = store
+        self.path = path
+        self.interval = interval
+        self.version_fn = version_fn
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, name="state-snapshot", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.store.save_snapshot(self.path, self.version_fn())
+            except OSError as e:
+                logger.error(f"[STATE] Periodic snapshot failed: {e}")
+
+    def stop(self):
+        """停止后台线程并写最后一次快照"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        try:
+            self.store.save_snapshot(self.path, self.version_fn())
+        except OSError as e:
+            # 磁盘满 / 只读: 记录后照常关机 (不让异常打断 lifespan 的其余清理)
+            logger.error(f"[STATE] Final snapshot failed: {e}")
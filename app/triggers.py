@@ -0,0 +1,85 @@
+# app/triggers.py
+"""
+价格触发表: 两次轮询之间由 EA 在每个 tick 上本地执行的反应
+
+5 秒一次的轮询之间，价格突破信号 K 线、浮盈越过减仓 / 移动止损阈值都要等下一次往返才被发现。
+服务端在每个响应里附带一张触发表 (按本次的 ATR / 阶段 / 持仓算好的价格水平)，有效到本根 M5 收盘:
+    BID > 2012.35 -> MODIFY_SL 到 2008.10 (ticket 123)
+EA 每个 tick 检查，满足即执行，并尽快发起下一次请求由服务端重新决策 (服务端仍是唯一的决策方)。
+
+紧凑的文本格式 (EA 的简易 JSON 解析只能取字符串字段):
+    行之间用 ";" 分隔，每行 "组,价格,比较,水平,动作,ticket,sl,lot"
+    价格 B = bid / A = ask; 比较 ">" / "<" (严格); 动作 MODIFY_SL / CLOSE_PARTIAL / POLL
+    同一组按优先顺序排列，只执行第一条满足的 (例如移动止损的几档取最远的一档)
+
+与 main._analyze 的规则一一对应:
+- CLOSE_PARTIAL: 手数 >= 0.02、未减过仓的持仓，价格偏离开仓价超过 PARTIAL_CLOSE_ATR (两个方向，与服务端相同)
+- MODIFY_SL: 按阶段的移动止损 (浮盈超过启动阈值且新止损比旧止损好 TRAIL_MIN_STEP 以上)，
+  给出 TRIGGER_TRAIL_LEVELS 档，每档止损 = 触发价 -/+ 止损距离
+- POLL: 空仓 HOLD 时价格越过信号 K 线的 entry 水平 (高点 + tick buffer / 低点 - tick buffer)，立即重新请求
+本次已下发动作的持仓、被 L0 拦截的请求不下发触发。
+"""
+from .polling import M5_SECONDS, trail_params
+
+POSITION_ACTIONS = ("MODIFY_SL", "CLOSE_PARTIAL", "CLOSE_POS")
+
+
+def _row(group, side, op, level, action, ticket=0, sl=0.0, lot=0.0):
+    return f"{group},{side},{op},{level:.5f},{action},{ticket},{sl:.5f},{lot:.2f}"
+
+
+def _trail_rows(group, pos, atr, stage, cfg):
+    start_atr, dist_atr = trail_params(stage, cfg)
+    start, dist = atr * start_atr, atr * dist_atr
+    step = atr * cfg.TRIGGER_TRAIL_STEP_ATR
+    rows = []
+    if pos.type == "BUY":
+        # 浮盈 > start 且 (bid - dist) > 旧止损 + TRAIL_MIN_STEP
+        first = max(pos.open_price + start, pos.sl + cfg.TRAIL_MIN_STEP + dist)
+        for k in reversed(range(cfg.TRIGGER_TRAIL_LEVELS)):
+            level = first + k * step
+            rows.append(_row(group, "B", ">", level, "MODIFY_SL", pos.ticket, sl=level - dist))
+    elif pos.type == "SELL":
+        first = pos.open_price - start
+        if pos.sl != 0:
+            first = min(first, pos.sl - cfg.TRAIL_MIN_STEP - dist)
+        for k in reversed(range(cfg.TRIGGER_TRAIL_LEVELS)):
+            level = first - k * step
+            rows.append(_row(group, "A", "<", level, "MODIFY_SL", pos.ticket, sl=level + dist))
+    return rows
+
+
+def build_triggers(data, response, cfg, atr=None, stage=None):
+    """返回 (触发表文本, 有效期截止的服务器时间戳); 没有可下发的触发时为 ("", 0)"""
+    if atr is None or not data.m5_candles or response.reason.startswith("RISK:"):
+        return "", 0
+    acted = response.ticket if response.action in POSITION_ACTIONS else None
+    rows = []
+    group = 0
+    for pos in data.current_positions:
+        if pos.ticket == acted:
+            continue
+        side = "B" if pos.type == "BUY" else "A"
+        if pos.volume >= 0.02 and "PARTIAL" not in pos.comment:
+            threshold = atr * cfg.PARTIAL_CLOSE_ATR
+            rows.append(_row(group, side, ">", pos.open_price + threshold, "CLOSE_PARTIAL", pos.ticket,
+                             lot=cfg.PARTIAL_CLOSE_LOT))
+            rows.append(_row(group, side, "<", pos.open_price - threshold, "CLOSE_PARTIAL", pos.ticket,
+                             lot=cfg.PARTIAL_CLOSE_LOT))
+            group += 1
+        # 移动止损依赖阶段 (L3 之前提前返回时没有)
+        if stage is not None and cfg.TRIGGER_TRAIL_LEVELS > 0:
+            trail = _trail_rows(group, pos, atr, stage, cfg)
+            if trail:
+                rows.extend(trail)
+                group += 1
+
+    if response.action == "HOLD" and stage is not None and not data.current_positions:
+        bar = data.m5_candles[-1]
+        tick_buffer = max(cfg.MIN_TICK_SIZE, atr * 0.05)
+        rows.append(_row(group, "A", ">", bar.high + tick_buffer, "POLL"))
+        rows.append(_row(group, "B", "<", bar.low - tick_buffer, "POLL"))
+
+    if not rows:
+        return "", 0
+    return ";".join(rows), data.m5_candles[-1].time + M5_SECONDS
@@ -0,0 +1,56 @@
+# app/warmup.py
+"""
+启动预热: 在端口开始接收请求前，用一份合成行情把整条流水线跑一遍
+(Pydantic 校验、NumPy 指标、L0-L5、响应序列化)，让 MT5 的第一笔真实请求不用付冷启动成本。
+"""
+import math
+import time
+
+from .schemas import MarketData, SignalResponse
+
+WARMUP_SYMBOL = "WARMUP"
+
+
+def synthetic_payload(n_m5=110, n_h1=50, start=1_700_000_000):
+    """确定性的合成行情 (正弦 + 趋势)，字段与 EA 发送的一致; 参数保证能走到 L5"""
+    def bars(n, step, amp):
+        out = []
+        price = 2000.0
+        for i in range(n):
+            o = price
+            c = o + amp * math.sin(i / 11.0) - 0.1 * amp
+            out.append({
+                "time": start + i * step, "open": round(o, 2),
+                "high": round(max(o, c) + amp * 0.3, 2), "low": round(min(o, c) - amp * 0.3, 2),
+                "close": round(c, 2), "tick_vol": 100 + i, "spread": 200,
+            })
+            price = c
+        return out
+
+    m5 = bars(n_m5, 300, 1.5)
+    return {
+        "symbol": WARMUP_SYMBOL,
+        # 12:00 服务器时间 -> 北京 18:00，避开禁止交易时段，保证 L1-L5 都会执行
+        "server_time_hour": 12, "server_time_minute": 0,
+        "bid": m5[-1]["close"], "ask": m5[-1]["close"] + 0.2, "spread": 200,
+        "account_equity": 1000.0, "margin_level": 0.0,
+        "m5_candles": m5, "h1_candles": bars(n_h1, 3600, 4.0),
+        "news_info": {"has_news": False, "impact_level": 0, "minutes_to_news": 999, "event_name": "None"},
+        "current_positions": [],
+    }
+
+
+def run_warmup(analyze, cfg, rounds=2):
+    """
+    analyze: (MarketData, cfg) -> SignalResponse
+    返回每轮耗时 (毫秒)，第一轮即冷启动延迟
+    """
+    payload = synthetic_payload()
+    timings = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        data = MarketData(**payload)
+        response = analyze(data, cfg)
+        SignalResponse.model_validate(response).model_dump_json()
+        timings.append((time.perf_counter() - t0) * 1000.0)
+    return timings
@@ -0,0 +1,78 @@
+# tools/alloc_bench.py
+"""
+按阶段的内存分配基准 (进程内，不经过 HTTP)
+
+用压测工具的虚拟终端 (tools.load_test.VirtualTerminal) 生成与 EA 相同的请求体，
+逐个交给 app.alloc.measure 计量: JSON 解析 + Pydantic 校验、状态合并、指标、L0-L5、
+响应序列化各自分配了多少、临时峰值多高、新增多少 GC 跟踪对象; 按请求类别汇总，
+并给出各类别的请求内 Python 堆峰值、请求期间的进程 RSS 最高水位 (VmHWM) 与请求后的 RSS。
+
+用法:
+    python -m tools.alloc_bench --terminals 20 --requests 50
+    python -m tools.alloc_bench --json alloc.json
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+from app import alloc
+from app.main import _sandbox_signal
+from tools.load_test import VirtualTerminal
+
+
+def _kb(x):
+    return f"{x / 1024:8.1f}"
+
+
+def print_report(report):
+    for cls, c in report.items():
+        peak = "n/a" if c["rss_peak_bytes"] is None else f"{c['rss_peak_bytes'] / 1024 / 1024:.1f} MB"
+        print(f"\n[{cls}] requests={c['requests']} | request peak {c['request_peak_bytes'] / 1024:.1f} KB "
+              f"| RSS peak {peak} | RSS after {c['rss_after_bytes'] / 1024 / 1024:.1f} MB")
+        print(f"  {'stage':<11} | {'net KB':>8} | {'peak KB':>8} | {'max pk KB':>9} | {'blocks':>7} | {'gc objs':>7}")
+        for stage, s in c["stages"].items():
+            print(f"  {stage:<11} | {_kb(s['mean_net_bytes'])} | {_kb(s['mean_peak_bytes'])} | "
+                  f"{_kb(s['max_peak_bytes']):>9} | {s['mean_blocks']:7.1f} | {s['mean_gc_objects']:7.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage allocation accounting for /signal")
+    parser.add_argument("--terminals", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=50, help="requests per terminal")
+    parser.add_argument("--no-trade-share", type=float, default=0.1)
+    parser.add_argument("--high-spread-share", type=float, default=0.05)
+    parser.add_argument("--position-share", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    # 流水线的 INFO 日志会淹没输出
+    logging.getLogger().setLevel(logging.WARNING)
+
+    terminals = [VirtualTerminal(i, seed=args.seed, no_trade_share=args.no_trade_share,
+                                 high_spread_share=args.high_spread_share, position_share=args.position_share)
+                 for i in range(args.terminals)]
+    stats = alloc.AllocationStats()
+    signal = _sandbox_signal()
+    t0 = time.perf_counter()
+    for _ in range(args.requests):
+        for term in terminals:
+            alloc.measure(term.next_payload(), signal, stats)
+    elapsed = time.perf_counter() - t0
+
+    report = stats.report()
+    print(f"Requests: {args.terminals * args.requests} | {elapsed:.1f}s (tracemalloc on)")
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
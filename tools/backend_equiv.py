@@ -0,0 +1,250 @@
+# tools/backend_equiv.py
+"""
+计算后端等价性比对 (app/backends.py)
+
+性能改写 (identify_stage / update_counter / _detect_wedge_fuzzy / generate_order) 不允许改变任何交易结论。
+这里对每个窗口 (与 tools.replay 相同的 EA 发包方式: 最近 110 根 M5 + 50 根 H1) 先跑 reference，
+再把每个后端与它逐字段比较 (数值按位相等，NaN 视为相等):
+- stage: identify_stage 的 (阶段, 方向)
+- wedge: _detect_wedge_fuzzy 的 (分数, 类型, 三个 Pivot 价格)
+- setup: update_counter 的 (setup, major_trend, wedge_start)，楔形用 reference (只看这一层)
+- order: generate_order 的 (action, lot, entry, sl, tp, reason)，输入为 reference 的阶段 / 方向 / Setup
+- chain: 整条流水线都用该后端 (identify_stage + evaluate_entry，与 /signal 相同; 不含 L0 与 L4 门控)
+逐层比较用同一份输入，定位是哪一层出的差异; chain 确认各层组合后的下单结论一致。
+后端没有自己实现的层 (沿用 reference) 不重复比较。
+
+窗口来源: 录制的历史文件 (可多个) 与 tools.synth_bars 的合成行情 (--synthetic N: 按状态切换覆盖各阶段与
+楔形 / MTR / 微观双底双顶 Setup)。同时统计每层每次调用的耗时与相对 reference 的加速比。
+有任何差异时退出码为 1 (可直接放进上线前的检查)。
+
+用法:
+    python -m tools.backend_equiv history.csv
+    python -m tools.backend_equiv --synthetic 20000 --seed 7
+    python -m tools.backend_equiv history.csv --synthetic 20000 --backends array --csv divergences.csv
+"""
+import argparse
+import collections
+import csv
+import logging
+import math
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+
+from app import backends, runtime_config
+from app.history import load_bars, to_candles, T
+from app.pipeline import evaluate_entry, prepare_market_data
+from tools.replay import H1Window, M5_WINDOW
+from tools.synth_bars import generate
+
+CHECKS = backends.LAYERS + ("chain",)
+CHECK_FIELDS = {
+    "stage": ("stage", "trend"),
+    "wedge": ("wedge_score", "wedge_type", "wedge_pivots"),
+    "setup": ("setup", "major_trend", "wedge_start"),
+    "order": ("action", "lot", "entry", "sl", "tp", "reason"),
+    "chain": ("stage", "trend", "setup", "action", "entry", "sl", "tp", "lot", "reason"),
+}
+DIVERGENCE_FIELDS = ("source", "bar", "time", "backend", "check", "field", "reference", "candidate")
+DEFAULT_SHOW = 20
+# 保留明细的差异条数上限 (计数不受限)
+MAX_KEPT = 10_000
+
+
+def backend_config(cfg, name):
+    """在 cfg 的基础上所有层都用 name 的配置快照"""
+    values = cfg.as_dict()
+    values.update({key: "" for key in runtime_config.COMPUTE_BACKEND_KEYS})
+    values["COMPUTE_BACKEND"] = name
+    return runtime_config.build_snapshot(values, source=f"backend_equiv:{name}")
+
+
+def iter_windows(bars, cfg, limit=0):
+    """与 tools.replay.iter_signals 相同的窗口: 产出 (i, df_m5, M5 candles, atr, df_h1)"""
+    candles = to_candles(bars)
+    h1 = H1Window(bars)
+    end = len(bars) if not limit else min(len(bars), M5_WINDOW - 1 + limit)
+    for i in range(M5_WINDOW - 1, end):
+        window = candles[i - M5_WINDOW + 1:i + 1]
+        df_m5, current_atr = prepare_market_data(window, cfg=cfg)
+        if df_m5 is None:
+            continue
+        yield i, df_m5, window, current_atr, h1.window(i)
+
+
+def _same(a, b):
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return a == b
+
+
+class Harness:
+    """逐窗口比较各后端与 reference，累计差异与耗时"""
+
+    def __init__(self, cfg, names):
+        self.cfg = backend_config(cfg, backends.REFERENCE)
+        self.names = names
+        self.cfgs = {name: backend_config(cfg, name) for name in names}
+        self.ref = {layer: backends.implementation(layer, backends.REFERENCE) for layer in backends.LAYERS}
+        # 每个后端需要单独比较的层 (与 reference 是同一个实现的层跳过)
+        self.impls = {name: {layer: backends.implementation(layer, name) for layer in backends.LAYERS
+                             if backends.implementation(layer, name) is not self.ref[layer]}
+                      for name in names}
+        self.seconds = collections.Counter()
+        self.calls = collections.Counter()
+        self.diverged = collections.Counter()      # (backend, check) -> 有差异的窗口数
+        self.field_counts = collections.Counter()  # (backend, check, field) -> 次数
+        self.kept = []
+        self.coverage = {}
+
+    def _timed(self, key, fn, *args, **kwargs):
+        t0 = time.perf_counter()
+        out = fn(*args, **kwargs)
+        self.seconds[key] += time.perf_counter() - t0
+        self.calls[key] += 1
+        return out
+
+    def _layer(self, layer, impl, name, w, ref):
+        i, df, candles, atr, h1 = w
+        cfg = self.cfg
+        key = (name, layer)
+        if layer == "stage":
+            return self._timed(key, impl.identify_stage, df, h1, atr, cfg)
+        if layer == "wedge":
+            score, kind, pivots = self._timed(key, impl, df, atr)
+            return score, kind, tuple(pivots)
+        if layer == "setup":
+            res = self._timed(key, impl.update_counter, df, ref["stage"][1], atr, cfg,
+                              detect_wedge=self.ref["wedge"])
+            return res.get("setup"), res.get("major_trend"), res.get("wedge_start")
+        action, lot, entry, sl, tp, reason = self._timed(
+            key, impl.generate_order, ref["stage"][0], ref["stage"][1], ref["setup"][0], df, candles, atr, cfg)
+        return action, lot, entry, sl, tp, reason
+
+    def _chain(self, name, cfg, w):
+        i, df, candles, atr, h1 = w
+        t0 = time.perf_counter()
+        stage, trend = backends.identify_stage(df, h1, atr, cfg)
+        res = evaluate_entry(df, candles, stage, trend, atr, cfg, prob_gate=False)
+        self.seconds[(name, "chain")] += time.perf_counter() - t0
+        self.calls[(name, "chain")] += 1
+        return stage, trend, res["setup"], res["action"], res["entry"], res["sl"], res["tp"], res["lot"], res["reason"]
+
+    def _compare(self, source, w, bars, name, check, expected, got):
+        diff = [k for k, a, b in zip(CHECK_FIELDS[check], expected, got) if not _same(a, b)]
+        if not diff:
+            return
+        self.diverged[(name, check)] += 1
+        i = w[0]
+        for field, a, b in zip(CHECK_FIELDS[check], expected, got):
+            if field not in diff:
+                continue
+            self.field_counts[(name, check, field)] += 1
+            if len(self.kept) < MAX_KEPT:
+                self.kept.append((source, i, int(bars[i, T]), name, check, field, a, b))
+
+    def run(self, source, bars, limit=0):
+        cov = self.coverage[source] = {"windows": 0, "stages": collections.Counter(),
+                                       "setups": collections.Counter(), "placed": 0}
+        for w in iter_windows(bars, self.cfg, limit):
+            ref = {layer: self._layer(layer, self.ref[layer], backends.REFERENCE, w, None)
+                   for layer in ("stage", "wedge")}
+            ref["setup"] = self._layer("setup", self.ref["setup"], backends.REFERENCE, w, ref)
+            ref["order"] = self._layer("order", self.ref["order"], backends.REFERENCE, w, ref)
+            ref_chain = self._chain(backends.REFERENCE, self.cfg, w)
+
+            cov["windows"] += 1
+            cov["stages"][ref["stage"][0]] += 1
+            cov["setups"][ref["setup"][0]] += 1
+            cov["placed"] += ref_chain[3] != "HOLD"
+
+            for name in self.names:
+                for layer, impl in self.impls[name].items():
+                    self._compare(source, w, bars, name, layer, ref[layer], self._layer(layer, impl, name, w, ref))
+                self._compare(source, w, bars, name, "chain", ref_chain, self._chain(name, self.cfgs[name], w))
+
+    @property
+    def total_divergences(self):
+        return sum(self.diverged.values())
+
+
+def print_report(h, show=DEFAULT_SHOW):
+    for source, cov in h.coverage.items():
+        stages = " | ".join(f"{k} {v}" for k, v in sorted(cov["stages"].items()))
+        setups = len([k for k in cov["setups"] if k != "NONE"])
+        print(f"{source}: {cov['windows']} windows | {stages} | {setups} distinct setups | "
+              f"{cov['placed']} orders placed")
+
+    print(f"\n{'backend':<12}{'check':<8}{'windows':>9}{'diverged':>10}{'ref us':>9}{'us':>9}{'speedup':>9}")
+    for name in h.names:
+        for check in CHECKS:
+            key = (name, check)
+            if check != "chain" and check not in h.impls[name]:
+                print(f"{name:<12}{check:<8}{'= reference':>9}")
+                continue
+            ref_us = h.seconds[(backends.REFERENCE, check)] / max(1, h.calls[(backends.REFERENCE, check)]) * 1e6
+            us = h.seconds[key] / max(1, h.calls[key]) * 1e6
+            speedup = ref_us / us if us > 0 else float("nan")
+            print(f"{name:<12}{check:<8}{h.calls[key]:>9}{h.diverged[key]:>10}{ref_us:>9.1f}{us:>9.1f}{speedup:>8.2f}x")
+
+    if h.field_counts:
+        print("\nDivergent fields:")
+        for (name, check, field), n in sorted(h.field_counts.items()):
+            print(f"  {name} {check}.{field}: {n}")
+        print(f"\nFirst {min(show, len(h.kept))} divergences:")
+        for source, i, ts, name, check, field, a, b in h.kept[:show]:
+            print(f"  {source} bar {i} (t={ts}) {name} {check}.{field}: reference={a!r} {name}={b!r}")
+
+
+def write_csv(path, h):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(DIVERGENCE_FIELDS)
+        for row in h.kept:
+            writer.writerow(row[:6] + tuple(repr(v) for v in row[6:]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Differential check of the compute backends against the reference")
+    parser.add_argument("history", nargs="*", help="recorded history CSV(s) (time,open,high,low,close,tick_vol,spread)")
+    parser.add_argument("--synthetic", type=int, default=0, help="also check N synthetic bars (tools.synth_bars)")
+    parser.add_argument("--seed", type=int, default=0, help="synthetic generator seed")
+    parser.add_argument("--limit", type=int, default=0, help="windows per source (0 = all)")
+    parser.add_argument("--backends", default=None,
+                        help=f"comma-separated backends to check (default: all of {runtime_config.COMPUTE_BACKENDS[1:]})")
+    parser.add_argument("--show", type=int, default=DEFAULT_SHOW, help="divergences printed")
+    parser.add_argument("--csv", default=None, help="write the divergences (first %d) to CSV" % MAX_KEPT)
+    args = parser.parse_args(argv)
+
+    if not args.history and not args.synthetic:
+        parser.error("nothing to check: give a history file and/or --synthetic N")
+    names = [n for n in runtime_config.COMPUTE_BACKENDS if n != backends.REFERENCE]
+    if args.backends:
+        names = [n.strip() for n in args.backends.split(",") if n.strip()]
+        unknown = [n for n in names if n not in runtime_config.COMPUTE_BACKENDS or n == backends.REFERENCE]
+        if unknown:
+            parser.error(f"unknown backend(s): {', '.join(unknown)}")
+
+    logging.getLogger().setLevel(logging.WARNING)
+    h = Harness(runtime_config.current(), names)
+    t0 = time.perf_counter()
+    for path in args.history:
+        h.run(os.path.basename(path), load_bars(path), args.limit)
+    if args.synthetic:
+        bars, _ = generate(args.synthetic, seed=args.seed)
+        h.run(f"synthetic(seed={args.seed})", bars, args.limit)
+
+    print_report(h, args.show)
+    if args.csv:
+        write_csv(args.csv, h)
+    print(f"\n{h.total_divergences} divergent checks | {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+    if h.total_divergences:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# tools/build_prob_table.py
+"""
+离线生成 L4 概率表
+
+回放历史 K 线 (不经过 L4 门控)，把每个成交的信号按
+(stage, setup, trend-bar, control, rejection, ATR 区间) 分桶，
+统计"先到 +1R 再到 SL"的实际胜率与 Wilson 置信区间，写成 .npz 供 L4 查表。
+
+用法:
+    python -m tools.build_prob_table history.csv -o app/prob_table.npz
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from app.history import load_bars
+from app.services.l4_probability import (
+    CONTROLS, DEFAULT_ATR_EDGES, REJECTIONS, SETUPS, STAGES, ProbabilityTable, bucket_index, table_shape,
+)
+from tools.replay import EXPIRY_BARS, HORIZON_BARS, replay, replay_parallel
+
+
+def build_table(records, atr_edges=DEFAULT_ATR_EDGES, meta=None):
+    """信号记录 (tools.replay.replay 的输出) -> ProbabilityTable; 未成交的信号不计入"""
+    size = int(np.prod(table_shape(atr_edges)))
+    filled = [r for r in records if r["filled"]]
+    idx = np.fromiter(
+        (bucket_index(r["stage"], r["setup"], r["is_trend_bar"], r["control"], r["rejection_type"], r["atr"], atr_edges)
+         for r in filled),
+        dtype=np.int64, count=len(filled),
+    )
+    wins = np.fromiter((r["hit_1r"] for r in filled), dtype=np.int32, count=len(filled))
+    return ProbabilityTable(
+        np.bincount(idx, weights=wins, minlength=size),
+        np.bincount(idx, minlength=size),
+        atr_edges, meta,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the L4 lookup-table probability model")
+    parser.add_argument("history", help="history CSV (time,open,high,low,close,tick_vol,spread)")
+    parser.add_argument("-o", "--output", default=os.path.join("app", "prob_table.npz"))
+    parser.add_argument("--atr-edges", default=",".join(str(x) for x in DEFAULT_ATR_EDGES),
+                        help="ATR regime boundaries in USD, comma separated")
+    parser.add_argument("--horizon", type=int, default=HORIZON_BARS, help="max bars held after fill")
+    parser.add_argument("--no-risk", action="store_true", help="skip L0 time/spread filters")
+    parser.add_argument("--top", type=int, default=15, help="print the N largest buckets")
+    parser.add_argument("--workers", type=int, default=1, help="processes for a time-partitioned parallel replay")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    atr_edges = tuple(sorted(float(x) for x in args.atr_edges.split(",") if x.strip()))
+    bars = load_bars(args.history)
+
+    t0 = time.perf_counter()
+    if args.workers > 1:
+        records, report = replay_parallel(bars, apply_risk=not args.no_risk, prob_gate=False,
+                                          expiry_bars=EXPIRY_BARS, horizon=args.horizon, workers=args.workers)
+        if report["mismatches"]:
+            print(f"Warning: {len(report['mismatches'])} overlap bars differ between partitions", file=sys.stderr)
+    else:
+        records = replay(bars, apply_risk=not args.no_risk, prob_gate=False,
+                         expiry_bars=EXPIRY_BARS, horizon=args.horizon)
+    meta = {"history": os.path.basename(args.history), "bars": len(bars),
+            "horizon": args.horizon, "built_at": int(time.time())}
+    table = build_table(records, atr_edges, meta)
+    table.save(args.output)
+
+    n = int(table.trials.sum())
+    print(f"Bars: {len(bars)} | Signals: {len(records)} | Filled: {n} | "
+          f"Buckets used: {int((table.trials > 0).sum())}/{table.trials.size} | {time.perf_counter() - t0:.1f}s")
+    shape = table_shape(atr_edges)
+    for i in np.argsort(-table.trials)[:args.top]:
+        if table.trials[i] == 0:
+            break
+        st, su, tb, ct, rj, rg = np.unravel_index(i, shape)
+        print(f"  {STAGES[st]:<16} {SETUPS[su]:<14} trend_bar={bool(tb)!s:<5} {CONTROLS[ct]:<7} {REJECTIONS[rj]:<11} "
+              f"atr_regime={rg} | n={table.trials[i]:<5} win={table.win_rate[i]:.2f} "
+              f"[{table.lower[i]:.2f}-{table.upper[i]:.2f}]")
+    print(f"Table written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+# tools/exit_sweep.py
+"""
+出场策略扫描 (移动止损 / 减仓参数)
+
+main._analyze 的出场规则 (config.py SECTION D，默认值如下):
+- 移动止损: 浮盈超过启动阈值 (TRAIL_S1 / S2 / OTHER_START_ATR = 2.0 / 1.5 / 1.0 ATR) 后，止损跟在价格后面
+  (TRAIL_*_DISTANCE_ATR = 1.5 / 1.0 / 0.5 ATR)，只向有利方向移动
+- 减仓: 手数 >= 0.02、价格偏离开仓价超过 PARTIAL_CLOSE_ATR (两个方向都算，与服务端相同) 时平掉 PARTIAL_CLOSE_LOT
+这里不再逐组参数重跑回放: 把回放成交 (tools.replay 的输出，或含相同字段的实盘记录) 的后续 K 线
+排成 (持仓 × K 线) 的有利方向偏移 (ATR 单位)，与参数组合一维广播，一次得到 (持仓 × 参数 × K 线) 的
+止损水平与出场位置:
+- 第 j 根的止损 = max(初始 SL, 前 j-1 根的最高有利偏移 - 跟踪距离) (最高偏移超过启动阈值后)，
+  同一根 K 线内按 SL 先到处理，与 tools.replay.simulate_trade 相同 (不启用移动止损与减仓时 R 完全一致)
+- 减仓在出场那根 K 线之前触发才计入，按阈值价成交
+ATR 与阶段取信号 K 线的值 (线上每次请求按当时的 ATR / 阶段计算)；TRAIL_MIN_STEP 的最小改动忽略。
+
+输出每组参数 (全部持仓与 Stage 1 / Stage 2 / 其他三组分别统计) 的期望 R、胜率、盈亏、
+平均 MFE / MAE (R)、MFE 兑现率 (总 R / 总 MFE)、平均持仓根数，以及线上规则与不管理 (只看 SL / TP) 两个基准。
+
+用法:
+    python -m tools.exit_sweep trades.csv history.csv
+    python -m tools.exit_sweep trades.csv history.csv --grid TRAIL_START_ATR=0.5:3:0.25 \\
+        --grid PARTIAL_FRACTION=0,0.5 --partial-side profit --csv exits.csv
+"""
+import argparse
+import csv
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from app import runtime_config
+from app.history import load_bars, T, H, L, C
+from app.polling import trail_params
+from tools.replay import CONTRACT_SIZE, HORIZON_BARS, read_trades
+
+EXIT_PARAMS = ("TRAIL_START_ATR", "TRAIL_DISTANCE_ATR", "PARTIAL_ATR", "PARTIAL_FRACTION")
+STAGE_GROUPS = ("1-STRONG_TREND", "2-CHANNEL", "OTHER")
+GROUP_NAMES = ("ALL",) + STAGE_GROUPS
+METRICS = ("trades", "expectancy_r", "win_rate", "pnl_usd", "mfe_r", "mae_r", "mfe_capture",
+           "bars_in_trade", "p_trail", "p_partial")
+# 出场原因编码
+SL, TRAIL, TP, TIMEOUT = 0, 1, 2, 3
+# 每次广播的 (持仓 × 参数组合 × K 线) 单元数上限，控制内存
+DEFAULT_MAX_CELLS = 2_000_000
+DEFAULT_TOP = 10
+
+
+def default_grid():
+    """inf = 不启用移动止损; PARTIAL_FRACTION 0 = 不减仓"""
+    return {
+        "TRAIL_START_ATR": np.array([0.5, 0.75, 1.0, 1.25, 1.5, 2.0, 2.5, 3.0, np.inf]),
+        "TRAIL_DISTANCE_ATR": np.array([0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 2.0]),
+        "PARTIAL_ATR": np.array([0.5, 0.75, 1.0, 1.5, 2.0]),
+        "PARTIAL_FRACTION": np.array([0.0, 0.25, 0.5]),
+    }
+
+
+def parse_grid_spec(text):
+    """NAME=start:stop:step (含 stop) 或 NAME=v1,v2,... (可写 inf)"""
+    name, _, spec = text.partition("=")
+    name = name.strip()
+    if name not in EXIT_PARAMS:
+        raise ValueError(f"{name}: not a sweepable parameter ({', '.join(EXIT_PARAMS)})")
+    if ":" in spec:
+        start, stop, step = (float(x) for x in spec.split(":"))
+        values = np.arange(start, stop + step / 2, step)
+    else:
+        values = np.array([float(x) for x in spec.split(",") if x.strip()])
+    if len(values) == 0:
+        raise ValueError(f"{name}: empty grid")
+    return name, np.round(np.unique(values), 6)
+
+
+def _group(stage):
+    return STAGE_GROUPS.index(stage) if stage in STAGE_GROUPS[:-1] else len(STAGE_GROUPS) - 1
+
+
+def load_positions(rows, bars, horizon=HORIZON_BARS):
+    """
+    rows: 成交记录 (read_trades)，需要 action / fill_price / sl / tp / atr / stage / lot，
+          以及 fill_bar (历史文件中的下标) 或 fill_time (成交时间戳，取所在的 M5)
+    返回持仓数组 (有利方向、ATR 单位): hi / lo / close (N, horizon)，超出历史或持有期的 K 线不会触发
+    """
+    n = len(bars)
+    keep = []
+    for r in rows:
+        if not r.get("filled", True) or float(r.get("atr", 0)) <= 0:
+            continue
+        if "fill_bar" in r:
+            fb = int(r["fill_bar"])
+        else:
+            fb = int(np.searchsorted(bars[:, T], float(r["fill_time"]), side="right")) - 1
+        if 0 <= fb < n:
+            keep.append((r, fb))
+    if not keep:
+        return None
+
+    fill_bar = np.array([fb for _, fb in keep])
+    direction = np.array([1.0 if "BUY" in r["action"] else -1.0 for r, _ in keep])
+    fill = np.array([float(r["fill_price"]) for r, _ in keep])
+    atr = np.array([float(r["atr"]) for r, _ in keep])
+    sl = np.array([float(r["sl"]) for r, _ in keep])
+    tp = np.array([float(r["tp"]) for r, _ in keep])
+    entry = np.array([float(r.get("entry", r["fill_price"])) for r, _ in keep])
+    lot = np.array([float(r["lot"]) for r, _ in keep])
+
+    idx = fill_bar[:, None] + np.arange(horizon)
+    valid = idx < np.minimum(fill_bar + horizon, n)[:, None]
+    idx = np.minimum(idx, n - 1)
+    buy = (direction > 0)[:, None]
+    hi = np.where(buy, bars[idx, H] - fill[:, None], fill[:, None] - bars[idx, L]) / atr[:, None]
+    lo = np.where(buy, bars[idx, L] - fill[:, None], fill[:, None] - bars[idx, H]) / atr[:, None]
+    close = direction[:, None] * (bars[idx, C] - fill[:, None]) / atr[:, None]
+    risk = np.abs(entry - sl)
+    risk = np.where(risk > 0, risk, 1e-9)
+    return {
+        "hi": np.where(valid, hi, -np.inf), "lo": np.where(valid, lo, np.inf), "close": close,
+        "last": valid.sum(axis=1) - 1,
+        "sl": direction * (sl - fill) / atr,
+        "tp": np.where(tp > 0, direction * (tp - fill) / atr, np.inf),
+        "risk_atr": risk / atr, "risk_usd": risk * lot * CONTRACT_SIZE, "lot": lot,
+        "group": np.array([_group(r["stage"]) for r, _ in keep]),
+    }
+
+
+def live_params(pos, cfg):
+    """线上规则 (当前配置): 按阶段的启动阈值 / 跟踪距离; 手数 >= 0.02 的持仓减 PARTIAL_CLOSE_LOT"""
+    start, dist = np.array([trail_params(STAGE_GROUPS[g], cfg) for g in pos["group"]]).reshape(-1, 2).T
+    frac = np.minimum(cfg.PARTIAL_CLOSE_LOT / pos["lot"], 1.0)
+    return start[:, None], dist[:, None], np.full((len(start), 1), cfg.PARTIAL_CLOSE_ATR), frac[:, None]
+
+
+def _take(a, idx):
+    return np.take_along_axis(a, idx[..., None], axis=-1)[..., 0]
+
+
+def simulate_exits(pos, start, dist, partial_atr, partial_frac, partial_both=True):
+    """
+    参数形状 (N, P) 或 (1, P)，返回 (N, P) 的 r / reason / exit_bar / mfe_r / mae_r / partial
+    partial_both: 与线上相同，价格向不利方向偏离阈值也减仓
+    """
+    hi, lo = pos["hi"], pos["lo"]
+    n = len(hi)
+    run_max = np.maximum.accumulate(hi, axis=1)
+    run_min = np.minimum.accumulate(lo, axis=1)
+    # 第 j 根开始时已知的最高有利偏移 (成交那根之前没有)
+    prev_max = np.concatenate((np.full((n, 1), -np.inf), run_max[:, :-1]), axis=1)[:, None, :]
+    sl = pos["sl"][:, None, None]
+
+    active = prev_max > start[..., None]
+    stop = np.where(active, np.maximum(sl, prev_max - dist[..., None]), sl)
+    sl_hit = lo[:, None, :] <= stop
+    exit_mask = sl_hit | (hi >= pos["tp"][:, None])[:, None, :]
+    has_exit = exit_mask.any(axis=-1)
+    last = np.broadcast_to(pos["last"][:, None], has_exit.shape)
+    exit_bar = np.where(has_exit, exit_mask.argmax(axis=-1), last)
+    by_stop = has_exit & _take(sl_hit, exit_bar)
+    stop_at = _take(stop, exit_bar)
+    timeout_px = pos["close"][np.arange(n), pos["last"]][:, None]
+    exit_fav = np.where(by_stop, stop_at, np.where(has_exit, pos["tp"][:, None], timeout_px))
+    reason = np.where(by_stop, np.where(stop_at > pos["sl"][:, None], TRAIL, SL), np.where(has_exit, TP, TIMEOUT))
+
+    # 减仓: 在出场那根之前越过阈值 (出场那根内按 SL 先到，不计)
+    level = partial_atr[..., None]
+    trig_lo = (-lo[:, None, :] > level) if partial_both else np.zeros((1, 1, 1), dtype=bool)
+    trig = (hi[:, None, :] > level) | trig_lo
+    first = trig.argmax(axis=-1)
+    eligible = (pos["lot"] >= 0.02)[:, None] & (partial_frac > 0)
+    partial = eligible & _take(trig, first) & (first < exit_bar)
+    if partial_both:
+        side = np.where(_take(np.broadcast_to(trig_lo, trig.shape), first), -partial_atr, partial_atr)
+    else:
+        side = np.broadcast_to(partial_atr, partial.shape)
+    frac = np.where(partial, partial_frac, 0.0)
+    realized = frac * side + (1.0 - frac) * exit_fav
+
+    risk = pos["risk_atr"][:, None]
+    return {
+        "r": realized / risk, "reason": reason, "exit_bar": exit_bar, "partial": partial,
+        "mfe_r": _take(np.broadcast_to(run_max[:, None, :], stop.shape), exit_bar) / risk,
+        "mae_r": _take(np.broadcast_to(run_min[:, None, :], stop.shape), exit_bar) / risk,
+    }
+
+
+def summarize(pos, out):
+    """返回 {指标: (4, P)}，行为 GROUP_NAMES (全部 / Stage 1 / Stage 2 / 其他)"""
+    masks = [np.ones(len(pos["group"]), dtype=bool)] + [pos["group"] == g for g in range(len(STAGE_GROUPS))]
+    r = out["r"]
+    pnl = r * pos["risk_usd"][:, None]
+    res = {m: np.zeros((len(masks), r.shape[1])) for m in METRICS}
+    for k, m in enumerate(masks):
+        count = int(m.sum())
+        res["trades"][k] = count
+        if count == 0:
+            continue
+        rk = r[m]
+        res["expectancy_r"][k] = rk.mean(axis=0)
+        res["win_rate"][k] = (rk > 0).mean(axis=0)
+        res["pnl_usd"][k] = pnl[m].sum(axis=0)
+        res["mfe_r"][k] = out["mfe_r"][m].mean(axis=0)
+        res["mae_r"][k] = out["mae_r"][m].mean(axis=0)
+        total_mfe = np.maximum(out["mfe_r"][m], 0.0).sum(axis=0)
+        res["mfe_capture"][k] = np.divide(rk.sum(axis=0), total_mfe, out=np.zeros_like(total_mfe), where=total_mfe > 0)
+        res["bars_in_trade"][k] = (out["exit_bar"][m] + 1).mean(axis=0)
+        res["p_trail"][k] = (out["reason"][m] == TRAIL).mean(axis=0)
+        res["p_partial"][k] = out["partial"][m].mean(axis=0)
+    return res
+
+
+def grid_sets(grid):
+    """全部参数组合 (按 EXIT_PARAMS 顺序的 C 序展开) -> 每个参数一个 (P,) 数组"""
+    mesh = np.meshgrid(*(grid[name] for name in EXIT_PARAMS), indexing="ij")
+    return [m.ravel() for m in mesh]
+
+
+def sweep(pos, grid, partial_both=True, max_cells=DEFAULT_MAX_CELLS):
+    """按块广播全部参数组合，返回 {指标: (4, P)}"""
+    params = grid_sets(grid)
+    n_sets = len(params[0])
+    n, horizon = pos["hi"].shape
+    step = max(1, max_cells // (n * horizon))
+    res = {m: np.zeros((len(GROUP_NAMES), n_sets)) for m in METRICS}
+    for p0 in range(0, n_sets, step):
+        p1 = min(n_sets, p0 + step)
+        out = simulate_exits(pos, *(p[None, p0:p1] for p in params), partial_both=partial_both)
+        for m, v in summarize(pos, out).items():
+            res[m][:, p0:p1] = v
+    return params, res
+
+
+def best_per_group(res):
+    """每个阶段组各自取期望 R 最高的参数; 返回 ([组内最优下标], 合并后的期望 R)"""
+    rows = range(1, len(GROUP_NAMES))
+    best = [int(np.argmax(res["expectancy_r"][k])) if res["trades"][k, 0] else -1 for k in rows]
+    total = sum(res["expectancy_r"][k, b] * res["trades"][k, 0] for k, b in zip(rows, best) if b >= 0)
+    return best, total / max(1.0, res["trades"][0, 0])
+
+
+def _distinct(res, k, top):
+    """按期望 R 排序的前 top 组; 结果完全相同的组合只列第一组 (如不减仓时 PARTIAL_ATR 不起作用)"""
+    seen, picked = set(), []
+    for p in np.argsort(-res["expectancy_r"][k], kind="stable"):
+        key = tuple(round(float(res[m][k, p]), 9) for m in METRICS)
+        if key not in seen:
+            seen.add(key)
+            picked.append(int(p))
+            if len(picked) == top:
+                break
+    return picked
+
+
+def _fmt_params(values):
+    return " ".join(f"{v:>6.3g}" for v in values)
+
+
+def _fmt_metrics(res, k, p):
+    return (f"{res['expectancy_r'][k, p]:+7.3f} {res['win_rate'][k, p] * 100:6.1f}% {res['pnl_usd'][k, p]:10.2f} "
+            f"{res['mfe_r'][k, p]:6.2f} {res['mae_r'][k, p]:6.2f} {res['mfe_capture'][k, p] * 100:6.1f}% "
+            f"{res['bars_in_trade'][k, p]:6.1f} {res['p_trail'][k, p] * 100:6.1f}% {res['p_partial'][k, p] * 100:6.1f}%")
+
+
+HEADER = (f"{'':>10} | {'start':>6} {'dist':>6} {'p_atr':>6} {'p_frac':>6} | "
+          f"{'E[R]':>7} {'win':>7} {'pnl_usd':>10} {'MFE_R':>6} {'MAE_R':>6} {'capt':>7} {'bars':>6} {'trail':>7} {'part':>7}")
+
+
+def write_csv(path, params, res):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["group"] + list(EXIT_PARAMS) + list(METRICS))
+        for k, group in enumerate(GROUP_NAMES):
+            for p in range(len(params[0])):
+                writer.writerow([group] + [f"{v[p]:.6g}" for v in params]
+                                + [f"{res[m][k, p]:.6g}" for m in METRICS])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate trailing-stop / partial-close parameter sets on replayed entries")
+    parser.add_argument("trades", help="trade CSV (tools.replay output, or records with the same columns)")
+    parser.add_argument("history", help="history CSV the trades refer to (time,open,high,low,close,tick_vol,spread)")
+    parser.add_argument("--grid", action="append", default=[],
+                        help="NAME=start:stop:step or NAME=v1,v2,... (repeatable; NAME in " + ", ".join(EXIT_PARAMS) + ")")
+    parser.add_argument("--horizon", type=int, default=HORIZON_BARS, help="bars held at most (same as the replay)")
+    parser.add_argument("--partial-side", choices=("both", "profit"), default="both",
+                        help="both: partial close on a 1 ATR move either way (live rule); profit: favourable moves only")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="parameter sets listed by expectancy")
+    parser.add_argument("--max-cells", type=int, default=DEFAULT_MAX_CELLS,
+                        help="positions x sets x bars broadcast at once (memory bound)")
+    parser.add_argument("--csv", default=None, help="write one row per group and parameter set")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    cfg = runtime_config.current()
+    grid = default_grid()
+    for spec in args.grid:
+        try:
+            name, values = parse_grid_spec(spec)
+        except ValueError as e:
+            parser.error(str(e))
+        grid[name] = values
+
+    bars = load_bars(args.history)
+    pos = load_positions(read_trades(args.trades), bars, args.horizon)
+    if pos is None:
+        print("No filled trades inside the history.")
+        return
+    partial_both = args.partial_side == "both"
+    t0 = time.perf_counter()
+    params, res = sweep(pos, grid, partial_both, args.max_cells)
+    elapsed = time.perf_counter() - t0
+    n_sets = len(params[0])
+    counts = np.bincount(pos["group"], minlength=len(STAGE_GROUPS))
+    print(f"Positions: {len(pos['group'])} (" + " / ".join(f"{g} {c}" for g, c in zip(STAGE_GROUPS, counts))
+          + f") | sets: {n_sets} | {elapsed:.2f}s")
+
+    live = summarize(pos, simulate_exits(pos, *live_params(pos, cfg), partial_both=partial_both))
+    one = np.ones((1, 1))
+    static = summarize(pos, simulate_exits(pos, one * np.inf, one, one, one * 0.0, partial_both=partial_both))
+    for k, group in enumerate(GROUP_NAMES):
+        if not res["trades"][k, 0]:
+            continue
+        print(f"\n{group} ({int(res['trades'][k, 0])} positions)")
+        print(HEADER)
+        print(f"{'live':>10} | {'(per-stage rule)':>27} | " + _fmt_metrics(live, k, 0))
+        print(f"{'SL/TP only':>10} | {'':>27} | " + _fmt_metrics(static, k, 0))
+        for rank, p in enumerate(_distinct(res, k, args.top), 1):
+            print(f"{'#' + str(rank):>10} | " + _fmt_params([v[p] for v in params]) + " | " + _fmt_metrics(res, k, p))
+
+    best, combined = best_per_group(res)
+    print(f"\nBest set per stage group: E[R] {combined:+.3f} "
+          f"(live {live['expectancy_r'][0, 0]:+.3f}, SL/TP only {static['expectancy_r'][0, 0]:+.3f})")
+    for group, p in zip(STAGE_GROUPS, best):
+        if p >= 0:
+            print(f"  {group:<16} " + " ".join(f"{name}={v[p]:g}" for name, v in zip(EXIT_PARAMS, params)))
+
+    if args.csv:
+        write_csv(args.csv, params, res)
+        print(f"\nWrote {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+# tools/export_features.py
+"""
+研究用逐 K 线特征导出 (流式、分块、可断点续跑)
+
+把一段很长的 M5 历史按块流过 app.batch.iter_features，每块写一个列式文件:
+    out_dir/features_000000.npz, features_000001.npz, ...   (列见 app.batch.FEATURE_FIELDS)
+    out_dir/manifest.json                                    (源文件 / 配置版本 / 已完成的块)
+
+- 生成器流水线: 读块 (app.history.iter_bar_blocks) -> 拼上一块的尾部 -> 计算特征 -> 写文件，
+  任一时刻内存中只有一块 K 线及其特征，与历史长度无关
+- 第 j 块对应源文件第 [j*chunk, (j+1)*chunk) 根 K 线; 前面不足一个 EA 窗口的 109 根没有特征
+- 每块计算时带上前一块的最后 overlap 根 (M5 窗口 110 根 / H1 窗口所需的 M5 根数取大者)，
+  结果与整段一次性计算 (iter_series) 逐位一致
+- 文件与 manifest 都先写临时文件再 os.replace: 中断后 manifest 只记录完整写完的块，
+  再次运行同一命令从下一块继续; 末尾不满一块的会重算 (源文件追加了新 K 线也能接着导)
+- 配置版本 / 块大小 / 源文件与 manifest 不一致时拒绝续跑，--restart 清掉重导
+
+输出用压缩的 NumPy npz (np.load 按列读取; 本项目不依赖 pyarrow / parquet)。
+
+用法:
+    python -m tools.export_features history.csv -o features/ --chunk 50000
+    python -m tools.export_features history.csv -o features/ --restart
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from app import runtime_config
+from app.batch import DEFAULT_CHUNK, FEATURE_FIELDS, M5_WINDOW, iter_features
+from app.history import T, iter_bar_blocks
+
+MANIFEST = "manifest.json"
+FORMAT = 1
+DEFAULT_EXPORT_CHUNK = 50000
+
+
+def chunk_file(j):
+    return f"features_{j:06d}.npz"
+
+
+def overlap_bars(cfg):
+    """每块需要带上的前一块尾部根数: M5 窗口与 H1 窗口 (每根 H1 最多 12 根 M5，含正在形成的一根) 取大者"""
+    return max(M5_WINDOW, (cfg.H1_WINDOW_BARS + 2) * 12)
+
+
+def _write_atomic(path, write):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_manifest(out_dir):
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(out_dir, manifest):
+    payload = json.dumps(manifest, indent=1).encode("utf-8")
+    _write_atomic(os.path.join(out_dir, MANIFEST), lambda f: f.write(payload))
+
+
+def new_manifest(source, chunk_size, cfg):
+    return {
+        "format": FORMAT, "source": os.path.abspath(source), "chunk_size": chunk_size,
+        "config_version": cfg.version, "fields": list(FEATURE_FIELDS), "complete": False, "chunks": [],
+    }
+
+
+def check_manifest(manifest, source, chunk_size, cfg):
+    """manifest 与本次参数不一致时返回原因，否则返回 None"""
+    expected = new_manifest(source, chunk_size, cfg)
+    for key in ("format", "source", "chunk_size", "config_version", "fields"):
+        if manifest.get(key) != expected[key]:
+            return f"{key} changed: {manifest.get(key)!r} -> {expected[key]!r}"
+    return None
+
+
+def resume_point(manifest):
+    """续跑从哪一块开始: 保留完整的块，末尾不满一块的丢掉重算"""
+    chunks = manifest["chunks"]
+    while chunks and chunks[-1]["bars"] < manifest["chunk_size"]:
+        chunks.pop()
+    return len(chunks)
+
+
+def iter_segments(path, chunk_size, overlap, first_chunk=0, expect_time=None):
+    """
+    逐块产出 (块号, 第一根特征的下标, 本块 K 线数, 片段, 片段内起点)
+    片段 = 前一块最后 overlap 根 + 本块; 从第 first_chunk 块开始 (expect_time: 前一块最后一根的时间，用于核对)
+    """
+    skip = first_chunk * chunk_size
+    tail = np.empty((0, 7))
+    if skip > 0:
+        tail_start = max(0, skip - overlap)
+        tail = next(iter_bar_blocks(path, skip - tail_start, skip_rows=tail_start), tail)
+        if len(tail) != skip - tail_start or (expect_time is not None and int(tail[-1, T]) != expect_time):
+            raise ValueError(f"{path}: source no longer matches the exported chunks (rewritten or truncated?)")
+
+    for j, block in enumerate(iter_bar_blocks(path, chunk_size, skip_rows=skip), start=first_chunk):
+        if len(tail) and block[0, T] < tail[-1, T]:
+            raise ValueError(f"{path}: bars must be sorted by time for streaming reads")
+        segment = np.concatenate((tail, block)) if len(tail) else block
+        start = max(len(tail), M5_WINDOW - 1)
+        yield j, j * chunk_size + start - len(tail), len(block), segment, start
+        tail = segment[-overlap:]
+
+
+def iter_feature_chunks(segments, cfg, batch_size=DEFAULT_CHUNK):
+    """(块号, 第一根下标, 本块 K 线数, 特征列 dict 或 None (本块没有满窗口的 K 线))"""
+    for j, first_index, n_bars, segment, start in segments:
+        parts = list(iter_features(segment, cfg, start=start, chunk_size=batch_size))
+        columns = {k: np.concatenate([p[k] for p in parts]) for k in FEATURE_FIELDS} if parts else None
+        yield j, first_index, n_bars, columns
+
+
+def export(source, out_dir, chunk_size=DEFAULT_EXPORT_CHUNK, cfg=None, restart=False):
+    """导出 (或续跑)，返回 manifest"""
+    cfg = cfg or runtime_config.current()
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir)
+    if manifest is not None and not restart:
+        problem = check_manifest(manifest, source, chunk_size, cfg)
+        if problem:
+            raise ValueError(f"{out_dir}: cannot resume ({problem}); use --restart to export from scratch")
+    else:
+        if manifest is not None:
+            for c in manifest["chunks"]:
+                if c["file"] and os.path.exists(os.path.join(out_dir, c["file"])):
+                    os.remove(os.path.join(out_dir, c["file"]))
+        manifest = new_manifest(source, chunk_size, cfg)
+
+    first_chunk = resume_point(manifest)
+    expect_time = manifest["chunks"][-1]["last_time"] if manifest["chunks"] else None
+    manifest["complete"] = False
+    segments = iter_segments(source, chunk_size, overlap_bars(cfg), first_chunk, expect_time)
+
+    for j, first_index, n_bars, columns in iter_feature_chunks(segments, cfg):
+        entry = {"index": j, "file": None, "bars": n_bars, "first_index": first_index, "rows": 0,
+                 "first_time": None, "last_time": None}
+        if columns is not None:
+            entry.update(file=chunk_file(j), rows=len(columns["time"]),
+                         first_time=int(columns["time"][0]), last_time=int(columns["time"][-1]))
+            _write_atomic(os.path.join(out_dir, entry["file"]), lambda f: np.savez_compressed(f, **columns))
+        manifest["chunks"].append(entry)
+        save_manifest(out_dir, manifest)
+
+    manifest["complete"] = True
+    save_manifest(out_dir, manifest)
+    return manifest
+
+
+def load_features(out_dir, fields=None):
+    """把导出的各块按列拼回一个 dict (数据量大时请直接逐个 np.load 块文件)"""
+    manifest = load_manifest(out_dir)
+    fields = fields or manifest["fields"]
+    parts = {k: [] for k in fields}
+    for c in manifest["chunks"]:
+        if c["file"]:
+            with np.load(os.path.join(out_dir, c["file"])) as data:
+                for k in fields:
+                    parts[k].append(data[k])
+    return {k: np.concatenate(v) if v else np.empty(0) for k, v in parts.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream per-bar L1/L2/L3/L5 features of an M5 history "
+                                                 "into chunked columnar files (resumable)")
+    parser.add_argument("history", help="history CSV sorted by time (time,open,high,low,close,tick_vol,spread)")
+    parser.add_argument("-o", "--output", required=True, help="output directory (chunks + manifest.json)")
+    parser.add_argument("--chunk", type=int, default=DEFAULT_EXPORT_CHUNK, help="source bars per output chunk")
+    parser.add_argument("--restart", action="store_true", help="discard existing chunks and export from scratch")
+    args = parser.parse_args(argv)
+    if args.chunk < M5_WINDOW:
+        parser.error(f"--chunk must be at least {M5_WINDOW}")
+
+    logging.getLogger().setLevel(logging.WARNING)
+    cfg = runtime_config.current()
+    previous = load_manifest(args.output)
+    resumed = 0 if previous is None or args.restart else sum(
+        1 for c in previous["chunks"] if c["bars"] == previous.get("chunk_size"))
+
+    t0 = time.perf_counter()
+    try:
+        manifest = export(args.history, args.output, args.chunk, cfg, restart=args.restart)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    rows = sum(c["rows"] for c in manifest["chunks"])
+    bars = sum(c["bars"] for c in manifest["chunks"])
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Bars: {bars} | Rows: {rows} | Chunks: {len(manifest['chunks'])} (resumed after {resumed}) | "
+          f"Config: {manifest['config_version']} | {time.perf_counter() - t0:.1f}s | Peak RSS: {peak_mb:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# tools/fill_model.py
+"""
+K 线内价格路径成交模型 (回放用，没有真实 tick 时)
+
+K 线级回放 (tools.replay.simulate_trade) 不知道一根 K 线里 entry / SL / TP 谁先到，一律按 SL 先到处理。
+这对 Stage 3 贴身 0.5 ATR 的止损、Stage 1 巨型 K 线 50% 位置的止损影响很大:
+成交那根 K 线的低点可能出现在成交之前，K 线级模型仍然判为止损。
+
+这里为每根 K 线一次性生成 n_paths 条可能的 K 线内路径 (向量化，没有逐 tick 的 Python 循环):
+- 每条路径从 open 出发、在 close 结束，恰好触及 high 与 low (先高后低或先低后高，
+  先后的概率按两种走法的路程长短给出: 路程越短越可能)，极值出现的时刻随机
+- 各段之间叠加布朗桥噪声 (端点固定，幅度与 K 线振幅成正比)，再截断在 [low, high] 内
+- Bid 为路径本身，Ask = Bid + 本根点差 (spread 点 × SPREAD_POINT)
+在路径上按时间顺序判断: 挂单成交 (买单看 Ask，卖单看 Bid) -> 成交之后的 SL / TP / 1R
+(同一步同时满足按 SL 处理)。挂单有效期按秒计 (EA: 下单后 600 秒过期)，
+用真实 K 线时间戳判断，休市跨越的时间同样计入。跳空开盘越过水平时按开盘价成交 / 出场。
+结果是各事件在路径上的频率 (p_fill / p_sl / p_tp / p_hit_1r) 与期望 R，
+代表性成交 (价格、K 线、出场原因) 取成交路径中 R 的中位数那一条。
+"""
+import numpy as np
+
+from app.history import T, O, H, L, C, S
+
+M5_SECONDS = 300
+# 挂单有效期 (EA: ORDER_TIME_SPECIFIED，TimeCurrent() + 600)
+EXPIRY_SECONDS = 600
+# 点差的点值 (XAUUSD 3 位小数，与 global_risk 的 ATR * 1000 换算一致)
+SPREAD_POINT = 0.001
+DEFAULT_PATHS = 64
+DEFAULT_STEPS = 60          # 每根 K 线的步数 (5 秒一步)
+NOISE = 0.25                # 布朗桥噪声: 整根 K 线上的标准差约为振幅的 NOISE 倍
+
+PATH_FIELDS = ("p_fill", "p_sl", "p_tp", "p_hit_1r", "r_mean")
+
+
+def intrabar_paths(bars, n_paths=DEFAULT_PATHS, steps=DEFAULT_STEPS, rng=None, noise=NOISE):
+    """
+    bars: (nb, 7) K 线 -> Bid 路径 (nb, n_paths, steps + 1)
+    第 0 步 = open，最后一步 = close，每条路径的最大值 = high、最小值 = low
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    nb = len(bars)
+    o, h, l, c = (bars[:, k][:, None] for k in (O, H, L, C))
+
+    # 先高后低 (O->H->L->C) 与先低后高 (O->L->H->C) 的路程; 路程短的一种更可能
+    len_high_first = (h - o) + (h - l) + (c - l)
+    len_low_first = (o - l) + (h - l) + (h - c)
+    total = len_high_first + len_low_first
+    p_high_first = np.divide(len_low_first, total, out=np.full_like(total, 0.5), where=total > 0)
+    high_first = rng.random((nb, n_paths)) < p_high_first
+    x1 = np.where(high_first, h, l)[..., None]
+    x2 = np.where(high_first, l, h)[..., None]
+
+    # 两个极值的时刻 t1 < t2 (步号 1 .. steps-1)
+    u = rng.random((2, nb, n_paths))
+    t1 = 1 + np.floor(u[0] * (steps - 2)).astype(np.int64)
+    t2 = t1 + 1 + np.floor(u[1] * (steps - 1 - t1)).astype(np.int64)
+    t1, t2 = t1[..., None], t2[..., None]
+
+    t = np.arange(steps + 1)
+    seg_a = np.where(t < t1, 0, np.where(t < t2, t1, t2))
+    seg_b = np.where(t < t1, t1, np.where(t < t2, t2, steps))
+    va = np.where(t < t1, o[..., None], np.where(t < t2, x1, x2))
+    vb = np.where(t < t1, x1, np.where(t < t2, x2, c[..., None]))
+    frac = (t - seg_a) / (seg_b - seg_a)
+    path = va + (vb - va) * frac
+
+    # 布朗桥: 每段端点 (open / 两个极值 / close) 处为 0
+    walk = np.concatenate((np.zeros((nb, n_paths, 1)),
+                           np.cumsum(rng.standard_normal((nb, n_paths, steps)), axis=-1)), axis=-1)
+    wa = np.take_along_axis(walk, seg_a, axis=-1)
+    wb = np.take_along_axis(walk, seg_b, axis=-1)
+    bridge = walk - wa - (wb - wa) * frac
+    scale = (noise * (h - l) / np.sqrt(steps))[..., None]
+    return np.clip(path + scale * bridge, l[..., None], h[..., None])
+
+
+def _first(mask):
+    """每行第一个 True 的列号，没有则为 -1"""
+    idx = mask.argmax(axis=1)
+    return np.where(mask.any(axis=1), idx, -1)
+
+
+def simulate_trade_paths(bars, i, action, entry, sl, tp, expiry_seconds=EXPIRY_SECONDS, horizon=48,
+                         n_paths=DEFAULT_PATHS, steps=DEFAULT_STEPS, seed=0, delay_seconds=0):
+    """
+    与 tools.replay.simulate_trade 相同的挂单 / 出场规则，在 K 线内路径上判断先后
+    挂单在第 i+1 根开盘后 delay_seconds 秒下单，expiry_seconds 秒后过期;
+    成交后最多持有到成交那根之后的第 horizon - 1 根，仍未出场按该根收盘价平仓
+    返回 simulate_trade 的字段 (代表性路径) + PATH_FIELDS
+    """
+    is_buy = "BUY" in action
+    is_stop = "STOP" in action
+    direction = 1.0 if is_buy else -1.0
+    n = len(bars)
+    first = i + 1
+    if first >= n:
+        return _no_fill()
+
+    # 可能成交的 K 线 (按时间戳算有效期) + 成交后最多 horizon 根
+    order_start = bars[first, T] + delay_seconds
+    order_end = order_start + expiry_seconds
+    last_fill_bar = int(np.searchsorted(bars[:, T], order_end, side="left")) - 1
+    stop = min(n, last_fill_bar + horizon)
+    # 每条路径都会触及每根 K 线的高低点: 有效期之后第一根振幅覆盖 SL / TP 的 K 线上，所有持仓路径都已出场，
+    # 之后的 K 线不必生成路径
+    after_bars = bars[last_fill_bar + 1:stop]
+    spread = after_bars[:, S] * SPREAD_POINT
+    if is_buy:
+        ends = (after_bars[:, L] <= sl) | ((after_bars[:, H] >= tp) if tp > 0 else False)
+    else:
+        ends = (after_bars[:, H] + spread >= sl) | ((after_bars[:, L] + spread <= tp) if tp > 0 else False)
+    if ends.any():
+        stop = last_fill_bar + 2 + int(ends.argmax())
+    window = bars[first:stop]
+    nb = len(window)
+
+    # 随机数按信号 K 线的时间戳取种子: 同一笔交易在整段 / 分区回放中得到相同的路径
+    rng = np.random.default_rng([seed, int(bars[i, T])])
+    bid = intrabar_paths(window, n_paths, steps, rng).transpose(1, 0, 2).reshape(n_paths, nb * (steps + 1))
+    ask = bid + np.repeat(window[:, S] * SPREAD_POINT, steps + 1)
+    times = (window[:, T][:, None] + np.arange(steps + 1) * (M5_SECONDS / steps)).ravel()
+    bar_of = np.repeat(np.arange(nb), steps + 1)
+    at_open = np.tile(np.arange(steps + 1) == 0, nb)
+
+    # 1. 挂单成交 (买单看 Ask，卖单看 Bid)
+    quote = ask if is_buy else bid
+    if is_stop:
+        hit = quote >= entry if is_buy else quote <= entry
+    else:
+        hit = quote <= entry if is_buy else quote >= entry
+    live = (times >= order_start) & (times < order_end)
+    fill_idx = _first(hit & live)
+    filled = fill_idx >= 0
+    if not filled.any():
+        return _no_fill()
+
+    rows = np.arange(n_paths)
+    fi = np.maximum(fill_idx, 0)
+    fill_quote = quote[rows, fi]
+    # 跳空开盘越过挂单价: 按开盘价成交 (Stop 更差、Limit 更好)
+    gapped = np.where(is_buy == is_stop, np.maximum(entry, fill_quote), np.minimum(entry, fill_quote))
+    fill_price = np.where(at_open[fi], gapped, entry)
+
+    # 2. 成交之后: SL / TP / 超时 (平多看 Bid，平空看 Ask)
+    close_quote = bid if is_buy else ask
+    step = np.arange(close_quote.shape[1])
+    fill_bar = bar_of[fi]
+    last_bar = np.minimum(fill_bar + horizon, nb) - 1
+    after = (step[None, :] > fi[:, None]) & (bar_of[None, :] <= last_bar[:, None])
+    sl_hit = (close_quote <= sl) if is_buy else (close_quote >= sl)
+    tp_hit = ((close_quote >= tp) if is_buy else (close_quote <= tp)) if tp > 0 else np.zeros_like(sl_hit)
+    sl_idx = _first(sl_hit & after)
+    tp_idx = _first(tp_hit & after)
+    # 同一步同时满足 (或 SL 更早) 按 SL 处理
+    sl_first = (sl_idx >= 0) & ((tp_idx < 0) | (sl_idx <= tp_idx))
+    tp_first = (tp_idx >= 0) & ~sl_first
+    timeout_idx = (last_bar + 1) * (steps + 1) - 1
+    exit_idx = np.where(sl_first, sl_idx, np.where(tp_first, tp_idx, timeout_idx))
+    exit_quote = close_quote[rows, exit_idx]
+    exit_gap = at_open[exit_idx]
+    sl_price = np.where(exit_gap, np.minimum(sl, exit_quote) if is_buy else np.maximum(sl, exit_quote), sl)
+    tp_price = np.where(exit_gap, np.maximum(tp, exit_quote) if is_buy else np.minimum(tp, exit_quote), tp)
+    exit_price = np.where(sl_first, sl_price, np.where(tp_first, tp_price, exit_quote))
+
+    risk = abs(entry - sl) or 1e-9
+    target_1r = fill_price + direction * risk
+    reach = (close_quote >= target_1r[:, None]) if is_buy else (close_quote <= target_1r[:, None])
+    hit_1r = (reach & after & (step[None, :] <= exit_idx[:, None])).any(axis=1)
+    r = direction * (exit_price - fill_price) / risk
+    stats = {"p_fill": float(filled.mean()), "p_sl": float(sl_first[filled].mean()),
+             "p_tp": float(tp_first[filled].mean()), "p_hit_1r": float(hit_1r[filled].mean()),
+             "r_mean": float(r[filled].mean())}
+    if stats["p_fill"] < 0.5:
+        return {**_no_fill(), **stats}
+
+    # 代表性路径: 成交路径中 R 的中位数
+    filled_rows = np.flatnonzero(filled)
+    k = filled_rows[np.argsort(r[filled_rows], kind="stable")[len(filled_rows) // 2]]
+    reason = "SL" if sl_first[k] else ("TP" if tp_first[k] else "TIMEOUT")
+    return {
+        "filled": True, "fill_bar": first + int(fill_bar[k]), "fill_price": float(fill_price[k]),
+        "exit_bar": first + int(bar_of[exit_idx[k]]), "exit_price": float(exit_price[k]), "exit_reason": reason,
+        "hit_1r": bool(hit_1r[k]), "r_multiple": float(r[k]), **stats,
+    }
+
+
+def _no_fill():
+    return {"filled": False, "fill_bar": -1, "fill_price": 0.0, "exit_bar": -1, "exit_price": 0.0,
+            "exit_reason": "NOFILL", "hit_1r": False, "r_multiple": 0.0,
+            "p_fill": 0.0, "p_sl": 0.0, "p_tp": 0.0, "p_hit_1r": 0.0, "r_mean": 0.0}
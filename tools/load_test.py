@@ -0,0 +1,432 @@
+# tools/load_test.py
+"""
+多终端压测 (Fleet Load Generator)
+
+模拟 N 个 MT5 终端按 EA 的节奏 (每 5 秒一次，同步等待响应) 调用 /signal:
+- 每个终端有自己的行情 (随机游走 + 波动率 / 趋势切换)，M5 / H1 K 线逐根演化
+- 随机持仓; 可配置"禁止交易时段"和"高点差"请求的比例
+- 记录吞吐、p50/p99/max 延迟、错误率、超过 EA WebRequest 5000ms 的超时率
+- 采样服务端进程 (含 worker 子进程) 的 RSS 与 CPU (/proc)
+
+依次跑多个终端数，输出容量曲线 (terminals / core)。
+
+用法:
+    python -m tools.load_test --spawn --workers 1 --terminals 10,50,100,200,400 --duration 60
+    python -m tools.load_test --spawn --workers 4 --state-backend shm --terminals 200,400,800
+    python -m tools.load_test --url http://127.0.0.1:8002 --pid 1234 --terminals 50,100
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from app import config
+
+EA_CADENCE_SECONDS = 5.0
+EA_TIMEOUT_MS = 5000
+M5_BARS = 110
+H1_BARS = 50
+# 服务器时间 (冬令时 +6 = 北京时间): 4-20 点可交易，22 点落在禁止交易时段
+TRADE_SERVER_HOURS = tuple(range(4, 21))
+NO_TRADE_SERVER_HOUR = 22
+HIGH_SPREAD_POINTS = 3000
+RSS_SAMPLE_SECONDS = 1.0
+
+
+# ==================================================================
+# 虚拟终端行情
+# ==================================================================
+class VirtualTerminal:
+    """
+    单个终端的行情与账户状态
+    每次请求推进 bar_seconds / requests_per_bar 的虚拟时间; 跨过 K 线边界时收线开新 K 线
+    """
+
+    def __init__(self, terminal_id, seed=0, requests_per_bar=60, no_trade_share=0.1,
+                 high_spread_share=0.05, position_share=0.3):
+        self.id = terminal_id
+        self.rng = random.Random(seed * 100_003 + terminal_id)
+        self.symbol = f"XAUUSD.{terminal_id}"
+        self.account = 10_000_000 + terminal_id
+        self.step_seconds = 300.0 / requests_per_bar
+        self.no_trade_share = no_trade_share
+        self.high_spread_share = high_spread_share
+        self.position_share = position_share
+
+        self.vol = 1.0      # 每根 M5 的典型波动 (美元)
+        self.drift = 0.0
+        self.now = 1_700_000_000.0 + self.rng.randrange(0, 3600 * 24 * 30) // 3600 * 3600
+        self.m5 = self._seed_bars(M5_BARS, 300, self.vol)
+        self.h1 = self._seed_bars(H1_BARS, 3600, self.vol * 3.5)
+        self.positions = []
+        self.requests = 0
+
+    def _seed_bars(self, n, step, vol):
+        bars = []
+        price = 2000.0 + self.rng.uniform(-100, 100)
+        t0 = int(self.now // step * step) - (n - 1) * step
+        for i in range(n):
+            o = price
+            c = o + self.rng.gauss(0, vol)
+            bars.append(self._bar(t0 + i * step, o, max(o, c) + abs(self.rng.gauss(0, vol * 0.3)),
+                                  min(o, c) - abs(self.rng.gauss(0, vol * 0.3)), c))
+            price = c
+        return bars
+
+    def _bar(self, t, o, h, l, c):
+        return {"time": int(t), "open": round(o, 2), "high": round(h, 2), "low": round(l, 2),
+                "close": round(c, 2), "tick_vol": self.rng.randint(50, 500), "spread": self.rng.randint(150, 300)}
+
+    def _regime_switch(self):
+        """每根新 K 线有小概率切换波动率 / 趋势，让 L3 的阶段判断有变化"""
+        if self.rng.random() < 0.02:
+            self.vol = self.rng.choice((0.5, 1.0, 2.0, 4.0))
+        if self.rng.random() < 0.03:
+            self.drift = self.rng.choice((-0.3, 0.0, 0.0, 0.3)) * self.vol
+
+    def _tick(self):
+        """推进虚拟时间并更新正在形成的 M5 / H1 K 线"""
+        self.now += self.step_seconds
+        for bars, step in ((self.m5, 300), (self.h1, 3600)):
+            last = bars[-1]
+            if self.now >= last["time"] + step:
+                o = last["close"]
+                bars.append(self._bar(last["time"] + step, o, o, o, o))
+                del bars[0]
+                if step == 300:
+                    self._regime_switch()
+
+        sub_steps = 300.0 / self.step_seconds
+        move = self.rng.gauss(self.drift / sub_steps, self.vol / math.sqrt(sub_steps))
+        price = self.m5[-1]["close"] + move
+        for bar in (self.m5[-1], self.h1[-1]):
+            bar["close"] = round(price, 2)
+            bar["high"] = max(bar["high"], bar["close"])
+            bar["low"] = min(bar["low"], bar["close"])
+        return price
+
+    def _update_positions(self, price):
+        if not self.positions and self.rng.random() < self.position_share / 60.0:
+            side = self.rng.choice(("BUY", "SELL"))
+            sign = 1 if side == "BUY" else -1
+            self.positions.append({
+                "ticket": self.rng.randint(1_000_000, 9_999_999), "type": side,
+                "volume": self.rng.choice((0.01, 0.02, 0.04)), "open_price": round(price, 2),
+                "current_price": round(price, 2), "sl": round(price - sign * self.vol * 3, 2), "tp": 0.0,
+                "profit": 0.0, "comment": "AB_Agent",
+            })
+        elif self.positions and self.rng.random() < 1.0 / 120:
+            self.positions.clear()
+        for p in self.positions:
+            sign = 1 if p["type"] == "BUY" else -1
+            p["current_price"] = round(price, 2)
+            p["profit"] = round(sign * (price - p["open_price"]) * p["volume"] * 100, 2)
+
+    def next_payload(self):
+        """生成下一次请求的 JSON (bytes)"""
+        self.requests += 1
+        price = self._tick()
+        self._update_positions(price)
+
+        r = self.rng.random()
+        if r < self.no_trade_share:
+            hour = NO_TRADE_SERVER_HOUR
+        else:
+            hour = self.rng.choice(TRADE_SERVER_HOURS)
+        spread = HIGH_SPREAD_POINTS if self.rng.random() < self.high_spread_share else self.rng.randint(150, 300)
+
+        payload = {
+            "symbol": self.symbol, "account_login": self.account,
+            "server_time_hour": hour, "server_time_minute": self.rng.randint(0, 59),
+            "bid": round(price, 2), "ask": round(price + spread / 1000.0, 2), "spread": spread,
+            "account_equity": config.INITIAL_BALANCE + sum(p["profit"] for p in self.positions),
+            "margin_level": 0.0 if not self.positions else 2000.0,
+            "m5_candles": self.m5, "h1_candles": self.h1,
+            "news_info": {"has_news": False, "impact_level": 0, "minutes_to_news": 999, "event_name": "None"},
+            "current_positions": self.positions,
+        }
+        return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+
+# ==================================================================
+# HTTP 客户端 (与 EA 一样每次请求新建连接)
+# ==================================================================
+async def post_json(host, port, path, body):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(
+            f"POST {path} HTTP/1.1\r\nHost: {host}:{port}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii") + body
+        )
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        length = None
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        if length is not None:
+            await reader.readexactly(length)
+        else:
+            await reader.read()
+        return status
+    finally:
+        writer.close()
+
+
+class StepStats:
+    def __init__(self):
+        self.latencies_ms = []
+        self.errors = 0
+        self.timeouts = 0
+
+
+async def _terminal_loop(term, host, port, path, stats, start_at, stop_at, record_after):
+    """EA 行为: 同步发送 -> 等响应 -> 距上次发送满 5 秒后再发"""
+    await asyncio.sleep(max(0.0, start_at - time.monotonic()))
+    loop_t = time.monotonic()
+    while loop_t < stop_at:
+        body = term.next_payload()
+        t0 = time.monotonic()
+        status = None
+        try:
+            status = await asyncio.wait_for(post_json(host, port, path, body), EA_TIMEOUT_MS / 1000.0)
+        except asyncio.TimeoutError:
+            if t0 >= record_after:
+                stats.timeouts += 1
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+            if t0 >= record_after:
+                stats.errors += 1
+        elapsed_ms = (time.monotonic() - t0) * 1000.0
+        if t0 >= record_after and status is not None:
+            if status == 200:
+                stats.latencies_ms.append(elapsed_ms)
+            else:
+                stats.errors += 1
+        loop_t = max(loop_t + EA_CADENCE_SECONDS, time.monotonic())
+        await asyncio.sleep(max(0.0, loop_t - time.monotonic()))
+
+
+# ==================================================================
+# 服务端进程采样 (/proc)
+# ==================================================================
+def _process_tree(pid):
+    pids = [pid]
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                for child in f.read().split():
+                    pids.extend(_process_tree(int(child)))
+    except OSError:
+        pass
+    return pids
+
+
+def sample_process(pid):
+    """返回 (rss_mb, cpu_seconds)，包含所有子进程 (uvicorn --workers)"""
+    rss_kb, ticks = 0, 0
+    for p in _process_tree(pid):
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss_kb += int(line.split()[1])
+                        break
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+                ticks += int(fields[11]) + int(fields[12])  # utime + stime
+        except OSError:
+            continue
+    return rss_kb / 1024.0, ticks / os.sysconf("SC_CLK_TCK")
+
+
+async def _sample_rss(pid, series, t_origin, stop_at):
+    while time.monotonic() < stop_at:
+        rss, cpu = sample_process(pid)
+        series.append((round(time.monotonic() - t_origin, 2), round(rss, 1), round(cpu, 2)))
+        await asyncio.sleep(RSS_SAMPLE_SECONDS)
+
+
+async def run_step(n_terminals, host, port, path, duration, pid=None, seed=0, ramp=EA_CADENCE_SECONDS, **term_kwargs):
+    """
+    跑一个终端数档位: 启动在一个周期内均匀错开，前 ramp 秒不计入统计
+    返回该档位的汇总 dict
+    """
+    terminals = [VirtualTerminal(i, seed, **term_kwargs) for i in range(n_terminals)]
+    stats = StepStats()
+    series = []
+    now = time.monotonic()
+    record_after = now + ramp
+    stop_at = record_after + duration
+
+    cpu_before = sample_process(pid)[1] if pid else None
+    client_cpu_before = time.process_time()
+    tasks = [
+        _terminal_loop(t, host, port, path, stats, now + EA_CADENCE_SECONDS * i / n_terminals, stop_at, record_after)
+        for i, t in enumerate(terminals)
+    ]
+    if pid:
+        tasks.append(_sample_rss(pid, series, now, stop_at))
+    await asyncio.gather(*tasks)
+    wall = duration
+
+    lat = np.asarray(stats.latencies_ms)
+    total = len(lat) + stats.errors + stats.timeouts
+    row = {
+        "terminals": n_terminals,
+        "requests": total,
+        "throughput_rps": total / wall if wall > 0 else 0.0,
+        "p50_ms": float(np.percentile(lat, 50)) if len(lat) else None,
+        "p99_ms": float(np.percentile(lat, 99)) if len(lat) else None,
+        "max_ms": float(lat.max()) if len(lat) else None,
+        "error_rate": stats.errors / total if total else 0.0,
+        "timeout_rate": stats.timeouts / total if total else 0.0,
+        "client_cpu_cores": (time.process_time() - client_cpu_before) / (time.monotonic() - now),
+    }
+    if pid:
+        # CPU 从启动开始算 (包含 ramp)，与 ramp 期间的请求量大致抵消
+        server_cpu = (sample_process(pid)[1] - cpu_before) / (time.monotonic() - now)
+        row["server_cpu_cores"] = server_cpu
+        row["terminals_per_core"] = n_terminals / server_cpu if server_cpu > 0 else None
+        row["rss_mb_max"] = max(s[1] for s in series) if series else None
+        row["rss_series"] = series
+    return row
+
+
+# ==================================================================
+# 本地服务端
+# ==================================================================
+def spawn_server(port, workers, state_dir, state_backend="local"):
+    """启动本地 uvicorn; 状态快照写到临时目录，不污染 app/data; 共享内存用独立的段名"""
+    override = os.path.join(state_dir, "config_override.json")
+    with open(override, "w", encoding="utf-8") as f:
+        json.dump({"STATE_SNAPSHOT_FILE": os.path.join(state_dir, "state_snapshot.bin"),
+                   "STATE_BACKEND": state_backend, "STATE_SHM_NAME": f"load_test_{os.getpid()}"}, f)
+    env = dict(os.environ, AGENT_CONFIG_FILE=override)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1):
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("server did not become healthy within 30s")
+
+
+def capacity(rows, cores, p99_budget_ms):
+    """满足 SLO (无错误 / 超时，p99 < 预算) 的最大终端数，及折算到每核"""
+    ok = [r for r in rows if r["error_rate"] == 0 and r["timeout_rate"] == 0
+          and r["p99_ms"] is not None and r["p99_ms"] < p99_budget_ms]
+    best = max((r["terminals"] for r in ok), default=0)
+    return best, best / cores if cores else None
+
+
+def _parse_url(url):
+    rest = url.split("://", 1)[-1]
+    hostport, _, path = rest.partition("/")
+    host, _, port = hostport.partition(":")
+    return host, int(port or 80), "/" + (path or "signal")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate N MT5 terminals against /signal and report a capacity curve")
+    parser.add_argument("--url", default="http://127.0.0.1:8002/signal")
+    parser.add_argument("--spawn", action="store_true", help="start a local uvicorn server for the test")
+    parser.add_argument("--port", type=int, default=8123, help="port for --spawn")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for --spawn (= cores used)")
+    parser.add_argument("--state-backend", choices=("local", "shm"), default="local",
+                        help="STATE_BACKEND for --spawn (shm = one shared state for all workers)")
+    parser.add_argument("--pid", type=int, default=None, help="server pid to sample RSS/CPU (implied by --spawn)")
+    parser.add_argument("--cores", type=float, default=None, help="cores available to the server (default: --workers)")
+    parser.add_argument("--terminals", default="10,50,100,200", help="terminal counts, comma separated")
+    parser.add_argument("--duration", type=float, default=60.0, help="measured seconds per step")
+    parser.add_argument("--requests-per-bar", type=int, default=60,
+                        help="requests per M5 bar (60 = real time; smaller = faster market)")
+    parser.add_argument("--no-trade-share", type=float, default=0.1)
+    parser.add_argument("--high-spread-share", type=float, default=0.05)
+    parser.add_argument("--position-share", type=float, default=0.3)
+    parser.add_argument("--p99-budget-ms", type=float, default=EA_TIMEOUT_MS / 5,
+                        help="p99 latency that still counts as healthy (default: 1/5 of the EA timeout)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="write all steps (with RSS series) as JSON")
+    args = parser.parse_args(argv)
+
+    proc, state_dir = None, None
+    if args.spawn:
+        state_dir = tempfile.mkdtemp(prefix="load_test_")
+        proc = spawn_server(args.port, args.workers, state_dir, args.state_backend)
+        host, port, path = "127.0.0.1", args.port, "/signal"
+        pid = proc.pid
+    else:
+        host, port, path = _parse_url(args.url)
+        pid = args.pid
+    cores = args.cores or args.workers
+
+    term_kwargs = dict(requests_per_bar=args.requests_per_bar, no_trade_share=args.no_trade_share,
+                       high_spread_share=args.high_spread_share, position_share=args.position_share)
+    rows = []
+    try:
+        print(f"Target: {host}:{port}{path} | cores: {cores} | {args.duration:.0f}s per step | "
+              f"timeout {EA_TIMEOUT_MS}ms | p99 budget {args.p99_budget_ms:.0f}ms")
+        print(f"{'terms':>6} | {'req/s':>7} | {'p50':>7} | {'p99':>7} | {'max':>7} | {'err%':>5} | {'tmo%':>5} "
+              f"| {'srv cpu':>7} | {'term/core':>9} | {'rss MB':>7}")
+        for n in [int(x) for x in args.terminals.split(",") if x.strip()]:
+            row = asyncio.run(run_step(n, host, port, path, args.duration, pid, args.seed, **term_kwargs))
+            rows.append(row)
+
+            def fmt(v, spec):
+                return format(v, spec) if v is not None else "-"
+            print(f"{n:>6} | {row['throughput_rps']:7.1f} | {fmt(row['p50_ms'], '7.1f')} | {fmt(row['p99_ms'], '7.1f')} "
+                  f"| {fmt(row['max_ms'], '7.1f')} | {row['error_rate'] * 100:5.1f} | {row['timeout_rate'] * 100:5.1f} "
+                  f"| {fmt(row.get('server_cpu_cores'), '7.2f')} | {fmt(row.get('terminals_per_core'), '9.0f')} "
+                  f"| {fmt(row.get('rss_mb_max'), '7.1f')}")
+            if row["client_cpu_cores"] > 0.8:
+                print(f"       ! load generator used {row['client_cpu_cores']:.2f} cores; "
+                      f"latencies may include client-side queueing")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+            if args.state_backend == "shm":
+                from app.shm_state import remove_lock_file
+                remove_lock_file(f"load_test_{os.getpid()}")
+
+    best, per_core = capacity(rows, cores, args.p99_budget_ms)
+    print(f"Capacity within SLO: {best} terminals on {cores} core(s)"
+          + (f" = {per_core:.0f} terminals/core" if per_core else ""))
+    measured = [r["terminals_per_core"] for r in rows if r.get("terminals_per_core")]
+    if measured:
+        # 最高档位的 CPU 折算更接近稳态 (低档位时固定开销占比大)
+        print(f"CPU-extrapolated at the largest step: {measured[-1]:.0f} terminals/core "
+              f"(not yet latency-verified beyond {best})")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"cores": cores, "p99_budget_ms": args.p99_budget_ms, "capacity_terminals": best,
+                       "terminals_per_core": per_core, "steps": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+# tools/replay.py
+"""
+离线回放 (Replay)
+
+按 EA 的发包方式 (M5 最近 110 根 + H1 最近 50 根，含当前未收盘 H1) 逐根 K 线
+调用与 /signal 相同的决策流水线 (app.pipeline)，再用后续 K 线模拟挂单成交与出场。
+
+并行回放 (--workers N): 把 [start, end) 按时间切成若干分区，放进进程池各自回放，再按顺序拼接:
+- 决策只依赖最近 110 根 M5 与 50 根 H1 (EMA / ATR / 拐点都在窗口内重新计算)，
+  每个分区向前多带 WARMUP_BARS 根 (H1 窗口 + 可能不完整的首个 H1 桶)，之后的决策与整段顺序回放一致
+- 再向前多算 CHECK_BARS 根: 与上一个分区对这些 K 线的决策 (阶段 / 趋势 / Setup / 动作 / 价格 / 手数) 逐根比对，
+  不一致的 K 线列在报告中 (以上一个分区的结果为准)
+- 每个分区向后多带 EXPIRY_BARS + HORIZON_BARS 根用于成交 / 出场模拟
+多年的 M5 历史按核数近似线性加速 (每个分区固定多算约 900 根)。
+
+--fill-model paths: 用 K 线内路径模型 (tools.fill_model) 判断 entry / SL / TP 的先后与 600 秒挂单有效期，
+输出多出 p_fill / p_sl / p_tp / p_hit_1r / r_mean 列; 默认 bar 为原来的 K 线级保守模型。
+
+用法:
+    python -m tools.replay history.csv -o trades.csv
+    python -m tools.replay history.csv -o trades.csv --workers 8
+    python -m tools.replay history.csv -o trades.csv --fill-model paths --paths 128
+"""
+import argparse
+import concurrent.futures
+import csv
+import logging
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from app import backends, runtime_config
+from app.history import load_bars, to_candles, T, O, H, L, C, S
+from app.indicators import BarFrame
+from app.pipeline import risk_svc, prepare_market_data, evaluate_entry
+from app.resample import TIMEFRAME_SECONDS, resample
+from app.schemas import NewsInfo
+from tools.fill_model import DEFAULT_PATHS, M5_SECONDS, PATH_FIELDS, simulate_trade_paths
+
+M5_WINDOW = 110        # EA: CopyRates(PERIOD_M5, 0, 110)
+H1_WINDOW = 50         # EA: CopyRates(PERIOD_H1, 0, 50)
+EXPIRY_BARS = 2        # EA 挂单有效期 600 秒 = 2 根 M5
+HORIZON_BARS = 48      # 成交后 4 小时仍未出场 -> 按收盘价平仓
+CONTRACT_SIZE = 100    # XAUUSD 1 手 = 100 盎司 (与 L5 手数公式一致)
+# 并行回放: 分区向前带的预热根数 (50 根完整 H1 + 首个可能不完整的 H1 桶，每桶最多 12 根 M5) 与比对根数 (1 天)
+WARMUP_BARS = (H1_WINDOW + 2) * 12
+CHECK_BARS = 288
+FILL_MODELS = ("bar", "paths")
+
+TRADE_FIELDS = (
+    "bar", "time", "stage", "trend", "setup", "is_trend_bar", "control", "rejection_type", "atr",
+    "action", "entry", "sl", "tp", "lot", "filled", "fill_bar", "fill_price",
+    "exit_bar", "exit_price", "exit_reason", "hit_1r", "r_multiple", "pnl_usd",
+)
+
+_NO_NEWS = NewsInfo(has_news=False, impact_level=0, minutes_to_news=999, event_name="None")
+
+
+class H1Window:
+    """
+    从 M5 聚合 H1 (app.resample)，并按 EA 的方式给出"截至第 i 根 M5"的 H1 窗口
+    (已收盘的 H1 + 当前正在形成的 H1)
+    """
+
+    def __init__(self, bars, seconds=TIMEFRAME_SECONDS["H1"]):
+        self.bars = bars
+        self.seconds = seconds
+        bucket = (bars[:, T] // seconds).astype(np.int64)
+        # 每个 H1 桶的起始 M5 下标
+        change = np.flatnonzero(np.diff(bucket)) + 1
+        self.starts = np.concatenate(([0], change))
+        ends = np.concatenate((change, [len(bars)]))
+        self.bucket_of = np.repeat(np.arange(len(self.starts)), ends - self.starts)
+        self.completed = resample(bars, seconds, drop_partial_head=False)
+
+    def window(self, i, size=H1_WINDOW):
+        b = self.bucket_of[i]
+        current = resample(self.bars[self.starts[b]:i + 1], self.seconds, drop_partial_head=False)
+        return BarFrame.from_array(np.concatenate((self.completed[max(0, b - size + 1):b], current)))
+
+
+def _risk_view(bars, i, cfg):
+    """构造 L0 需要的请求字段 (时间/点差取自 K 线，账户字段取配置初值)"""
+    ts = int(bars[i, T])
+    return SimpleNamespace(
+        server_time_hour=(ts // 3600) % 24, server_time_minute=(ts // 60) % 60, server_time=ts,
+        spread=int(bars[i, S]), account_equity=cfg.INITIAL_BALANCE, margin_level=0.0,
+        news_info=_NO_NEWS, last_closed_profit=0.0, last_closed_time=0, m5_candles=None,
+    )
+
+
+def iter_signals(bars, cfg=None, start=None, end=None, apply_risk=True, prob_gate=True):
+    """
+    逐根回放，产出 (i, stage, trend_dir, atr, entry_result)
+    i 是信号棒 (当前 K 线) 的下标; entry_result 同 pipeline.evaluate_entry
+    """
+    cfg = cfg or runtime_config.current()
+    candles = to_candles(bars)
+    h1 = H1Window(bars)
+    start = max(M5_WINDOW - 1, start or 0)
+    end = len(bars) if end is None else min(end, len(bars))
+
+    for i in range(start, end):
+        window = candles[i - M5_WINDOW + 1:i + 1]
+        df_m5, current_atr = prepare_market_data(window, cfg=cfg)
+        if df_m5 is None:
+            continue
+        if apply_risk:
+            is_safe, _ = risk_svc.check_safety(_risk_view(bars, i, cfg), current_atr, cfg)
+            if not is_safe:
+                continue
+        stage, trend_dir = backends.identify_stage(df_m5, h1.window(i), current_atr, cfg)
+        entry_result = evaluate_entry(df_m5, window, stage, trend_dir, current_atr, cfg, prob_gate=prob_gate)
+        yield i, stage, trend_dir, current_atr, entry_result
+
+
+def simulate_trade(bars, i, action, entry, sl, tp, expiry_bars=EXPIRY_BARS, horizon=HORIZON_BARS):
+    """
+    K 线级成交/出场模拟 (同一根 K 线内先后顺序未知时一律按 SL 先到处理, 偏保守)
+    返回 dict (未成交时 filled=False)
+    """
+    is_buy = "BUY" in action
+    is_stop = "STOP" in action
+    direction = 1.0 if is_buy else -1.0
+    n = len(bars)
+
+    # 1. 挂单成交 (跳空时 Stop 单按开盘价成交, Limit 单按更优价成交)
+    fill_bar, fill_price = -1, 0.0
+    for j in range(i + 1, min(i + 1 + expiry_bars, n)):
+        o, hi, lo = bars[j, O], bars[j, H], bars[j, L]
+        if is_buy and is_stop and hi >= entry:
+            fill_bar, fill_price = j, max(entry, o)
+        elif is_buy and not is_stop and lo <= entry:
+            fill_bar, fill_price = j, min(entry, o)
+        elif not is_buy and is_stop and lo <= entry:
+            fill_bar, fill_price = j, min(entry, o)
+        elif not is_buy and not is_stop and hi >= entry:
+            fill_bar, fill_price = j, max(entry, o)
+        if fill_bar >= 0:
+            break
+    if fill_bar < 0:
+        return {"filled": False, "fill_bar": -1, "fill_price": 0.0, "exit_bar": -1, "exit_price": 0.0,
+                "exit_reason": "NOFILL", "hit_1r": False, "r_multiple": 0.0}
+
+    # 2. 出场: SL / TP / 超时
+    risk = abs(entry - sl) or 1e-9
+    target_1r = fill_price + direction * risk
+    hit_1r = False
+    last = min(fill_bar + horizon, n) - 1
+    exit_bar, exit_price, exit_reason = last, bars[last, C], "TIMEOUT"
+    for j in range(fill_bar, last + 1):
+        hi, lo = bars[j, H], bars[j, L]
+        sl_hit = lo <= sl if is_buy else hi >= sl
+        if sl_hit:
+            exit_bar, exit_price, exit_reason = j, sl, "SL"
+            break
+        if (hi >= target_1r) if is_buy else (lo <= target_1r):
+            hit_1r = True
+        if tp > 0 and ((hi >= tp) if is_buy else (lo <= tp)):
+            exit_bar, exit_price, exit_reason = j, tp, "TP"
+            break
+
+    return {
+        "filled": True, "fill_bar": fill_bar, "fill_price": fill_price,
+        "exit_bar": exit_bar, "exit_price": exit_price, "exit_reason": exit_reason,
+        "hit_1r": hit_1r, "r_multiple": direction * (exit_price - fill_price) / risk,
+    }
+
+
+def _record(bars, i, stage, trend_dir, atr, res, expiry_bars, horizon, fill_model="bar", n_paths=DEFAULT_PATHS):
+    if fill_model == "paths":
+        outcome = simulate_trade_paths(bars, i, res["action"], res["entry"], res["sl"], res["tp"],
+                                       expiry_seconds=expiry_bars * M5_SECONDS, horizon=horizon, n_paths=n_paths)
+    else:
+        outcome = simulate_trade(bars, i, res["action"], res["entry"], res["sl"], res["tp"], expiry_bars, horizon)
+    direction = 1.0 if "BUY" in res["action"] else -1.0
+    pnl = direction * (outcome["exit_price"] - outcome["fill_price"]) * res["lot"] * CONTRACT_SIZE if outcome["filled"] else 0.0
+    return {
+        "bar": i, "time": int(bars[i, T]), "stage": stage, "trend": trend_dir, "setup": res["setup"],
+        "is_trend_bar": bool(res["bar"]["is_trend_bar"]), "control": res["bar"]["control"],
+        "rejection_type": res["bar"]["rejection_type"], "atr": float(atr),
+        "action": res["action"], "entry": res["entry"], "sl": res["sl"], "tp": res["tp"], "lot": res["lot"],
+        **outcome, "pnl_usd": pnl,
+    }
+
+
+def replay(bars, cfg=None, start=None, end=None, apply_risk=True, prob_gate=True,
+           expiry_bars=EXPIRY_BARS, horizon=HORIZON_BARS, fill_model="bar", n_paths=DEFAULT_PATHS):
+    """回放并模拟每个开仓信号，返回信号记录列表 (字段见 TRADE_FIELDS; paths 模型另有 PATH_FIELDS)"""
+    records = []
+    for i, stage, trend_dir, atr, res in iter_signals(bars, cfg, start, end, apply_risk, prob_gate):
+        if res["action"] == "HOLD":
+            continue
+        records.append(_record(bars, i, stage, trend_dir, atr, res, expiry_bars, horizon, fill_model, n_paths))
+    return records
+
+
+def _decision(stage, trend_dir, res):
+    """分区比对用的决策摘要"""
+    return (stage, trend_dir, res["setup"], res["action"], res["entry"], res["sl"], res["tp"], res["lot"])
+
+
+def partition_bounds(start, end, partitions):
+    """把 [start, end) 等分成 partitions 段，返回 [(s, e), ...]"""
+    edges = np.linspace(start, end, partitions + 1).round().astype(int)
+    return [(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:]) if b > a]
+
+
+def _replay_partition(task):
+    """
+    进程池任务: 回放一个分区 [s, e)
+    返回 (本分区的信号记录, 分区前 CHECK_BARS 根的决策 {i: 摘要}, 本分区最后 CHECK_BARS 根的决策)
+    下标都已换算回整段历史
+    """
+    (bars, offset, s, e, check, cfg_values, cfg_source, apply_risk, prob_gate, expiry_bars, horizon,
+     fill_model, n_paths) = task
+    logging.getLogger().setLevel(logging.WARNING)
+    cfg = runtime_config.ConfigSnapshot(cfg_values, source=cfg_source)
+    records, head, tail = [], {}, {}
+    for j, stage, trend_dir, atr, res in iter_signals(bars, cfg, s - check - offset, e - offset, apply_risk, prob_gate):
+        i = j + offset
+        if i < s:
+            head[i] = _decision(stage, trend_dir, res)
+            continue
+        if i >= e - CHECK_BARS:
+            tail[i] = _decision(stage, trend_dir, res)
+        if res["action"] == "HOLD":
+            continue
+        r = _record(bars, j, stage, trend_dir, atr, res, expiry_bars, horizon, fill_model, n_paths)
+        r["bar"] = i
+        for k in ("fill_bar", "exit_bar"):
+            if r[k] >= 0:
+                r[k] += offset
+        records.append(r)
+    return records, head, tail
+
+
+def replay_parallel(bars, cfg=None, start=None, end=None, apply_risk=True, prob_gate=True,
+                    expiry_bars=EXPIRY_BARS, horizon=HORIZON_BARS, workers=None, partitions=None,
+                    fill_model="bar", n_paths=DEFAULT_PATHS):
+    """
+    按时间分区并行回放，结果与 replay() 相同
+    返回 (信号记录列表, 报告 {"partitions", "checked_bars", "mismatches": [K 线下标, ...]})
+    """
+    cfg = cfg or runtime_config.current()
+    workers = workers or os.cpu_count() or 1
+    start = max(M5_WINDOW - 1, start or 0)
+    end = len(bars) if end is None else min(end, len(bars))
+    bounds = partition_bounds(start, end, partitions or workers)
+
+    tasks = []
+    for s, e in bounds:
+        # 第一个分区之前没有可比对的结果，也不需要额外预热 (与整段回放的起点相同)
+        check = min(CHECK_BARS, s - start)
+        offset = max(0, s - check - WARMUP_BARS) if check > 0 else 0
+        stop = min(len(bars), e + expiry_bars + horizon)
+        tasks.append((bars[offset:stop], offset, s, e, check, cfg.as_dict(), cfg.source,
+                      apply_risk, prob_gate, expiry_bars, horizon, fill_model, n_paths))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+        results = list(pool.map(_replay_partition, tasks))
+
+    records, mismatches, checked = [], [], 0
+    for k, (part, head, _) in enumerate(results):
+        records.extend(part)
+        if k == 0:
+            continue
+        previous = results[k - 1][2]
+        for i in range(bounds[k][0] - CHECK_BARS, bounds[k][0]):
+            if i in head or i in previous:
+                checked += 1
+                if head.get(i) != previous.get(i):
+                    mismatches.append(i)
+    return records, {"partitions": len(bounds), "checked_bars": checked, "mismatches": mismatches}
+
+
+def write_trades(path, records):
+    fields = TRADE_FIELDS + (PATH_FIELDS if records and PATH_FIELDS[0] in records[0] else ())
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for r in records:
+            writer.writerow({k: r[k] for k in fields})
+
+
+def read_trades(path):
+    """读取 write_trades 输出的 CSV (数值字段转 float)"""
+    text_fields = {"stage", "trend", "setup", "control", "rejection_type", "action", "exit_reason"}
+    bool_fields = {"is_trend_bar", "filled", "hit_1r"}
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = []
+        for row in csv.DictReader(f):
+            for k, v in row.items():
+                if k in bool_fields:
+                    row[k] = v == "True"
+                elif k not in text_fields:
+                    row[k] = float(v)
+            rows.append(row)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay M5 history through the decision pipeline")
+    parser.add_argument("history", help="history CSV (time,open,high,low,close,tick_vol,spread)")
+    parser.add_argument("-o", "--output", default="trades.csv")
+    parser.add_argument("--start", type=int, default=None, help="first bar index")
+    parser.add_argument("--end", type=int, default=None, help="last bar index (exclusive)")
+    parser.add_argument("--no-risk", action="store_true", help="skip L0 time/spread filters")
+    parser.add_argument("--no-prob-gate", action="store_true", help="skip the L4 probability gate")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes for a time-partitioned parallel replay (1 = sequential)")
+    parser.add_argument("--partitions", type=int, default=None, help="time partitions (default: --workers)")
+    parser.add_argument("--fill-model", choices=FILL_MODELS, default="bar",
+                        help="bar: SL-first when a bar is ambiguous; paths: simulated intrabar price paths")
+    parser.add_argument("--paths", type=int, default=DEFAULT_PATHS, help="intrabar paths per bar (--fill-model paths)")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    bars = load_bars(args.history)
+    t0 = time.perf_counter()
+    report = None
+    if args.workers > 1 or (args.partitions or 1) > 1:
+        records, report = replay_parallel(bars, start=args.start, end=args.end, apply_risk=not args.no_risk,
+                                          prob_gate=not args.no_prob_gate, workers=args.workers,
+                                          partitions=args.partitions, fill_model=args.fill_model, n_paths=args.paths)
+    else:
+        records = replay(bars, start=args.start, end=args.end, apply_risk=not args.no_risk,
+                         prob_gate=not args.no_prob_gate, fill_model=args.fill_model, n_paths=args.paths)
+    elapsed = time.perf_counter() - t0
+    write_trades(args.output, records)
+
+    filled = [r for r in records if r["filled"]]
+    print(f"Bars: {len(bars)} | Signals: {len(records)} | Filled: {len(filled)} | {elapsed:.1f}s")
+    if report is not None:
+        mismatches = report["mismatches"]
+        print(f"Partitions: {report['partitions']} | Overlap bars checked: {report['checked_bars']} | "
+              f"Mismatches: {len(mismatches)}" + (f" (first at bar {mismatches[0]})" if mismatches else ""))
+    if filled:
+        pnl = sum(r["pnl_usd"] for r in filled)
+        print(f"Net PnL: {pnl:.2f} USD | Avg R: {np.mean([r['r_multiple'] for r in filled]):.2f}")
+    print(f"Trades written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
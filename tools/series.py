@@ -0,0 +1,88 @@
+# tools/series.py
+"""
+整段序列批量分析 (app.batch) 的命令行入口
+
+把历史文件的每一根 K 线的 ATR / 阶段 / Setup / 楔形分数 / 假想订单写成 NDJSON。
+--verify N: 对前 N 根同时逐窗口调用 L1-L5 (tools.replay)，确认两边结果逐位一致。
+
+用法:
+    python -m tools.series history.csv -o series.ndjson
+    python -m tools.series history.csv --verify 2000
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from app import runtime_config
+from app.batch import DEFAULT_CHUNK, M5_WINDOW, iter_ndjson, iter_series
+from app.history import load_bars
+from tools.replay import iter_signals
+
+COMPARED = ("atr", "stage", "trend", "setup", "action", "entry", "sl", "tp", "lot")
+
+
+def verify(bars, cfg, count, prob_gate=False):
+    """返回不一致的 (bar, 字段, 逐窗口结果, 批量结果) 列表"""
+    end = min(len(bars), M5_WINDOW - 1 + count)
+    batch = {}
+    for chunk in iter_series(bars, cfg, end=end, prob_gate=prob_gate):
+        for k, v in chunk.items():
+            batch.setdefault(k, []).append(v)
+    batch = {k: np.concatenate(v) for k, v in batch.items()}
+
+    mismatches = []
+    for n, (i, stage, trend, atr, res) in enumerate(iter_signals(bars, cfg, end=end, apply_risk=False,
+                                                                  prob_gate=prob_gate)):
+        expected = {"atr": atr, "stage": stage, "trend": trend, **{k: res[k] for k in COMPARED[3:]}}
+        for k in COMPARED:
+            got = batch[k][n].item()
+            if got != expected[k]:
+                mismatches.append((i, k, expected[k], got))
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Whole-series batch analysis of an M5 history (NDJSON output)")
+    parser.add_argument("history", help="history CSV (time,open,high,low,close,tick_vol,spread)")
+    parser.add_argument("-o", "--output", default=None, help="NDJSON output (default: stdout)")
+    parser.add_argument("--start", type=int, default=None, help="first bar index")
+    parser.add_argument("--end", type=int, default=None, help="last bar index (exclusive)")
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK, help="windows per chunk")
+    parser.add_argument("--prob-gate", action="store_true", help="apply the L4 probability gate")
+    parser.add_argument("--verify", type=int, default=0, help="check the first N bars against the per-window pipeline")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    cfg = runtime_config.current()
+    bars = load_bars(args.history)
+
+    if args.verify:
+        t0 = time.perf_counter()
+        mismatches = verify(bars, cfg, args.verify, args.prob_gate)
+        print(f"Verified {min(args.verify, len(bars) - M5_WINDOW + 1)} bars in {time.perf_counter() - t0:.1f}s: "
+              f"{len(mismatches)} mismatches", file=sys.stderr)
+        for m in mismatches[:20]:
+            print(f"  bar {m[0]} {m[1]}: pipeline={m[2]!r} batch={m[3]!r}", file=sys.stderr)
+        if mismatches:
+            sys.exit(1)
+        return
+
+    t0 = time.perf_counter()
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for block in iter_ndjson(iter_series(bars, cfg, args.start, args.end, args.chunk, args.prob_gate)):
+            out.write(block)
+    finally:
+        if args.output:
+            out.close()
+    print(f"Bars: {len(bars)} | {time.perf_counter() - t0:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# tools/stage_sensitivity.py
+"""
+L3 阶段阈值敏感性分析 (Stage Threshold Sensitivity)
+
+调 SLOPE_SPIKE_ATR / SLOPE_FLAT_ATR / STAGE3_THRESHOLD_ATR / STAGE4_THRESHOLD_ATR /
+CHOPS_SLOPE_MULTIPLIER 时不再逐组参数重跑回放:
+- 与阈值无关的特征 (归一化斜率、10 根幅度、穿越 / 重叠、动能、瞬时突破) 每根 K 线只算一次
+  (app.batch.stage_features)
+- 所有参数组合排成一维，与 K 线一维广播，一次分类 (app.batch.classify_stages)，
+  按块累计每组参数的阶段分布与相邻 K 线的阶段转移次数
+
+输出:
+- 当前配置的阶段分布; 每个参数单独变化 (其余取最接近当前值的格点) 时的分布与切换频率
+- 两个参数的热力图 (其余参数同上): 各阶段占比、每 100 根 K 线的阶段切换次数、指定转移的频率
+- --output: 全部组合的计数张量 (.npz); --csv: 每组参数一行
+
+用法:
+    python -m tools.stage_sensitivity history.csv
+    python -m tools.stage_sensitivity history.csv --grid SLOPE_SPIKE_ATR=0.3:0.8:0.05 \\
+        --grid SLOPE_FLAT_ATR=0.1,0.15,0.2,0.25,0.3 --heatmap SLOPE_SPIKE_ATR,SLOPE_FLAT_ATR \\
+        --transition 2-CHANNEL,3-TRADING_RANGE -o sens.npz
+"""
+import argparse
+import csv
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from app import runtime_config
+from app.batch import DEFAULT_CHUNK, STAGE_NAMES, STAGE_PARAMS, classify_stages, iter_stage_features
+from app.history import load_bars
+
+DEFAULT_STEPS = 7
+# 每次分类的 (K 线 × 参数组合) 单元数上限，控制内存
+DEFAULT_MAX_CELLS = 2_000_000
+N_STAGES = len(STAGE_NAMES)
+
+
+def default_grid(cfg, steps=DEFAULT_STEPS):
+    """当前值的 0.5x - 1.5x (含当前值本身)"""
+    return {name: np.round(getattr(cfg, name) * np.linspace(0.5, 1.5, steps), 4) for name in STAGE_PARAMS}
+
+
+def parse_grid_spec(text):
+    """NAME=start:stop:step (含 stop) 或 NAME=v1,v2,..."""
+    name, _, spec = text.partition("=")
+    name = name.strip()
+    if name not in STAGE_PARAMS:
+        raise ValueError(f"{name}: not a sweepable parameter ({', '.join(STAGE_PARAMS)})")
+    if ":" in spec:
+        start, stop, step = (float(x) for x in spec.split(":"))
+        values = np.arange(start, stop + step / 2, step)
+    else:
+        values = np.array([float(x) for x in spec.split(",") if x.strip()])
+    if len(values) == 0:
+        raise ValueError(f"{name}: empty grid")
+    return name, np.round(np.unique(values), 6)
+
+
+def sweep(bars, cfg, grid, start=None, end=None, chunk_size=DEFAULT_CHUNK, max_cells=DEFAULT_MAX_CELLS):
+    """
+    grid: {参数名: 取值数组} (STAGE_PARAMS 全部 5 个)
+    返回 (counts (P, 5), transitions (P, 5, 5), K 线数)，P 为全部组合 (按 STAGE_PARAMS 顺序的 C 序展开)
+    """
+    mesh = np.meshgrid(*(grid[name] for name in STAGE_PARAMS), indexing="ij")
+    params = [m.ravel() for m in mesh]
+    n_combos = len(params[0])
+    counts = np.zeros((n_combos, N_STAGES), dtype=np.int64)
+    transitions = np.zeros((n_combos, N_STAGES, N_STAGES), dtype=np.int64)
+    prev = None
+    n_bars = 0
+
+    for idx, features in iter_stage_features(bars, cfg, start, end, chunk_size):
+        n_bars += len(idx)
+        step = max(1, max_cells // len(idx))
+        last = np.empty(n_combos, dtype=np.int8)
+        for p0 in range(0, n_combos, step):
+            p1 = min(n_combos, p0 + step)
+            codes = classify_stages(features, *(p[p0:p1] for p in params), cfg.SPIKE_FROM_RANGE_PENALTY)
+            k = p1 - p0
+            counts[p0:p1] += np.bincount((codes + np.arange(k) * N_STAGES).ravel(),
+                                         minlength=k * N_STAGES).reshape(k, N_STAGES)
+            seq = codes if prev is None else np.concatenate((prev[None, p0:p1], codes))
+            pairs = seq[:-1].astype(np.int64) * N_STAGES + seq[1:]
+            transitions[p0:p1] += np.bincount((pairs + np.arange(k) * N_STAGES ** 2).ravel(),
+                                              minlength=k * N_STAGES ** 2).reshape(k, N_STAGES, N_STAGES)
+            last[p0:p1] = codes[-1]
+        prev = last
+    return counts, transitions, n_bars
+
+
+def change_rate(transitions):
+    """每 100 根 K 线的阶段切换次数 (转移矩阵的非对角线部分)"""
+    total = transitions.sum(axis=(-2, -1))
+    stay = np.trace(transitions, axis1=-2, axis2=-1)
+    return np.where(total > 0, (total - stay) / np.maximum(total, 1) * 100.0, 0.0)
+
+
+def _nearest(values, target):
+    return int(np.argmin(np.abs(values - target)))
+
+
+def _fixed_index(grid, cfg):
+    """其余参数取最接近当前配置的格点"""
+    return {name: _nearest(grid[name], getattr(cfg, name)) for name in STAGE_PARAMS}
+
+
+def print_one_at_a_time(grid, cfg, counts, transitions):
+    shape = tuple(len(grid[name]) for name in STAGE_PARAMS)
+    counts = counts.reshape(shape + (N_STAGES,))
+    transitions = transitions.reshape(shape + (N_STAGES, N_STAGES))
+    fixed = _fixed_index(grid, cfg)
+    short = [s.split("-")[1][:8] for s in STAGE_NAMES]
+    for axis, name in enumerate(STAGE_PARAMS):
+        if len(grid[name]) < 2:
+            continue
+        print(f"\n{name} (current {getattr(cfg, name)}; others at nearest grid point)")
+        print(f"{'value':>8} | " + " | ".join(f"{s:>8}" for s in short) + " | chg/100")
+        for i, value in enumerate(grid[name]):
+            key = tuple(i if a == axis else fixed[n] for a, n in enumerate(STAGE_PARAMS))
+            row = counts[key]
+            share = row / max(1, row.sum()) * 100.0
+            print(f"{value:8.4g} | " + " | ".join(f"{v:7.1f}%" for v in share)
+                  + f" | {change_rate(transitions[key]):7.2f}")
+
+
+def heatmaps(grid, cfg, counts, transitions, x_name, y_name, transition=None):
+    """返回 [(标题, 矩阵)]: 行 = x_name 的取值，列 = y_name 的取值"""
+    shape = tuple(len(grid[name]) for name in STAGE_PARAMS)
+    counts = counts.reshape(shape + (N_STAGES,))
+    transitions = transitions.reshape(shape + (N_STAGES, N_STAGES))
+    fixed = _fixed_index(grid, cfg)
+    ax, ay = STAGE_PARAMS.index(x_name), STAGE_PARAMS.index(y_name)
+    index = [slice(None) if a in (ax, ay) else fixed[n] for a, n in enumerate(STAGE_PARAMS)]
+    sub_counts = counts[tuple(index)]
+    sub_trans = transitions[tuple(index)]
+    if ax > ay:
+        sub_counts = np.swapaxes(sub_counts, 0, 1)
+        sub_trans = np.swapaxes(sub_trans, 0, 1)
+
+    totals = np.maximum(sub_counts.sum(axis=-1), 1)
+    maps = [(f"{stage} share %", sub_counts[..., s] / totals * 100.0) for s, stage in enumerate(STAGE_NAMES)]
+    maps.append(("stage changes per 100 bars", change_rate(sub_trans)))
+    if transition is not None:
+        a, b = transition
+        n_pairs = np.maximum(sub_trans.sum(axis=(-2, -1)), 1)
+        maps.append((f"{STAGE_NAMES[a]} -> {STAGE_NAMES[b]} per 100 bars", sub_trans[..., a, b] / n_pairs * 100.0))
+    return maps
+
+
+def print_heatmap(title, matrix, x_name, x_values, y_name, y_values):
+    print(f"\n{title}  (rows: {x_name}, columns: {y_name})")
+    print(f"{'':>8} | " + " ".join(f"{v:>7.4g}" for v in y_values))
+    for value, row in zip(x_values, matrix):
+        print(f"{value:8.4g} | " + " ".join(f"{v:7.2f}" for v in row))
+
+
+def write_csv(path, grid, counts, transitions):
+    mesh = np.meshgrid(*(grid[name] for name in STAGE_PARAMS), indexing="ij")
+    params = [m.ravel() for m in mesh]
+    totals = np.maximum(counts.sum(axis=1), 1)
+    rates = change_rate(transitions)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(list(STAGE_PARAMS) + [f"share_{s}" for s in STAGE_NAMES] + ["changes_per_100"])
+        for p in range(len(counts)):
+            writer.writerow([f"{v[p]:.6g}" for v in params]
+                            + [f"{x:.4f}" for x in counts[p] / totals[p]] + [f"{rates[p]:.4f}"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep L3 stage thresholds over an M5 history by broadcasting")
+    parser.add_argument("history", help="history CSV (time,open,high,low,close,tick_vol,spread)")
+    parser.add_argument("--grid", action="append", default=[],
+                        help="NAME=start:stop:step or NAME=v1,v2,... (repeatable; default 0.5x-1.5x of current)")
+    parser.add_argument("--steps", type=int, default=DEFAULT_STEPS, help="points per default grid axis")
+    parser.add_argument("--heatmap", default="SLOPE_SPIKE_ATR,SLOPE_FLAT_ATR", help="two parameters: rows,columns")
+    parser.add_argument("--transition", default=None, help="FROM,TO stage names for an extra transition heatmap")
+    parser.add_argument("--start", type=int, default=None, help="first bar index")
+    parser.add_argument("--end", type=int, default=None, help="last bar index (exclusive)")
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK, help="bars per chunk")
+    parser.add_argument("--max-cells", type=int, default=DEFAULT_MAX_CELLS,
+                        help="bars x combinations classified at once (memory bound)")
+    parser.add_argument("-o", "--output", default=None, help="write all counts / transitions as .npz")
+    parser.add_argument("--csv", default=None, help="write one row per parameter combination")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    cfg = runtime_config.current()
+    grid = default_grid(cfg, args.steps)
+    for spec in args.grid:
+        name, values = parse_grid_spec(spec)
+        grid[name] = values
+    x_name, y_name = (s.strip() for s in args.heatmap.split(","))
+    for name in (x_name, y_name):
+        if name not in STAGE_PARAMS:
+            parser.error(f"--heatmap: {name} is not one of {', '.join(STAGE_PARAMS)}")
+    transition = None
+    if args.transition:
+        names = [s.strip() for s in args.transition.split(",")]
+        if len(names) != 2 or any(n not in STAGE_NAMES for n in names):
+            parser.error(f"--transition needs FROM,TO out of {', '.join(STAGE_NAMES)}")
+        transition = tuple(STAGE_NAMES.index(n) for n in names)
+
+    bars = load_bars(args.history)
+    n_combos = int(np.prod([len(grid[name]) for name in STAGE_PARAMS]))
+    t0 = time.perf_counter()
+    counts, transitions, n_bars = sweep(bars, cfg, grid, args.start, args.end, args.chunk, args.max_cells)
+    elapsed = time.perf_counter() - t0
+    if n_bars == 0:
+        print("Not enough bars for one EA window.")
+        return
+    print(f"Bars: {n_bars} | combinations: {n_combos} | {elapsed:.2f}s "
+          f"({n_bars * n_combos / max(elapsed, 1e-9) / 1e6:.0f}M bar-classifications/s)")
+
+    base_counts, base_trans, _ = sweep(bars, cfg, {name: np.array([getattr(cfg, name)]) for name in STAGE_PARAMS},
+                                       args.start, args.end, args.chunk, args.max_cells)
+    share = base_counts[0] / n_bars * 100.0
+    print("Current config: " + " | ".join(f"{s} {v:.1f}%" for s, v in zip(STAGE_NAMES, share))
+          + f" | {change_rate(base_trans[0]):.2f} changes/100 bars")
+
+    print_one_at_a_time(grid, cfg, counts, transitions)
+    if x_name != y_name:
+        for title, matrix in heatmaps(grid, cfg, counts, transitions, x_name, y_name, transition):
+            print_heatmap(title, matrix, x_name, grid[x_name], y_name, grid[y_name])
+
+    if args.output:
+        shape = tuple(len(grid[name]) for name in STAGE_PARAMS)
+        np.savez_compressed(
+            args.output, params=np.array(STAGE_PARAMS), stages=np.array(STAGE_NAMES), bars=n_bars,
+            counts=counts.reshape(shape + (N_STAGES,)),
+            transitions=transitions.reshape(shape + (N_STAGES, N_STAGES)),
+            **{f"axis_{name}": grid[name] for name in STAGE_PARAMS},
+        )
+        print(f"\nWrote {args.output}")
+    if args.csv:
+        write_csv(args.csv, grid, counts, transitions)
+        print(f"Wrote {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+# tools/synth_bars.py
+"""
+合成 XAUUSD M5 K 线 (状态切换过程，带种子，可复现)
+
+压测 / 等价性测试 / 性能基线需要能稳定把 identify_stage 推进每个阶段、把 update_counter 推进
+楔形 / MTR / 微观双底双顶的行情。这里用马尔可夫链在几种状态之间切换，每段状态内按模板生成收盘价路径，
+再加影线、噪声、开盘跳空与点差:
+- BARBWIRE     窄幅、长影线、实体很小的十字星反复穿越均线 -> 0-BARBWIRE
+- TREND        单边大实体、收在极端 (约一半的段以一根巨型突破棒开始) -> 1-STRONG_TREND
+- CHANNEL      缓慢的单边斜率 + 回调 -> 2-CHANNEL (H1 / H2 / L1 / L2 / 微观双底双顶)
+- RANGE        围绕中枢的有界振荡 (两个正弦叠加，段末回到中枢) -> 3-TRADING_RANGE
+- COMPRESSION  趋势之后的短暂收缩: K 线在箱体上下沿之间交替 (开盘相对前收有跳动)，实体占箱体一半以上 -> 4-BREAKOUT_MODE
+               (L3 的 Stage 4 要求 10 根幅度 < 1.5 ATR 且 < 2 倍平均实体、重叠不多: 只在 ATR 还带着前一段的波动时成立)
+- WEDGE        三推 (第三推幅度递减) 后反转 -> WEDGE_TOP / WEDGE_BOTTOM，之后转向
+- MTR          趋势腿 + 反向突破均线 + 回测极值 -> MTR_TOP / MTR_BOTTOM，之后沿新方向
+全部向量化: 只有状态序列按段循环 (每段几十根)，逐根的价格、影线、点差都是数组运算，百万根在数秒内完成。
+价格在对数空间累积 (波动与价位成比例、不会为负)；时间戳为周一至周五 01:00-23:55 (服务器时间)，
+每个交易日第一根 K 线按 gap_atr 跳空，点差在开盘后 SESSION_OPEN_BARS 根放大。
+
+用法:
+    python -m tools.synth_bars -n 1000000 -o synth.csv --h1 synth_h1.csv --seed 7
+    python -m tools.synth_bars -n 50000 -o synth.csv --labels synth_regimes.npy --report
+"""
+import argparse
+import collections
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from app.history import COLUMNS, T, O, H, L, C, V, S, save_bars
+from app.resample import TIMEFRAME_SECONDS, resample
+
+REGIMES = ("BARBWIRE", "TREND", "CHANNEL", "RANGE", "COMPRESSION", "WEDGE", "MTR")
+BARBWIRE, TREND, CHANNEL, RANGE, COMPRESSION, WEDGE, MTR = range(len(REGIMES))
+# 各状态期望驱动出的 L3 阶段 / L2 Setup (--report 对照)
+TARGET_STAGES = {BARBWIRE: "0-BARBWIRE", TREND: "1-STRONG_TREND", CHANNEL: "2-CHANNEL",
+                 RANGE: "3-TRADING_RANGE", COMPRESSION: "4-BREAKOUT_MODE"}
+TARGET_SETUPS = {CHANNEL: ("H1", "H2", "L1", "L2", "H1_MICRO_DB", "L1_MICRO_DT"),
+                 WEDGE: ("WEDGE_TOP", "WEDGE_BOTTOM"), MTR: ("MTR_TOP", "MTR_BOTTOM")}
+
+# 状态转移概率 (行: 当前状态，列: 下一状态，顺序同 REGIMES)
+TRANSITIONS = np.array([
+    # BW    TR    CH    RG    CP    WG    MTR
+    [0.00, 0.30, 0.20, 0.40, 0.00, 0.00, 0.10],   # BARBWIRE
+    [0.00, 0.00, 0.35, 0.15, 0.30, 0.10, 0.10],   # TREND
+    [0.10, 0.20, 0.00, 0.30, 0.00, 0.30, 0.10],   # CHANNEL
+    [0.20, 0.25, 0.35, 0.00, 0.00, 0.00, 0.20],   # RANGE
+    [0.00, 0.80, 0.00, 0.20, 0.00, 0.00, 0.00],   # COMPRESSION
+    [0.00, 0.30, 0.40, 0.30, 0.00, 0.00, 0.00],   # WEDGE
+    [0.00, 0.40, 0.60, 0.00, 0.00, 0.00, 0.00],   # MTR
+])
+# 每段长度 (根，含两端)
+DURATION = np.array([(15, 40), (10, 25), (30, 80), (30, 90), (11, 13), (36, 54), (36, 60)])
+# 影线 / 收盘噪声的幅度 (波动单位)
+WICK = np.array([0.60, 0.08, 0.30, 0.35, 0.01, 0.12, 0.25])
+NOISE = np.array([0.05, 0.10, 0.25, 0.30, 0.00, 0.05, 0.15])
+# 楔形 / MTR 模板: (节点时间占比, 节点水平)，方向为 +1 时: 楔形顶 (之后转空)、MTR 底 (之后转多)
+WEDGE_KNOTS = (np.linspace(0.0, 1.0, 7), np.array([0.0, 3.0, 1.7, 5.0, 3.9, 6.0, 3.0]))
+MTR_KNOTS = (np.array([0.0, 0.15, 0.40, 0.60, 0.80, 1.0]), np.array([0.0, -4.0, -1.2, -3.2, 0.5, 2.5]))
+# 箱体宽度 (前一段波动单位的倍数) 与实体占箱体的比例
+COMPRESSION_BOX = (0.6, 0.8)
+COMPRESSION_BODY = 0.56
+
+M5_SECONDS = 300
+SESSION_START_HOUR = 1          # 每天 00:00-01:00 休市
+SESSION_OPEN_BARS = 3
+SESSION_OPEN_SPREAD_MULT = 3.0
+DEFAULT_START_TIME = 1_704_153_600  # 2024-01-02 00:00 (周二)
+DEFAULT_PRICE = 2000.0
+DEFAULT_VOL = 1.5               # 波动单位 (美元，约为 M5 的 ATR)
+DEFAULT_VOL_OF_VOL = 0.3
+DEFAULT_GAP_ATR = 1.0
+DEFAULT_SPREAD = 180            # 点
+DEFAULT_TICK_VOL = 150
+
+
+def trading_times(n, start_time=DEFAULT_START_TIME):
+    """从 start_time 起的 n 个 M5 时间戳 (周一至周五，每天 SESSION_START_HOUR 点开盘)"""
+    day0 = start_time // 86400
+    per_day = 288 - SESSION_START_HOUR * 12
+    days = int(n / per_day * 7 / 5) + 10
+    slots = day0 * 86400 + np.arange(days * 288, dtype=np.int64) * M5_SECONDS
+    weekday = (slots // 86400 + 3) % 7          # 1970-01-01 是周四
+    keep = (weekday < 5) & ((slots % 86400) >= SESSION_START_HOUR * 3600) & (slots >= start_time)
+    return slots[keep][:n]
+
+
+def regime_runs(n, rng, transitions=TRANSITIONS, vol_of_vol=DEFAULT_VOL_OF_VOL):
+    """
+    状态序列 (按段): 返回 (状态, 长度, 方向 ±1, 波动倍数)，总长度 >= n
+    楔形之后反向、MTR 之后沿新方向; 收缩段沿用前一段的波动 (ATR 还带着前一段的幅度)
+    """
+    cum = np.cumsum(transitions, axis=1)
+    regimes, lengths, dirs, mults = [], [], [], []
+    state = int(rng.integers(len(REGIMES)))
+    direction = 1
+    mult = 1.0
+    total = 0
+    while total < n:
+        lo, hi = DURATION[state]
+        length = int(rng.integers(lo, hi + 1))
+        prev = regimes[-1] if regimes else None
+        if prev == WEDGE:
+            direction = -direction
+        elif prev != MTR:
+            direction = 1 if rng.random() < 0.5 else -1
+        if state != COMPRESSION:
+            mult = float(np.exp(rng.normal(0.0, vol_of_vol)))
+        regimes.append(state)
+        lengths.append(length)
+        dirs.append(direction)
+        mults.append(mult)
+        total += length
+        state = min(int(np.searchsorted(cum[state], rng.random(), side="right")), len(REGIMES) - 1)
+    return np.array(regimes), np.array(lengths), np.array(dirs, dtype=np.float64), np.array(mults)
+
+
+def _template(knots, frac):
+    """分段线性模板在 frac (0-1] 处的值"""
+    t, v = knots
+    seg = np.clip(np.searchsorted(t, frac, side="right") - 1, 0, len(t) - 2)
+    return v[seg] + (v[seg + 1] - v[seg]) * (frac - t[seg]) / (t[seg + 1] - t[seg])
+
+
+def generate(n, seed=0, start_time=DEFAULT_START_TIME, start_price=DEFAULT_PRICE, vol=DEFAULT_VOL,
+             vol_of_vol=DEFAULT_VOL_OF_VOL, gap_atr=DEFAULT_GAP_ATR, spread=DEFAULT_SPREAD,
+             transitions=TRANSITIONS, digits=2):
+    """
+    返回 (bars (n, 7) app.history 格式, 每根 K 线的状态编码 (n,) int8，下标对应 REGIMES)
+    同一组参数与种子得到逐位相同的结果
+    """
+    rng = np.random.default_rng(seed)
+    regimes, lengths, dirs, mults = regime_runs(n, rng, transitions, vol_of_vol)
+    n_runs = len(regimes)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+    # 每段的随机参数 (按段一次抽完)
+    trend_drift = rng.uniform(1.0, 1.6, n_runs)
+    spike = np.where(rng.random(n_runs) < 0.5, rng.uniform(2.5, 3.5, n_runs), 0.0)
+    channel_drift = rng.uniform(0.20, 0.35, n_runs)
+    channel_amp = rng.uniform(1.0, 1.5, n_runs)
+    channel_period = rng.uniform(8.0, 14.0, n_runs)
+    range_amp = rng.uniform(1.2, 2.0, n_runs)
+    range_cycles = np.maximum(1, np.round(lengths / rng.uniform(12.0, 20.0, n_runs)))
+    template_scale = rng.uniform(0.8, 1.2, n_runs)
+    box = rng.uniform(*COMPRESSION_BOX, n_runs)
+
+    # 逐根: 所在段、段内位置
+    run = np.repeat(np.arange(n_runs), lengths)[:n]
+    pos = np.arange(n) - starts[run]
+    t1 = pos + 1.0
+    frac = t1 / lengths[run]
+    reg = regimes[run]
+    d = dirs[run]
+    m = mults[run]
+
+    # 段内收盘价路径 (相对段起点，波动单位)
+    level = np.zeros(n)
+    sel = reg == TREND
+    level[sel] = d[sel] * (spike[run][sel] + trend_drift[run][sel] * t1[sel])
+    sel = reg == CHANNEL
+    level[sel] = (d[sel] * channel_drift[run][sel] * t1[sel]
+                  + channel_amp[run][sel] * np.sin(2 * np.pi * t1[sel] / channel_period[run][sel]))
+    sel = reg == RANGE
+    w = 2 * np.pi * range_cycles[run][sel] * frac[sel]
+    level[sel] = range_amp[run][sel] * (0.65 * np.sin(w) + 0.35 * np.sin(3 * w))
+    sel = reg == BARBWIRE
+    level[sel] = 0.15 * np.where(pos[sel] % 2 == 0, 1.0, -1.0)
+    sel = reg == WEDGE
+    level[sel] = d[sel] * template_scale[run][sel] * _template(WEDGE_KNOTS, frac[sel])
+    sel = reg == MTR
+    level[sel] = d[sel] * template_scale[run][sel] * _template(MTR_KNOTS, frac[sel])
+    comp = reg == COMPRESSION
+    up_bar = pos % 2 == 0
+    half = box[run] / 2
+    comp_open = np.where(up_bar, -half, half)
+    comp_close = comp_open + np.where(up_bar, 1.0, -1.0) * COMPRESSION_BODY * box[run]
+    level[comp] = comp_close[comp]
+
+    # 段起点 = 前面各段终点的累积 (对数空间，按各段的波动倍数)
+    ends = np.minimum(starts + lengths, n) - 1
+    run_start = np.concatenate(([0.0], np.cumsum(level[ends] * mults)[:-1]))
+
+    times = trading_times(n, start_time)
+    session_open = np.concatenate(([False], np.diff(times) > M5_SECONDS))
+    gaps = np.where(session_open, rng.normal(0.0, gap_atr, n), 0.0) * m
+    shift = run_start[run] + np.cumsum(gaps)
+
+    close = shift + level * m + rng.normal(0.0, 1.0, n) * NOISE[reg] * m
+    open_ = np.concatenate(([shift[0]], close[:-1])) + gaps
+    open_[comp] = (shift + comp_open * m)[comp]
+    wick = WICK[reg] * m
+    high = np.maximum(open_, close) + wick * rng.uniform(0.2, 1.0, n)
+    low = np.minimum(open_, close) - wick * rng.uniform(0.2, 1.0, n)
+
+    # 对数空间 -> 价格 (单调变换，高低点关系不变)
+    scale = vol / start_price
+    bars = np.empty((n, len(COLUMNS)))
+    bars[:, T] = times
+    for k, x in ((O, open_), (H, high), (L, low), (C, close)):
+        bars[:, k] = np.round(start_price * np.exp(x * scale), digits)
+    bars[:, H] = np.maximum(bars[:, H], np.maximum(bars[:, O], bars[:, C]))
+    bars[:, L] = np.minimum(bars[:, L], np.minimum(bars[:, O], bars[:, C]))
+
+    bar_range = (high - low) / m
+    bars[:, V] = np.maximum(1, np.round(DEFAULT_TICK_VOL * bar_range * rng.uniform(0.7, 1.3, n)))
+    since_open = np.arange(n) - np.maximum.accumulate(np.where(session_open, np.arange(n), 0))
+    widen = np.where(since_open < SESSION_OPEN_BARS, SESSION_OPEN_SPREAD_MULT, 1.0)
+    bars[:, S] = np.round(spread * widen * np.sqrt(m) * rng.uniform(0.8, 1.25, n))
+    return bars, reg.astype(np.int8)
+
+
+def h1_bars(m5):
+    """与 M5 对应的 H1 (app.resample，时间戳 // 3600 分桶)"""
+    return resample(m5, TIMEFRAME_SECONDS["H1"], drop_partial_head=False)
+
+
+def coverage(bars, labels, cfg=None):
+    """
+    用 app.batch 对整段分类，按状态统计阶段 / Setup 的分布
+    返回 {状态名: {"bars", "hit_bars", "episodes", "hit_episodes", "stages": Counter, "setups": Counter}}
+    hit: 阶段状态为目标阶段、模板状态 (楔形 / MTR / 通道) 为目标 Setup; 一段中至少一根命中即算该段命中
+    """
+    from app.batch import M5_WINDOW, iter_series
+
+    first = M5_WINDOW - 1
+    stage = np.empty(len(bars) - first, dtype=object)
+    setup = np.empty(len(bars) - first, dtype=object)
+    offset = 0
+    for chunk in iter_series(bars, cfg):
+        k = len(chunk["stage"])
+        stage[offset:offset + k] = chunk["stage"]
+        setup[offset:offset + k] = chunk["setup"]
+        offset += k
+    labels = labels[first:]
+    episode = np.concatenate(([0], np.cumsum(labels[1:] != labels[:-1])))
+
+    out = {}
+    for code, name in enumerate(REGIMES):
+        sel = labels == code
+        if code in TARGET_STAGES:
+            hit = stage == TARGET_STAGES[code]
+        else:
+            hit = np.isin(setup, TARGET_SETUPS[code])
+        episodes = np.unique(episode[sel])
+        out[name] = {
+            "bars": int(sel.sum()), "hit_bars": int((hit & sel).sum()),
+            "episodes": len(episodes), "hit_episodes": len(np.unique(episode[hit & sel])),
+            "stages": collections.Counter(stage[sel].tolist()), "setups": collections.Counter(setup[sel].tolist()),
+        }
+    return out
+
+
+def print_coverage(report):
+    print(f"\n{'regime':<12} | {'bars':>8} | {'target':<16} | {'bars %':>6} | {'runs %':>6} | top stages / setups")
+    for code, name in enumerate(REGIMES):
+        r = report[name]
+        if not r["bars"]:
+            continue
+        target = TARGET_STAGES.get(code) or "/".join(TARGET_SETUPS[code])
+        stages = ", ".join(f"{s} {c / r['bars'] * 100:.0f}%" for s, c in r["stages"].most_common(3))
+        setups = ", ".join(f"{s} {c}" for s, c in r["setups"].most_common(7) if s != "NONE")
+        print(f"{name:<12} | {r['bars']:>8} | {target[:16]:<16} | {r['hit_bars'] / r['bars'] * 100:6.1f} | "
+              f"{r['hit_episodes'] / max(1, r['episodes']) * 100:6.1f} | {stages}")
+        print(f"{'':<12} | {'':>8} | {'':<16} | {'':>6} | {'':>6} | {setups}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate seeded regime-switching synthetic XAUUSD M5 bars")
+    parser.add_argument("-n", "--bars", type=int, default=100_000, help="number of M5 bars")
+    parser.add_argument("-o", "--output", default="synth.csv", help="M5 history CSV")
+    parser.add_argument("--h1", default=None, help="also write the matching H1 aggregate")
+    parser.add_argument("--labels", default=None, help="write the regime code per bar (.npy, index into REGIMES)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--start-time", type=int, default=DEFAULT_START_TIME, help="first bar (server time, seconds)")
+    parser.add_argument("--price", type=float, default=DEFAULT_PRICE, help="starting price")
+    parser.add_argument("--vol", type=float, default=DEFAULT_VOL, help="volatility unit in USD (about the M5 ATR)")
+    parser.add_argument("--vol-of-vol", type=float, default=DEFAULT_VOL_OF_VOL,
+                        help="log-normal sigma of the per-regime volatility multiplier")
+    parser.add_argument("--gap-atr", type=float, default=DEFAULT_GAP_ATR, help="session-open gap sigma (volatility units)")
+    parser.add_argument("--spread", type=float, default=DEFAULT_SPREAD, help="typical spread in points")
+    parser.add_argument("--report", action="store_true", help="classify the result and print stage / setup coverage")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    t0 = time.perf_counter()
+    bars, labels = generate(args.bars, seed=args.seed, start_time=args.start_time, start_price=args.price,
+                            vol=args.vol, vol_of_vol=args.vol_of_vol, gap_atr=args.gap_atr, spread=args.spread)
+    elapsed = time.perf_counter() - t0
+    counts = np.bincount(labels, minlength=len(REGIMES))
+    print(f"Bars: {len(bars)} | {elapsed:.2f}s | " + " / ".join(f"{r} {c / len(bars) * 100:.0f}%"
+                                                               for r, c in zip(REGIMES, counts)))
+    save_bars(args.output, bars)
+    print(f"Wrote {args.output}")
+    if args.h1:
+        save_bars(args.h1, h1_bars(bars))
+        print(f"Wrote {args.h1}")
+    if args.labels:
+        np.save(args.labels, labels)
+        print(f"Wrote {args.labels}")
+    if args.report:
+        print_coverage(coverage(bars, labels))
+
+
+if __name__ == "__main__":
+    main()
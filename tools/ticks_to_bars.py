@@ -0,0 +1,398 @@
+# tools/ticks_to_bars.py
+"""
+经纪商 Tick 导出 -> M5 / H1 历史 K 线 (流式、分块并行、可断点续跑)
+
+XAUUSD 的 tick 导出动辄几十 GB，而服务与各离线工具只认 app.history 格式的 K 线:
+    time,open,high,low,close,tick_vol,spread
+与 MT5 CopyRates 一致: 按 Bid 建 K 线，时间戳 = 服务器时间的周期起点，tick_vol = 本根的 tick 数，
+spread = 本根 tick 点差 (ask - bid，按 --point 折算成点) 的平均 / 最大 / 最小值 (--spread，默认 avg)。
+没有 tick 的周期 (周末 / 休市) 不产生 K 线。
+
+支持两种输入:
+- MT5 "导出 Tick" 文件: 制表符分隔，表头 <DATE> <TIME> <BID> <ASK> ...，时间 2024.01.02 01:00:00.123;
+  未变化的 BID / ASK 留空 (沿用上一个 tick 的值)
+- 普通 CSV: 表头含 time (或 timestamp)、bid、ask; time 为秒 / 毫秒时间戳或日期时间字符串
+
+流程:
+1. 按字节把文件切成固定大小的块 (--chunk-mb，按行对齐)，进程池里各块独立解析并聚合成
+   "部分 K 线" (带点差和 / 最大 / 最小与 tick 数，可以再合并)，每块写一个 part 文件
+   块开头 BID / ASK 留空、要沿用上一块数值的几行原样带回，合并时再补
+2. 按顺序合并各块: 跨块边界的同一根 K 线 (上一块的最后一根 + 下一块的第一根) 合并成一根;
+   H1 由合并后的 M5 部分 K 线再聚合 (精确，点差统计不失真)
+内存: 每个进程一次只处理一块，合并阶段一次只读一个 part 文件，与文件总长度无关。
+断点续跑: part 文件与 manifest.json 都原子写入，再次运行同一命令只解析还没完成的块;
+源文件 (大小 / 修改时间) 或分块参数变了则拒绝续跑，--restart 清掉重来。
+
+用法:
+    python -m tools.ticks_to_bars XAUUSD_ticks.csv -o history.csv --h1 history_h1.csv --workers 8
+    python -m tools.ticks_to_bars XAUUSD_ticks.csv -o history.csv --restart
+"""
+import argparse
+import concurrent.futures
+import io
+import logging
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.getcwd())
+
+from app.history import COLUMNS, T, O, H, L, C, V, S, save_bars
+from app.resample import TIMEFRAME_SECONDS
+from tools.export_features import load_manifest, save_manifest
+
+FORMAT = 1
+M5_SECONDS = 300
+DEFAULT_CHUNK_MB = 32
+# XAUUSD 3 位小数: 1 点 = 0.001 (与 global_risk 中 ATR * 1000 的点差换算一致)
+DEFAULT_POINT = 0.001
+SPREAD_MODES = ("avg", "max", "min")
+
+# 部分 K 线的列: 前 6 列同 app.history，之后是点差和 / 最大 / 最小 (可合并)
+SSUM, SMAX, SMIN = 6, 7, 8
+PARTIAL_WIDTH = 9
+
+
+def part_file(k):
+    return f"part_{k:06d}.npz"
+
+
+# ------------------------------------------------------------------
+# 部分 K 线的聚合与合并
+# ------------------------------------------------------------------
+
+def _group_starts(keys):
+    return np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+
+
+def aggregate_ticks(seconds, bid, spread, period=M5_SECONDS):
+    """按时间排好序的 tick -> 部分 K 线 (n, PARTIAL_WIDTH)"""
+    if len(seconds) == 0:
+        return np.empty((0, PARTIAL_WIDTH))
+    bucket = seconds // period * period
+    starts = _group_starts(bucket)
+    ends = np.concatenate((starts[1:], [len(bucket)]))
+    out = np.empty((len(starts), PARTIAL_WIDTH))
+    out[:, T] = bucket[starts]
+    out[:, O] = bid[starts]
+    out[:, H] = np.maximum.reduceat(bid, starts)
+    out[:, L] = np.minimum.reduceat(bid, starts)
+    out[:, C] = bid[ends - 1]
+    out[:, V] = ends - starts
+    out[:, SSUM] = np.add.reduceat(spread, starts)
+    out[:, SMAX] = np.maximum.reduceat(spread, starts)
+    out[:, SMIN] = np.minimum.reduceat(spread, starts)
+    return out
+
+
+def reduce_partials(rows, period=M5_SECONDS):
+    """把按时间排好序的部分 K 线按 period 重新分桶合并 (同一桶的相邻行合成一行)"""
+    if len(rows) == 0:
+        return rows
+    bucket = rows[:, T] // period * period
+    starts = _group_starts(bucket)
+    ends = np.concatenate((starts[1:], [len(rows)]))
+    out = np.empty((len(starts), PARTIAL_WIDTH))
+    out[:, T] = bucket[starts]
+    out[:, O] = rows[starts, O]
+    out[:, H] = np.maximum.reduceat(rows[:, H], starts)
+    out[:, L] = np.minimum.reduceat(rows[:, L], starts)
+    out[:, C] = rows[ends - 1, C]
+    for col in (V, SSUM):
+        out[:, col] = np.add.reduceat(rows[:, col], starts)
+    out[:, SMAX] = np.maximum.reduceat(rows[:, SMAX], starts)
+    out[:, SMIN] = np.minimum.reduceat(rows[:, SMIN], starts)
+    return out
+
+
+class BarStream:
+    """按顺序接收部分 K 线，产出已经完整的 K 线 (最后一根留到下一批或 finish 再确定)"""
+
+    def __init__(self, period):
+        self.period = period
+        self.pending = np.empty((0, PARTIAL_WIDTH))
+
+    def push(self, rows):
+        if len(rows) == 0:
+            return rows
+        merged = reduce_partials(np.concatenate((self.pending, rows)), self.period)
+        self.pending = merged[-1:]
+        return merged[:-1]
+
+    def finish(self):
+        rows, self.pending = self.pending, np.empty((0, PARTIAL_WIDTH))
+        return rows
+
+
+def to_bars(rows, spread_mode="avg"):
+    """部分 K 线 -> app.history 格式 (n, 7)"""
+    bars = np.empty((len(rows), len(COLUMNS)))
+    bars[:, :S] = rows[:, :S]
+    if spread_mode == "max":
+        bars[:, S] = rows[:, SMAX]
+    elif spread_mode == "min":
+        bars[:, S] = rows[:, SMIN]
+    else:
+        bars[:, S] = np.round(rows[:, SSUM] / rows[:, V])
+    return bars
+
+
+# ------------------------------------------------------------------
+# 输入格式与分块
+# ------------------------------------------------------------------
+
+def read_layout(path):
+    """读表头，返回 {"kind", "sep", "names", "data_start"}"""
+    with open(path, "rb") as f:
+        header = f.readline()
+    text = header.decode("utf-8-sig").strip()
+    sep = "\t" if "\t" in text else ("," if "," in text else ";")
+    names = [c.strip().strip("<>").lower() for c in text.split(sep)]
+    if "date" in names and "time" in names and "bid" in names:
+        kind = "mt5"
+    elif ("time" in names or "timestamp" in names) and "bid" in names and "ask" in names:
+        kind = "csv"
+    else:
+        raise ValueError(f"{path}: unrecognized tick header {text!r} "
+                         "(expected MT5 export <DATE> <TIME> <BID> <ASK> ... or CSV with time,bid,ask)")
+    return {"kind": kind, "sep": sep, "names": names, "data_start": len(header)}
+
+
+def chunk_ranges(size, data_start, chunk_bytes):
+    """[(起始字节, 结束字节), ...]; 每块从起始字节之后的第一个整行开始"""
+    edges = list(range(data_start, size, chunk_bytes)) + [size]
+    return [(a, b) for a, b in zip(edges[:-1], edges[1:])]
+
+
+def read_chunk(path, start, end, data_start):
+    """读出起始位置落在 [start, end) 内的所有整行"""
+    with open(path, "rb") as f:
+        if start > data_start:
+            # 从前一个字节读到行尾: start 恰好是行首时只跳过前一行的换行符
+            f.seek(start - 1)
+            f.readline()
+        else:
+            f.seek(start)
+        pos = f.tell()
+        if pos >= end:
+            return b""
+        block = f.read(end - pos)
+        if block and not block.endswith(b"\n"):
+            block += f.readline()
+        return block
+
+
+def _parse_times(values):
+    """日期时间字符串 / 秒 / 毫秒时间戳 -> 毫秒 (int64)"""
+    if pd.api.types.is_numeric_dtype(values):
+        ms = values.to_numpy(dtype=np.float64)
+        if len(ms) and np.nanmax(ms) < 1e11:
+            ms = ms * 1000.0
+        return ms.astype(np.int64)
+    for fmt in ("%Y.%m.%d %H:%M:%S.%f", "%Y.%m.%d %H:%M:%S", "ISO8601"):
+        try:
+            return pd.to_datetime(values, format=fmt).to_numpy(dtype="datetime64[ms]").astype(np.int64)
+        except ValueError:
+            continue
+    raise ValueError(f"unrecognized tick time format: {values.iloc[0]!r}")
+
+
+def parse_ticks(block, layout):
+    """一块文本 -> (毫秒时间, bid, ask); 留空的 bid / ask 为 NaN"""
+    if not block.strip():
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+    names = layout["names"]
+    df = pd.read_csv(io.BytesIO(block), sep=layout["sep"], header=None, names=names,
+                     usecols=[n for n in names if n in ("date", "time", "timestamp", "bid", "ask")],
+                     dtype={"date": str}, skip_blank_lines=True)
+    if layout["kind"] == "mt5":
+        times = _parse_times(df["date"].astype(str) + " " + df["time"].astype(str))
+    else:
+        times = _parse_times(df["time"] if "time" in df else df["timestamp"])
+    return times, df["bid"].to_numpy(dtype=np.float64), df["ask"].to_numpy(dtype=np.float64)
+
+
+def _spread_points(bid, ask, point):
+    return np.round((ask - bid) / point)
+
+
+def _ffill(values, first):
+    """NaN 沿用前一个值 (first 为本段之前的值)"""
+    out = np.concatenate(([first], values))
+    idx = np.where(np.isnan(out), 0, np.arange(len(out)))
+    np.maximum.accumulate(idx, out=idx)
+    return out[idx][1:]
+
+
+def convert_chunk(task):
+    """
+    进程池任务: 解析一块并写 part 文件
+    part 文件: agg (部分 M5 K 线), head (开头 bid / ask 还没出现过的几行原始 tick: 毫秒, bid, ask),
+              last (本块最后的 bid, ask), first_ms / last_ms (本块第一 / 最后一个 tick 的时间)
+    """
+    path, k, start, end, layout, point, work_dir = task
+    times, bid, ask = parse_ticks(read_chunk(path, start, end, layout["data_start"]), layout)
+    if len(times) and (np.diff(times) < 0).any():
+        raise ValueError(f"{path}: ticks must be sorted by time (chunk {k})")
+
+    # bid 与 ask 都出现过之后，本块内就能自己补齐留空的值
+    known = np.flatnonzero(~np.isnan(bid)), np.flatnonzero(~np.isnan(ask))
+    split = max(known[0][0] if len(known[0]) else len(times), known[1][0] if len(known[1]) else len(times))
+    head = np.column_stack((times[:split], bid[:split], ask[:split]))
+    body_bid = _ffill(bid[split:], _last_known(bid[:split]))
+    body_ask = _ffill(ask[split:], _last_known(ask[:split]))
+    agg = aggregate_ticks(times[split:] // 1000, body_bid, _spread_points(body_bid, body_ask, point))
+
+    last = np.array([_last_known(bid), _last_known(ask)])
+    first_ms = int(times[0]) if len(times) else -1
+    last_ms = int(times[-1]) if len(times) else -1
+    target = os.path.join(work_dir, part_file(k))
+    tmp = target + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, agg=agg, head=head, last=last, first_ms=first_ms, last_ms=last_ms)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, target)
+    return k, len(times), len(agg)
+
+
+def _last_known(values):
+    idx = np.flatnonzero(~np.isnan(values))
+    return values[idx[-1]] if len(idx) else np.nan
+
+
+# ------------------------------------------------------------------
+# 主流程
+# ------------------------------------------------------------------
+
+def new_manifest(source, chunk_bytes, point):
+    stat = os.stat(source)
+    return {"format": FORMAT, "source": os.path.abspath(source), "size": stat.st_size,
+            "mtime": int(stat.st_mtime), "chunk_bytes": chunk_bytes, "point": point, "done": []}
+
+
+def check_manifest(manifest, expected):
+    for key in ("format", "source", "size", "mtime", "chunk_bytes", "point"):
+        if manifest.get(key) != expected[key]:
+            return f"{key} changed: {manifest.get(key)!r} -> {expected[key]!r}"
+    return None
+
+
+def convert_parts(source, work_dir, chunk_bytes, point=DEFAULT_POINT, workers=1, restart=False):
+    """第 1 步: 并行解析各块 (已完成的跳过)，返回 (manifest, 块数, 本次解析的块数)"""
+    expected = new_manifest(source, chunk_bytes, point)
+    manifest = load_manifest(work_dir) if os.path.isdir(work_dir) else None
+    if manifest is not None and not restart:
+        problem = check_manifest(manifest, expected)
+        if problem:
+            raise ValueError(f"{work_dir}: cannot resume ({problem}); use --restart to convert from scratch")
+    else:
+        if os.path.isdir(work_dir):
+            shutil.rmtree(work_dir)
+        manifest = expected
+    os.makedirs(work_dir, exist_ok=True)
+    save_manifest(work_dir, manifest)
+
+    layout = read_layout(source)
+    ranges = chunk_ranges(expected["size"], layout["data_start"], chunk_bytes)
+    done = set(manifest["done"])
+    todo = [(source, k, a, b, layout, point, work_dir) for k, (a, b) in enumerate(ranges)
+            if k not in done or not os.path.exists(os.path.join(work_dir, part_file(k)))]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(convert_chunk, task) for task in todo]
+        for future in concurrent.futures.as_completed(futures):
+            # 完成一块记一块，中断后从未记录的块继续
+            k, _, _ = future.result()
+            manifest["done"] = sorted(set(manifest["done"]) | {k})
+            save_manifest(work_dir, manifest)
+    return manifest, len(ranges), len(todo)
+
+
+def merge_parts(work_dir, n_parts, point, m5_path, h1_path=None, spread_mode="avg"):
+    """第 2 步: 按顺序合并各块 -> M5 (与可选的 H1) 历史文件，返回 (M5 根数, H1 根数, tick 数)"""
+    m5_stream, h1_stream = BarStream(M5_SECONDS), BarStream(TIMEFRAME_SECONDS["H1"])
+    carry = np.array([np.nan, np.nan])
+    last_ms = None
+    counts = {"m5": 0, "h1": 0, "ticks": 0}
+    started = set()
+
+    def emit(path, key, rows):
+        if path is None or len(rows) == 0:
+            return
+        save_bars(path, to_bars(rows, spread_mode), append=key in started)
+        started.add(key)
+        counts[key] += len(rows)
+
+    for k in range(n_parts):
+        with np.load(os.path.join(work_dir, part_file(k))) as part:
+            agg, head, last = part["agg"], part["head"], part["last"]
+            first_ms, part_last_ms = int(part["first_ms"]), int(part["last_ms"])
+        if first_ms < 0:
+            continue
+        if last_ms is not None and first_ms < last_ms:
+            raise ValueError(f"ticks must be sorted by time (chunk {k} starts before chunk {k - 1} ends)")
+        last_ms = part_last_ms
+
+        # 本块开头沿用上一块 bid / ask 的几行; 文件最开头仍然缺值的 tick 丢弃
+        if len(head):
+            h_bid, h_ask = _ffill(head[:, 1], carry[0]), _ffill(head[:, 2], carry[1])
+            ok = ~(np.isnan(h_bid) | np.isnan(h_ask))
+            rows = aggregate_ticks(head[ok, 0].astype(np.int64) // 1000, h_bid[ok],
+                                   _spread_points(h_bid[ok], h_ask[ok], point))
+            agg = np.concatenate((rows, agg))
+        counts["ticks"] += int(agg[:, V].sum())
+        carry = np.where(np.isnan(last), carry, last)
+
+        complete = m5_stream.push(agg)
+        emit(m5_path, "m5", complete)
+        emit(h1_path, "h1", h1_stream.push(complete))
+
+    tail = m5_stream.finish()
+    emit(m5_path, "m5", tail)
+    emit(h1_path, "h1", h1_stream.push(tail))
+    emit(h1_path, "h1", h1_stream.finish())
+    for path, key in ((m5_path, "m5"), (h1_path, "h1")):
+        if path is not None and key not in started:
+            save_bars(path, np.empty((0, len(COLUMNS))))
+    return counts["m5"], counts["h1"], counts["ticks"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert broker tick exports into M5 / H1 history bars "
+                                                 "(chunked, parallel, resumable)")
+    parser.add_argument("ticks", help="MT5 tick export (<DATE> <TIME> <BID> <ASK> ...) or CSV with time,bid,ask")
+    parser.add_argument("-o", "--output", required=True, help="M5 history CSV (time,open,high,low,close,tick_vol,spread)")
+    parser.add_argument("--h1", default=None, help="also write H1 bars to this CSV")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="parallel chunk parsers")
+    parser.add_argument("--chunk-mb", type=float, default=DEFAULT_CHUNK_MB, help="bytes of tick file per chunk (MB)")
+    parser.add_argument("--point", type=float, default=DEFAULT_POINT, help="price of one spread point")
+    parser.add_argument("--spread", choices=SPREAD_MODES, default="avg", help="per-bar spread statistic")
+    parser.add_argument("--work-dir", default=None, help="chunk results + manifest (default: <output>.parts)")
+    parser.add_argument("--restart", action="store_true", help="discard finished chunks and convert from scratch")
+    parser.add_argument("--keep-parts", action="store_true", help="keep the work directory after merging")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    work_dir = args.work_dir or args.output + ".parts"
+    chunk_bytes = max(1, int(args.chunk_mb * 1024 * 1024))
+    t0 = time.perf_counter()
+    try:
+        manifest, n_parts, parsed = convert_parts(args.ticks, work_dir, chunk_bytes, args.point,
+                                                  args.workers, args.restart)
+        m5, h1, ticks = merge_parts(work_dir, n_parts, args.point, args.output, args.h1, args.spread)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    if not args.keep_parts:
+        shutil.rmtree(work_dir)
+    print(f"Ticks: {ticks} | Chunks: {n_parts} (parsed {parsed}, resumed {n_parts - parsed}) | "
+          f"M5 bars: {m5}" + (f" | H1 bars: {h1}" if args.h1 else "") + f" | {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()